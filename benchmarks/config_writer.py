@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the karma configuration writers, over synthetic
+configurations with a large number of files and preprocessors entries.
+
+Reports the time taken and the peak memory allocated by each writer.
+Usage:
+
+    python benchmarks/config_writer.py [count ...]
+"""
+
+import sys
+import time
+from functools import partial
+from os import close
+from os import remove
+from tempfile import mkstemp
+
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    # Python 2.7 has no tracemalloc; only timing will be available.
+    tracemalloc = None
+
+from calmjs.dev import karma
+from calmjs.dev.cli import KarmaDriver
+
+WRITERS = (
+    ('config_writer', karma.config_writer),
+    ('streaming_config_writer', karma.streaming_config_writer),
+)
+
+DEFAULT_COUNTS = (1000, 10000, 50000)
+
+
+def make_config(count):
+    files = [
+        '/srv/build/package%d/tests/test_module%d.js' % (i % 97, i)
+        for i in range(count)
+    ]
+    return {
+        'basePath': '/srv/build',
+        'browsers': ['PhantomJS'],
+        'files': files,
+        'frameworks': ['mocha', 'expect', 'sinon'],
+        'preprocessors': {path: ['wrap', 'coverage'] for path in files},
+        'reporters': ['spec', 'coverage'],
+        'singleRun': True,
+    }
+
+
+def measure(writer, config, target):
+    if tracemalloc:
+        tracemalloc.start()
+    start = time.time()
+    with open(target, 'w') as fd:
+        writer(config, fd)
+    elapsed = time.time() - start
+    peak = None
+    if tracemalloc:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return elapsed, peak
+
+
+def main(counts):
+    driver = KarmaDriver()
+    fd, target = mkstemp()
+    close(fd)
+    try:
+        print('%-26s %8s %10s %12s' % (
+            'writer', 'entries', 'time (s)', 'peak (KiB)'))
+        for count in counts:
+            config = make_config(count)
+            for name, writer in WRITERS:
+                elapsed, peak = measure(
+                    partial(writer, driver), config, target)
+                print('%-26s %8d %10.3f %12s' % (
+                    name, count, elapsed,
+                    '-' if peak is None else '%d' % (peak // 1024)))
+    finally:
+        remove(target)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_COUNTS)
@@ -53,6 +53,7 @@ package_json = {
         "karma-mocha": "~1.2.0",
         "karma-phantomjs-launcher": "~1.0.2",
         "karma-sinon": "~1.0.5",
+        "karma-sourcemap-loader": "~0.3.7",
         "karma-spec-reporter": "~0.0.26",
         "karma-wrap-preprocessor": "~0.1.0",
         "mocha": "~3.1.2",
@@ -112,6 +113,8 @@ setup(
         ],
         'calmjs.dev.runtime.karma': [
             'run = calmjs.dev.runtime:run',
+            'history = calmjs.dev.runtime:history_report',
+            'bench = calmjs.dev.runtime:bench_run',
         ],
     },
     test_suite="calmjs.dev.tests.make_suite",
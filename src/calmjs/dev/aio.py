@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+"""
+Module providing the asyncio interface to the karma driver, such that
+any number of karma test runs may be executed concurrently on a single
+event loop.  Requires Python 3.5+.
+
+The karma process is spawned as an asyncio subprocess in its own
+session, such that the cancellation of the coroutine that awaits it
+will terminate the entire process group (i.e. the browsers that were
+launched by karma).  Note that the steps of the toolchain that prepare
+the test are still executed synchronously on the event loop; only the
+execution of karma itself is awaited.
+"""
+
+import asyncio
+import codecs
+import errno
+import logging
+import os
+import shutil
+import signal
+import sys
+from functools import partial
+from itertools import chain
+from os import mkdir
+from os.path import isdir
+from os.path import join
+from os.path import realpath
+from tempfile import mkdtemp
+from time import time
+
+from calmjs.types.exceptions import AdviceAbort
+from calmjs.types.exceptions import AdviceCancel
+from calmjs.types.exceptions import ToolchainAbort
+from calmjs.types.exceptions import ToolchainCancel
+from calmjs.registry import get
+from calmjs.toolchain import AFTER_TEST
+from calmjs.toolchain import BEFORE_TEST
+from calmjs.toolchain import BUILD_DIR
+from calmjs.toolchain import CLEANUP
+from calmjs.toolchain import DEBUG
+from calmjs.toolchain import EXPORT_TARGET
+from calmjs.toolchain import SETUP
+from calmjs.toolchain import SUCCESS
+from calmjs.toolchain import Spec
+from calmjs.toolchain import log_exc_reason
+from calmjs.utils import raise_os_error
+
+from calmjs.dev import history
+from calmjs.dev import karma
+from calmjs.dev import profiler
+from calmjs.dev import rusage
+from calmjs.dev import utils
+from calmjs.dev.cli import KarmaDriver
+from calmjs.dev.cli import _check_tests_missing
+from calmjs.dev.cli import _new_record
+from calmjs.dev.cli import _prepare_builder_spec
+from calmjs.dev.cli import _write_reused_junit_xml
+from calmjs.dev.cli import execution_key
+from calmjs.dev.cli import index_export_targets
+from calmjs.dev.cli import load_builders
+from calmjs.dev.cli import summarize_package_usage
+from calmjs.dev.toolchain import EXECUTION_KEY
+from calmjs.dev.toolchain import create_spec_build_cache_dir
+
+logger = logging.getLogger(__name__)
+
+# the spec key for the test deferred by the advice to the coroutine
+KARMA_DEFERRED_TEST = 'karma_deferred_test'
+# the steps of the toolchain, as executed by Toolchain.calf
+TOOLCHAIN_STEPS = ('prepare', 'compile', 'assemble', 'link', 'finalize')
+# the size of the chunks of output read from the process
+STREAM_CHUNK_SIZE = 4096
+# the seconds to wait for the process group to terminate before killing
+TERMINATE_TIMEOUT = 5
+# the default number of the concurrent executions for verification
+VERIFY_CONCURRENCY = 4
+
+
+def _signal_process_group(process, signum):
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(process.pid, signum)
+        else:  # pragma: no cover
+            process.send_signal(signum)
+    except OSError:
+        # already terminated.
+        pass
+
+
+async def terminate_process(process, timeout=TERMINATE_TIMEOUT):
+    """
+    Terminate the process along with every other process in its
+    process group, killing them if they did not terminate before the
+    timeout.
+    """
+
+    _signal_process_group(process, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(process.wait(), timeout)
+    except asyncio.TimeoutError:
+        _signal_process_group(
+            process, getattr(signal, 'SIGKILL', signal.SIGTERM))
+        await process.wait()
+
+
+async def stream_output(reader, output):
+    """
+    Pass the decoded output from the reader to the output callable as
+    they become available.
+    """
+
+    decoder = codecs.getincrementaldecoder('utf8')('replace')
+    while True:
+        chunk = await reader.read(STREAM_CHUNK_SIZE)
+        text = decoder.decode(chunk, not chunk)
+        if text:
+            output(text)
+        if not chunk:
+            break
+
+
+async def _complete_deferred(spec, name):
+    # complete the test deferred by the advice group, with the handling
+    # of the exceptions mirroring Spec.handle.
+    deferred = spec.pop(KARMA_DEFERRED_TEST, None)
+    if deferred is None:
+        return
+    try:
+        await deferred()
+    except (asyncio.CancelledError, ToolchainCancel):
+        raise
+    except AdviceCancel as e:
+        logger.info(
+            "test deferred by group '%s' signaled its cancellation "
+            "during its execution: %s", name, e
+        )
+    except AdviceAbort as e:
+        logger.warning(
+            "test deferred by group '%s' encountered a known error "
+            "during its execution: %s; continuing with toolchain "
+            "execution", name, e
+        )
+    except ToolchainAbort as e:
+        logger.critical(
+            "test deferred by group '%s' triggered an abort: %s", name, e)
+        raise
+    except Exception as e:
+        logger.critical(
+            "test deferred by group '%s' terminated due to an "
+            "unexpected exception: %s", name, e
+        )
+        if spec.get(DEBUG):
+            logger.critical('showing traceback for error', exc_info=1)
+
+
+async def _handle(spec, name):
+    spec.handle(name)
+    await _complete_deferred(spec, name)
+
+
+async def run_toolchain(toolchain, spec):
+    """
+    Execute the toolchain with the spec as Toolchain.calf does, with
+    the tests deferred by the advices of an advice group awaited before
+    the toolchain continues onto the next group.
+    """
+
+    if not isinstance(spec, Spec):
+        raise TypeError('spec must be of type Spec')
+
+    # ensure build directory is defined and sane.
+    if not spec.get(BUILD_DIR):
+        tempdir = realpath(mkdtemp())
+        spec.advise(CLEANUP, shutil.rmtree, tempdir)
+        build_dir = join(tempdir, 'build')
+        mkdir(build_dir)
+        spec[BUILD_DIR] = build_dir
+    else:
+        build_dir = toolchain.realpath(spec, BUILD_DIR)
+        if not isdir(build_dir):
+            logger.error("build_dir '%s' is not a directory", build_dir)
+            raise_os_error(errno.ENOTDIR, build_dir)
+
+    toolchain.realpath(spec, EXPORT_TARGET)
+    spec.advise(SETUP, toolchain.setup_apply_advice_packages, spec)
+
+    try:
+        await _handle(spec, SETUP)
+        for step in TOOLCHAIN_STEPS:
+            await _handle(spec, 'before_' + step)
+            getattr(toolchain, step)(spec)
+            await _handle(spec, 'after_' + step)
+        await _handle(spec, SUCCESS)
+    except ToolchainCancel:
+        if spec.get(DEBUG):
+            log_exc_reason(*sys.exc_info())
+    except ToolchainAbort:
+        if spec.get(DEBUG):
+            log_exc_reason(*sys.exc_info())
+        raise
+    finally:
+        spec.handle(CLEANUP)
+
+
+class AsyncKarmaDriver(KarmaDriver):
+    """
+    The karma driver, with karma executed as an asyncio subprocess.
+    """
+
+    def __init__(self, *a, output=None, **kw):
+        """
+        Arguments in addition to KarmaDriver
+
+        output
+            The callable that will be called with the output of karma as
+            they become available; the output will be left on the
+            standard output if not provided.
+        """
+
+        super(AsyncKarmaDriver, self).__init__(*a, **kw)
+        self.output = output
+
+    async def execute(self, args, **kw):
+        """
+        Execute the command in its own process group, returning its
+        return code.  The process group will be terminated if this is
+        cancelled.
+        """
+
+        if self.output is not None:
+            kw['stdout'] = asyncio.subprocess.PIPE
+            kw['stderr'] = asyncio.subprocess.STDOUT
+        process = await asyncio.create_subprocess_exec(
+            *args, start_new_session=True, **kw)
+        try:
+            if self.output is not None:
+                await stream_output(process.stdout, self.output)
+            return await process.wait()
+        except BaseException:
+            # most notably the cancellation of this coroutine.
+            logger.info(
+                "terminating process group of '%s' (pid %d)",
+                args[0], process.pid,
+            )
+            await terminate_process(process)
+            raise
+
+    async def karma(self, spec):
+        """
+        Start karma with the provided spec
+        """
+
+        spec.handle(karma.BEFORE_KARMA)
+
+        config_fn = join(spec[BUILD_DIR], self.karma_conf_js)
+        call_kw = self._gen_call_kws(**utils.karma_environ(self))
+        limiter = rusage.memory_limiter(spec.get(karma.KARMA_MEMORY_LIMIT))
+        if limiter:
+            call_kw['preexec_fn'] = limiter
+        logger.info('invoking %s start %r', self.binary, config_fn)
+        binary = self.find_karma_binary(spec)
+        outcome_fn = join(spec[BUILD_DIR], karma.KARMA_OUTCOME_JSON)
+        if self.outcome_enabled(spec):
+            karma.clear_outcome(outcome_fn)
+        profiles = self._prepare_node_profiles(spec)
+        started = spec[karma.KARMA_STARTED] = time()
+        spec[karma.KARMA_RETURN_CODE] = await self._call_karma(
+            self.karma_command(spec, binary, config_fn), **call_kw)
+        if self.outcome_enabled(spec):
+            spec[karma.KARMA_OUTCOME] = karma.read_outcome(outcome_fn)
+        if spec.get(karma.KARMA_SPLIT_ON_CRASH):
+            spec[karma.KARMA_RETURN_CODE] = await self._split_on_crash(
+                spec, binary, call_kw, spec[karma.KARMA_RETURN_CODE])
+        if spec.get(karma.KARMA_QUARANTINE_TESTS) and spec.get(
+                karma.KARMA_QUARANTINE_MODE) == karma.QUARANTINE_SEPARATE:
+            spec[karma.KARMA_QUARANTINE_RUN] = await self._run_quarantined(
+                spec, binary, call_kw)
+        spec[karma.KARMA_DURATION] = time() - started
+        # the processes are reaped by the event loop, so the usage of
+        # the individual processes is not available, and that of all the
+        # children would include the concurrent executions.
+        spec[karma.KARMA_RUSAGE] = None
+        self._collect_node_profiles(spec, profiles)
+
+        spec.handle(karma.AFTER_KARMA)
+
+    async def _call_karma(self, args, **call_kw):
+        with profiler.paused():
+            return await self.execute(args, **call_kw)
+
+    async def _split_on_crash(self, spec, binary, call_kw, return_code):
+        runs = spec[karma.KARMA_SPLIT_RUNS] = []
+        for subset in self._split_subsets(spec, return_code):
+            runs.append(await self._run_subset(
+                spec, binary, call_kw, subset, len(runs)))
+        return self._merge_split_runs(runs, return_code)
+
+    async def _run_subset(self, spec, binary, call_kw, test_module_paths,
+                          index):
+        config_fn, outcome_fn = self._prepare_subset(
+            spec, test_module_paths, index)
+        return_code = await self._call_karma(
+            self.karma_command(spec, binary, config_fn), **call_kw)
+        return self._subset_run(test_module_paths, return_code, outcome_fn)
+
+    async def _run_quarantined(self, spec, binary, call_kw):
+        config_fn, outcome_fn = self._prepare_quarantined(spec)
+        return_code = await self._call_karma(
+            self.karma_command(spec, binary, config_fn), **call_kw)
+        return self._quarantined_run(return_code, outcome_fn)
+
+    def test_spec(self, spec):
+        # this is invoked as an advice, which cannot be awaited upon, so
+        # the test is deferred for the completion by run_toolchain.
+        spec.handle(BEFORE_TEST)
+        spec[KARMA_DEFERRED_TEST] = partial(self.complete_test_spec, spec)
+
+    async def complete_test_spec(self, spec):
+        await self.karma(spec)
+        spec.handle(AFTER_TEST)
+
+    async def run(self, toolchain, spec):
+        """
+        Run the toolchain with the spec, with the tests executed by
+        karma awaited upon.
+        """
+
+        create_spec_build_cache_dir(spec)
+        self.setup_toolchain_spec(toolchain, spec)
+        await run_toolchain(toolchain, spec)
+
+
+async def execute_builder(registry, entry_point, toolchain, spec):
+    """
+    The asyncio analogue of ArtifactTestRegistry.execute_builder.
+    """
+
+    await AsyncKarmaDriver.create().run(toolchain, spec)
+    return {}
+
+
+async def _execute_builder(registry, builder, kwargs, executions, record):
+    entry_point, toolchain, spec = builder
+    if not _prepare_builder_spec(spec, kwargs):
+        logger.warning("artifact not found: %s", spec[EXPORT_TARGET])
+        record['skip_reason'] = 'artifact not found'
+        return False
+
+    key = record[EXECUTION_KEY] = spec[EXECUTION_KEY] = execution_key(
+        spec, toolchain=toolchain)
+    if key in executions:
+        logger.info(
+            "tests for artifact '%s' are identical to a concurrent or "
+            "previous execution; reusing its result", spec[EXPORT_TARGET])
+        record['cache_hit'] = True
+        return_code = record['return_code'] = await asyncio.shield(
+            executions[key])
+        _write_reused_junit_xml(spec)
+        return return_code == 0
+
+    future = executions[key] = asyncio.get_event_loop().create_future()
+    try:
+        await execute_builder(registry, entry_point, toolchain, spec)
+    finally:
+        future.set_result(spec.get(karma.KARMA_RETURN_CODE))
+    return_code = record['return_code'] = future.result()
+    record['rusage'] = spec.get(karma.KARMA_RUSAGE)
+    record['metrics'] = spec.get(karma.KARMA_METRICS)
+    record['quarantine'] = history.summarize_quarantine(spec)
+    record['artifact_load'] = spec.get(karma.KARMA_ARTIFACT_LOAD)
+    return return_code == 0
+
+
+async def karma_verify_package_artifacts_report(
+        package_names=[], keep_going=False, concurrency=VERIFY_CONCURRENCY,
+        **kwargs):
+    """
+    The asyncio analogue of cli.karma_verify_package_artifacts_report,
+    with up to concurrency number of the tests for the artifacts being
+    executed concurrently.  Without keep_going, the tests that have yet
+    to start will be skipped after a failure.
+    """
+
+    started = time()
+    report = {'packages': {}}
+    main_registry = get('calmjs.artifacts')
+    test_registry = get('calmjs.artifacts.tests')
+    test_index = index_export_targets(test_registry, package_names)
+    main_index = index_export_targets(main_registry, package_names)
+    executions = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    state = {'success': True}
+    builders = iter(load_builders(test_registry, list(
+        chain.from_iterable(test_index[package] for package in package_names)
+    )))
+
+    async def verify(builder, record):
+        if not builder:
+            record['status'] = 'error'
+            record['skip_reason'] = 'builder not available'
+            state['success'] = False
+            return
+        async with semaphore:
+            if not (state['success'] or keep_going):
+                record['status'] = 'skipped'
+                record['skip_reason'] = 'previous failure'
+                return
+            begin = time()
+            success = await _execute_builder(
+                test_registry, builder, kwargs, executions, record)
+        record['duration'] = time() - begin
+        record['status'] = 'passed' if success else (
+            'error' if record['return_code'] is None else 'failed')
+        state['success'] = state['success'] and success
+
+    tasks = []
+    for package in package_names:
+        records = []
+        for entry_point, export_target in test_index[package]:
+            record = _new_record(entry_point, export_target)
+            records.append(record)
+            tasks.append(verify(next(builders), record))
+        report['packages'][package] = {
+            'export_targets': records,
+            'tests_missing': _check_tests_missing(
+                main_registry, main_index, test_index, package),
+        }
+
+    tasks = [asyncio.ensure_future(task) for task in tasks]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # ensure the remaining executions (and their processes) are
+        # terminated before the error is propagated.
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    for package in report['packages'].values():
+        summarize_package_usage(package)
+    report['success'] = state['success'] and not any(
+        package['tests_missing'] for package in report['packages'].values())
+    report['duration'] = time() - started
+    return report
+
+
+async def karma_verify_package_artifacts(package_names=[], **kwargs):
+    """
+    The asyncio analogue of cli.karma_verify_package_artifacts.
+    """
+
+    report = await karma_verify_package_artifacts_report(
+        package_names, **kwargs)
+    return report['success']
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Module for the results of the benchmarks run through karma, and their
+comparison against a saved baseline.
+
+The results are as captured by the bench reporter plugin from the
+karma-benchmark framework, with the operations per second and the
+relative margin of error (as a percentage) of every benchmark, keyed by
+the browser, suite and name of the benchmark.
+"""
+
+import codecs
+import json
+import logging
+
+from calmjs.dev.utils import write_json
+
+logger = logging.getLogger(__name__)
+
+# the ratio of the reduction of the operations per second from the
+# baseline for a result to be considered a regression
+BENCH_THRESHOLD = 0.1
+
+
+def result_key(result):
+    return (result.get('browser') or '', result.get('suite') or '',
+            result.get('name') or '')
+
+
+def load_baseline(path):
+    """
+    Load the results of the baseline from the file at path; an empty
+    list is returned if it does not exist.
+    """
+
+    try:
+        with codecs.open(path, encoding='utf8') as fd:
+            return json.load(fd).get('results', [])
+    except (IOError, OSError):
+        logger.debug("no benchmark baseline found at '%s'", path)
+    except ValueError:
+        logger.warning("ignoring invalid benchmark baseline at '%s'", path)
+    return []
+
+
+def write_results(path, results):
+    """
+    Write the results of the benchmarks to the file at path, such that
+    it may be used as the baseline of the subsequent runs.
+    """
+
+    write_json({'results': sorted(results, key=result_key)}, path)
+    logger.info(
+        "wrote the results of %d benchmark(s) to '%s'", len(results), path)
+
+
+def _bounds(result):
+    # the interval of the operations per second within the margin of
+    # error of the result.
+    hz = result.get('hz') or 0.0
+    margin = hz * (result.get('rme') or 0.0) / 100.0
+    return hz - margin, hz + margin
+
+
+def compare_results(baseline, results, threshold=BENCH_THRESHOLD):
+    """
+    Compare the results against the baseline, returning the comparison
+    of every result that has a baseline.
+
+    A result is a regression if its operations per second is reduced
+    from the baseline by more than the threshold ratio, and the margins
+    of error of the two do not overlap.
+    """
+
+    index = {result_key(result): result for result in baseline}
+    comparisons = []
+    for result in sorted(results, key=result_key):
+        base = index.get(result_key(result))
+        if not base or not base.get('hz'):
+            continue
+        ratio = (result.get('hz') or 0.0) / base['hz']
+        comparisons.append({
+            'browser': result.get('browser') or '',
+            'suite': result.get('suite') or '',
+            'name': result.get('name') or '',
+            'hz': result.get('hz'),
+            'rme': result.get('rme'),
+            'baseline_hz': base['hz'],
+            'baseline_rme': base.get('rme'),
+            'ratio': ratio,
+            'regression': ratio < 1.0 - threshold and (
+                _bounds(result)[1] < _bounds(base)[0]),
+        })
+    return comparisons
+
+
+def format_comparisons(comparisons):
+    """
+    Format the comparisons as lines of text for the report.
+    """
+
+    return ['%s%s: %s: %.2f ops/sec -> %.2f ops/sec (x%.2f)' % (
+        'REGRESSION ' if comparison['regression'] else '',
+        comparison['browser'], ' > '.join(
+            part for part in (comparison['suite'], comparison['name'])
+            if part),
+        comparison['baseline_hz'], comparison['hz'] or 0.0,
+        comparison['ratio'],
+    ) for comparison in comparisons]
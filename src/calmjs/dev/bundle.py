@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Module for the concatenation of test modules into bundles.
+
+Each test module is wrapped with a function closure, equivalent to what
+the wrap preprocessor would have done, and a source map is written
+alongside of every bundle such that locations within the bundle may be
+traced back to the original test modules.
+"""
+
+import codecs
+import json
+import logging
+import re
+from os.path import basename
+from os.path import dirname
+from os.path import relpath
+from os.path import sep
+
+from calmjs.parse.vlq import encode_mappings
+
+logger = logging.getLogger(__name__)
+
+WRAP_HEADER = '(function () {'
+WRAP_FOOTER = '})();'
+
+_source_mapping_url = re.compile(r'^\s*//[#@] sourceMappingURL=')
+
+
+def _source_path(path, start):
+    try:
+        return '/'.join(relpath(path, start).split(sep))
+    except ValueError:
+        # i.e. paths on different drives.
+        return path
+
+
+def write_test_bundle(paths, target):
+    """
+    Write the test modules provided by paths into the target bundle,
+    each wrapped in their own function closure, along with the source
+    map at the target with the '.map' suffix.
+
+    Returns the path to the source map.
+    """
+
+    map_path = target + '.map'
+    mappings = []
+    sources = []
+    # the source map segment values are relative to the previous one.
+    prev_idx = prev_line = 0
+
+    with codecs.open(target, 'w', encoding='utf8') as writer:
+        for idx, path in enumerate(paths):
+            sources.append(_source_path(path, dirname(map_path)))
+            writer.write(WRAP_HEADER + '\n')
+            mappings.append([])
+            with codecs.open(path, encoding='utf8') as reader:
+                for line, text in enumerate(reader):
+                    if _source_mapping_url.match(text):
+                        # no longer valid in the bundle
+                        text = '\n'
+                    elif not text.endswith('\n'):
+                        text += '\n'
+                    writer.write(text)
+                    mappings.append([(
+                        0, idx - prev_idx, line - prev_line, 0)])
+                    prev_idx, prev_line = idx, line
+            writer.write(WRAP_FOOTER + '\n')
+            mappings.append([])
+        writer.write('//# sourceMappingURL=%s\n' % basename(map_path))
+
+    with codecs.open(map_path, 'w', encoding='utf8') as fd:
+        json.dump({
+            'version': 3,
+            'sources': sources,
+            'names': [],
+            'mappings': encode_mappings(mappings),
+            'file': basename(target),
+        }, fd)
+
+    logger.debug(
+        "wrote %d test module(s) into bundle '%s'", len(paths), target)
+    return map_path
@@ -3,13 +3,27 @@
 This module provides interface to the karma cli runtime.
 """
 
+import codecs
+import hashlib
+import json
 import logging
 import re
+import shlex
+import sys
+from collections import Counter
 from functools import partial
+from itertools import chain
+from multiprocessing.pool import ThreadPool
+from os import listdir
+from os import makedirs
+from os import remove
+from os.path import dirname
 from os.path import exists
+from os.path import getsize
 from os.path import join
+from os.path import pardir
 from os.path import realpath
-from subprocess import call
+from time import time
 
 from calmjs.types.exceptions import (
     AdviceAbort,
@@ -38,14 +52,35 @@ from calmjs.cli import NodeDriver
 from calmjs.cli import get_bin_version
 from calmjs.cli import get_node_version
 
+from calmjs.dev import bench
+from calmjs.dev import bundle
+from calmjs.dev import diffcover
 from calmjs.dev import dist
+from calmjs.dev import history
+from calmjs.dev import junit
 from calmjs.dev import karma
+from calmjs.dev import loadtime
+from calmjs.dev import metrics
+from calmjs.dev import plan
+from calmjs.dev import profiler
+from calmjs.dev import rusage
+from calmjs.dev import spool
 from calmjs.dev import utils
 
+from calmjs.dev.rusage import call
+
+from calmjs.dev.toolchain import BUILD_CACHE_DIR
+from calmjs.dev.toolchain import BUNDLE_TESTS
+from calmjs.dev.toolchain import EXECUTION_KEY
+from calmjs.dev.toolchain import EXECUTION_KEY_PREPROCESSOR_OPTIONS
+from calmjs.dev.toolchain import BUNDLE_TESTS_MODULE_LIMIT
+from calmjs.dev.toolchain import BUNDLE_TESTS_MODULE_LIMIT_DEFAULT
 from calmjs.dev.toolchain import COVERAGE_ENABLE
 from calmjs.dev.toolchain import COVERAGE_TYPE
 from calmjs.dev.toolchain import COVER_ARTIFACT
 from calmjs.dev.toolchain import COVER_BUNDLE
+from calmjs.dev.toolchain import COVER_DIFF
+from calmjs.dev.toolchain import COVER_DIFF_REPORT
 from calmjs.dev.toolchain import COVER_PATH_FILTER
 from calmjs.dev.toolchain import COVER_REPORT_DIR
 from calmjs.dev.toolchain import COVER_REPORT_FILE
@@ -56,15 +91,26 @@ from calmjs.dev.toolchain import COVER_REPORT_DIR_DEFAULT
 from calmjs.dev.toolchain import NO_WRAP_TESTS
 from calmjs.dev.toolchain import TEST_FILENAME_PREFIX
 from calmjs.dev.toolchain import TEST_FILENAME_PREFIX_DEFAULT
+from calmjs.dev.toolchain import TEST_BUNDLE_DIRNAME
+from calmjs.dev.toolchain import TEST_BUNDLE_MODULES
 
 from calmjs.dev.toolchain import TEST_COVERED_ARTIFACT_PATHS
 from calmjs.dev.toolchain import TEST_COVERED_TEST_PATHS
 from calmjs.dev.toolchain import TEST_COVERED_BUILD_DIR_PATHS
+from calmjs.dev.toolchain import TEST_BUNDLE_PATHS
+from calmjs.dev.toolchain import create_spec_build_cache_dir
+from calmjs.dev.toolchain import prepare_spec_artifact_fingerprints
+from calmjs.dev.toolchain import prepared_spec
 from calmjs.dev.toolchain import prepare_spec_artifacts
+from calmjs.dev.toolchain import prepare_spec_build_cache_dir
+from calmjs.dev.toolchain import spec_option_values
 from calmjs.dev.toolchain import update_spec_for_karma
 
 logger = logging.getLogger(__name__)
 
+# the number of threads used for the loading of the artifact builders
+BUILDER_POOL_SIZE = 4
+
 
 def warn_if_nodejs_lt_6(*a, **kw):
     version = get_node_version()
@@ -113,26 +159,349 @@ class KarmaDriver(NodeDriver):
 
         config_fn = join(spec[BUILD_DIR], self.karma_conf_js)
         call_kw = self._gen_call_kws(**utils.karma_environ(self))
+        limiter = rusage.memory_limiter(spec.get(karma.KARMA_MEMORY_LIMIT))
+        if limiter:
+            call_kw['preexec_fn'] = limiter
         logger.info('invoking %s start %r', self.binary, config_fn)
         # TODO would be great if there is a way to "tee" the result into
         # both here and stdout.
         # perhaps the provided spec can contain well-defined keywords
         # that can be passed to the `call` function (extend call_kw).
         # For now at least log this down like so.
+        binary = self.find_karma_binary(spec)
+        # but actually run it with the '--color' flag, because otherwise
+        # colors don't work consistently... Node.js tools in a nutshell.
+        # ... at least disable colours in the config file will also make
+        # this option disabled.
+        outcome_fn = join(spec[BUILD_DIR], karma.KARMA_OUTCOME_JSON)
+        if self.outcome_enabled(spec):
+            karma.clear_outcome(outcome_fn)
+        profiles = self._prepare_node_profiles(spec)
+        # the usage of every karma process for this run.
+        usages = call_kw['usages'] = []
+        started = spec[karma.KARMA_STARTED] = time()
+        return_code = self._call_karma(
+            self.karma_command(spec, binary, config_fn), **call_kw)
+        if self.outcome_enabled(spec):
+            spec[karma.KARMA_OUTCOME] = karma.read_outcome(outcome_fn)
+        if spec.get(karma.KARMA_SPLIT_ON_CRASH):
+            return_code = self._split_on_crash(
+                spec, binary, call_kw, return_code)
+        if spec.get(karma.KARMA_QUARANTINE_TESTS) and spec.get(
+                karma.KARMA_QUARANTINE_MODE) == karma.QUARANTINE_SEPARATE:
+            spec[karma.KARMA_QUARANTINE_RUN] = self._run_quarantined(
+                spec, binary, call_kw)
+        spec[karma.KARMA_RETURN_CODE] = return_code
+        spec[karma.KARMA_DURATION] = time() - started
+        spec[karma.KARMA_RUSAGE] = rusage.combine_usage(usages)
+        self._collect_node_profiles(spec, profiles)
+
+        spec.handle(karma.AFTER_KARMA)
+
+    def _call_karma(self, args, **call_kw):
+        # the time waiting on karma is excluded from the profile of the
+        # Python side, if active.
+        with profiler.paused():
+            return call(args, **call_kw)
+
+    def karma_command(self, spec, binary, config_fn):
+        """
+        Return the command that starts karma with the config, which will
+        be run under Node.js directly if any arguments for it are
+        specified by the spec.
+        """
+
+        args = ['start', config_fn, '--color']
+        node_args = self.node_arguments(spec)
+        if not node_args:
+            return [binary] + args
+        return [self.node_bin] + node_args + [
+            self.find_karma_script(binary)] + args
+
+    def find_karma_script(self, binary):
+        """
+        Return the script that the karma binary will run with Node.js.
+        """
+
+        script = realpath(binary)
+        if script.lower().endswith('.cmd'):
+            # the wrapper generated by npm on Windows.
+            return join(dirname(binary), pardir, 'karma', 'bin', 'karma')
+        return script
+
+    def node_arguments(self, spec):
+        """
+        Return the arguments for Node.js specified by the spec, for the
+        profiling of karma and the other options provided.
+        """
+
+        args = shlex.split(spec.get(karma.KARMA_NODE_OPTIONS) or '')
+        if spec.get(karma.KARMA_NODE_CPU_PROF):
+            args.extend([
+                '--cpu-prof', '--cpu-prof-dir=' + self.node_prof_dir(spec)])
+        if spec.get(karma.KARMA_NODE_HEAP_PROF):
+            args.extend([
+                '--heap-prof', '--heap-prof-dir=' + self.node_prof_dir(
+                    spec)])
+        return args
+
+    def node_prof_dir(self, spec):
+        """
+        Return the directory for the profiles written by Node.js, which
+        defaults to one in the current working directory as the build
+        directory may be a temporary one that is removed after the run.
+        """
+
+        return realpath(
+            spec.get(karma.KARMA_NODE_PROF_DIR) or karma.NODE_PROF_DIRNAME)
+
+    def _prepare_node_profiles(self, spec):
+        # return the existing files in the profile directory, such that
+        # only the profiles from this run are collected.
+        if not (spec.get(karma.KARMA_NODE_CPU_PROF) or spec.get(
+                karma.KARMA_NODE_HEAP_PROF)):
+            return None
+        prof_dir = self.node_prof_dir(spec)
+        if not exists(prof_dir):
+            makedirs(prof_dir)
+        return set(listdir(prof_dir))
+
+    def _collect_node_profiles(self, spec, existing):
+        if existing is None:
+            return
+        prof_dir = self.node_prof_dir(spec)
+        profiles = spec[karma.KARMA_NODE_PROFILES] = sorted(
+            join(prof_dir, name) for name in listdir(prof_dir)
+            if name.endswith(karma.NODE_PROFILE_SUFFIXES) and
+            name not in existing
+        )
+        logger.info(
+            "collected %d Node.js profile(s) of karma in '%s'",
+            len(profiles), prof_dir)
+
+    def find_karma_binary(self, spec):
+        """
+        Return the karma binary, or abort as specified by the spec if it
+        is not found.
+        """
+
         binary = self.which() or self.which_with_node_modules()
         if binary is None:
             if spec.get(karma.KARMA_ABORT_ON_TEST_FAILURE):
                 raise ToolchainAbort('karma not found')
             else:
                 raise AdviceAbort('karma not found')
-        # but actually run it with the '--color' flag, because otherwise
-        # colors don't work consistently... Node.js tools in a nutshell.
-        # ... at least disable colours in the config file will also make
-        # this option disabled.
-        spec[karma.KARMA_RETURN_CODE] = call(
-            [binary, 'start', config_fn, '--color'], **call_kw)
+        return binary
 
-        spec.handle(karma.AFTER_KARMA)
+    def outcome_enabled(self, spec):
+        """
+        Whether the outcome of the karma run is to be captured.
+        """
+
+        return bool(spec.get(karma.KARMA_SPLIT_ON_CRASH) or (
+            self.metrics_enabled(spec)) or spec.get(karma.KARMA_HISTORY) or (
+            spec.get(karma.KARMA_QUARANTINE_TESTS)) or self.junit_enabled(
+            spec))
+
+    def metrics_enabled(self, spec):
+        """
+        Whether the metrics of the karma run are to be produced, either
+        for the export to the locations specified by the spec, or for
+        the collection by the verification of the artifacts.
+        """
+
+        return bool(spec.get(karma.KARMA_METRICS_PROMETHEUS) or spec.get(
+            karma.KARMA_METRICS_JSONL) or spec.get(
+            karma.KARMA_METRICS_COLLECT))
+
+    def junit_enabled(self, spec):
+        """
+        Whether the results of the karma run are to be written as JUnit
+        XML.
+        """
+
+        return bool(spec.get(karma.KARMA_JUNIT_XML) or spec.get(
+            karma.KARMA_JUNIT_WRITER))
+
+    def artifact_load_enabled(self, spec):
+        """
+        Whether the loading of the artifacts is to be measured.
+        """
+
+        return bool(spec.get(karma.KARMA_MEASURE_ARTIFACTS) or spec.get(
+            karma.KARMA_ARTIFACT_BUDGETS))
+
+    def minimal_enabled(self, spec):
+        """
+        Whether the minimal reporter is to replace the default reporters
+        of the karma run.
+        """
+
+        return spec.get(karma.KARMA_REPORTER) == karma.REPORTER_MINIMAL
+
+    def _apply_run_outcome(self, config, build_dir, suffix):
+        # direct the outcome, and the stream of the results, of a
+        # separate run to their own files, returning the outcome file.
+        options = config['calmjsOutcome'] = dict(config['calmjsOutcome'])
+        options['file'] = join(build_dir, 'karma.outcome.%s.json' % suffix)
+        if options.get('stream'):
+            options['stream'] = join(
+                build_dir, 'karma.results.%s.jsonl' % suffix)
+        if 'calmjsMinimal' in config:
+            config['calmjsMinimal'] = {'file': join(
+                build_dir, 'karma.minimal.%s.log' % suffix)}
+        karma.clear_outcome(options['file'])
+        return options['file']
+
+    def _split_on_crash(self, spec, binary, call_kw, return_code):
+        # bisect the test modules into separate runs for as long as
+        # the runs crashed, returning the merged return code.
+        runs = spec[karma.KARMA_SPLIT_RUNS] = []
+        for subset in self._split_subsets(spec, return_code):
+            runs.append(self._run_subset(
+                spec, binary, call_kw, subset, len(runs)))
+        return self._merge_split_runs(runs, return_code)
+
+    def _split_subsets(self, spec, return_code):
+        # generate the subsets of the test modules to be run separately,
+        # where the run of every subset generated must be appended to
+        # spec[KARMA_SPLIT_RUNS] before the next subset is requested.
+        outcome = spec.get(karma.KARMA_OUTCOME)
+        runs = spec[karma.KARMA_SPLIT_RUNS]
+        # the bundles are split into the test modules they contain, as
+        # the subsets of those will be bundled again for their runs.
+        bundle_modules = spec.get(TEST_BUNDLE_MODULES, {})
+        test_module_paths = list(chain.from_iterable(
+            bundle_modules.get(path, [path])
+            for path in spec.get(karma.KARMA_TEST_MODULE_PATHS, [])
+        ))
+        if not (karma.is_crashed(return_code, outcome) and len(
+                test_module_paths) > 1):
+            return
+
+        logger.warning(
+            "karma run crashed or the browser disconnected with %d test "
+            "module(s); splitting the test modules into separate runs",
+            len(test_module_paths),
+        )
+        pending = [test_module_paths]
+        while pending:
+            paths = pending.pop(0)
+            half = len(paths) // 2
+            for subset in (paths[:half], paths[half:]):
+                yield subset
+                if runs[-1]['crashed'] and len(subset) > 1:
+                    pending.append(subset)
+
+    def _merge_split_runs(self, runs, return_code):
+        if not runs:
+            return return_code
+        # only the runs that were not split further are merged.
+        results = [
+            run['return_code'] for run in runs
+            if not (run['crashed'] and len(run['test_module_paths']) > 1)
+        ]
+        logger.info(
+            "completed %d split karma run(s) with return codes %r",
+            len(results), results,
+        )
+        return next((code for code in results if code), 0)
+
+    def _run_subset(self, spec, binary, call_kw, test_module_paths, index):
+        # run karma with only the subset of the test modules.
+        config_fn, outcome_fn = self._prepare_subset(
+            spec, test_module_paths, index)
+        return_code = self._call_karma(
+            self.karma_command(spec, binary, config_fn), **call_kw)
+        return self._subset_run(test_module_paths, return_code, outcome_fn)
+
+    def _prepare_subset(self, spec, test_module_paths, index):
+        build_dir = spec[BUILD_DIR]
+        config = dict(spec[karma.KARMA_CONFIG])
+        subset_paths = test_module_paths
+        if spec.get(TEST_BUNDLE_MODULES):
+            subset_paths, bundles = self._write_bundles(
+                spec, test_module_paths, prefix='split%d.' % index)
+            config['preprocessors'] = dict(
+                (path, preprocessor) for path, preprocessor in config.get(
+                    'preprocessors', {}).items()
+                if path not in spec[TEST_BUNDLE_MODULES]
+            )
+            config['preprocessors'].update(
+                (target, ['sourcemap']) for target, modules in bundles)
+        # the subset takes the place of the complete set of test modules
+        # in the listing of the files.
+        paths = set(spec[karma.KARMA_TEST_MODULE_PATHS])
+        files = [path for path in config['files'] if path not in paths]
+        position = next((
+            idx for idx, path in enumerate(config['files'])
+            if path in paths), len(config['files']))
+        files[position:position] = subset_paths
+        config['files'] = files
+        outcome_fn = self._apply_run_outcome(config, build_dir, index)
+        config_fn = join(build_dir, 'karma.split.%d.conf.js' % index)
+        self._write_config_file(spec, config, config_fn)
+        logger.info(
+            'invoking %s start %r with %d test module(s)',
+            self.binary, config_fn, len(test_module_paths),
+        )
+        return config_fn, outcome_fn
+
+    def _subset_run(self, test_module_paths, return_code, outcome_fn):
+        outcome = karma.read_outcome(outcome_fn)
+        return {
+            'test_module_paths': test_module_paths,
+            'return_code': return_code,
+            'outcome': outcome,
+            'crashed': karma.is_crashed(return_code, outcome),
+        }
+
+    def _run_quarantined(self, spec, binary, call_kw):
+        # run only the quarantined tests, as a separate run that will
+        # not affect the result.
+        config_fn, outcome_fn = self._prepare_quarantined(spec)
+        return_code = self._call_karma(
+            self.karma_command(spec, binary, config_fn), **call_kw)
+        return self._quarantined_run(return_code, outcome_fn)
+
+    def _prepare_quarantined(self, spec):
+        build_dir = spec[BUILD_DIR]
+        quarantine_js = join(build_dir, karma.KARMA_QUARANTINE_JS)
+        quarantine_only_js = join(build_dir, karma.KARMA_QUARANTINE_ONLY_JS)
+        utils.write_if_changed(quarantine_only_js, lambda fd: fd.write(
+            karma.quarantine_source(
+                spec[karma.KARMA_QUARANTINE_TESTS], only=True)))
+        config = dict(spec[karma.KARMA_CONFIG])
+        config['files'] = [
+            quarantine_only_js if path == quarantine_js else path
+            for path in config['files']
+        ]
+        # the coverage reports of the run are to be retained.
+        config['reporters'] = [
+            reporter for reporter in config['reporters']
+            if reporter != 'coverage'
+        ]
+        outcome_fn = self._apply_run_outcome(config, build_dir, 'quarantine')
+        config_fn = join(build_dir, 'karma.quarantine.conf.js')
+        self._write_config_file(spec, config, config_fn)
+        logger.info(
+            'invoking %s start %r with the %d quarantined test(s)',
+            self.binary, config_fn, len(spec[karma.KARMA_QUARANTINE_TESTS]),
+        )
+        return config_fn, outcome_fn
+
+    def _quarantined_run(self, return_code, outcome_fn):
+        outcome = karma.read_outcome(outcome_fn)
+        logger.info(
+            "quarantined test(s) completed with return code %d: %s passed, "
+            "%s failed; the result of the run is not affected",
+            return_code, (outcome or {}).get('passed'),
+            (outcome or {}).get('failed'),
+        )
+        return {
+            'return_code': return_code,
+            'outcome': outcome,
+        }
 
     # these should be a self-contained function that apply the
     # advice on the spec with its internal, closure function?
@@ -190,6 +559,10 @@ class KarmaDriver(NodeDriver):
             report_keys = list(spec.get(
                 COVER_REPORT_TYPES, karma.DEFAULT_COVER_REPORT_TYPE_OPTIONS))
 
+        if spec.get(COVER_DIFF) and 'json' not in report_keys:
+            # the changed lines report is derived from the json report.
+            report_keys.append('json')
+
         report_dir = realpath(spec.get(
             COVER_REPORT_DIR, COVER_REPORT_DIR_DEFAULT))
         report_file = spec.get(COVER_REPORT_FILE, None)
@@ -243,6 +616,68 @@ class KarmaDriver(NodeDriver):
         })
         self._apply_coverage_reporters(spec, config)
 
+    def _get_coverage_json_path(self, spec):
+        coverage_reporter = spec.get(karma.KARMA_CONFIG, {}).get(
+            'coverageReporter', {})
+        for reporter in coverage_reporter.get(
+                'reporters', [coverage_reporter]):
+            if reporter.get('type') == 'json':
+                return reporter.get('file')
+        return None
+
+    def _get_cover_diff_targets(self, spec, changed):
+        # map each of the changed sources to the covered files that
+        # were produced from them, by the module names.
+        build_dir = spec.get(BUILD_DIR, '')
+        covered = spec.get(TEST_COVERED_BUILD_DIR_PATHS, set())
+        targetpaths = [
+            spec[key] for key in spec.get(karma.KARMA_SPEC_KEYS, [])
+            if isinstance(spec.get(key), dict)
+        ]
+        targets = {}
+        for key, sourcepaths in spec.items():
+            if not (key.endswith('_sourcepath') and
+                    isinstance(sourcepaths, dict)):
+                continue
+            for modname, source in sourcepaths.items():
+                source = realpath(source)
+                if source not in changed:
+                    continue
+                for paths in targetpaths:
+                    target = paths.get(modname)
+                    if target in covered:
+                        targets.setdefault(source, []).append(
+                            join(build_dir, target))
+
+        # the tests and artifacts are covered directly.
+        for path in chain(
+                spec.get(TEST_COVERED_TEST_PATHS, ()),
+                spec.get(TEST_COVERED_ARTIFACT_PATHS, ())):
+            source = realpath(path)
+            if source in changed:
+                targets.setdefault(source, []).append(path)
+        return targets
+
+    def report_cover_diff(self, spec):
+        coverage_json = self._get_coverage_json_path(spec)
+        if not coverage_json or not exists(coverage_json):
+            logger.warning(
+                "coverage data not found at '%s'; cannot produce the changed "
+                "lines coverage report", coverage_json,
+            )
+            return
+
+        changed = diffcover.read_unified_diff(spec[COVER_DIFF])
+        logger.debug(
+            "diff '%s' changed %d file(s)", spec[COVER_DIFF], len(changed))
+        with codecs.open(coverage_json, encoding='utf8') as fd:
+            coverage = json.load(fd)
+
+        report = diffcover.build_diff_coverage_report(
+            changed, coverage, self._get_cover_diff_targets(spec, changed))
+        spec[COVER_DIFF_REPORT] = report
+        sys.stdout.write(diffcover.format_diff_coverage_report(report))
+
     def _valid_wrap_test_file(self, spec, path):
         return re.search(r'%s[^\\\/]*js$' % spec.get(
             TEST_FILENAME_PREFIX, TEST_FILENAME_PREFIX_DEFAULT), path)
@@ -259,6 +694,85 @@ class KarmaDriver(NodeDriver):
             "template": "(function () { <%= contents %> })()",
         }
 
+    def _apply_bundle_sourcemaps(self, spec, config):
+        # the bundles reference the original test modules through their
+        # source maps, which karma-sourcemap-loader provides to karma.
+        self._apply_preprocessors_config(config, {
+            path: ['sourcemap']
+            for path in spec.get(TEST_BUNDLE_PATHS, [])
+        })
+
+    def _bundle_tests(self, spec, test_module_paths):
+        # only the tests that would have been wrapped will be bundled,
+        # as the remaining ones may depend on being loaded separately.
+        if spec.get(NO_WRAP_TESTS) or spec.get(COVER_TEST):
+            logger.warning(
+                "tests will not be bundled as they are not wrapped or are "
+                "to be covered",
+            )
+            return test_module_paths
+        if BUILD_DIR not in spec:
+            logger.warning("tests will not be bundled without a build_dir")
+            return test_module_paths
+
+        result, bundles = self._write_bundles(spec, test_module_paths)
+        bundle_paths = spec[TEST_BUNDLE_PATHS] = [
+            target for target, modules in bundles]
+        spec[TEST_BUNDLE_MODULES] = dict(bundles)
+
+        # remove the bundles left behind by prior runs that produced a
+        # larger number of bundles in a reused build directory, along
+        # with the bundles written for the split runs.
+        bundle_dir = join(spec[BUILD_DIR], TEST_BUNDLE_DIRNAME)
+        current = set(chain(
+            bundle_paths, (path + '.map' for path in bundle_paths)))
+        for name in listdir(bundle_dir):
+            path = join(bundle_dir, name)
+            if re.match(r'(split\d+\.)?bundle\d+\.js(\.map)?$', name) and (
+                    path not in current):
+                remove(path)
+
+        logger.info(
+            "bundled %d test module(s) into %d bundle(s) at '%s'",
+            len(test_module_paths) - len(result) + len(bundle_paths),
+            len(bundle_paths), bundle_dir,
+        )
+        return result
+
+    def _write_bundles(self, spec, test_module_paths, prefix=''):
+        # write the test modules that can be wrapped into the bundles,
+        # returning the resulting test module paths along with the list
+        # of the bundles written and the test modules within them.
+        bundle_dir = join(spec[BUILD_DIR], TEST_BUNDLE_DIRNAME)
+        if not exists(bundle_dir):
+            makedirs(bundle_dir)
+        limit = spec.get(
+            BUNDLE_TESTS_MODULE_LIMIT, BUNDLE_TESTS_MODULE_LIMIT_DEFAULT)
+        bundles = []
+        result = []
+        modules = []
+
+        def write_bundle():
+            if not modules:
+                return
+            target = join(bundle_dir, '%sbundle%d.js' % (prefix, len(bundles)))
+            bundle.write_test_bundle(modules, target)
+            bundles.append((target, list(modules)))
+            result.append(target)
+            del modules[:]
+
+        for path in test_module_paths:
+            if not self._valid_wrap_test_file(spec, path):
+                # keep the original ordering of the files.
+                write_bundle()
+                result.append(path)
+                continue
+            modules.append(path)
+            if len(modules) >= limit:
+                write_bundle()
+        write_bundle()
+        return result, bundles
+
     def _apply_preprocessors_config(self, config, new_preprocessors):
         original = config['preprocessors'] = config.get('preprocessors', {})
         for key in new_preprocessors:
@@ -272,7 +786,33 @@ class KarmaDriver(NodeDriver):
             else:
                 preprocessor.append(new_preprocessors[key])
 
-    def _create_config(self, spec, spec_keys):
+    def _compact_config(self, spec, config):
+        # produce a compacted copy, such that the complete listing will
+        # remain available through the spec.
+        build_dir = spec[BUILD_DIR]
+        preprocessors = config.get('preprocessors', {})
+        compacted = dict(config)
+        compacted['files'] = karma.compact_files(
+            config.get('files', []), build_dir,
+            single_run=config.get('singleRun'), preprocessors=preprocessors,
+        )
+        if preprocessors:
+            compacted['preprocessors'] = karma.compact_preprocessors(
+                preprocessors, build_dir)
+        logger.debug(
+            "compacted karma configuration from %d files and %d "
+            "preprocessors entries to %d and %d entries respectively",
+            len(config.get('files', [])), len(preprocessors),
+            len(compacted['files']), len(compacted.get('preprocessors', {})),
+        )
+        return compacted
+
+    def resolve_test_module_paths_map(self, spec):
+        """
+        Resolve the test modules for the packages specified in the spec
+        through the specified registries.
+        """
+
         package_names = self._pick_spec_keys(
             spec, TEST_PACKAGE_NAMES, SOURCE_PACKAGE_NAMES, default=[])
 
@@ -288,11 +828,17 @@ class KarmaDriver(NodeDriver):
             "registries %r for testing", package_names, module_registries,
         )
 
+        return dist.get_module_registries_dependencies(
+            package_names, module_registries)
+
+    def _create_config(self, spec, spec_keys):
         # calculate, extract and persist the test module names
         test_module_paths_map = spec[TEST_MODULE_PATHS_MAP] = spec.get(
             TEST_MODULE_PATHS_MAP, {})
-        test_module_paths_map.update(dist.get_module_registries_dependencies(
-            package_names, module_registries))
+        resolved_paths_map = self.resolve_test_module_paths_map(spec)
+        spec[karma.KARMA_COST_KEY] = plan.cost_key(
+            spec, resolved_paths_map.values())
+        test_module_paths_map.update(resolved_paths_map)
 
         config = karma.build_base_config()
         config['frameworks'].extend(spec.get(karma.KARMA_EXTRA_FRAMEWORKS, []))
@@ -302,10 +848,48 @@ class KarmaDriver(NodeDriver):
 
         files = list(utils.get_targets_from_spec(spec, spec_keys))
         test_module_paths = sorted(test_module_paths_map.values())
+        if spec.get(BUNDLE_TESTS):
+            test_module_paths = self._bundle_tests(spec, test_module_paths)
+            self._apply_bundle_sourcemaps(spec, config)
 
         config['files'] = files + test_module_paths
+        spec[karma.KARMA_TEST_MODULE_PATHS] = test_module_paths
         self._apply_coverage_config(spec, config, files, test_module_paths)
         self._apply_wrap_tests(spec, config, test_module_paths)
+        if self.minimal_enabled(spec) and BUILD_DIR in spec:
+            karma.apply_minimal_reporter_config(
+                config, spec[BUILD_DIR],
+                join(spec[BUILD_DIR], karma.KARMA_MINIMAL_LOG))
+        if spec.get(karma.KARMA_BENCH) and BUILD_DIR in spec:
+            karma.apply_bench_config(
+                config, spec[BUILD_DIR],
+                join(spec[BUILD_DIR], karma.KARMA_BENCH_JSON))
+        if self.artifact_load_enabled(spec) and spec.get(
+                ARTIFACT_PATHS) and BUILD_DIR in spec:
+            karma.apply_artifacts_reporter_config(
+                config, spec[BUILD_DIR],
+                join(spec[BUILD_DIR], karma.KARMA_ARTIFACTS_JSON))
+        spec[karma.KARMA_QUARANTINE_TESTS] = history.quarantine_tests(spec)
+        if spec[karma.KARMA_QUARANTINE_TESTS] and 'mocha' not in config[
+                'frameworks']:
+            logger.warning(
+                "the quarantine cannot be applied as the tests are not run "
+                "through the mocha framework; running all tests")
+            spec[karma.KARMA_QUARANTINE_TESTS] = []
+        if spec[karma.KARMA_QUARANTINE_TESTS] and BUILD_DIR in spec:
+            logger.info(
+                "%d quarantined test(s) will be excluded from the run",
+                len(spec[karma.KARMA_QUARANTINE_TESTS]))
+            config['files'].insert(
+                0, join(spec[BUILD_DIR], karma.KARMA_QUARANTINE_JS))
+        if self.outcome_enabled(spec) and BUILD_DIR in spec:
+            karma.apply_outcome_reporter_config(
+                config, spec[BUILD_DIR],
+                join(spec[BUILD_DIR], karma.KARMA_OUTCOME_JSON),
+                results=bool(spec.get(karma.KARMA_HISTORY)),
+                stream=join(spec[BUILD_DIR], karma.KARMA_RESULTS_JSONL) if (
+                    self.junit_enabled(spec)) else None,
+            )
 
         return config
 
@@ -323,35 +907,96 @@ class KarmaDriver(NodeDriver):
             )
             return
 
+        build_dir = spec[BUILD_DIR]
+        artifact_paths = spec.get(ARTIFACT_PATHS)
+        if artifact_paths and 'calmjsArtifacts' in karma_config:
+            # the artifacts are loaded by the loader for the measurement.
+            utils.write_if_changed(
+                join(build_dir, karma.KARMA_ARTIFACTS_LOADER_JS),
+                lambda fd: fd.write(karma.artifacts_loader_source(
+                    artifact_paths, build_dir)),
+            )
+            utils.write_if_changed(
+                join(build_dir, karma.KARMA_ARTIFACTS_REPORTER_JS),
+                lambda fd: fd.write(karma.KARMA_ARTIFACTS_REPORTER_SOURCE),
+            )
+            karma.clear_outcome(join(build_dir, karma.KARMA_ARTIFACTS_JSON))
+            artifact_paths = karma.artifacts_loader_files(
+                artifact_paths, build_dir)
+
         files = []
         # prepend the file listing with the source artifacts.
-        for f in (spec.get(ARTIFACT_PATHS), karma_config.get('files')):
+        for f in (artifact_paths, karma_config.get('files')):
             if isinstance(f, (tuple, list)):
                 files.extend(f)
         karma_config['files'] = files
 
-        build_dir = spec[BUILD_DIR]
-        config_fn = join(build_dir, self.karma_conf_js)
-        with open(config_fn, 'w') as fd:
-            if karma.KARMA_CONFIG_WRITER in spec:
-                writer = spec[karma.KARMA_CONFIG_WRITER]
-                logger.debug(
-                    "writing karma configuration file to '%s' with writer "
-                    "that was assigned to spec[KARMA_CONFIG_WRITER]", config_fn
-                )
-                warn_if_nodejs_lt_6(
-                    "custom karma config writer specified with spec; if "
-                    "an 'Invalid config file' or 'Error: cannot find "
-                    "module' message results, please upgrade Node.js to "
-                    "version 6 or above.",
-                )
-            else:
-                writer = partial(karma.config_writer, self)
+        if self.outcome_enabled(spec):
+            utils.write_if_changed(
+                join(build_dir, karma.KARMA_OUTCOME_REPORTER_JS),
+                lambda fd: fd.write(karma.KARMA_OUTCOME_REPORTER_SOURCE),
+            )
+        if self.minimal_enabled(spec):
+            utils.write_if_changed(
+                join(build_dir, karma.KARMA_MINIMAL_REPORTER_JS),
+                lambda fd: fd.write(karma.KARMA_MINIMAL_REPORTER_SOURCE),
+            )
+        if spec.get(karma.KARMA_BENCH):
+            utils.write_if_changed(
+                join(build_dir, karma.KARMA_BENCH_REPORTER_JS),
+                lambda fd: fd.write(karma.KARMA_BENCH_REPORTER_SOURCE),
+            )
+            # remove the results of any prior run in the build directory.
+            karma.clear_outcome(join(build_dir, karma.KARMA_BENCH_JSON))
+        if spec.get(karma.KARMA_QUARANTINE_TESTS):
+            utils.write_if_changed(
+                join(build_dir, karma.KARMA_QUARANTINE_JS),
+                lambda fd: fd.write(karma.quarantine_source(
+                    spec[karma.KARMA_QUARANTINE_TESTS])),
+            )
+        return self._write_config_file(
+            spec, karma_config, join(build_dir, self.karma_conf_js))
+
+    def _write_config_file(self, spec, karma_config, config_fn):
+        if spec.get(karma.KARMA_COMPACT_CONFIG):
+            karma_config = self._compact_config(spec, karma_config)
+
+        if karma.KARMA_CONFIG_WRITER in spec:
+            writer = spec[karma.KARMA_CONFIG_WRITER]
+            logger.debug(
+                "writing karma configuration file to '%s' with writer "
+                "that was assigned to spec[KARMA_CONFIG_WRITER]", config_fn
+            )
+            warn_if_nodejs_lt_6(
+                "custom karma config writer specified with spec; if "
+                "an 'Invalid config file' or 'Error: cannot find "
+                "module' message results, please upgrade Node.js to "
+                "version 6 or above.",
+            )
+        elif spec.get(karma.KARMA_CONFIG_SIDECAR):
+            sidecar_fn = karma.sidecar_path(config_fn)
+            logger.debug(
+                "writing karma configuration to sidecar '%s' to be loaded "
+                "by the karma configuration file '%s'", sidecar_fn, config_fn
+            )
+            if not utils.write_if_changed(sidecar_fn, partial(
+                    karma.sidecar_writer, karma_config)):
                 logger.debug(
-                    "writing karma configuration file to '%s' with default "
-                    "karma configuration writer", config_fn
-                )
-            writer(karma_config, fd)
+                    "karma configuration sidecar '%s' unchanged", sidecar_fn)
+            writer = karma.config_stub_writer
+        else:
+            writer = partial(karma.streaming_config_writer, self)
+            logger.debug(
+                "writing karma configuration file to '%s' with default "
+                "karma configuration writer", config_fn
+            )
+
+        # only replace the existing configuration file if changed, such
+        # that it may be reused by subsequent runs as is.
+        if not utils.write_if_changed(config_fn, partial(
+                writer, karma_config)):
+            logger.debug(
+                "karma configuration file '%s' unchanged", config_fn)
         return config_fn
 
     def write_config(self, spec):
@@ -367,6 +1012,9 @@ class KarmaDriver(NodeDriver):
         Setup a spec for execution.
         """
 
+        if spec.get(karma.KARMA_BENCH) and spec.pop(COVERAGE_ENABLE, None):
+            logger.warning('coverage is not available for benchmarks')
+
         # must use source map if coverage is enabled
         if spec.get(COVERAGE_ENABLE):
             spec[GENERATE_SOURCE_MAP] = True
@@ -379,6 +1027,27 @@ class KarmaDriver(NodeDriver):
         spec.advise(BEFORE_TEST, self.create_config, spec)
         spec.advise(karma.BEFORE_KARMA, self.write_config, spec)
 
+        if spec.get(COVERAGE_ENABLE) and spec.get(COVER_DIFF):
+            spec.advise(karma.AFTER_KARMA, self.report_cover_diff, spec)
+
+        if self.artifact_load_enabled(spec):
+            spec.advise(karma.AFTER_KARMA, self.measure_artifact_load, spec)
+
+        if spec.get(BUILD_CACHE_DIR):
+            spec.advise(karma.AFTER_KARMA, self.record_timing, spec)
+
+        if self.metrics_enabled(spec):
+            spec.advise(karma.AFTER_KARMA, self.export_metrics, spec)
+
+        if spec.get(karma.KARMA_HISTORY):
+            spec.advise(karma.AFTER_KARMA, self.record_history, spec)
+
+        if self.junit_enabled(spec):
+            spec.advise(karma.AFTER_KARMA, self.write_junit_xml, spec)
+
+        if spec.get(karma.KARMA_BENCH):
+            spec.advise(karma.AFTER_KARMA, self.compare_bench, spec)
+
         if spec.get(karma.KARMA_HALT_AFTER_TEST):
             spec.advise(AFTER_TEST, self.halt_after_test, spec)
 
@@ -387,6 +1056,169 @@ class KarmaDriver(NodeDriver):
         else:
             spec.advise(AFTER_TEST, self.warn_on_test_failure, spec)
 
+    def record_timing(self, spec):
+        if karma.KARMA_COST_KEY in spec and karma.KARMA_DURATION in spec:
+            plan.record_timing(
+                spec[BUILD_CACHE_DIR], spec[karma.KARMA_COST_KEY],
+                spec[karma.KARMA_DURATION],
+            )
+
+    def measure_artifact_load(self, spec):
+        """
+        Capture the measurements of the loading of the artifacts, and
+        check them against the budget for the export target specified
+        by the spec.  The run fails if the budget was exceeded, or if
+        the budget has a limit on the loading that was not measured.
+        """
+
+        artifact_paths = spec.get(ARTIFACT_PATHS) or []
+        if not artifact_paths:
+            return
+        reported = karma.read_outcome(
+            join(spec[BUILD_DIR], karma.KARMA_ARTIFACTS_JSON)) or {}
+        measured = bool(reported.get('browsers'))
+        artifacts = loadtime.summarize_load(
+            artifact_paths, reported.get('browsers'))
+        for line in loadtime.format_load(artifacts):
+            logger.info(line)
+
+        budget = None
+        if spec.get(karma.KARMA_ARTIFACT_BUDGETS):
+            budget = loadtime.budget_for(
+                loadtime.load_budgets(spec[karma.KARMA_ARTIFACT_BUDGETS]),
+                spec.get(EXPORT_TARGET),
+            )
+        exceeded = loadtime.check_budget(artifacts, budget)
+        spec[karma.KARMA_ARTIFACT_LOAD] = {
+            'artifacts': artifacts,
+            'budget': budget,
+            'exceeded': exceeded,
+            'measured': measured,
+        }
+        failed = bool(exceeded)
+        for line in loadtime.format_exceeded(exceeded):
+            logger.error(line)
+        if not measured:
+            if budget and budget.get('load') is not None:
+                logger.error(
+                    'the loading of the artifacts was not measured for '
+                    'the budget of its load')
+                failed = True
+            else:
+                logger.warning(
+                    'the loading of the artifacts was not measured')
+        if failed and not spec.get(karma.KARMA_RETURN_CODE):
+            spec[karma.KARMA_RETURN_CODE] = 1
+
+    def export_metrics(self, spec):
+        """
+        Produce the metrics of the karma run, and export them to the
+        locations specified by the spec, if any.
+        """
+
+        spec[karma.KARMA_METRICS] = metrics.run_metrics(
+            spec, self._get_coverage_json_path(spec) if spec.get(
+                COVERAGE_ENABLE) else None)
+        metrics.export_metrics(
+            spec[karma.KARMA_METRICS],
+            prometheus=spec.get(karma.KARMA_METRICS_PROMETHEUS),
+            jsonl=spec.get(karma.KARMA_METRICS_JSONL),
+        )
+
+    def record_history(self, spec):
+        """
+        Record the karma run, with the results of its tests, into the
+        history database specified by the spec.
+        """
+
+        history.record_run(spec[karma.KARMA_HISTORY], spec)
+
+    def write_junit_xml(self, spec):
+        """
+        Write the results of the karma run as JUnit XML, through the
+        writer shared by the verification of the artifacts if present
+        in the spec, otherwise to the file specified by the spec.
+        """
+
+        writer = spec.get(karma.KARMA_JUNIT_WRITER)
+        if writer is not None:
+            junit.write_junit_xml(spec, writer)
+            return
+        with junit.JUnitXMLWriter(spec[karma.KARMA_JUNIT_XML]) as writer:
+            junit.write_junit_xml(spec, writer)
+        logger.info(
+            "wrote the results of the karma run as JUnit XML to '%s'",
+            spec[karma.KARMA_JUNIT_XML])
+
+    def compare_bench(self, spec):
+        """
+        Capture the results of the benchmarks, compare them against the
+        baseline specified by the spec, and write them to the specified
+        output.  The run fails if any of the results is a regression.
+        """
+
+        results = spec[karma.KARMA_BENCH_RESULTS] = karma.read_bench_results(
+            join(spec[BUILD_DIR], karma.KARMA_BENCH_JSON)) or []
+        if not results:
+            logger.warning('no benchmark results were captured')
+            return
+
+        regressions = spec[karma.KARMA_BENCH_REGRESSIONS] = []
+        if spec.get(karma.KARMA_BENCH_BASELINE):
+            threshold = spec.get(karma.KARMA_BENCH_THRESHOLD)
+            comparisons = bench.compare_results(
+                bench.load_baseline(spec[karma.KARMA_BENCH_BASELINE]),
+                results, bench.BENCH_THRESHOLD if threshold is None else (
+                    threshold),
+            )
+            for line in bench.format_comparisons(comparisons):
+                sys.stdout.write(line + '\n')
+            regressions.extend(
+                comparison for comparison in comparisons
+                if comparison['regression'])
+
+        # written after the comparison, as the output may replace the
+        # baseline.
+        if spec.get(karma.KARMA_BENCH_OUTPUT):
+            bench.write_results(spec[karma.KARMA_BENCH_OUTPUT], results)
+
+        if regressions:
+            logger.error(
+                "%d benchmark regression(s) against the baseline at '%s'",
+                len(regressions), spec[karma.KARMA_BENCH_BASELINE])
+            if not spec.get(karma.KARMA_RETURN_CODE):
+                spec[karma.KARMA_RETURN_CODE] = 1
+
+    def create_plan(self, spec, timings=None, toolchain=None):
+        """
+        Produce the planned execution for the spec, with the test
+        modules and artifacts resolved, without executing anything.  If
+        the toolchain is provided, the test modules are resolved with
+        the registry names that it would prepare for the spec.
+        """
+
+        timings = plan.load_timings(
+            spec.get(BUILD_CACHE_DIR)) if timings is None else timings
+        test_module_paths = sorted(self.resolve_test_module_paths_map(
+            spec if toolchain is None else prepared_spec(
+                toolchain, spec)).values())
+        key = plan.cost_key(spec, test_module_paths)
+        return {
+            'test_package_names': self._pick_spec_keys(
+                spec, TEST_PACKAGE_NAMES, SOURCE_PACKAGE_NAMES, default=[]),
+            'test_module_paths': test_module_paths,
+            'artifact_paths': list(spec.get(ARTIFACT_PATHS) or []),
+            'browsers': list(spec.get(karma.KARMA_BROWSERS) or []),
+            'extra_frameworks': list(
+                spec.get(karma.KARMA_EXTRA_FRAMEWORKS) or []),
+            'coverage_enable': bool(spec.get(COVERAGE_ENABLE)),
+            'cover_artifact': bool(spec.get(COVER_ARTIFACT)),
+            'cover_test': bool(spec.get(COVER_TEST)),
+            'build_dir': spec.get(BUILD_DIR),
+            'cost_key': key,
+            'estimated_duration': plan.estimate_duration(timings, key),
+        }
+
     def run(self, toolchain, spec):
         """
         This is the test method invoked on a successful toolchain run.
@@ -394,18 +1226,54 @@ class KarmaDriver(NodeDriver):
         Will be invoked from a toolchain success
         """
 
+        create_spec_build_cache_dir(spec)
         self.setup_toolchain_spec(toolchain, spec)
         toolchain(spec)
 
 
-def _execute_builder(registry, builder, kwargs):
-    entry_point, toolchain, spec = builder
+def execution_key(spec, driver=None, toolchain=None):
+    """
+    Produce the key that identifies the test execution described by the
+    spec, derived only from the fingerprints of the artifacts, the
+    resolved test modules, the browsers, the frameworks and the options
+    that determine the preprocessors, such that the specs for identical
+    executions will produce the same key, regardless of the packages
+    that they were declared for.  The test modules are resolved with the
+    registry names that the toolchain would prepare for the spec.
+    """
+
+    driver = KarmaDriver() if driver is None else driver
+    fingerprints = prepare_spec_artifact_fingerprints(spec)
+    values = {
+        'artifacts': [
+            fingerprints.get(realpath(path))
+            for path in spec.get(ARTIFACT_PATHS, [])
+        ],
+        'test_module_paths': sorted(driver.resolve_test_module_paths_map(
+            spec if toolchain is None else prepared_spec(
+                toolchain, spec)).values()),
+        'browsers': list(spec.get(karma.KARMA_BROWSERS) or []),
+        'frameworks': list(spec.get(karma.KARMA_EXTRA_FRAMEWORKS) or []),
+        'preprocessors': {
+            key: spec.get(key) for key in EXECUTION_KEY_PREPROCESSOR_OPTIONS},
+    }
+    return hashlib.sha256(json.dumps(
+        values, sort_keys=True).encode('utf8')).hexdigest()
+
+
+def _prepare_builder_spec(spec, kwargs):
     # process the extra arguments such that the "default" values are
     # stripped from the extra arguments to prevent them from being
     # needlessly applied later.
     extra_arguments = {}
     update_spec_for_karma(extra_arguments, **kwargs)
 
+    # the metrics are exported once by the verification, with the
+    # metrics of every run included, so the runs only collect them.
+    for key in (karma.KARMA_METRICS_PROMETHEUS, karma.KARMA_METRICS_JSONL):
+        if extra_arguments.pop(key, None):
+            extra_arguments[karma.KARMA_METRICS_COLLECT] = True
+
     # ensure that this is available in the spec.
     artifacts = spec[ARTIFACT_PATHS] = spec.get(ARTIFACT_PATHS, [])
     # manually merge any extra arguments that should be merged
@@ -422,22 +1290,154 @@ def _execute_builder(registry, builder, kwargs):
             "spec['%s'] was %r replaced with %r", key, old, new)
 
     prepare_spec_artifacts(spec)
-    artifact_exists = exists(spec[EXPORT_TARGET])
+    prepare_spec_build_cache_dir(spec)
+    return exists(spec[EXPORT_TARGET])
+
+
+def _write_reused_junit_xml(spec):
+    # the testsuites for the execution that reused the results are
+    # written from those of the identical execution.
+    writer = spec.get(karma.KARMA_JUNIT_WRITER)
+    if writer is not None:
+        junit.write_reused_junit_xml(spec, writer)
+
+
+def _execute_builder(
+        registry, builder, kwargs, executions=None, record=None):
+    entry_point, toolchain, spec = builder
+    record = {} if record is None else record
+    artifact_exists = _prepare_builder_spec(spec, kwargs)
     if not artifact_exists:
         logger.warning("artifact not found: %s", spec[EXPORT_TARGET])
+        record['skip_reason'] = 'artifact not found'
         return False
 
+    if executions is not None:
+        key = record[EXECUTION_KEY] = spec[EXECUTION_KEY] = execution_key(
+            spec, toolchain=toolchain)
+        if key in executions:
+            logger.info(
+                "tests for artifact '%s' are identical to a previous "
+                "execution; reusing its result", spec[EXPORT_TARGET])
+            record['cache_hit'] = True
+            record['return_code'] = executions[key]
+            _write_reused_junit_xml(spec)
+            return executions[key] == 0
+
     registry.execute_builder(entry_point, toolchain, spec)
-    return spec.get(karma.KARMA_RETURN_CODE) == 0
+    return_code = record['return_code'] = spec.get(karma.KARMA_RETURN_CODE)
+    record['rusage'] = spec.get(karma.KARMA_RUSAGE)
+    record['metrics'] = spec.get(karma.KARMA_METRICS)
+    record['quarantine'] = history.summarize_quarantine(spec)
+    record['artifact_load'] = spec.get(karma.KARMA_ARTIFACT_LOAD)
+    if executions is not None:
+        executions[key] = return_code
+    return return_code == 0
 
 
-def karma_verify_package_artifacts(package_names=[], **kwargs):
+def index_export_targets(registry, package_names):
+    """
+    Produce a mapping from each of the package names to the list of the
+    (entry_point, export_target) records declared for it in the
+    registry, such that the registry need only be scanned once for the
+    duration of the verification.
+    """
+
+    return {
+        package: list(registry.iter_export_targets_for(package))
+        for package in package_names
+    }
+
+
+def load_builders(registry, export_targets, pool_size=BUILDER_POOL_SIZE):
+    """
+    Generate the builders for the list of (entry_point, export_target)
+    records using a thread pool, returning a list of builders in the
+    same order, with None in place of the ones that failed to generate.
+    """
+
+    def load(record):
+        return next(registry.generate_builder(*record), None)
+
+    if len(export_targets) < 2 or pool_size < 2:
+        return [load(record) for record in export_targets]
+
+    pool = ThreadPool(min(pool_size, len(export_targets)))
+    try:
+        return pool.map(load, export_targets)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _new_record(entry_point, export_target):
+    return {
+        'entry_point': str(entry_point),
+        'export_target': export_target,
+        'return_code': None,
+        'skip_reason': None,
+        'cache_hit': False,
+        'duration': 0.0,
+        'rusage': None,
+        'metrics': None,
+        'quarantine': None,
+        'artifact_load': None,
+    }
+
+
+def summarize_package_usage(package):
+    # summarize the resource usage of the records for the package.
+    package['rusage'] = rusage.summarize_usage(
+        record.get('rusage') for record in package['export_targets'])
+    return package
+
+
+def _verify_builder(registry, builder, kwargs, executions, record):
+    # execute the builder, with the outcome recorded into the record.
+    if not builder:
+        # immediate failure if builder does not exist.
+        record['status'] = 'error'
+        record['skip_reason'] = 'builder not available'
+        return False
+    started = time()
+    success = _execute_builder(registry, builder, kwargs, executions, record)
+    record['duration'] = time() - started
+    record['status'] = 'passed' if success else (
+        'error' if record['return_code'] is None else 'failed')
+    return success
+
+
+def _check_tests_missing(main_registry, main_index, test_index, package):
+    # Check also for the artifact registry for any definitions that do
+    # not have a corresponding test defined.
+    if test_index[package]:
+        return False
+    if not any(
+            next(main_registry.generate_builder(*main_record), None)
+            for main_record in main_index[package]):
+        logger.info(
+            "no artifacts or tests defined for package '%s'", package)
+        return False
+    logger.error(
+        "no test found for artifacts declared for package '%s'", package)
+    return True
+
+
+def karma_verify_package_artifacts_report(
+        package_names=[], keep_going=False, **kwargs):
     """
+    Verify the artifacts for the packages, returning the report of the
+    verification, which includes the outcome of every export target
+    declared for the packages.  If keep_going is specified, the tests
+    for every export target will be executed even after a failure.
+
     The kwargs are there so that runtime (or other external users) can
     pass in arguments to control certain execution aspects of the tests.
     """
 
     result = True
+    started = time()
+    report = {'packages': {}}
     # Should the value of the registry be arguments?  Not doing that for
     # now to limit the scope of the implementation.
     main_registry = get('calmjs.artifacts')
@@ -448,32 +1448,239 @@ def karma_verify_package_artifacts(package_names=[], **kwargs):
     # that it also assume the production of metadata, while this simply
     # does not do anything of that sort.
 
+    # index the registries once, and load all the test builders ahead
+    # of their execution.
+    test_index = index_export_targets(test_registry, package_names)
+    main_index = index_export_targets(main_registry, package_names)
+    # the results of the executions, keyed by their execution keys,
+    # such that identical executions are only done once.
+    executions = {}
+    builders = iter(load_builders(test_registry, list(
+        chain.from_iterable(test_index[package] for package in package_names)
+    )))
+
     for package in package_names:
-        for entry_point, export_target in \
-                test_registry.iter_export_targets_for(package):
-            builder = next(test_registry.generate_builder(
-                entry_point, export_target), None)
-            if not builder:
-                # immediate failure if builder does not exist.
-                result = False
+        records = []
+        for entry_point, export_target in test_index[package]:
+            builder = next(builders)
+            record = _new_record(entry_point, export_target)
+            records.append(record)
+            if builder and not (result or keep_going):
+                record['status'] = 'skipped'
+                record['skip_reason'] = 'previous failure'
                 continue
-            result = result and _execute_builder(
-                test_registry, builder, kwargs)
-
-        # Check also for the artifact registry for any definitions that
-        # do not have a corresponding test defined.
-        tests_missing = False
-        if not any(test_registry.iter_export_targets_for(package)):
-            if not any(main_registry.iter_builders_for(package)):
-                logger.info(
-                    "no artifacts or tests defined for package '%s'", package)
-            else:
-                tests_missing = True
-                logger.error(
-                    "no test found for artifacts declared for package '%s'",
-                    package
-                )
+            result = _verify_builder(
+                test_registry, builder, kwargs, executions, record) and result
 
+        tests_missing = _check_tests_missing(
+            main_registry, main_index, test_index, package)
         result = result and not tests_missing
+        report['packages'][package] = summarize_package_usage({
+            'export_targets': records,
+            'tests_missing': tests_missing,
+        })
+
+    report['success'] = result
+    report['duration'] = time() - started
+    return report
+
+
+def karma_plan_package_artifacts(package_names=[], **kwargs):
+    """
+    Produce the plan for the verification of the artifacts for the
+    packages, without executing any of the tests.
+    """
+
+    test_registry = get('calmjs.artifacts.tests')
+    test_index = index_export_targets(test_registry, package_names)
+    records = list(chain.from_iterable(
+        ((package, record) for record in test_index[package])
+        for package in package_names
+    ))
+    builders = load_builders(test_registry, [
+        record for package, record in records])
+    driver = KarmaDriver()
+    timings = plan.load_timings(kwargs.get(BUILD_CACHE_DIR))
+    executions = []
+    planned = []
+
+    for (package, (entry_point, export_target)), builder in zip(
+            records, builders):
+        execution = {
+            'package': package,
+            'entry_point': str(entry_point),
+            'export_target': export_target,
+        }
+        executions.append(execution)
+        if not builder:
+            execution['skip_reason'] = 'builder not available'
+            continue
+        toolchain, spec = builder[1:]
+        if not _prepare_builder_spec(spec, kwargs):
+            execution['skip_reason'] = 'artifact not found'
+            continue
+        execution.update(driver.create_plan(spec, timings, toolchain))
+        planned.append((execution, toolchain, spec, tuple(
+            getsize(path) for path in spec[ARTIFACT_PATHS])))
+
+    # only the executions with artifacts of identical sizes may be
+    # identical, so only those artifacts need to be fingerprinted; the
+    # fingerprint cache is not written for the plan.
+    sizes = Counter(size for execution, toolchain, spec, size in planned)
+    keys = set()
+    for execution, toolchain, spec, size in planned:
+        if sizes[size] < 2:
+            continue
+        prepare_spec_artifact_fingerprints(spec, save=False)
+        key = execution[EXECUTION_KEY] = execution_key(
+            spec, driver, toolchain)
+        if key in keys:
+            # identical executions are only done once.
+            execution['skip_reason'] = 'identical to a previous execution'
+            execution['estimated_duration'] = 0.0
+        keys.add(key)
+
+    return plan.summarize_plan(executions)
+
+
+def karma_spool_enqueue(spool_dir, package_names=[], **kwargs):
+    """
+    Enqueue the artifact tests for the packages as jobs into the spool
+    directory, each with the options provided by kwargs, such that the
+    jobs may be executed by any number of workers through the function
+    ``karma_spool_work``.  Returns the list of job ids.
+    """
+
+    queue = spool.Spool(spool_dir)
+    test_registry = get('calmjs.artifacts.tests')
+    test_index = index_export_targets(test_registry, package_names)
+    options = spec_option_values(kwargs)
+    job_ids = []
+    for package in package_names:
+        for entry_point, export_target in test_index[package]:
+            job = {
+                'package': package,
+                'entry_point': str(entry_point),
+                'export_target': export_target,
+                'kwargs': options,
+            }
+            job_id = '%05d-%s' % (len(job_ids), hashlib.sha256(json.dumps(
+                job, sort_keys=True).encode('utf8')).hexdigest()[:16])
+            queue.enqueue(job_id, job)
+            job_ids.append(job_id)
+
+    logger.info(
+        "enqueued %d job(s) for packages %r into spool directory '%s'",
+        len(job_ids), package_names, spool_dir,
+    )
+    return job_ids
+
+
+def _generate_job_builder(registry, job):
+    for entry_point, export_target in registry.iter_export_targets_for(
+            job['package']):
+        if (str(entry_point) == job['entry_point'] and
+                export_target == job['export_target']):
+            return next(registry.generate_builder(
+                entry_point, export_target), None)
+    return None
+
+
+def karma_spool_work(spool_dir, lease=None):
+    """
+    Claim and execute the jobs in the spool directory until there are no
+    more pending jobs, writing the result of each of them back into the
+    spool directory.  Returns True if all the jobs executed by this
+    worker have passed.
+
+    The jobs left running by the workers on this host that are no longer
+    alive are reclaimed before every claim, along with the running jobs
+    claimed more than lease seconds ago, if specified, which must then
+    exceed the duration of every job.
+    """
+
+    queue = spool.Spool(spool_dir)
+    test_registry = get('calmjs.artifacts.tests')
+    worker = spool.worker_id()
+    executions = {}
+    result = True
+
+    def claim():
+        queue.reclaim(lease)
+        return queue.claim(worker)
+
+    for job_id, job in iter(claim, None):
+        record = _new_record(job['entry_point'], job['export_target'])
+        record['package'] = job['package']
+        record['worker'] = worker
+        result = _verify_builder(
+            test_registry, _generate_job_builder(test_registry, job),
+            job['kwargs'], executions, record,
+        ) and result
+        queue.complete(job_id, record)
 
     return result
+
+
+def karma_spool_collect(spool_dir):
+    """
+    Aggregate the results in the spool directory into the verification
+    report; it will not be successful if there are jobs not completed.
+    """
+
+    queue = spool.Spool(spool_dir)
+    counts = queue.counts()
+    report = {'packages': {}}
+    for record in queue.results():
+        package = report['packages'].setdefault(
+            record.pop('package'), {'export_targets': []})
+        package['export_targets'].append(record)
+    for package in report['packages'].values():
+        summarize_package_usage(package)
+
+    report['pending'] = counts[spool.PENDING]
+    report['running'] = counts[spool.RUNNING]
+    report['success'] = not (report['pending'] or report['running']) and all(
+        record['status'] == 'passed'
+        for package in report['packages'].values()
+        for record in package['export_targets']
+    )
+    if report['pending'] or report['running']:
+        logger.warning(
+            "spool directory '%s' has %d pending and %d running job(s)",
+            spool_dir, report['pending'], report['running'],
+        )
+    return report
+
+
+def write_verification_report(report, path):
+    """
+    Write the verification report as JSON to the path, or to stdout if
+    the path is '-'.
+    """
+
+    utils.write_json(report, path)
+    if path != '-':
+        logger.info("wrote verification report to '%s'", path)
+
+
+def export_verification_metrics(report, prometheus=None, jsonl=None):
+    """
+    Export the metrics of the verification, which include the metrics
+    of the karma runs, to the provided locations.
+    """
+
+    metrics.export_metrics(
+        metrics.verification_metrics(report),
+        prometheus=prometheus, jsonl=jsonl,
+    )
+
+
+def karma_verify_package_artifacts(package_names=[], **kwargs):
+    """
+    The kwargs are there so that runtime (or other external users) can
+    pass in arguments to control certain execution aspects of the tests.
+    """
+
+    return karma_verify_package_artifacts_report(
+        package_names, **kwargs)['success']
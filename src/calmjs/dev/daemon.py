@@ -0,0 +1,474 @@
+# -*- coding: utf-8 -*-
+"""
+Module for the resident calmjs daemon and its client.
+
+The daemon constructs the calmjs runtime once, such that the working set
+scanning, the loading of the entry points and the construction of the
+registries are only done once.  Each of the commands from the client is
+then executed in a process forked from the daemon, with the standard
+streams of the client passed through the UNIX socket, so that the
+output goes directly to the client.
+
+The daemon will stop itself once the installed distributions change, as
+the runtime it holds would no longer be valid; the client will execute
+the command directly in that case, or if the daemon is not available.
+
+As the environment and the standard streams of the client are passed to
+the daemon, the socket must be in a directory that is private to the
+user, such as the XDG_RUNTIME_DIR, and the daemon will only accept the
+connections from the processes of the same user where the credentials
+of the peer are available.
+
+Usage:
+
+    python -m calmjs.dev.daemon serve &
+    python -m calmjs.dev.daemon run -- karma run calmjs.dev
+"""
+
+import array
+import errno
+import io
+import json
+import logging
+import os
+import socket
+import stat
+import struct
+import sys
+from argparse import ArgumentParser
+from argparse import REMAINDER
+from hashlib import sha256
+from os import listdir
+from os.path import curdir
+from os.path import dirname
+from os.path import isdir
+from os.path import join
+from tempfile import gettempdir
+from threading import Thread
+
+try:  # pragma: no cover
+    from socketserver import ForkingMixIn
+    from socketserver import StreamRequestHandler
+    from socketserver import UnixStreamServer
+except ImportError:  # pragma: no cover
+    from SocketServer import ForkingMixIn
+    from SocketServer import StreamRequestHandler
+    from SocketServer import UnixStreamServer
+
+logger = logging.getLogger(__name__)
+
+# the environment variable for the location of the socket
+CALMJS_DEV_DAEMON_SOCKET = 'CALMJS_DEV_DAEMON_SOCKET'
+# the name of the socket within the private directory for the user
+SOCKET_NAME = 'calmjs-dev-daemon.sock'
+# the standard streams passed to the daemon
+STD_FDS = (0, 1, 2)
+# the message that stops the daemon
+STOP_MESSAGE = b'{"command": "stop"}\n'
+# the seconds the daemon waits for the message to check for the stop,
+# before the connection is passed to the forked process regardless.
+STOP_CHECK_TIMEOUT = 1.0
+# the suffixes of the files that affect the installed distributions
+_DIST_SUFFIXES = ('.dist-info', '.egg-info', '.egg-link', '.egg', '.pth')
+
+# the passing of file descriptors is only available for Python 3.3+
+supported = hasattr(socket, 'AF_UNIX') and hasattr(socket.socket, 'sendmsg')
+
+
+def _getuid():
+    return os.getuid() if hasattr(os, 'getuid') else 0
+
+
+def default_socket_path():
+    path = os.environ.get(CALMJS_DEV_DAEMON_SOCKET)
+    if path:
+        return path
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return join(runtime_dir, SOCKET_NAME)
+    return join(
+        gettempdir(), 'calmjs-dev-daemon-%d' % _getuid(), SOCKET_NAME)
+
+
+def ensure_private_dir(path):
+    """
+    Ensure that the directory of the socket at path is only accessible
+    by the user, creating it if it does not exist.  Raises OSError if it
+    is not, such as when another user created it first.
+    """
+
+    socket_dir = dirname(path) or curdir
+    try:
+        os.mkdir(socket_dir, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    st = os.lstat(socket_dir)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != _getuid() or (
+            st.st_mode & 0o077):
+        raise OSError(
+            errno.EPERM, 'directory of the socket is not private to the user',
+            socket_dir)
+
+
+def peer_uid(sock):
+    """
+    Return the uid of the process at the other end of the socket, or
+    None if it is not available on the platform.
+    """
+
+    if hasattr(socket, 'SO_PEERCRED'):
+        # Linux, with the struct ucred of pid, uid and gid.
+        creds = sock.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        return struct.unpack('3i', creds)[1]
+    if hasattr(socket, 'LOCAL_PEERCRED'):  # pragma: no cover
+        # BSD and macOS, with the struct xucred of the version and uid.
+        creds = sock.getsockopt(0, socket.LOCAL_PEERCRED, 76)
+        return struct.unpack('2I', creds[:8])[1]
+    return None  # pragma: no cover
+
+
+def working_set_signature(paths=None):
+    """
+    Produce the signature of the installed distributions on the paths,
+    which defaults to sys.path, from the modification times of the
+    paths and the distribution metadata inside them.
+    """
+
+    digest = sha256()
+    for path in sys.path if paths is None else paths:
+        if not isdir(path):
+            continue
+        digest.update(('%s:%r\n' % (path, os.stat(path).st_mtime)).encode(
+            'utf8'))
+        for name in sorted(listdir(path)):
+            if name.endswith(_DIST_SUFFIXES):
+                target = join(path, name)
+                digest.update(('%s:%r\n' % (
+                    target, os.stat(target).st_mtime)).encode('utf8'))
+    return digest.hexdigest()
+
+
+def send_message(sock, message, fds=()):
+    data = (json.dumps(message) + '\n').encode('utf8')
+    if fds:
+        sock.sendmsg([data], [(
+            socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))])
+    else:
+        sock.sendall(data)
+
+
+def recv_message(sock, maxfds=len(STD_FDS)):
+    """
+    Receive a message, returning the message along with the list of
+    file descriptors passed with it.
+    """
+
+    fds = array.array('i')
+    chunks = []
+    while True:
+        data, ancdata, flags, addr = sock.recvmsg(
+            1 << 16, socket.CMSG_LEN(maxfds * fds.itemsize))
+        for level, kind, value in ancdata:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                fds.frombytes(value[:len(value) - (len(value) % fds.itemsize)])
+        if not data:
+            break
+        chunks.append(data)
+        if data.endswith(b'\n'):
+            break
+    if not chunks:
+        return None, list(fds)
+    return json.loads(b''.join(chunks).decode('utf8')), list(fds)
+
+
+def validate_message(message):
+    """
+    Return the reason why the message is not a valid request for the run
+    of a command, or None if it is valid.
+    """
+
+    if not isinstance(message, dict) or message.get('command') != 'run':
+        return 'unsupported command'
+    for key, cls in (('args', list), ('cwd', type(u'')), ('environ', dict)):
+        if not isinstance(message.get(key), cls):
+            return 'missing or invalid %r' % key
+    return None
+
+
+class DaemonRequestHandler(StreamRequestHandler):
+    """
+    Executes the command in the forked process.
+    """
+
+    def reject(self, fds, error):
+        logger.warning('rejected the request: %s', error)
+        for fd in fds:
+            os.close(fd)
+        send_message(self.request, {'status': 'error', 'error': error})
+
+    def handle(self):
+        try:
+            message, fds = recv_message(self.request)
+        except ValueError:
+            return self.reject([], 'malformed message')
+        if not message:
+            return
+
+        error = validate_message(message)
+        if error:
+            return self.reject(fds, error)
+        try:
+            os.chdir(message['cwd'])
+        except OSError as e:
+            return self.reject(fds, 'invalid cwd: %s' % e)
+
+        for stream in (sys.stdout, sys.stderr):
+            stream.flush()
+        for fd, target in zip(fds, STD_FDS):
+            os.dup2(fd, target)
+            os.close(fd)
+        # the streams of the daemon may have been replaced, so bind new
+        # ones to the standard file descriptors that were passed.
+        sys.stdin = io.open(0, 'r', closefd=False)
+        sys.stdout = io.open(1, 'w', closefd=False)
+        sys.stderr = io.open(2, 'w', closefd=False)
+        os.environ.clear()
+        os.environ.update(message['environ'])
+
+        try:
+            returncode = 0 if self.server.execute(message['args']) else 1
+        except SystemExit as e:
+            returncode = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            logger.exception('unhandled exception in the daemon')
+            returncode = 1
+        finally:
+            for stream in (sys.stdout, sys.stderr):
+                stream.flush()
+        send_message(self.request, {
+            'status': 'ok', 'returncode': returncode})
+
+
+class DaemonServer(ForkingMixIn, UnixStreamServer):
+    """
+    The resident daemon, holding the constructed runtime.
+    """
+
+    def __init__(self, path, runtime, signature=None):
+        self.runtime = runtime
+        self.signature = signature or working_set_signature()
+        UnixStreamServer.__init__(self, path, DaemonRequestHandler)
+
+    def execute(self, args):
+        return self.runtime(args)
+
+    def stop(self):
+        # the shutdown must be done outside of the thread that serves.
+        Thread(target=self.shutdown).start()
+
+    def verify_request(self, request, client_address):
+        # this is done by the daemon process, before the fork.
+        uid = peer_uid(request)
+        if uid is not None and uid != _getuid():
+            logger.warning('rejected the connection from uid %d', uid)
+            return False
+
+        if working_set_signature() != self.signature:
+            logger.info(
+                'installed distributions changed; stopping the daemon')
+            send_message(request, {'status': 'stale'})
+            self.stop()
+            return False
+
+        # the client that does not send its message in time must not
+        # block the daemon, so it is left for the forked process.
+        request.settimeout(STOP_CHECK_TIMEOUT)
+        try:
+            peeked = request.recv(len(STOP_MESSAGE), socket.MSG_PEEK)
+        except socket.timeout:
+            peeked = None
+        finally:
+            request.settimeout(None)
+        if peeked == STOP_MESSAGE:
+            logger.info('stopping the daemon as requested')
+            send_message(request, {'status': 'stopped'})
+            self.stop()
+            return False
+        return True
+
+
+def create_runtime():
+    """
+    Construct the calmjs runtime, with the argparser (and thus all the
+    runtimes and registries that it reference) constructed.
+    """
+
+    from calmjs.runtime import CalmJSRuntime
+    from calmjs.registry import get
+    runtime = CalmJSRuntime()
+    runtime.argparser
+    for name in ('calmjs.artifacts', 'calmjs.artifacts.tests'):
+        get(name)
+    return runtime
+
+
+def serve(path, runtime=None):
+    ensure_private_dir(path)
+    if os.path.exists(path):
+        os.remove(path)
+    server = DaemonServer(path, create_runtime() if runtime is None else (
+        runtime))
+    logger.info("calmjs daemon listening on '%s'", path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def connect(path):
+    """
+    Connect to the daemon at path, returning the socket.  Raises
+    socket.error if the daemon is unavailable.
+    """
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except Exception:
+        sock.close()
+        raise
+    return sock
+
+
+def exchange(sock, message, fds=()):
+    """
+    Send the message through the connected socket, returning the
+    response; None is returned if the connection was closed without
+    one.
+    """
+
+    closed = (errno.EPIPE, errno.ECONNRESET)
+    try:
+        try:
+            send_message(sock, message, fds)
+        except socket.error as e:
+            # the daemon may have closed the connection (e.g. when it
+            # is stale) with its response already sent.
+            if e.errno not in closed:
+                raise
+        try:
+            return recv_message(sock)[0]
+        except socket.error as e:
+            # closed with the message unread and without a response.
+            if e.errno not in closed:
+                raise
+            return None
+    finally:
+        sock.close()
+
+
+def request(path, message, fds=()):
+    """
+    Send the message to the daemon at path, returning the response.
+    Raises socket.error if the daemon is unavailable.
+    """
+
+    return exchange(connect(path), message, fds)
+
+
+def run(args, path):
+    """
+    Execute the calmjs command provided by args through the daemon at
+    path, or directly if the daemon is unavailable or stale.  Returns
+    the return code.
+    """
+
+    sock = None
+    if supported:
+        try:
+            ensure_private_dir(path)
+            sock = connect(path)
+        except (socket.error, OSError) as e:
+            logger.debug("calmjs daemon at '%s' not available: %s", path, e)
+
+    if sock is not None:
+        for stream in (sys.stdout, sys.stderr):
+            stream.flush()
+        # once the request is accepted, the command may have started,
+        # so it must not be executed again should the daemon fail.
+        try:
+            response = exchange(sock, {
+                'command': 'run',
+                'args': args,
+                'cwd': os.getcwd(),
+                'environ': dict(os.environ),
+            }, STD_FDS)
+        except (socket.error, OSError) as e:
+            logger.error("calmjs daemon at '%s' failed: %s", path, e)
+            return 1
+        if response and response.get('status') == 'ok':
+            return response['returncode']
+        if response and response.get('status') == 'error':
+            logger.error(
+                "calmjs daemon at '%s' rejected the command: %s",
+                path, response.get('error'))
+            return 1
+        if not response or response.get('status') != 'stale':
+            logger.error(
+                "calmjs daemon at '%s' did not complete the command", path)
+            return 1
+
+    # fallback to direct execution.
+    from calmjs.runtime import main
+    try:
+        main(args)
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else 1
+    return 0
+
+
+def main(argv=None):
+    parser = ArgumentParser(
+        prog='python -m calmjs.dev.daemon',
+        description='resident calmjs daemon and its client',
+    )
+    parser.add_argument(
+        '--socket', default=default_socket_path(),
+        help='the location of the UNIX socket for the daemon',
+    )
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('serve', help='start the daemon')
+    commands.add_parser('stop', help='stop the daemon')
+    run_parser = commands.add_parser(
+        'run', help='execute the calmjs command through the daemon')
+    run_parser.add_argument('args', nargs=REMAINDER)
+    parsed = parser.parse_args(argv)
+
+    if parsed.command == 'serve':
+        if not supported:
+            parser.error('the daemon is not supported on this platform')
+        logging.basicConfig(level=logging.INFO)
+        try:
+            serve(parsed.socket)
+        except OSError as e:
+            parser.error(str(e))
+        return 0
+    elif parsed.command == 'stop':
+        try:
+            request(parsed.socket, {'command': 'stop'})
+        except (socket.error, OSError):
+            return 1
+        return 0
+    elif parsed.command == 'run':
+        args = parsed.args[1:] if parsed.args[:1] == ['--'] else parsed.args
+        return run(args, parsed.socket)
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(main())
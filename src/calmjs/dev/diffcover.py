@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+Module that provides the changed lines (diff) coverage report.
+
+The report is produced by intersecting the lines added or modified by
+a unified diff with the coverage data produced by istanbul through
+karma-coverage, with the covered paths inside the build directory
+mapped back to their original sources through the source maps that
+were generated alongside of them.
+"""
+
+import codecs
+import json
+import logging
+import re
+import sys
+from os.path import curdir
+from os.path import dirname
+from os.path import exists
+from os.path import join
+from os.path import normpath
+from os.path import realpath
+
+from calmjs.parse.vlq import decode_mappings
+
+logger = logging.getLogger(__name__)
+
+DEV_NULL = '/dev/null'
+STDIN_PATH = '-'
+
+_hunk_header = re.compile(r'^@@ -\d+(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+def _strip_diff_path(path, strip):
+    # the path may be followed by a tab and a timestamp
+    path = path.split('\t', 1)[0].strip()
+    if path == DEV_NULL:
+        return None
+    return '/'.join(path.split('/')[strip:]) or None
+
+
+def parse_unified_diff(lines, strip=1, basedir=curdir):
+    """
+    Parse the lines of a unified diff into a mapping of the real path of
+    every file in the new revision to the set of line numbers that were
+    added or modified in it.  Deleted files are omitted.
+
+    Arguments
+
+    lines
+        An iterable of lines of the unified diff.
+    strip
+        Number of leading path components to strip from the file names
+        in the diff, same as the ``-p`` flag of ``patch``; default is 1
+        to match the ``a/`` and ``b/`` prefixes produced by ``git``.
+    basedir
+        The directory the stripped file names are relative to.
+    """
+
+    result = {}
+    changed = None
+    old_remaining = new_remaining = 0
+    lineno = 0
+
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if old_remaining > 0 or new_remaining > 0:
+            marker = line[:1]
+            if marker == '+':
+                if changed is not None:
+                    changed.add(lineno)
+                lineno += 1
+                new_remaining -= 1
+            elif marker == '-':
+                old_remaining -= 1
+            elif marker == '\\':
+                # "\ No newline at end of file"
+                continue
+            else:
+                # context line; blank lines may have lost their space.
+                lineno += 1
+                old_remaining -= 1
+                new_remaining -= 1
+            continue
+
+        if line.startswith('+++ '):
+            path = _strip_diff_path(line[4:], strip)
+            if path is None:
+                changed = None
+                continue
+            changed = result.setdefault(
+                realpath(join(basedir, path)), set())
+            continue
+
+        match = _hunk_header.match(line)
+        if match:
+            old_count, start, new_count = match.groups()
+            old_remaining = 1 if old_count is None else int(old_count)
+            new_remaining = 1 if new_count is None else int(new_count)
+            lineno = int(start)
+
+    return {path: lines for path, lines in result.items() if lines}
+
+
+def read_unified_diff(path, strip=1, basedir=curdir):
+    """
+    Read the unified diff from the provided path, or from stdin if the
+    path is '-', and return the parsed result.
+    """
+
+    if path == STDIN_PATH:
+        return parse_unified_diff(sys.stdin, strip=strip, basedir=basedir)
+    with codecs.open(path, encoding='utf8') as fd:
+        return parse_unified_diff(fd, strip=strip, basedir=basedir)
+
+
+def index_statement_lines(file_coverage):
+    """
+    Produce a mapping of line number to whether any statement starting
+    on that line was executed, from the istanbul coverage entry of a
+    single file.
+    """
+
+    result = {}
+    hits = file_coverage.get('s', {})
+    for key, statement in file_coverage.get('statementMap', {}).items():
+        line = statement['start']['line']
+        result[line] = result.get(line, False) or bool(hits.get(key))
+    return result
+
+
+def load_source_map(target):
+    """
+    Load the source map that was written alongside the target.  Returns
+    None if not available.
+    """
+
+    map_path = target + '.map'
+    if not exists(map_path):
+        return None
+    with codecs.open(map_path, encoding='utf8') as fd:
+        source_map = json.load(fd)
+    root = join(dirname(map_path), source_map.get('sourceRoot') or '')
+    source_map['sources'] = [
+        realpath(join(root, source))
+        for source in source_map.get('sources', [])
+    ]
+    return source_map
+
+
+def map_source_lines(source_map, source, lines):
+    """
+    Return a mapping of the provided lines in the source to the set of
+    lines in the generated file that were produced from them, through
+    the provided source map.  All line numbers are 1-based.
+    """
+
+    wanted = set(
+        idx for idx, path in enumerate(source_map['sources'])
+        if path == source
+    )
+    result = {}
+    if not wanted:
+        return result
+
+    source_idx = source_line = 0
+    for gen_line, segments in enumerate(
+            decode_mappings(source_map.get('mappings', '')), 1):
+        for segment in segments:
+            if len(segment) < 4:
+                continue
+            source_idx += segment[1]
+            source_line += segment[2]
+            if source_idx in wanted and (source_line + 1) in lines:
+                result.setdefault(source_line + 1, set()).add(gen_line)
+    return result
+
+
+def build_diff_coverage_report(changed, coverage, targets):
+    """
+    Build the changed lines coverage report.
+
+    Arguments
+
+    changed
+        The mapping of source path to the set of changed lines, as
+        produced by parse_unified_diff.
+    coverage
+        The istanbul coverage data, keyed by the path to the covered
+        files.
+    targets
+        A mapping of source path to the list of covered files that were
+        generated from that source; sources that were covered directly
+        may simply map to themselves.
+
+    Returns a mapping of source path to a dict with the sorted lists of
+    'covered' and 'missed' lines; changed lines that do not contain
+    any statements are omitted.
+    """
+
+    normalized = {normpath(key): value for key, value in coverage.items()}
+    report = {}
+    for source, lines in changed.items():
+        covered = set()
+        missed = set()
+        for target in targets.get(source, ()):
+            file_coverage = normalized.get(
+                normpath(target), normalized.get(realpath(target)))
+            if file_coverage is None:
+                continue
+            statements = index_statement_lines(file_coverage)
+            source_map = load_source_map(target)
+            if source_map is None:
+                line_map = {line: {line} for line in lines}
+            else:
+                line_map = map_source_lines(source_map, source, lines)
+            for line, gen_lines in line_map.items():
+                hits = [statements[n] for n in gen_lines if n in statements]
+                if any(hits):
+                    covered.add(line)
+                elif hits:
+                    missed.add(line)
+        missed.difference_update(covered)
+        if covered or missed:
+            report[source] = {
+                'covered': sorted(covered),
+                'missed': sorted(missed),
+            }
+    return report
+
+
+def _format_ranges(lines):
+    ranges = []
+    for line in lines:
+        if ranges and ranges[-1][1] == line - 1:
+            ranges[-1][1] = line
+        else:
+            ranges.append([line, line])
+    return ', '.join(
+        str(start) if start == end else '%d-%d' % (start, end)
+        for start, end in ranges
+    )
+
+
+def format_diff_coverage_report(report):
+    """
+    Format the report into a plain text table.
+    """
+
+    rows = [('Changed lines', 'Stmts', 'Miss', 'Cover', 'Missing')]
+    total = total_missed = 0
+    for source in sorted(report):
+        covered = report[source]['covered']
+        missed = report[source]['missed']
+        count = len(covered) + len(missed)
+        total += count
+        total_missed += len(missed)
+        rows.append((
+            source, str(count), str(len(missed)),
+            '%d%%' % (100 * len(covered) // count),
+            _format_ranges(missed),
+        ))
+    rows.append((
+        'TOTAL', str(total), str(total_missed),
+        '%d%%' % (100 * (total - total_missed) // total) if total else '-',
+        '',
+    ))
+
+    widths = [max(len(row[idx]) for row in rows) for idx in range(4)]
+    lines = []
+    for row in rows:
+        lines.append('  '.join(
+            [row[0].ljust(widths[0])] +
+            [col.rjust(width) for col, width in zip(row[1:4], widths[1:])] +
+            [row[4]]
+        ).rstrip())
+    lines.insert(1, '-' * len(max(lines, key=len)))
+    lines.insert(-1, lines[1])
+    return '\n'.join(lines) + '\n'
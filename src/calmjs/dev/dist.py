@@ -9,6 +9,9 @@ from calmjs.base import BaseModuleRegistry
 from calmjs.module import resolve_child_module_registries_lineage
 from calmjs.registry import get
 
+# the suffix for the registries of the benchmark modules
+BENCH_REGISTRY_NAME_SUFFIX = '.bench'
+
 
 def get_module_registries_dependencies(
         pkg_names, registry_names, working_set=None):
@@ -43,6 +46,16 @@ def map_registry_name_to_test(
         yield registry_name + test_registry_name_suffix
 
 
+def map_registry_name_to_bench(
+        registry_names, bench_registry_name_suffix=BENCH_REGISTRY_NAME_SUFFIX):
+    """
+    Map a given list of registry_names to its benchmark equivalent.
+    """
+
+    return map_registry_name_to_test(
+        registry_names, bench_registry_name_suffix)
+
+
 def get_module_default_test_registries_dependencies(
         pkg_names, registry_names,
         test_registry_name_suffix=TEST_REGISTRY_NAME_SUFFIX,
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Module for the fingerprinting of artifacts.
+
+The content hash of a file is memoized by the identity of the file as
+reported by the filesystem, i.e. the device, inode, size and the
+modification time in nanoseconds, such that the bytes of the file need
+not be read again until any of those are changed.  The memoized values
+may be persisted to a small JSON store.
+"""
+
+import codecs
+import hashlib
+import json
+import logging
+import mmap
+import os
+from functools import partial
+from os.path import join
+from os.path import realpath
+from threading import Lock
+
+from calmjs.dev.utils import file_digest
+from calmjs.dev.utils import write_if_changed
+
+logger = logging.getLogger(__name__)
+
+# the filename of the store in the build cache directory
+FINGERPRINT_STORE = 'fingerprints.json'
+# the size of each of the chunks hashed from the memory mapped files
+MMAP_CHUNK_SIZE = 1 << 20
+
+# the caches, keyed by the path to their store.
+_caches = {}
+_caches_lock = Lock()
+
+
+def hash_file(path, algorithm='sha256'):
+    """
+    Return the hex digest of the contents of the file at path, making
+    use of memory mapped chunked reads where possible.
+    """
+
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as fd:
+        try:
+            mapped = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error, OSError):
+            # empty files cannot be mapped, nor can some other types of
+            # files; fallback to the standard reads.
+            return file_digest(path, algorithm)
+        try:
+            for offset in range(0, len(mapped), MMAP_CHUNK_SIZE):
+                digest.update(mapped[offset:offset + MMAP_CHUNK_SIZE])
+        finally:
+            mapped.close()
+    return digest.hexdigest()
+
+
+def stat_key(st):
+    """
+    Produce the key that identifies the file that was stat'd.
+    """
+
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        # Python 2.7
+        mtime_ns = int(st.st_mtime * 1000000000)
+    return [st.st_dev, st.st_ino, st.st_size, mtime_ns]
+
+
+class FingerprintCache(object):
+    """
+    The memoized fingerprints of files, optionally persisted to the
+    JSON store at the provided path.
+    """
+
+    def __init__(self, path=None, algorithm='sha256'):
+        self.path = path
+        self.algorithm = algorithm
+        self.records = {}
+        self.dirty = False
+        self.lock = Lock()
+        if path:
+            self.load()
+
+    def load(self):
+        try:
+            with codecs.open(self.path, encoding='utf8') as fd:
+                store = json.load(fd)
+        except (IOError, OSError):
+            logger.debug("no fingerprint store found at '%s'", self.path)
+            return
+        except ValueError:
+            logger.warning(
+                "ignoring invalid fingerprint store at '%s'", self.path)
+            return
+
+        if store.get('algorithm') == self.algorithm:
+            self.records = store.get('records', {})
+
+    def save(self):
+        """
+        Persist the fingerprints to the store, if it is defined and that
+        there were changes.
+        """
+
+        with self.lock:
+            if not (self.path and self.dirty):
+                return
+            write_if_changed(self.path, partial(json.dump, {
+                'algorithm': self.algorithm,
+                'records': self.records,
+            }, sort_keys=True))
+            self.dirty = False
+
+    def fingerprint(self, path):
+        """
+        Return the fingerprint for the file at path, or None if it is
+        not a file that may be read.
+        """
+
+        path = realpath(path)
+        try:
+            key = stat_key(os.stat(path))
+        except OSError:
+            return None
+
+        with self.lock:
+            record = self.records.get(path)
+        if record and record[:4] == key:
+            return record[4]
+
+        try:
+            digest = hash_file(path, self.algorithm)
+        except (IOError, OSError):
+            return None
+
+        with self.lock:
+            self.records[path] = key + [digest]
+            self.dirty = True
+        logger.debug("fingerprint for '%s' is %s", path, digest)
+        return digest
+
+    def fingerprints(self, paths):
+        """
+        Return a mapping of the paths that may be read to their
+        fingerprints.
+        """
+
+        result = {}
+        for path in paths:
+            digest = self.fingerprint(path)
+            if digest is not None:
+                result[path] = digest
+        return result
+
+
+def get_fingerprint_cache(cache_dir=None):
+    """
+    Return the shared fingerprint cache for the cache directory, which
+    will be persisted to the store inside it if provided.
+    """
+
+    path = join(realpath(cache_dir), FINGERPRINT_STORE) if cache_dir else None
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = FingerprintCache(path)
+        return _caches[path]
@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+"""
+Module for the local history of the karma runs, kept in a SQLite
+database, along with the detection of the regressions of the durations
+of the tests recorded in it.
+
+Every run is keyed by its packages and export target, with the duration
+and outcome of each of its tests recorded along with the browser that
+executed them.  The durations of the tests are captured by the outcome
+reporter plugin.
+
+The runs also record the digest of their inputs, such that the tests
+that both failed and passed with identical inputs may be classified as
+flaky, for the maintenance of the list of quarantined tests.
+"""
+
+import codecs
+import json
+import logging
+import sqlite3
+from contextlib import closing
+from hashlib import sha256
+from itertools import groupby
+from itertools import islice
+from math import sqrt
+from time import time
+
+from calmjs.dev import karma
+from calmjs.dev.fingerprint import get_fingerprint_cache
+from calmjs.dev.metrics import run_labels
+from calmjs.dev.toolchain import BUILD_CACHE_DIR
+from calmjs.dev.utils import write_json
+
+logger = logging.getLogger(__name__)
+
+# seconds to wait for the lock on the database held by concurrent runs
+HISTORY_TIMEOUT = 30
+# the number of the prior runs of a test that form its baseline
+REGRESSION_WINDOW = 20
+# the minimum number of the prior runs required for a baseline
+REGRESSION_MIN_SAMPLES = 5
+# the number of standard deviations above the mean of the baseline for
+# a duration to be considered a regression
+REGRESSION_Z_SCORE = 3.0
+# the minimum increase in milliseconds for a duration to be considered
+# a regression, as karma only report the durations in milliseconds
+REGRESSION_MIN_DELTA = 5.0
+# the number of the latest results of a test considered for flakiness
+FLAKY_WINDOW = 50
+
+HISTORY_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    packages TEXT NOT NULL,
+    export_target TEXT NOT NULL,
+    return_code INTEGER,
+    duration REAL,
+    inputs TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    browser TEXT NOT NULL,
+    suite TEXT NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    duration REAL
+);
+CREATE INDEX IF NOT EXISTS results_run_id ON results (run_id);
+'''
+
+
+def connect(path):
+    """
+    Connect to the history database at path, creating the tables as
+    required.
+    """
+
+    conn = sqlite3.connect(path, timeout=HISTORY_TIMEOUT)
+    # allow the concurrent runs to read while another is recording.
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(HISTORY_SCHEMA)
+    return conn
+
+
+def run_inputs(spec):
+    """
+    Produce the digest of the inputs of the karma run described by the
+    spec, from the contents of the files in its configuration, in the
+    order they are loaded.  The locations of the files are excluded, as
+    the build directories may differ between the runs.
+    """
+
+    config = spec.get(karma.KARMA_CONFIG) or {}
+    cache = get_fingerprint_cache(spec.get(BUILD_CACHE_DIR))
+    digest = sha256()
+    for entry in config.get('files', []):
+        pattern = entry.get('pattern') if isinstance(entry, dict) else entry
+        # patterns that do not lead to a file are included as is.
+        digest.update(((cache.fingerprint(pattern) or pattern) + '\n').encode(
+            'utf8'))
+    digest.update(json.dumps(sorted(
+        config.get('browsers') or [])).encode('utf8'))
+    return digest.hexdigest()
+
+
+def iter_results(spec):
+    """
+    Produce the results of the tests of the karma run described by the
+    spec, as captured by the outcome reporter.
+    """
+
+    outcomes = karma.completed_outcomes(spec)
+    quarantine_run = spec.get(karma.KARMA_QUARANTINE_RUN)
+    if quarantine_run and quarantine_run.get('outcome'):
+        outcomes.append(quarantine_run['outcome'])
+    for outcome in outcomes:
+        for result in outcome.get('results') or ():
+            yield result
+
+
+def record_run(path, spec):
+    """
+    Record the karma run described by the spec into the history
+    database at path, returning the id of the run, or None if the
+    outcome of the run was not captured.
+    """
+
+    if not karma.completed_outcomes(spec):
+        logger.warning(
+            "no outcome captured for the karma run; not recording it into "
+            "the history at '%s'", path)
+        return None
+
+    labels = run_labels(spec)
+    with closing(connect(path)) as conn:
+        # the results are inserted in a single transaction.
+        with conn:
+            run_id = conn.execute(
+                'INSERT INTO runs (timestamp, packages, export_target, '
+                'return_code, duration, inputs) VALUES (?, ?, ?, ?, ?, ?)', (
+                    time(), labels['packages'], labels['export_target'],
+                    spec.get(karma.KARMA_RETURN_CODE),
+                    spec.get(karma.KARMA_DURATION), run_inputs(spec),
+                )).lastrowid
+            conn.executemany(
+                'INSERT INTO results (run_id, browser, suite, name, status, '
+                'duration) VALUES (?, ?, ?, ?, ?, ?)', (
+                    (run_id, result.get('browser') or '',
+                     result.get('suite') or '', result.get('name') or '',
+                     result['status'], result.get('time'))
+                    for result in iter_results(spec)
+                ))
+    logger.debug("recorded karma run %d into the history at '%s'",
+                 run_id, path)
+    return run_id
+
+
+def _mean_stdev(values):
+    mean = float(sum(values)) / len(values)
+    variance = sum((value - mean) ** 2 for value in values) / max(
+        len(values) - 1, 1)
+    return mean, sqrt(variance)
+
+
+def find_regressions(
+        path, window=REGRESSION_WINDOW, min_samples=REGRESSION_MIN_SAMPLES,
+        z_score=REGRESSION_Z_SCORE, min_delta=REGRESSION_MIN_DELTA):
+    """
+    Find the tests in the history database at path where the duration
+    of their latest passing run is a regression against the baseline
+    formed by their prior passing runs, up to window of them.
+
+    The duration is a regression if it exceeds the mean of the baseline
+    by both z_score standard deviations and min_delta milliseconds,
+    with at least min_samples runs in the baseline.
+    """
+
+    regressions = []
+    with closing(connect(path)) as conn:
+        rows = conn.execute(
+            'SELECT runs.packages, runs.export_target, results.browser, '
+            'results.suite, results.name, results.duration FROM results '
+            'JOIN runs ON results.run_id = runs.id '
+            "WHERE results.status = 'passed' AND "
+            'results.duration IS NOT NULL '
+            'ORDER BY runs.packages, runs.export_target, results.browser, '
+            'results.suite, results.name, runs.id DESC'
+        )
+        for key, group in groupby(rows, key=lambda row: row[:5]):
+            durations = [row[5] for row in islice(group, window + 1)]
+            latest, baseline = durations[0], durations[1:]
+            if len(baseline) < min_samples:
+                continue
+            mean, stdev = _mean_stdev(baseline)
+            delta = latest - mean
+            # the durations are only reported to the millisecond.
+            score = delta / max(stdev, 1.0)
+            if delta < min_delta or score < z_score:
+                continue
+            packages, export_target, browser, suite, name = key
+            regressions.append({
+                'packages': packages,
+                'export_target': export_target,
+                'browser': browser,
+                'suite': suite,
+                'name': name,
+                'duration': latest,
+                'mean': mean,
+                'stdev': stdev,
+                'ratio': latest / mean if mean else None,
+                'z_score': score,
+                'samples': len(baseline),
+            })
+    return regressions
+
+
+def find_flaky(path, window=FLAKY_WINDOW):
+    """
+    Find the tests in the history database at path that are flaky, i.e.
+    those that have both failed and passed on the same browser with
+    identical inputs, within their latest window results.
+    """
+
+    flaky = []
+    with closing(connect(path)) as conn:
+        rows = conn.execute(
+            'SELECT runs.packages, runs.export_target, results.suite, '
+            'results.name, results.browser, runs.inputs, results.status '
+            'FROM results JOIN runs ON results.run_id = runs.id '
+            "WHERE results.status IN ('passed', 'failed') AND "
+            'runs.inputs IS NOT NULL '
+            'ORDER BY runs.packages, runs.export_target, results.suite, '
+            'results.name, runs.id DESC'
+        )
+        for key, group in groupby(rows, key=lambda row: row[:4]):
+            statuses = {}
+            for row in islice(group, window):
+                statuses.setdefault(row[4:6], set()).add(row[6])
+            browsers = sorted(set(
+                browser for (browser, inputs), seen in statuses.items()
+                if len(seen) > 1
+            ))
+            if not browsers:
+                continue
+            packages, export_target, suite, name = key
+            flaky.append({
+                'packages': packages,
+                'export_target': export_target,
+                'suite': suite,
+                'name': name,
+                'browsers': browsers,
+            })
+    return flaky
+
+
+def load_quarantine(path):
+    """
+    Load the list of the quarantined tests from the file at path; an
+    empty list is returned if it does not exist.
+    """
+
+    try:
+        with codecs.open(path, encoding='utf8') as fd:
+            return json.load(fd).get('tests', [])
+    except (IOError, OSError):
+        logger.debug("no quarantine list found at '%s'", path)
+    except ValueError:
+        logger.warning("ignoring invalid quarantine list at '%s'", path)
+    return []
+
+
+def write_quarantine(path, flaky):
+    """
+    Write the flaky tests as the list of the quarantined tests to the
+    file at path.
+    """
+
+    write_json({'tests': sorted([{
+        'packages': test['packages'],
+        'export_target': test['export_target'],
+        'suite': test['suite'],
+        'name': test['name'],
+    } for test in flaky], key=lambda test: (
+        test['packages'], test['export_target'], test['suite'], test['name'],
+    ))}, path)
+    logger.info(
+        "wrote %d flaky test(s) to the quarantine list at '%s'",
+        len(flaky), path)
+
+
+def quarantine_tests(spec):
+    """
+    Return the suite and name of the tests quarantined for the karma run
+    described by the spec, from the quarantine list specified by it.
+    """
+
+    path = spec.get(karma.KARMA_QUARANTINE)
+    if not path:
+        return []
+    labels = run_labels(spec)
+    return [[test['suite'], test['name']] for test in load_quarantine(
+        path) if (test['packages'], test['export_target']) == (
+            labels['packages'], labels['export_target'])]
+
+
+def summarize_quarantine(spec):
+    """
+    Summarize the handling of the quarantined tests for the karma run
+    described by the spec, or None if no tests were quarantined.
+    """
+
+    tests = spec.get(karma.KARMA_QUARANTINE_TESTS)
+    if not tests:
+        return None
+    summary = {
+        'tests': len(tests),
+        'mode': spec.get(karma.KARMA_QUARANTINE_MODE) or (
+            karma.QUARANTINE_EXCLUDE),
+        'return_code': None,
+    }
+    quarantine_run = spec.get(karma.KARMA_QUARANTINE_RUN)
+    if quarantine_run:
+        outcome = quarantine_run.get('outcome') or {}
+        summary['return_code'] = quarantine_run['return_code']
+        for result in ('passed', 'failed', 'skipped'):
+            summary[result] = outcome.get(result)
+    return summary
+
+
+def format_regressions(regressions):
+    """
+    Format the regressions as lines of text for the report.
+    """
+
+    lines = []
+    for regression in regressions:
+        ratio = regression['ratio']
+        lines.append('%s [%s] %s: %s' % (
+            regression['packages'], regression['export_target'],
+            regression['browser'], ' > '.join(
+                part for part in (regression['suite'], regression['name'])
+                if part),
+        ))
+        lines.append(
+            '    %.1f ms -> %.1f ms (%s, z=%.1f, %d prior runs)' % (
+                regression['mean'], regression['duration'],
+                'x%.2f' % ratio if ratio else 'from 0 ms',
+                regression['z_score'], regression['samples'],
+            ))
+    return lines
+
+
+def format_flaky(flaky):
+    """
+    Format the flaky tests as lines of text for the report.
+    """
+
+    return ['%s [%s] %s (flaky on %s)' % (
+        test['packages'], test['export_target'], ' > '.join(
+            part for part in (test['suite'], test['name']) if part),
+        ', '.join(test['browsers']),
+    ) for test in flaky]
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Module for the writing of the results of the karma runs as JUnit XML.
+
+The results are read from the streams written by the outcome reporter
+plugin, with every result written out as it is read, such that the
+complete set of results is never held in memory.  As the counts for
+the testsuite must be known before its testcases, the streams are read
+twice.  The testsuites for the executions that reused the results of an
+identical execution are copied from the written testsuites of the
+latter, as their streams may no longer be available.
+"""
+
+import codecs
+import json
+import logging
+import re
+import socket
+from datetime import datetime
+from datetime import timedelta
+from datetime import tzinfo
+from threading import Lock
+from xml.sax.saxutils import escape
+from xml.sax.saxutils import quoteattr
+
+from calmjs.dev import karma
+from calmjs.dev.metrics import run_labels
+from calmjs.dev.toolchain import EXECUTION_KEY
+
+logger = logging.getLogger(__name__)
+
+JUNIT_XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>\n'
+# the characters that may not be present in XML 1.0 documents, such as
+# the escape sequences for the colors in the logs of failures
+_INVALID_XML_CHARS = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+# the ANSI escape sequences for the colors
+_ANSI_ESCAPE = re.compile(u'\x1b\\[[0-9;]*m')
+# the size of each of the chunks copied for the reused testsuites
+COPY_CHUNK_SIZE = 1 << 16
+
+try:
+    from datetime import timezone
+    utc = timezone.utc
+except ImportError:  # pragma: no cover
+    # Python 2.7
+    class UTC(tzinfo):
+
+        def utcoffset(self, dt):
+            return timedelta(0)
+
+        def tzname(self, dt):
+            return 'UTC'
+
+        def dst(self, dt):
+            return timedelta(0)
+
+    utc = UTC()
+
+
+def _clean(value):
+    return _INVALID_XML_CHARS.sub(u'', _ANSI_ESCAPE.sub(u'', value))
+
+
+def _attrs(**attrs):
+    return ' '.join('%s=%s' % (key, quoteattr(_clean(u'%s' % value))) for (
+        key, value) in sorted(attrs.items()) if value is not None)
+
+
+def iter_stream(path):
+    """
+    Produce the results written to the stream at path by the outcome
+    reporter; a missing stream or a truncated last line, such as from a
+    crashed run, is ignored.
+    """
+
+    try:
+        with codecs.open(path, encoding='utf8') as fd:
+            for line in fd:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    logger.debug("ignoring incomplete result in '%s'", path)
+    except (IOError, OSError):
+        logger.debug("results stream '%s' not available", path)
+
+
+def testsuite_name(spec):
+    """
+    Produce the name of the testsuite for the karma run described by
+    the spec, from its packages and export target.
+    """
+
+    labels = run_labels(spec)
+    return ':'.join(
+        label for label in (labels['packages'], labels['export_target'])
+        if label) or 'karma'
+
+
+def write_testcase(fd, result):
+    suite = '.'.join(result.get('suite') or [])
+    browser = (result.get('browser') or '').replace('.', '_')
+    fd.write('    <testcase %s' % _attrs(
+        classname='.'.join(part for part in (browser, suite) if part),
+        name=result.get('name') or '',
+        time=(result.get('time') or 0) / 1000.0,
+    ))
+    status = result.get('status')
+    if status == 'passed':
+        fd.write('/>\n')
+        return
+    fd.write('>\n')
+    if status == 'skipped':
+        fd.write('      <skipped/>\n')
+    else:
+        log = u'\n'.join(result.get('log') or [])
+        fd.write('      <failure %s>%s</failure>\n' % (_attrs(
+            message=log.split(u'\n', 1)[0]), escape(_clean(log))))
+    fd.write('    </testcase>\n')
+
+
+class JUnitXMLWriter(object):
+    """
+    Writes the testsuites for the karma runs to the JUnit XML file at
+    path as they are provided; to be used as a context manager, and may
+    be shared by the runs for the verification of the artifacts.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        self.lock = Lock()
+        # the written testsuites, keyed by the execution key
+        self.executions = {}
+
+    def __enter__(self):
+        self.fd = codecs.open(self.path, 'w', encoding='utf8')
+        self.fd.write(JUNIT_XML_DECLARATION)
+        self.fd.write('<testsuites>\n')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.fd.write('</testsuites>\n')
+        self.fd.close()
+        self.fd = None
+
+    def write_testsuite(self, name, outcomes, duration=None):
+        """
+        Write the testsuite with the results of the runs that produced
+        the outcomes; the runs that crashed, or the lack of any outcome,
+        are written as errors.  Returns the record of the written
+        testsuite for copy_testsuite.
+        """
+
+        streams = [
+            outcome['stream'] for outcome in outcomes if outcome.get('stream')]
+        counts = {'passed': 0, 'failed': 0, 'skipped': 0}
+        for stream in streams:
+            for result in iter_stream(stream):
+                counts[result['status']] = counts.get(result['status'], 0) + 1
+        errors = [
+            'karma run crashed or the browser disconnected: %s' % ', '.join(
+                outcome.get('process_failures') or ['disconnected'])
+            for outcome in outcomes if karma.is_crashed(None, outcome)
+        ] or ([] if outcomes else ['karma run did not complete'])
+
+        attrs = dict(
+            tests=sum(counts.values()) + len(errors),
+            failures=counts['failed'],
+            errors=len(errors),
+            skipped=counts['skipped'],
+            time=duration,
+            timestamp=datetime.now(utc).strftime('%Y-%m-%dT%H:%M:%S'),
+            hostname=socket.gethostname(),
+        )
+        with self.lock:
+            fd = self.fd
+            fd.write('  <testsuite %s>\n' % _attrs(name=name, **attrs))
+            start = fd.tell()
+            for stream in streams:
+                for result in iter_stream(stream):
+                    write_testcase(fd, result)
+            for error in errors:
+                fd.write('    <testcase %s>\n' % _attrs(
+                    classname='karma', name=name))
+                fd.write('      <error %s/>\n' % _attrs(message=error))
+                fd.write('    </testcase>\n')
+            end = fd.tell()
+            fd.write('  </testsuite>\n')
+        logger.debug(
+            "wrote testsuite '%s' to the JUnit XML file '%s'", name, self.path)
+        return attrs, start, end
+
+    def copy_testsuite(self, name, record):
+        """
+        Write the testsuite with the testcases copied from the written
+        testsuite of the record, under the name.
+        """
+
+        attrs, start, end = record
+        decoder = codecs.getincrementaldecoder('utf8')()
+        with self.lock:
+            fd = self.fd
+            fd.flush()
+            fd.write('  <testsuite %s>\n' % _attrs(name=name, **attrs))
+            with open(self.path, 'rb') as source:
+                source.seek(start)
+                remaining = end - start
+                while remaining > 0:
+                    chunk = source.read(min(remaining, COPY_CHUNK_SIZE))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    fd.write(decoder.decode(chunk))
+            fd.write(decoder.decode(b'', final=True))
+            fd.write('  </testsuite>\n')
+        logger.debug(
+            "copied testsuite '%s' in the JUnit XML file '%s'", name,
+            self.path)
+
+
+def write_junit_xml(spec, writer):
+    """
+    Write the testsuites for the karma run described by the spec, with
+    the quarantined tests run separately written as their own testsuite.
+    """
+
+    name = testsuite_name(spec)
+    records = [('', writer.write_testsuite(
+        name, karma.completed_outcomes(spec),
+        spec.get(karma.KARMA_DURATION)))]
+    quarantine_run = spec.get(karma.KARMA_QUARANTINE_RUN)
+    if quarantine_run:
+        suffix = ' (quarantined)'
+        records.append((suffix, writer.write_testsuite(name + suffix, [
+            quarantine_run['outcome']] if quarantine_run['outcome'] else [])))
+    if spec.get(EXECUTION_KEY):
+        writer.executions[spec[EXECUTION_KEY]] = records
+
+
+def write_reused_junit_xml(spec, writer):
+    """
+    Write the testsuites for the artifact test execution described by
+    the spec, which reused the results of the identical execution that
+    was done previously, through the writer that has written them.
+    """
+
+    name = testsuite_name(spec)
+    records = writer.executions.get(spec.get(EXECUTION_KEY))
+    if records is None:
+        writer.write_testsuite(name, [])
+        return
+    for suffix, record in records:
+        writer.copy_testsuite(name + suffix, record)
@@ -3,11 +3,22 @@
 Module that provides integration with karma.
 """
 
+import codecs
+import json
 import logging
+from itertools import islice
+from os import listdir
+from os import remove
+from os.path import basename
 from os.path import curdir
+from os.path import dirname
+from os.path import isfile
 from os.path import sep
 from os.path import join
+from os.path import pardir
+from os.path import relpath
 from os.path import realpath
+from os.path import splitext
 
 logger = logging.getLogger(__name__)
 
@@ -16,14 +27,54 @@ AFTER_KARMA = 'after_karma'
 BEFORE_KARMA = 'before_karma'
 KARMA_ABORT_ON_TEST_FAILURE = 'karma_abort_on_test_failure'
 KARMA_ADVICE_GROUP = 'karma_advice_group'
+KARMA_ARTIFACT_BUDGETS = 'karma_artifact_budgets'
+KARMA_ARTIFACT_LOAD = 'karma_artifact_load'
+KARMA_BENCH = 'karma_bench'
+KARMA_BENCH_BASELINE = 'karma_bench_baseline'
+KARMA_BENCH_OUTPUT = 'karma_bench_output'
+KARMA_BENCH_REGRESSIONS = 'karma_bench_regressions'
+KARMA_BENCH_RESULTS = 'karma_bench_results'
+KARMA_BENCH_THRESHOLD = 'karma_bench_threshold'
 KARMA_BROWSERS = 'karma_browsers'
 KARMA_CONFIG = 'karma_config'
 KARMA_CONFIG_PATH = 'karma_config_path'
 KARMA_CONFIG_WRITER = 'karma_config_writer'
+KARMA_CONFIG_SIDECAR = 'karma_config_sidecar'
+KARMA_COST_KEY = 'karma_cost_key'
+KARMA_DURATION = 'karma_duration'
+KARMA_COMPACT_CONFIG = 'karma_compact_config'
 KARMA_EXTRA_FRAMEWORKS = 'karma_extra_frameworks'
 KARMA_HALT_AFTER_TEST = 'karma_halt_after_test'
+KARMA_HISTORY = 'karma_history'
+KARMA_JUNIT_WRITER = 'karma_junit_writer'
+KARMA_JUNIT_XML = 'karma_junit_xml'
+KARMA_MEASURE_ARTIFACTS = 'karma_measure_artifacts'
+KARMA_MEMORY_LIMIT = 'karma_memory_limit'
+KARMA_NODE_CPU_PROF = 'karma_node_cpu_prof'
+KARMA_NODE_HEAP_PROF = 'karma_node_heap_prof'
+KARMA_NODE_OPTIONS = 'karma_node_options'
+KARMA_NODE_PROF_DIR = 'karma_node_prof_dir'
+KARMA_NODE_PROFILES = 'karma_node_profiles'
+KARMA_METRICS = 'karma_metrics'
+KARMA_METRICS_COLLECT = 'karma_metrics_collect'
+KARMA_METRICS_JSONL = 'karma_metrics_jsonl'
+KARMA_METRICS_PROMETHEUS = 'karma_metrics_prometheus'
+KARMA_OUTCOME = 'karma_outcome'
+KARMA_PLAN = 'karma_plan'
+KARMA_PROFILE_PYTHON = 'karma_profile_python'
+KARMA_PROFILE_PYTHON_LIMIT = 'karma_profile_python_limit'
+KARMA_QUARANTINE = 'karma_quarantine'
+KARMA_QUARANTINE_MODE = 'karma_quarantine_mode'
+KARMA_QUARANTINE_RUN = 'karma_quarantine_run'
+KARMA_QUARANTINE_TESTS = 'karma_quarantine_tests'
+KARMA_REPORTER = 'karma_reporter'
 KARMA_RETURN_CODE = 'karma_return_code'
+KARMA_RUSAGE = 'karma_rusage'
 KARMA_SPEC_KEYS = 'karma_spec_keys'
+KARMA_SPLIT_ON_CRASH = 'karma_split_on_crash'
+KARMA_SPLIT_RUNS = 'karma_split_runs'
+KARMA_STARTED = 'karma_started'
+KARMA_TEST_MODULE_PATHS = 'karma_test_module_paths'
 
 # templates
 
@@ -33,8 +84,400 @@ module.exports = function(config) {
 }
 '''
 
+# the static karma.conf.js that loads the configuration from the sidecar
+# file, being the .json file that shares the basename of the stub
+KARMA_CONF_STUB = '''\
+var path = require('path');
+
+module.exports = function(config) {
+    config.set(require(path.join(__dirname, path.basename(
+        __filename, path.extname(__filename)) + '.json')));
+}
+'''
+
+# the karma reporter plugin that writes the outcome of the run to the
+# file specified by the calmjsOutcome.file configuration, and the result
+# of every test as a line of JSON to the calmjsOutcome.stream file as
+# they are completed
+KARMA_OUTCOME_JSON = 'karma.outcome.json'
+KARMA_RESULTS_JSONL = 'karma.results.jsonl'
+KARMA_OUTCOME_REPORTER = 'calmjs-outcome'
+KARMA_OUTCOME_REPORTER_JS = 'karma.outcome.reporter.js'
+KARMA_OUTCOME_REPORTER_SOURCE = '''\
+var fs = require('fs');
+
+var OutcomeReporter = function(config) {
+    var options = config.calmjsOutcome || {};
+    var target = options.file;
+    var outcome = {
+        disconnected: false,
+        process_failures: [],
+        passed: 0,
+        failed: 0,
+        skipped: 0
+    };
+    if (options.results) {
+        outcome.results = [];
+    }
+    var stream = null;
+    if (options.stream) {
+        stream = fs.openSync(options.stream, 'w');
+        outcome.stream = options.stream;
+    }
+    var write = function() {
+        if (target) {
+            fs.writeFileSync(target, JSON.stringify(outcome));
+        }
+    };
+    this.onBrowserRegister = function(browser) {
+        if (!outcome.browser_registered) {
+            outcome.browser_registered = Date.now();
+        }
+    };
+    this.onSpecComplete = function(browser, result) {
+        var status = (
+            result.skipped ? 'skipped' : result.success ? 'passed' : 'failed');
+        outcome[status]++;
+        if (outcome.results) {
+            outcome.results.push({
+                browser: browser.name,
+                suite: (result.suite || []).join(' > '),
+                name: result.description,
+                time: result.time,
+                status: status
+            });
+        }
+        if (stream !== null) {
+            fs.writeSync(stream, JSON.stringify({
+                browser: browser.name,
+                suite: result.suite || [],
+                name: result.description,
+                time: result.time,
+                status: status,
+                log: result.log || []
+            }) + '\\n');
+        }
+    };
+    this.onBrowserProcessFailure = function(failure) {
+        outcome.process_failures.push(String(
+            (failure && failure.error) || failure));
+        write();
+    };
+    this.onRunComplete = function(browsers, results) {
+        outcome.disconnected = Boolean(results.disconnected);
+        outcome.error = Boolean(results.error);
+        write();
+    };
+    this.onExit = function(done) {
+        if (stream !== null) {
+            fs.closeSync(stream);
+            stream = null;
+        }
+        done();
+    };
+};
+
+OutcomeReporter.$inject = ['config'];
+
+module.exports = {
+    'reporter:%s': ['type', OutcomeReporter]
+};
+''' % KARMA_OUTCOME_REPORTER
+
+# the karma reporter plugin that prints only the failures and a summary
+# to the console, with the complete details of the run written to the
+# file specified by the calmjsMinimal.file configuration
+KARMA_MINIMAL_LOG = 'karma.minimal.log'
+KARMA_MINIMAL_REPORTER = 'calmjs-minimal'
+KARMA_MINIMAL_REPORTER_JS = 'karma.minimal.reporter.js'
+KARMA_MINIMAL_REPORTER_SOURCE = '''\
+var fs = require('fs');
+
+var MinimalReporter = function(config) {
+    var options = config.calmjsMinimal || {};
+    var log = options.file ? fs.openSync(options.file, 'w') : null;
+    var started = Date.now();
+    var counts = {passed: 0, failed: 0, skipped: 0};
+    var detail = function(text) {
+        if (log !== null) {
+            fs.writeSync(log, text + '\\n');
+        }
+    };
+    var print = function(text) {
+        process.stdout.write(text + '\\n');
+        detail(text);
+    };
+    this.adapters = [];
+    this.onBrowserLog = function(browser, message, type) {
+        detail(browser.name + ' ' + String(type).toUpperCase() + ': ' +
+            message);
+    };
+    this.onBrowserError = function(browser, error) {
+        print(browser.name + ' ERROR: ' + String(
+            (error && error.message) || error));
+    };
+    this.onSpecComplete = function(browser, result) {
+        var status = (
+            result.skipped ? 'skipped' : result.success ? 'passed' : 'failed');
+        var title = (result.suite || []).concat(
+            [result.description]).join(' > ');
+        counts[status]++;
+        if (status === 'failed') {
+            print('FAILED ' + browser.name + ': ' + title);
+            (result.log || []).forEach(function(line) {
+                print('    ' + String(line).split('\\n').join('\\n    '));
+            });
+        } else {
+            detail(status.toUpperCase() + ' ' + browser.name + ': ' + title +
+                ' (' + result.time + ' ms)');
+        }
+    };
+    this.onRunComplete = function(browsers, results) {
+        print(
+            'Executed ' + (counts.passed + counts.failed + counts.skipped) +
+            ' tests: ' + counts.passed + ' passed, ' + counts.failed +
+            ' failed, ' + counts.skipped + ' skipped (' +
+            ((Date.now() - started) / 1000) + ' s)' +
+            (results.disconnected ? '; browser disconnected' : '') +
+            (results.error ? '; errors occurred' : ''));
+    };
+    this.onExit = function(done) {
+        if (log !== null) {
+            fs.closeSync(log);
+            log = null;
+        }
+        done();
+    };
+};
+
+MinimalReporter.$inject = ['config'];
+
+module.exports = {
+    'reporter:%s': ['type', MinimalReporter]
+};
+''' % KARMA_MINIMAL_REPORTER
+# the karma reporter plugin that prints the result of every benchmark
+# run by the karma-benchmark framework, and writes them to the file
+# specified by the calmjsBench.file configuration
+KARMA_BENCH_JSON = 'karma.bench.json'
+KARMA_BENCH_REPORTER = 'calmjs-bench'
+KARMA_BENCH_REPORTER_JS = 'karma.bench.reporter.js'
+KARMA_BENCH_REPORTER_SOURCE = '''\
+var fs = require('fs');
+
+var BenchReporter = function(config) {
+    var options = config.calmjsBench || {};
+    var results = [];
+    this.adapters = [];
+    this.onBrowserError = function(browser, error) {
+        process.stdout.write(browser.name + ' ERROR: ' + String(
+            (error && error.message) || error) + '\\n');
+    };
+    this.onSpecComplete = function(browser, result) {
+        var bench = result.benchmark;
+        if (!bench) {
+            return;
+        }
+        var stats = bench.stats || {};
+        var entry = {
+            browser: browser.name,
+            suite: bench.suite || (result.suite || []).join(' > '),
+            name: bench.name || result.description,
+            hz: bench.hz,
+            rme: stats.rme,
+            mean: stats.mean,
+            deviation: stats.deviation,
+            samples: (stats.sample || []).length
+        };
+        results.push(entry);
+        process.stdout.write(
+            entry.browser + ': ' + entry.suite + ' > ' + entry.name + ' x ' +
+            Number(entry.hz).toFixed(2) + ' ops/sec \\u00b1' +
+            Number(entry.rme).toFixed(2) + '%% (' + entry.samples +
+            ' samples)\\n');
+    };
+    this.onRunComplete = function() {
+        if (options.file) {
+            fs.writeFileSync(options.file, JSON.stringify({
+                results: results}));
+        }
+    };
+};
+
+BenchReporter.$inject = ['config'];
+
+module.exports = {
+    'reporter:%s': ['type', BenchReporter]
+};
+''' % KARMA_BENCH_REPORTER
+# the framework provided by karma-benchmark
+BENCH_FRAMEWORK = 'benchmark'
+# the benchmarks may run for much longer than the tests without any
+# activity reported to karma
+BENCH_NO_ACTIVITY_TIMEOUT = 300000
+
+# the script that has the artifacts loaded through the script elements
+# written into the context of karma, in place of those of karma, such
+# that they are loaded as they would be otherwise, measuring the time
+# taken to fetch each of them through the resource timing, and the time
+# taken to parse and evaluate each of them after they were fetched, as
+# the two cannot be measured apart for the script elements; the timings
+# are reported through the info channel of karma.
+ARTIFACTS_LOG_TYPE = 'calmjs-artifacts'
+KARMA_ARTIFACTS_LOADER_JS = 'karma.artifacts.loader.js'
+KARMA_ARTIFACTS_LOADER_TEMPLATE = '''\
+(function(window, document) {
+    var artifacts = %s;
+    var perf = window.performance;
+    var now = perf && perf.now ? function() {
+        return perf.now();
+    } : function() {
+        return Date.now();
+    };
+    var resolve = function(url) {
+        var anchor = document.createElement('a');
+        anchor.href = url;
+        return anchor.href;
+    };
+    var escape = function(value) {
+        return value.replace(/&/g, '&amp;').replace(/"/g, '&quot;');
+    };
+    var timings = [];
+    var started = null;
+    window.__calmjsArtifacts = {
+        start: function() {
+            started = now();
+        },
+        end: function(i) {
+            var ended = now();
+            var entries = perf && perf.getEntriesByName ?
+                perf.getEntriesByName(resolve(artifacts[i][1])) : [];
+            var entry = entries[entries.length - 1];
+            // the script is executed once it was fetched, which may
+            // have been done ahead of the marker.
+            var executing = entry && entry.responseEnd > started ?
+                entry.responseEnd : started;
+            timings.push({
+                path: artifacts[i][0],
+                fetch: entry ? entry.responseEnd - entry.startTime : null,
+                evaluate: ended - executing
+            });
+            if (timings.length === artifacts.length &&
+                    window.__karma__ && window.__karma__.info) {
+                window.__karma__.info({
+                    log: JSON.stringify(timings), type: %s});
+            }
+        }
+    };
+    for (var i = 0; i < artifacts.length; i++) {
+        document.write(
+            '<script>__calmjsArtifacts.start();<\\/script>' +
+            '<script src="' + escape(artifacts[i][1]) + '"><\\/script>' +
+            '<script>__calmjsArtifacts.end(' + i + ');<\\/script>');
+    }
+})(this, document);
+'''
+# the karma reporter plugin that writes the timings reported by the
+# loader for every browser to the file specified by the
+# calmjsArtifacts.file configuration
+KARMA_ARTIFACTS_JSON = 'karma.artifacts.json'
+KARMA_ARTIFACTS_REPORTER = 'calmjs-artifacts'
+KARMA_ARTIFACTS_REPORTER_JS = 'karma.artifacts.reporter.js'
+KARMA_ARTIFACTS_REPORTER_SOURCE = '''\
+var fs = require('fs');
+
+var ArtifactsReporter = function(config) {
+    var options = config.calmjsArtifacts || {};
+    var browsers = {};
+    this.adapters = [];
+    this.onBrowserLog = function(browser, log, type) {
+        if (type !== '%s') {
+            return;
+        }
+        try {
+            browsers[browser.name] = JSON.parse(log);
+        } catch (e) {
+            // not reported by the loader.
+        }
+    };
+    this.onRunComplete = function() {
+        if (options.file) {
+            fs.writeFileSync(options.file, JSON.stringify({
+                browsers: browsers}));
+        }
+    };
+};
+
+ArtifactsReporter.$inject = ['config'];
+
+module.exports = {
+    'reporter:%s': ['type', ArtifactsReporter]
+};
+''' % (ARTIFACTS_LOG_TYPE, KARMA_ARTIFACTS_REPORTER)
+
+# the default directory for the profiles written by Node.js, relative to
+# the build directory, and the suffixes of the profiles
+NODE_PROF_DIRNAME = 'node-profiles'
+NODE_PROFILE_SUFFIXES = ('.cpuprofile', '.heapprofile')
+
+# the reporters that may be selected
+REPORTER_DEFAULT = 'default'
+REPORTER_MINIMAL = 'minimal'
+REPORTERS = (REPORTER_DEFAULT, REPORTER_MINIMAL)
+
+# the script that filter the tests registered with mocha before the
+# run is started, such that the quarantined tests are either excluded or
+# are the only ones run; without mocha, no tests are filtered.
+KARMA_QUARANTINE_JS = 'karma.quarantine.js'
+KARMA_QUARANTINE_ONLY_JS = 'karma.quarantine.only.js'
+KARMA_QUARANTINE_SOURCE = '''\
+(function(karma, mocha) {
+    var tests = %(tests)s;
+    var only = %(only)s;
+    var quarantined = {};
+    for (var i = 0; i < tests.length; i++) {
+        quarantined[tests[i][0] + '\\n' + tests[i][1]] = true;
+    }
+    var isQuarantined = function(test) {
+        var titles = [];
+        for (var p = test.parent; p && !p.root; p = p.parent) {
+            titles.unshift(p.title);
+        }
+        return Object.prototype.hasOwnProperty.call(
+            quarantined, titles.join(' > ') + '\\n' + test.title);
+    };
+    var filter = function(suite) {
+        suite.tests = suite.tests.filter(function(test) {
+            return isQuarantined(test) === only;
+        });
+        suite.suites.forEach(filter);
+    };
+    var start = karma.start;
+    karma.start = function() {
+        if (mocha && mocha.suite) {
+            filter(mocha.suite);
+        }
+        else if (window.console) {
+            window.console.warn(
+                'mocha is not available; the quarantine is not applied');
+        }
+        return start.apply(this, arguments);
+    };
+})(window.__karma__, window.mocha);
+'''
+# the modes for the handling of the quarantined tests
+QUARANTINE_EXCLUDE = 'exclude'
+QUARANTINE_SEPARATE = 'separate'
+QUARANTINE_MODES = (QUARANTINE_EXCLUDE, QUARANTINE_SEPARATE)
+
 # other constants
 KARMA_CONF_JS = 'karma.conf.js'
+# the number of serialized chunks to be accumulated before writing
+STREAM_WRITE_CHUNKS = 4096
+
+# characters that have special meaning to the glob patterns that are
+# accepted by karma; paths with these will not be compacted.
+GLOB_CHARS = frozenset('*?[]{}()!+@')
 
 # note that the actual tool, with default dependencies, show that the
 # allowed values are clover, cobertura, html, json, json-summary, lcov,
@@ -83,6 +526,191 @@ def build_base_config(
     ]}
 
 
+def apply_outcome_reporter_config(
+        config, build_dir, outcome_fn, results=False, stream=None):
+    """
+    Apply the outcome reporter to the config, such that the outcome of
+    the run will be written to outcome_fn.  If results is True, the
+    result of every test will be included in the outcome, and if stream
+    is provided, the result of every test will be written to it as they
+    are completed.
+    """
+
+    # the default plugins must be retained once plugins are specified.
+    config['plugins'] = config.get('plugins', ['karma-*']) + [
+        join(build_dir, KARMA_OUTCOME_REPORTER_JS)]
+    config['reporters'] = config.get('reporters', []) + [
+        KARMA_OUTCOME_REPORTER]
+    config['calmjsOutcome'] = {'file': outcome_fn, 'results': results}
+    if stream:
+        config['calmjsOutcome']['stream'] = stream
+
+
+def apply_minimal_reporter_config(config, build_dir, log_fn):
+    """
+    Replace the reporters in the config with the minimal reporter, with
+    the complete details of the run written to log_fn.
+    """
+
+    config['plugins'] = config.get('plugins', ['karma-*']) + [
+        join(build_dir, KARMA_MINIMAL_REPORTER_JS)]
+    config['reporters'] = [
+        reporter for reporter in config.get('reporters', [])
+        if reporter not in ('spec', 'progress')
+    ] + [KARMA_MINIMAL_REPORTER]
+    config['calmjsMinimal'] = {'file': log_fn}
+    config['colors'] = False
+    config['logLevel'] = 'WARN'
+
+
+def apply_bench_config(config, build_dir, bench_fn):
+    """
+    Apply the benchmark framework and reporter to the config, replacing
+    the testing frameworks and the reporters, such that the results of
+    the benchmarks will be written to bench_fn.
+    """
+
+    config['frameworks'] = [BENCH_FRAMEWORK] + [
+        framework for framework in config.get('frameworks', [])
+        if framework not in ('mocha', 'chai', 'expect', 'sinon')
+    ]
+    config['plugins'] = config.get('plugins', ['karma-*']) + [
+        join(build_dir, KARMA_BENCH_REPORTER_JS)]
+    config['reporters'] = [KARMA_BENCH_REPORTER]
+    config['calmjsBench'] = {'file': bench_fn}
+    config['browserNoActivityTimeout'] = BENCH_NO_ACTIVITY_TIMEOUT
+
+
+def served_url(path, basedir):
+    """
+    Return the url the file at path will be served at by karma, with
+    basedir being its basePath.
+    """
+
+    rel = relpath(path, basedir)
+    if rel.split(sep, 1)[0] == pardir:
+        return '/absolute' + ('' if path.startswith(sep) else '/') + (
+            path.replace(sep, '/'))
+    return '/base/' + rel.replace(sep, '/')
+
+
+def artifacts_loader_source(paths, basedir):
+    """
+    Generate the script that loads the artifacts at paths, served by
+    karma from basedir, measuring the time taken for each of them.
+    """
+
+    return KARMA_ARTIFACTS_LOADER_TEMPLATE % (
+        json.dumps([[path, served_url(path, basedir)] for path in paths]),
+        json.dumps(ARTIFACTS_LOG_TYPE),
+    )
+
+
+def artifacts_loader_files(paths, build_dir):
+    """
+    Return the entries for the files of the karma configuration that
+    will have the artifacts at paths served but loaded by the loader.
+    """
+
+    return [join(build_dir, KARMA_ARTIFACTS_LOADER_JS)] + [{
+        'pattern': path, 'included': False, 'served': True,
+        'watched': False,
+    } for path in paths]
+
+
+def apply_artifacts_reporter_config(config, build_dir, result_fn):
+    """
+    Apply the artifacts reporter to the config, such that the timings
+    of the loading of the artifacts will be written to result_fn.
+    """
+
+    config['plugins'] = config.get('plugins', ['karma-*']) + [
+        join(build_dir, KARMA_ARTIFACTS_REPORTER_JS)]
+    config['reporters'] = config.get('reporters', []) + [
+        KARMA_ARTIFACTS_REPORTER]
+    config['calmjsArtifacts'] = {'file': result_fn}
+
+
+def read_bench_results(path):
+    """
+    Read the results of the benchmarks written by the bench reporter to
+    path, or None if not available.
+    """
+
+    try:
+        with codecs.open(path, encoding='utf8') as fd:
+            return json.load(fd)['results']
+    except (IOError, OSError, ValueError, KeyError):
+        logger.debug("benchmark results at '%s' not available", path)
+        return None
+
+
+def quarantine_source(tests, only=False):
+    """
+    Produce the source of the script that will exclude the quarantined
+    tests, a list of the suite and name of each test, from the run, or
+    if only is True, exclude all the other tests instead.
+    """
+
+    return KARMA_QUARANTINE_SOURCE % {
+        'tests': json.dumps(tests, sort_keys=True),
+        'only': json.dumps(bool(only)),
+    }
+
+
+def clear_outcome(path):
+    """
+    Remove the outcome of a previous run at path.
+    """
+
+    if isfile(path):
+        remove(path)
+
+
+def read_outcome(path):
+    """
+    Read the outcome written by the outcome reporter, or None if it was
+    not written.
+    """
+
+    try:
+        with codecs.open(path, encoding='utf8') as fd:
+            return json.load(fd)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def is_crashed(return_code, outcome):
+    """
+    Determine whether the run with the return code and outcome was
+    terminated by a crash or disconnection of the browser, or of karma
+    itself, rather than completing with the results of the tests.
+    """
+
+    if return_code is not None and return_code < 0:
+        # terminated by a signal, e.g. from exceeding a memory limit.
+        return True
+    return bool(outcome and (
+        outcome.get('disconnected') or outcome.get('process_failures')))
+
+
+def completed_outcomes(spec):
+    """
+    Return the outcomes of the karma run described by the spec, which
+    are those of the runs that were not split further if the test
+    modules were split into separate runs; outcomes not captured are
+    omitted.
+    """
+
+    split_runs = spec.get(KARMA_SPLIT_RUNS)
+    if not split_runs:
+        outcomes = [spec.get(KARMA_OUTCOME)]
+    else:
+        outcomes = [run.get('outcome') for run in split_runs if not (
+            run['crashed'] and len(run['test_module_paths']) > 1)]
+    return [outcome for outcome in outcomes if outcome]
+
+
 def build_coverage_reporter_config(report_key, report_dir, report_file):
     if report_key not in COVER_REPORT_TYPE_OPTIONS:
         logger.warning("coverage reporter '%s' not supported", report_key)
@@ -137,12 +765,156 @@ def build_coverage_reporters_config(report_keys, report_dir, report_file):
     }
 
 
+def _is_literal_path(path):
+    return not GLOB_CHARS.intersection(path)
+
+
+def _sibling_key(path):
+    # files sharing this key may be selected by a single glob pattern.
+    return dirname(path), splitext(path)[1]
+
+
+class _SiblingIndex(object):
+    """
+    Lazily list the files of the directories under basedir, grouped by
+    extension, such that whether a collection of sibling paths is the
+    exact selection of the glob that would replace them can be checked.
+    """
+
+    def __init__(self, basedir):
+        self.basedir = basedir
+        self.listings = {}
+
+    def listing(self, key):
+        if key not in self.listings:
+            path, ext = key
+            target = join(self.basedir, path)
+            try:
+                names = listdir(target)
+            except OSError:
+                names = []
+            # karma does not select the hidden files or directories.
+            self.listings[key] = sorted(
+                name for name in names
+                if splitext(name)[1] == ext and not name.startswith('.') and
+                isfile(join(target, name))
+            )
+        return self.listings[key]
+
+    def glob(self, paths):
+        """
+        Return the glob that selects exactly the provided paths in the
+        provided order, otherwise None.
+        """
+
+        if len(paths) < 2 or not all(_is_literal_path(p) for p in paths):
+            return None
+        key = _sibling_key(paths[0])
+        # without an extension the glob would select everything.
+        if not key[1] or self.listing(key) != [
+                basename(path) for path in paths]:
+            return None
+        return join(key[0], '*' + key[1])
+
+
+def compact_files(files, basedir, single_run=False, preprocessors=None):
+    """
+    Collapse the consecutive runs of sibling paths in the list of files
+    into a directory glob, when the glob would select exactly the same
+    set of files under basedir in the same order as they were listed.
+    As karma sorts the files selected by a glob by their path, a run
+    that is not already sorted will not be collapsed, such that the
+    ordering constraints are preserved.
+
+    If single_run is True, the resulting entries are emitted as file
+    pattern objects that will not be watched, and where no preprocessors
+    are applied, will not be cached by karma.
+    """
+
+    preprocessors = preprocessors or {}
+    index = _SiblingIndex(basedir)
+    # a glob in the preprocessors may match anything.
+    preprocessor_globs = not all(
+        _is_literal_path(key) for key in preprocessors)
+
+    def emit(paths):
+        pattern = index.glob(paths)
+        if pattern is None:
+            entries = [(path, [path]) for path in paths]
+        else:
+            entries = [(pattern, paths)]
+
+        for pattern, selected in entries:
+            if not single_run:
+                yield pattern
+                continue
+            entry = {'pattern': pattern, 'watched': False}
+            if not preprocessor_globs and not any(
+                    p in preprocessors for p in selected):
+                # karma will not preprocess files that are not cached.
+                entry['nocache'] = True
+            yield entry
+
+    result = []
+    run = []
+    for path in files:
+        if isinstance(path, dict):
+            # existing file pattern objects are kept as is.
+            result.extend(emit(run))
+            run = []
+            result.append(path)
+            continue
+        if run and (
+                _sibling_key(run[-1]) != _sibling_key(path) or
+                run[-1] >= path):
+            result.extend(emit(run))
+            run = []
+        run.append(path)
+    result.extend(emit(run))
+    return result
+
+
+def compact_preprocessors(preprocessors, basedir):
+    """
+    Collapse the sibling paths in the preprocessors mapping that share
+    the identical list of preprocessors into a directory glob, when the
+    glob would select exactly the same set of files under basedir.
+    """
+
+    index = _SiblingIndex(basedir)
+    groups = {}
+    for path, value in preprocessors.items():
+        if not _is_literal_path(path):
+            continue
+        value = value if isinstance(value, list) else [value]
+        groups.setdefault(
+            _sibling_key(path) + (tuple(value),), []).append(path)
+
+    result = dict(preprocessors)
+    for key, paths in groups.items():
+        pattern = index.glob(sorted(paths))
+        if pattern is None or pattern in result:
+            continue
+        for path in paths:
+            result.pop(path)
+        result[pattern] = list(key[2])
+    return result
+
+
+def _stream_json(encoder, config, fd):
+    chunks = encoder.iterencode(config)
+    for fragment in iter(
+            lambda: ''.join(islice(chunks, STREAM_WRITE_CHUNKS)), ''):
+        fd.write(fragment)
+
+
 def config_writer(driver, config, fd):
     """
-    The default complete karma config writer.  Note that the invocation
-    of the writer by the ``cli.KarmaDriver`` class only applies the
-    latter two arguments, and it would construct a partial using itself
-    to do so.
+    The original complete karma config writer, which produces the
+    entire serialized configuration in memory before writing.  Note that
+    the invocation of the writer by the ``cli.KarmaDriver`` class only
+    applies the latter two arguments, and it would construct a partial
+    using itself to do so.
 
     The writer itself may be override by providing a function that takes
     two arguments to spec[KARMA_CONFIG_WRITER], and it may be a partial
@@ -162,3 +934,49 @@ def config_writer(driver, config, fd):
     """
 
     fd.write(KARMA_CONF_TEMPLATE % driver.dumps(config))
+
+
+def streaming_config_writer(driver, config, fd):
+    """
+    The default karma config writer, which serializes the configuration
+    incrementally to the fd, such that the complete serialized form of
+    configurations with a large number of files will not be produced in
+    memory.  The resulting contents are identical to what would have
+    been produced by ``config_writer``, and it is applied in the same
+    manner.
+    """
+
+    header, footer = KARMA_CONF_TEMPLATE.split('%s')
+    fd.write(header)
+    _stream_json(json.JSONEncoder(
+        indent=driver.indent, sort_keys=True, separators=driver.separators,
+    ), config, fd)
+    fd.write(footer)
+
+
+def sidecar_writer(config, fd):
+    """
+    Write the configuration as compact JSON, for the sidecar file that
+    is to be loaded by the static ``KARMA_CONF_STUB``.
+    """
+
+    _stream_json(json.JSONEncoder(
+        sort_keys=True, separators=(',', ':')), config, fd)
+
+
+def sidecar_path(config_fn):
+    """
+    Return the path to the sidecar file for the karma configuration
+    file at config_fn, as loaded by the ``KARMA_CONF_STUB``.
+    """
+
+    return splitext(config_fn)[0] + '.json'
+
+
+def config_stub_writer(config, fd):
+    """
+    Write the static ``KARMA_CONF_STUB``, which loads the configuration
+    from the sidecar file; the provided config is not used.
+    """
+
+    fd.write(KARMA_CONF_STUB)
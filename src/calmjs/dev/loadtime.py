@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Module for the cost of the loading of the artifacts in the browsers, as
+measured by the artifacts loader, along with the sizes of the artifacts
+and the budgets that may be applied to them.
+
+The budgets are read from a JSON file, keyed by the export target, its
+basename, or ``*`` for all the other export targets, in that order of
+precedence, e.g.::
+
+    {
+        "*": {"size": "1M"},
+        "example.js": {"size": "200K", "load": 50}
+    }
+
+Where ``size`` is the limit of the size of every artifact in bytes with
+an optional K, M or G suffix, and ``load`` is the limit of the time in
+milliseconds taken to fetch, parse and evaluate every artifact in each
+of the browsers.  As the artifacts are loaded through script elements,
+the parsing and the evaluation are measured together as ``evaluate``.
+"""
+
+import codecs
+import json
+import logging
+from os.path import basename
+from os.path import getsize
+
+from calmjs.dev.utils import parse_size
+
+logger = logging.getLogger(__name__)
+
+# the phases of the loading that are measured
+LOAD_PHASES = ('fetch', 'evaluate')
+# the key of the budget applied to the export targets without one
+BUDGET_DEFAULT_KEY = '*'
+
+
+def summarize_load(paths, browsers):
+    """
+    Produce the measurements of the artifacts at paths, with the timings
+    of each of the browsers as reported by the artifacts loader.
+    """
+
+    artifacts = []
+    for path in paths:
+        try:
+            size = getsize(path)
+        except OSError:
+            size = None
+        timings = {}
+        for browser, entries in (browsers or {}).items():
+            for entry in entries:
+                if entry.get('path') != path:
+                    continue
+                timing = {phase: entry.get(phase) for phase in LOAD_PHASES}
+                timing['total'] = sum(
+                    entry.get(phase) or 0.0 for phase in LOAD_PHASES)
+                timings[browser] = timing
+        artifacts.append({'path': path, 'size': size, 'browsers': timings})
+    return artifacts
+
+
+def load_budgets(path):
+    """
+    Load the budgets from the file at path; an empty dict is returned
+    if it does not exist.
+    """
+
+    try:
+        with codecs.open(path, encoding='utf8') as fd:
+            return json.load(fd)
+    except (IOError, OSError):
+        logger.warning("no artifact budgets found at '%s'", path)
+    except ValueError:
+        logger.warning("ignoring invalid artifact budgets at '%s'", path)
+    return {}
+
+
+def budget_for(budgets, export_target):
+    """
+    Return the budget from budgets that applies to the export target,
+    with the size resolved to bytes, or None if there are none.
+    """
+
+    for key in (export_target, basename(export_target or ''),
+                BUDGET_DEFAULT_KEY):
+        if key and key in budgets:
+            budget = dict(budgets[key])
+            if budget.get('size') is not None:
+                budget['size'] = parse_size(str(budget['size']))
+            return budget
+    return None
+
+
+def check_budget(artifacts, budget):
+    """
+    Check the measurements of the artifacts against the budget,
+    returning the limits that were exceeded.
+    """
+
+    exceeded = []
+    if not budget:
+        return exceeded
+    for artifact in artifacts:
+        limit = budget.get('size')
+        if limit is not None and (artifact['size'] or 0) > limit:
+            exceeded.append({
+                'path': artifact['path'], 'browser': None, 'limit': 'size',
+                'value': artifact['size'], 'budget': limit,
+            })
+        limit = budget.get('load')
+        if limit is None:
+            continue
+        for browser, timing in sorted(artifact['browsers'].items()):
+            if timing['total'] > limit:
+                exceeded.append({
+                    'path': artifact['path'], 'browser': browser,
+                    'limit': 'load', 'value': timing['total'],
+                    'budget': limit,
+                })
+    return exceeded
+
+
+def _ms(value):
+    return 'n/a' if value is None else '%.1f ms' % value
+
+
+def format_load(artifacts):
+    """
+    Format the measurements of the artifacts as lines of text for the
+    report.
+    """
+
+    lines = []
+    for artifact in artifacts:
+        lines.append('%s: %s bytes' % (artifact['path'], (
+            'n/a' if artifact['size'] is None else artifact['size'])))
+        for browser, timing in sorted(artifact['browsers'].items()):
+            lines.append('    %s: fetch %s, parse and evaluate %s' % (
+                browser, _ms(timing['fetch']), _ms(timing['evaluate'])))
+    return lines
+
+
+def format_exceeded(exceeded):
+    """
+    Format the exceeded limits of the budget as lines of text for the
+    report.
+    """
+
+    return ['%s%s: %s of %s exceeds the budget of %s' % (
+        item['path'], ' (%s)' % item['browser'] if item['browser'] else '',
+        item['limit'], (
+            '%d bytes' % item['value'] if item['limit'] == 'size' else
+            _ms(item['value'])),
+        ('%d bytes' % item['budget'] if item['limit'] == 'size' else
+         _ms(item['budget'])),
+    ) for item in exceeded]
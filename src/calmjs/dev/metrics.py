@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Module for the metrics of the karma runs and the verification of the
+artifacts, which may be exported to a Prometheus textfile (as read by
+the textfile collector of the node exporter) and/or appended to a
+JSON-lines file.
+"""
+
+import codecs
+import json
+import logging
+from time import time
+
+from calmjs.toolchain import EXPORT_TARGET
+from calmjs.toolchain import SOURCE_PACKAGE_NAMES
+from calmjs.toolchain import TEST_PACKAGE_NAMES
+
+from calmjs.dev import diffcover
+from calmjs.dev import karma
+from calmjs.dev.utils import write_if_changed
+
+logger = logging.getLogger(__name__)
+
+# the prefix for the names of the Prometheus metrics
+METRICS_PREFIX = 'calmjs_dev'
+# the outcome counts of the tests
+TEST_RESULTS = ('passed', 'failed', 'skipped')
+# the kinds of the coverage
+COVERAGE_KINDS = ('statements', 'branches', 'functions', 'lines')
+
+
+def _ratio(covered, total):
+    return float(covered) / total if total else None
+
+
+def summarize_coverage(coverage):
+    """
+    Produce the ratios of the covered statements, branches, functions
+    and lines from the istanbul coverage data.
+    """
+
+    counts = {kind: [0, 0] for kind in COVERAGE_KINDS}
+
+    def add(kind, hits):
+        counts[kind][0] += sum(1 for hit in hits if hit)
+        counts[kind][1] += len(hits)
+
+    for file_coverage in coverage.values():
+        add('statements', list(file_coverage.get('s', {}).values()))
+        add('functions', list(file_coverage.get('f', {}).values()))
+        add('branches', [
+            hit for hits in file_coverage.get('b', {}).values()
+            for hit in hits
+        ])
+        add('lines', list(diffcover.index_statement_lines(
+            file_coverage).values()))
+    return {kind: _ratio(*counts[kind]) for kind in COVERAGE_KINDS}
+
+
+def load_coverage_summary(path):
+    """
+    Summarize the coverage from the istanbul coverage JSON at path, or
+    return None if not available.
+    """
+
+    if not path:
+        return None
+    try:
+        with codecs.open(path, encoding='utf8') as fd:
+            return summarize_coverage(json.load(fd))
+    except (IOError, OSError, ValueError):
+        logger.debug("coverage data at '%s' not available", path)
+        return None
+
+
+def _sum_outcomes(outcomes):
+    if not outcomes:
+        return {}
+    return {
+        result: sum(outcome.get(result) or 0 for outcome in outcomes)
+        for result in TEST_RESULTS
+    }
+
+
+def run_labels(spec):
+    """
+    Produce the labels that identify the karma run described by the
+    spec.
+    """
+
+    return {
+        'packages': ','.join(
+            spec.get(TEST_PACKAGE_NAMES) or
+            spec.get(SOURCE_PACKAGE_NAMES) or []),
+        'export_target': spec.get(EXPORT_TARGET) or '',
+        'browsers': ','.join(spec.get(karma.KARMA_BROWSERS) or []),
+    }
+
+
+def run_metrics(spec, coverage_json=None):
+    """
+    Produce the metrics for the karma run described by the spec.
+    """
+
+    outcome = spec.get(karma.KARMA_OUTCOME) or {}
+    counts = _sum_outcomes(karma.completed_outcomes(spec))
+    started = spec.get(karma.KARMA_STARTED)
+    registered = outcome.get('browser_registered')
+    return {
+        'type': 'karma_run',
+        'timestamp': time(),
+        'labels': run_labels(spec),
+        'duration_seconds': spec.get(karma.KARMA_DURATION),
+        'return_code': spec.get(karma.KARMA_RETURN_CODE),
+        'startup_seconds': (
+            registered / 1000.0 - started
+            if started and registered else None),
+        'tests': counts or None,
+        'coverage': load_coverage_summary(coverage_json),
+    }
+
+
+def verification_metrics(report):
+    """
+    Produce the metrics for the verification from its report.
+    """
+
+    records = [
+        record
+        for package in report['packages'].values()
+        for record in package['export_targets']
+    ]
+    statuses = {}
+    for record in records:
+        statuses[record['status']] = statuses.get(record['status'], 0) + 1
+    executed = [
+        record for record in records if record.get('return_code') is not None]
+    cache_hits = sum(1 for record in executed if record.get('cache_hit'))
+    return {
+        'type': 'verification',
+        'timestamp': time(),
+        'labels': {'packages': ','.join(sorted(report['packages']))},
+        'duration_seconds': report.get('duration'),
+        'success': report['success'],
+        'export_targets': statuses,
+        'cache_hits': cache_hits,
+        'cache_misses': len(executed) - cache_hits,
+        'runs': [record['metrics'] for record in records if record.get(
+            'metrics')],
+    }
+
+
+def _samples_for_run(metrics):
+    name = METRICS_PREFIX + '_karma_'
+    labels = metrics['labels']
+    yield name + 'duration_seconds', labels, metrics['duration_seconds']
+    yield name + 'return_code', labels, metrics['return_code']
+    yield name + 'startup_seconds', labels, metrics['startup_seconds']
+    for result, value in sorted((metrics['tests'] or {}).items()):
+        yield name + 'tests', dict(labels, result=result), value
+    for kind, value in sorted((metrics['coverage'] or {}).items()):
+        yield name + 'coverage_ratio', dict(labels, kind=kind), value
+
+
+def _samples_for_verification(metrics):
+    name = METRICS_PREFIX + '_verify_'
+    labels = metrics['labels']
+    yield name + 'duration_seconds', labels, metrics['duration_seconds']
+    yield name + 'success', labels, int(metrics['success'])
+    for status, value in sorted(metrics['export_targets'].items()):
+        yield name + 'export_targets', dict(labels, status=status), value
+    yield name + 'executions', dict(labels, cache='hit'), metrics[
+        'cache_hits']
+    yield name + 'executions', dict(labels, cache='miss'), metrics[
+        'cache_misses']
+    for run in metrics['runs']:
+        for sample in _samples_for_run(run):
+            yield sample
+
+
+def _escape_label_value(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace(
+        '"', '\\"')
+
+
+def format_prometheus(metrics):
+    """
+    Format the metrics in the Prometheus text exposition format.
+    """
+
+    samples = (
+        _samples_for_verification(metrics)
+        if metrics['type'] == 'verification' else _samples_for_run(metrics)
+    )
+    grouped = {}
+    for name, labels, value in samples:
+        if value is None:
+            continue
+        grouped.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name in sorted(grouped):
+        lines.append('# TYPE %s gauge' % name)
+        for labels, value in grouped[name]:
+            lines.append('%s{%s} %s' % (name, ','.join(
+                '%s="%s"' % (key, _escape_label_value(labels[key]))
+                for key in sorted(labels)
+            ), repr(float(value))))
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(metrics, path):
+    """
+    Write the metrics to the Prometheus textfile at path, atomically
+    such that the collector will never read a partially written file.
+    """
+
+    write_if_changed(path, lambda fd: fd.write(format_prometheus(metrics)))
+    logger.debug("wrote metrics to Prometheus textfile '%s'", path)
+
+
+def append_json_line(metrics, path):
+    """
+    Append the metrics as a single line of JSON to the file at path.
+    """
+
+    line = json.dumps(metrics, sort_keys=True) + '\n'
+    with codecs.open(path, 'a', encoding='utf8') as fd:
+        # written at once, such that concurrent appends by other runs
+        # will not be interleaved.
+        fd.write(line)
+    logger.debug("appended metrics to JSON-lines file '%s'", path)
+
+
+def export_metrics(metrics, prometheus=None, jsonl=None):
+    """
+    Export the metrics to the provided locations.
+    """
+
+    if prometheus:
+        write_prometheus(metrics, prometheus)
+    if jsonl:
+        append_json_line(metrics, jsonl)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Module for the execution plans and the recorded timings of the karma
+test executions.
+
+The timings are keyed by the cost key, which is derived from the test
+modules and the options that affect the duration of the execution, and
+they are recorded into a store inside the build cache directory, such
+that the duration of future executions with the same key may be
+estimated.
+"""
+
+import codecs
+import hashlib
+import json
+import logging
+from functools import partial
+from os.path import join
+from os.path import realpath
+
+from calmjs.dev.karma import KARMA_BROWSERS
+from calmjs.dev.karma import KARMA_EXTRA_FRAMEWORKS
+from calmjs.dev.utils import write_if_changed
+from calmjs.dev.utils import write_json
+
+logger = logging.getLogger(__name__)
+
+# the filename of the store in the build cache directory
+TIMINGS_STORE = 'timings.json'
+# the spec keys for the options that affect the cost of an execution
+COST_KEY_OPTIONS = (
+    KARMA_BROWSERS,
+    KARMA_EXTRA_FRAMEWORKS,
+    'coverage_enable',
+    'cover_artifact',
+    'cover_bundle',
+    'cover_test',
+)
+
+
+def cost_key(spec, test_module_paths):
+    """
+    Produce the key for the cost of the execution for the test modules
+    with the options in the spec.
+    """
+
+    values = {key: spec.get(key) for key in COST_KEY_OPTIONS}
+    values['test_module_paths'] = sorted(test_module_paths)
+    return hashlib.sha256(json.dumps(
+        values, sort_keys=True).encode('utf8')).hexdigest()
+
+
+def _timings_path(cache_dir):
+    return join(realpath(cache_dir), TIMINGS_STORE)
+
+
+def load_timings(cache_dir):
+    """
+    Load the recorded timings from the build cache directory.
+    """
+
+    if not cache_dir:
+        return {}
+    path = _timings_path(cache_dir)
+    try:
+        with codecs.open(path, encoding='utf8') as fd:
+            return json.load(fd)
+    except (IOError, OSError):
+        return {}
+    except ValueError:
+        logger.warning("ignoring invalid timings store at '%s'", path)
+        return {}
+
+
+def record_timing(cache_dir, key, duration):
+    """
+    Record the duration of the execution identified by the cost key
+    into the build cache directory.
+    """
+
+    timings = load_timings(cache_dir)
+    timing = timings.get(key, {'runs': 0, 'mean': 0.0})
+    runs = timing['runs'] + 1
+    timings[key] = {
+        'runs': runs,
+        'last': duration,
+        'mean': timing['mean'] + (duration - timing['mean']) / runs,
+    }
+    write_if_changed(_timings_path(cache_dir), partial(
+        json.dump, timings, sort_keys=True))
+    logger.debug(
+        "recorded duration of %.3fs for execution with cost key %s",
+        duration, key,
+    )
+
+
+def estimate_duration(timings, key):
+    """
+    Return the estimated duration for the cost key from the timings, or
+    None if not available.
+    """
+
+    timing = timings.get(key)
+    return timing['mean'] if timing else None
+
+
+def summarize_plan(executions):
+    """
+    Produce the complete plan from the list of the planned executions.
+    """
+
+    # the executions that will be skipped have no cost.
+    estimates = [
+        execution.get('estimated_duration') for execution in executions
+        if not execution.get('skip_reason')
+    ]
+    return {
+        'executions': executions,
+        'estimated_duration': sum(
+            estimate for estimate in estimates if estimate is not None),
+        'unestimated': estimates.count(None),
+    }
+
+
+def write_plan(plan, path):
+    """
+    Write the plan as JSON to the path, or to stdout if the path is '-'.
+    """
+
+    write_json(plan, path)
+    if path != '-':
+        logger.info("wrote execution plan to '%s'", path)
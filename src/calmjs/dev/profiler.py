@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Module for the profiling of the Python side of the karma runs, i.e. the
+resolution of the registries, the advices of the toolchains and the
+generation of the configuration.
+
+The time spent waiting on the karma child processes is excluded from
+the profiles, as the clock of the profiler is paused for the duration,
+such that the hot spots of the Python side are not obscured by it.
+"""
+
+import cProfile
+import logging
+import pstats
+import sys
+from contextlib import contextmanager
+from threading import Lock
+from timeit import default_timer
+
+logger = logging.getLogger(__name__)
+
+# the number of the entries in the summary of the profile
+PROFILE_LIMIT = 30
+
+
+class PausableClock(object):
+    """
+    The clock for the profiler, which does not advance while paused.
+    Pauses may be nested, such as by concurrent executions, where the
+    clock remains paused until all of them have been resumed.
+    """
+
+    def __init__(self, timer=default_timer):
+        self.timer = timer
+        self.lock = Lock()
+        self.depth = 0
+        self.paused_at = None
+        self.paused = 0.0
+
+    def __call__(self):
+        paused_at = self.paused_at
+        return (self.timer() if paused_at is None else paused_at) - (
+            self.paused)
+
+    def pause(self):
+        with self.lock:
+            if not self.depth:
+                self.paused_at = self.timer()
+            self.depth += 1
+
+    def resume(self):
+        with self.lock:
+            self.depth -= 1
+            if not self.depth:
+                self.paused += self.timer() - self.paused_at
+                self.paused_at = None
+
+
+# the clocks of the active profilers
+_clocks = []
+
+
+@contextmanager
+def paused():
+    """
+    Pause the clocks of the active profilers for the duration, e.g. for
+    the time spent waiting on a child process.
+    """
+
+    clocks = list(_clocks)
+    for clock in clocks:
+        clock.pause()
+    try:
+        yield
+    finally:
+        for clock in clocks:
+            clock.resume()
+
+
+def write_summary(profiler, stream, limit=PROFILE_LIMIT):
+    """
+    Write the summary of the top limit entries of the profile, sorted by
+    their cumulative time, to the stream.
+    """
+
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats('cumulative').print_stats(limit)
+
+
+@contextmanager
+def profiling(path, limit=PROFILE_LIMIT, stream=None):
+    """
+    Profile the execution for the duration, with the statistics dumped
+    to the file at path in the pstats format and the summary of the top
+    limit entries written to the stream, or stdout if not provided.
+    """
+
+    clock = PausableClock()
+    profiler = cProfile.Profile(clock)
+    _clocks.append(clock)
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        _clocks.remove(clock)
+        profiler.dump_stats(path)
+        logger.info(
+            "wrote the Python profile of the karma run to '%s', excluding "
+            "the time waiting on karma", path)
+        write_summary(profiler, sys.stdout if stream is None else stream,
+                      limit)
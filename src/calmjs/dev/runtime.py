@@ -6,6 +6,7 @@ select the resulting spec targets for usage
 """
 
 import logging
+import sys
 from itertools import chain
 from os.path import pathsep
 from argparse import SUPPRESS
@@ -20,33 +21,91 @@ from calmjs.toolchain import BUILD_DIR
 from calmjs.toolchain import CALMJS_TEST_REGISTRY_NAMES
 from calmjs.toolchain import TEST_PACKAGE_NAMES
 from calmjs.runtime import BaseArtifactRegistryRuntime
+from calmjs.runtime import BaseRuntime
 from calmjs.runtime import ToolchainRuntime
 from calmjs.runtime import DriverRuntime
 from calmjs.runtime import Runtime
 
+from calmjs.dev import bench
+from calmjs.dev import history
+from calmjs.dev import profiler
+from calmjs.dev.junit import JUnitXMLWriter
 from calmjs.dev.cli import KarmaDriver
-from calmjs.dev.cli import karma_verify_package_artifacts
+from calmjs.dev.cli import export_verification_metrics
+from calmjs.dev.cli import karma_plan_package_artifacts
+from calmjs.dev.cli import karma_spool_collect
+from calmjs.dev.cli import karma_spool_enqueue
+from calmjs.dev.cli import karma_spool_work
+from calmjs.dev.cli import karma_verify_package_artifacts_report
+from calmjs.dev.cli import write_verification_report
+from calmjs.dev.toolchain import prepare_spec_build_cache_dir
 from calmjs.dev.toolchain import prepare_spec_from_runtime
+from calmjs.dev.toolchain import KarmaBenchToolchain
 from calmjs.dev.toolchain import KarmaToolchain
+from calmjs.dev.toolchain import BUILD_CACHE_DIR
+from calmjs.dev.toolchain import BUNDLE_TESTS
 from calmjs.dev.toolchain import COVERAGE_ENABLE
 from calmjs.dev.toolchain import COVER_REPORT_TYPES
 from calmjs.dev.toolchain import COVER_ARTIFACT
 from calmjs.dev.toolchain import COVER_BUNDLE
+from calmjs.dev.toolchain import COVER_DIFF
 from calmjs.dev.toolchain import COVER_REPORT_DIR
 from calmjs.dev.toolchain import COVER_REPORT_FILE
 from calmjs.dev.toolchain import COVER_TEST
 from calmjs.dev.toolchain import COVERAGE_TYPE
 from calmjs.dev.toolchain import NO_WRAP_TESTS
+from calmjs.dev.utils import parse_size
 from calmjs.dev.karma import COVER_REPORT_TYPE_OPTIONS
 from calmjs.dev.karma import DEFAULT_COVER_REPORT_TYPE_OPTIONS
 from calmjs.dev.karma import KARMA_ABORT_ON_TEST_FAILURE
+from calmjs.dev.karma import KARMA_ARTIFACT_BUDGETS
+from calmjs.dev.karma import KARMA_BENCH
+from calmjs.dev.karma import KARMA_BENCH_BASELINE
+from calmjs.dev.karma import KARMA_BENCH_OUTPUT
+from calmjs.dev.karma import KARMA_BENCH_THRESHOLD
 from calmjs.dev.karma import KARMA_BROWSERS
+from calmjs.dev.karma import KARMA_COMPACT_CONFIG
+from calmjs.dev.karma import KARMA_CONFIG_SIDECAR
 from calmjs.dev.karma import KARMA_EXTRA_FRAMEWORKS
 from calmjs.dev.karma import KARMA_HALT_AFTER_TEST
+from calmjs.dev.karma import KARMA_HISTORY
+from calmjs.dev.karma import KARMA_JUNIT_WRITER
+from calmjs.dev.karma import KARMA_JUNIT_XML
+from calmjs.dev.karma import KARMA_MEASURE_ARTIFACTS
+from calmjs.dev.karma import KARMA_MEMORY_LIMIT
+from calmjs.dev.karma import KARMA_NODE_CPU_PROF
+from calmjs.dev.karma import KARMA_NODE_HEAP_PROF
+from calmjs.dev.karma import KARMA_NODE_OPTIONS
+from calmjs.dev.karma import KARMA_NODE_PROF_DIR
+from calmjs.dev.karma import NODE_PROF_DIRNAME
+from calmjs.dev.karma import KARMA_METRICS_JSONL
+from calmjs.dev.karma import KARMA_MINIMAL_LOG
+from calmjs.dev.karma import KARMA_METRICS_PROMETHEUS
+from calmjs.dev.karma import KARMA_PLAN
+from calmjs.dev.karma import KARMA_PROFILE_PYTHON
+from calmjs.dev.karma import KARMA_PROFILE_PYTHON_LIMIT
+from calmjs.dev.karma import KARMA_QUARANTINE
+from calmjs.dev.karma import KARMA_QUARANTINE_MODE
+from calmjs.dev.karma import KARMA_REPORTER
+from calmjs.dev.karma import REPORTER_DEFAULT
+from calmjs.dev.karma import REPORTERS
+from calmjs.dev.karma import QUARANTINE_EXCLUDE
+from calmjs.dev.karma import QUARANTINE_MODES
+from calmjs.dev.karma import KARMA_SPLIT_ON_CRASH
+from calmjs.dev.plan import summarize_plan
+from calmjs.dev.plan import write_plan
 
 logger = logging.getLogger(__name__)
 
 CALMJS_DEV_RUNTIME_KARMA = 'calmjs.dev.runtime.karma'
+# flag for continuing with the verification of artifacts after failures
+VERIFY_KEEP_GOING = 'keep_going'
+# the path to write the verification report to
+VERIFY_REPORT = 'verify_report'
+# the mode and location of the spool directory work queue
+VERIFY_SPOOL = 'verify_spool'
+VERIFY_SPOOL_DIR = 'verify_spool_dir'
+VERIFY_SPOOL_LEASE = 'verify_spool_lease'
 
 __all__ = ['KarmaRuntime', 'karma']
 
@@ -184,6 +243,17 @@ def init_argparser_common(argparser):
         help="include test sources for coverage report",
     )
 
+    argparser.add_argument(
+        '--cover-diff',
+        dest=COVER_DIFF, action='store',
+        metavar=metavar('FILE'),
+        help="also report the coverage of just the lines changed by the "
+             "unified diff provided by FILE, or '-' to read it from stdin; "
+             "file names in the diff are resolved from the current "
+             "directory after stripping their leading component, as per "
+             "the output of 'git diff'; requires coverage to be enabled",
+    )
+
     argparser.add_argument(
         '--artifact', default=[],
         dest=ARTIFACT_PATHS, action=StorePathSepDelimitedList,
@@ -206,6 +276,179 @@ def init_argparser_common(argparser):
         help="do not wrap tests with a function closure",
     )
 
+    argparser.add_argument(
+        '--bundle-tests',
+        dest=BUNDLE_TESTS, action='store_true',
+        help="concatenate the tests, each wrapped with a function closure, "
+             "into bundles with source maps such that they are loaded with "
+             "fewer requests; not applicable when tests are not wrapped or "
+             "are to be covered",
+    )
+
+    argparser.add_argument(
+        '--compact-config',
+        dest=KARMA_COMPACT_CONFIG, action='store_true',
+        help="compact the listing of files and preprocessors in the "
+             "generated karma configuration by collapsing sibling paths "
+             "into directory globs where they select the identical files",
+    )
+
+    argparser.add_argument(
+        '--config-sidecar',
+        dest=KARMA_CONFIG_SIDECAR, action='store_true',
+        help="write the generated karma configuration as a compact JSON "
+             "file alongside of a static karma configuration file that "
+             "loads it",
+    )
+
+    argparser.add_argument(
+        '--memory-limit', default=None, type=parse_size,
+        dest=KARMA_MEMORY_LIMIT, metavar=metavar('SIZE'),
+        help="limit the memory that may be written to by each of the "
+             "processes of the karma run, i.e. karma and the browsers, to "
+             "SIZE bytes, with an optional K, M or G suffix; not available "
+             "on all platforms",
+    )
+
+    argparser.add_argument(
+        '--node-options', default=None,
+        dest=KARMA_NODE_OPTIONS, metavar=metavar('OPTIONS'),
+        help="run karma under Node.js with OPTIONS, e.g. "
+             "'--node-options=--max-old-space-size=4096' for the karma "
+             "configurations with a huge number of files",
+    )
+
+    argparser.add_argument(
+        '--node-cpu-prof',
+        dest=KARMA_NODE_CPU_PROF, action='store_true',
+        help="run karma under Node.js with the CPU profiler, with the "
+             ".cpuprofile files written to the profile directory; "
+             "requires Node.js 12 or later",
+    )
+
+    argparser.add_argument(
+        '--node-heap-prof',
+        dest=KARMA_NODE_HEAP_PROF, action='store_true',
+        help="run karma under Node.js with the sampling heap profiler, "
+             "with the .heapprofile files written to the profile "
+             "directory; requires Node.js 12 or later",
+    )
+
+    argparser.add_argument(
+        '--node-prof-dir', default=None,
+        dest=KARMA_NODE_PROF_DIR, metavar=metavar('DIR'),
+        help="the profile directory for '--node-cpu-prof' and "
+             "'--node-heap-prof'; default: '%s' in the current "
+             "directory" % NODE_PROF_DIRNAME,
+    )
+
+    argparser.add_argument(
+        '--split-on-crash',
+        dest=KARMA_SPLIT_ON_CRASH, action='store_true',
+        help="when the karma run crashed or the browser disconnected, "
+             "split the test modules into halves to be executed as "
+             "separate runs, repeatedly until each of the runs complete, "
+             "with the results of the runs merged; the coverage reports "
+             "will be of the last run only",
+    )
+
+    argparser.add_argument(
+        '--metrics-prometheus', default=None,
+        dest=KARMA_METRICS_PROMETHEUS, metavar=metavar('FILE'),
+        help="write the metrics of the karma run, such as its duration, "
+             "the counts of the test outcomes and the coverage, to FILE "
+             "in the Prometheus text format, such as for the textfile "
+             "collector of the node exporter; the file is replaced "
+             "atomically",
+    )
+
+    argparser.add_argument(
+        '--metrics-jsonl', default=None,
+        dest=KARMA_METRICS_JSONL, metavar=metavar('FILE'),
+        help="append the metrics of the karma run to FILE as a line of "
+             "JSON",
+    )
+
+    argparser.add_argument(
+        '--history', default=None,
+        dest=KARMA_HISTORY, metavar=metavar('FILE'),
+        help="record the karma run, with the duration and outcome of "
+             "every test, into the SQLite database at FILE, for the "
+             "reports produced by 'calmjs karma history'",
+    )
+
+    argparser.add_argument(
+        '--junit-xml', default=None,
+        dest=KARMA_JUNIT_XML, metavar=metavar('FILE'),
+        help="write the results of the tests as JUnit XML to FILE; for "
+             "the verification of artifacts, every package and export "
+             "target will be written as a separate testsuite",
+    )
+
+    argparser.add_argument(
+        '--quarantine', default=None,
+        dest=KARMA_QUARANTINE, metavar=metavar('FILE'),
+        help="the list of the quarantined tests, as maintained by "
+             "'calmjs karma history --update-quarantine'; the quarantined "
+             "tests of the packages and export target will be excluded "
+             "from the run",
+    )
+
+    argparser.add_argument(
+        '--quarantine-mode', default=None,
+        dest=KARMA_QUARANTINE_MODE, choices=QUARANTINE_MODES,
+        help="exclude the quarantined tests, or run them in a separate "
+             "run after the main run, where the results are reported "
+             "separately and do not affect the outcome; default: %s" % (
+                 QUARANTINE_EXCLUDE),
+    )
+
+    argparser.add_argument(
+        '--measure-artifacts',
+        dest=KARMA_MEASURE_ARTIFACTS, action='store_true',
+        help="measure the time taken to fetch, parse and evaluate each of "
+             "the artifacts in the browsers before the tests are started, "
+             "along with the sizes of the artifacts",
+    )
+
+    argparser.add_argument(
+        '--artifact-budgets', default=None,
+        dest=KARMA_ARTIFACT_BUDGETS, metavar=metavar('FILE'),
+        help="the budgets for the sizes and the loading times of the "
+             "artifacts in FILE, as JSON keyed by the export target, its "
+             "basename or '*' for all others; the run fails if the budget "
+             "is exceeded; implies --measure-artifacts",
+    )
+
+    argparser.add_argument(
+        '--reporter', default=None,
+        dest=KARMA_REPORTER, choices=REPORTERS,
+        help="the reporter for the output of the karma run; the minimal "
+             "reporter prints only the failures and a final summary, with "
+             "the complete details written to '%s' in the build "
+             "directory; default: %s" % (
+                 KARMA_MINIMAL_LOG, REPORTER_DEFAULT),
+    )
+
+    argparser.add_argument(
+        '--plan', default=None, nargs='?', const='-',
+        dest=KARMA_PLAN, metavar=metavar('FILE'),
+        help="resolve the packages, test modules and artifacts, then write "
+             "the resulting execution plan, with the estimated durations "
+             "from the timings recorded in the build cache directory, as "
+             "JSON to the file or stdout if unspecified, without executing "
+             "the tests",
+    )
+
+    argparser.add_argument(
+        '--build-cache-dir', default=None,
+        dest=BUILD_CACHE_DIR, metavar=metavar(BUILD_CACHE_DIR),
+        help="the directory to keep build directories in across runs, each "
+             "keyed by the set of packages and options selected, such that "
+             "the generated files may be reused by subsequent runs; not "
+             "applicable when a build directory is specified",
+    )
+
     argparser.add_argument(
         '--wrap-tests', '--enable-wrap-tests',
         dest=NO_WRAP_TESTS, action='store_false',
@@ -288,6 +531,52 @@ class TestToolchainRuntime(ToolchainRuntime):
         Do nothing, as no export targets.
         """
 
+    def kwargs_to_spec(self, **kwargs):
+        spec = super(TestToolchainRuntime, self).kwargs_to_spec(**kwargs)
+        prepare_spec_build_cache_dir(spec)
+        return spec
+
+
+class BenchToolchainRuntime(TestToolchainRuntime):
+    """
+    karma runner for the benchmarks of the packages; requires the
+    karma-benchmark package, which is not installed by default
+    """
+
+    def init_argparser(self, argparser):
+        super(BenchToolchainRuntime, self).init_argparser(argparser)
+
+        argparser.add_argument(
+            '--baseline', default=None,
+            dest=KARMA_BENCH_BASELINE, metavar=metavar('FILE'),
+            help="compare the results of the benchmarks against the "
+                 "baseline in FILE, as written by '--bench-output'; the "
+                 "run fails if any of the results is a regression",
+        )
+
+        argparser.add_argument(
+            '--bench-output', default=None,
+            dest=KARMA_BENCH_OUTPUT, metavar=metavar('FILE'),
+            help="write the results of the benchmarks, i.e. the operations "
+                 "per second and their relative margin of error, as JSON "
+                 "to FILE; this may be the baseline, which will be replaced "
+                 "after the comparison",
+        )
+
+        argparser.add_argument(
+            '--bench-threshold', default=None, type=float,
+            dest=KARMA_BENCH_THRESHOLD, metavar=metavar('RATIO'),
+            help="the reduction of the operations per second from the "
+                 "baseline, as a ratio, for a result to be a regression, "
+                 "where the margins of error of the two must also not "
+                 "overlap; default: %s" % bench.BENCH_THRESHOLD,
+        )
+
+    def kwargs_to_spec(self, **kwargs):
+        spec = super(BenchToolchainRuntime, self).kwargs_to_spec(**kwargs)
+        spec[KARMA_BENCH] = True
+        return spec
+
 
 class KarmaArtifactRuntime(BaseArtifactRegistryRuntime):
     """
@@ -320,11 +609,207 @@ class KarmaArtifactRuntime(BaseArtifactRegistryRuntime):
             metavar=metavar(BUILD_DIR), help=SUPPRESS,
         )
 
+        argparser.add_argument(
+            '--keep-going',
+            dest=VERIFY_KEEP_GOING, action='store_true',
+            help='continue with the tests for the remaining artifacts after '
+                 'a failure, such that every artifact will be tested',
+        )
+
+        argparser.add_argument(
+            '--verify-report', default=None,
+            dest=VERIFY_REPORT, metavar=metavar('FILE'),
+            help='write the report of the verification of every artifact '
+                 "as JSON to the file; use '-' for stdout",
+        )
+
+        argparser.add_argument(
+            '--spool', default=None,
+            dest=VERIFY_SPOOL, choices=('enqueue', 'work', 'collect'),
+            help='make use of the spool directory as a work queue for the '
+                 'verification; enqueue the tests for the artifacts of the '
+                 'packages as jobs, work on the pending jobs until there are '
+                 'none left, or collect the results of the completed jobs '
+                 'into the verification report',
+        )
+
+        argparser.add_argument(
+            '--spool-dir', default=None,
+            dest=VERIFY_SPOOL_DIR, metavar=metavar('DIR'),
+            help='the spool directory, which may be shared by workers '
+                 'across hosts',
+        )
+
+        argparser.add_argument(
+            '--spool-lease', default=None, type=float,
+            dest=VERIFY_SPOOL_LEASE, metavar=metavar('SECONDS'),
+            help='the seconds after which the jobs claimed by the workers '
+                 'are reclaimed as pending jobs, which must exceed the '
+                 'duration of every job; without this, only the jobs of '
+                 'the workers on the same host that are no longer alive '
+                 'are reclaimed',
+        )
+
         self.init_argparser_package_names(
             argparser, help='Python packages to verify artifacts for')
 
     def run(self, argparser=None, package_names=[], **kwargs):
-        return karma_verify_package_artifacts(package_names, **kwargs)
+        plan_path = kwargs.pop(KARMA_PLAN, None)
+        if plan_path:
+            write_plan(karma_plan_package_artifacts(
+                package_names, **kwargs), plan_path)
+            return True
+
+        report_path = kwargs.pop(VERIFY_REPORT, None)
+        junit_xml = kwargs.pop(KARMA_JUNIT_XML, None)
+        spool_mode = kwargs.pop(VERIFY_SPOOL, None)
+        spool_dir = kwargs.pop(VERIFY_SPOOL_DIR, None)
+        spool_lease = kwargs.pop(VERIFY_SPOOL_LEASE, None)
+        if spool_mode and not spool_dir:
+            logger.error(
+                "the spool directory must be specified for '--spool'")
+            return False
+        elif spool_mode == 'enqueue':
+            karma_spool_enqueue(spool_dir, package_names, **kwargs)
+            return True
+        elif spool_mode == 'work':
+            return karma_spool_work(spool_dir, lease=spool_lease)
+        elif spool_mode == 'collect':
+            report = karma_spool_collect(spool_dir)
+        elif junit_xml:
+            # the testsuites of every execution written to the one file.
+            with JUnitXMLWriter(junit_xml) as writer:
+                report = karma_verify_package_artifacts_report(
+                    package_names, **dict(kwargs, **{
+                        KARMA_JUNIT_WRITER: writer}))
+        else:
+            report = karma_verify_package_artifacts_report(
+                package_names, **kwargs)
+
+        if report_path:
+            write_verification_report(report, report_path)
+        if kwargs.get(KARMA_METRICS_PROMETHEUS) or kwargs.get(
+                KARMA_METRICS_JSONL):
+            export_verification_metrics(
+                report,
+                prometheus=kwargs.get(KARMA_METRICS_PROMETHEUS),
+                jsonl=kwargs.get(KARMA_METRICS_JSONL),
+            )
+        return report['success']
+
+
+class KarmaCommandRuntime(BaseRuntime):
+    """
+    The base runtime class for the karma subcommands that do not invoke
+    a toolchain.
+    """
+
+
+class KarmaHistoryRuntime(KarmaCommandRuntime):
+    """
+    report the regressions of the durations of the tests and the flaky
+    tests from the history of the karma runs
+    """
+
+    def init_argparser(self, argparser):
+        super(KarmaHistoryRuntime, self).init_argparser(argparser)
+
+        argparser.add_argument(
+            '--history', default=None,
+            dest=KARMA_HISTORY, metavar=metavar('FILE'),
+            help="the SQLite database with the history of the karma runs",
+        )
+
+        argparser.add_argument(
+            '--window', default=history.REGRESSION_WINDOW, type=int,
+            metavar=metavar('RUNS'),
+            help="the number of the prior runs of each test that form the "
+                 "baseline for its latest duration; default: %(default)s",
+        )
+
+        argparser.add_argument(
+            '--min-samples', default=history.REGRESSION_MIN_SAMPLES,
+            type=int, metavar=metavar('RUNS'),
+            help="the minimum number of the prior runs of a test for its "
+                 "baseline to be used; default: %(default)s",
+        )
+
+        argparser.add_argument(
+            '--z-score', default=history.REGRESSION_Z_SCORE, type=float,
+            metavar=metavar('SCORE'),
+            help="the number of standard deviations above the mean of the "
+                 "baseline for the latest duration to be reported as a "
+                 "regression; default: %(default)s",
+        )
+
+        argparser.add_argument(
+            '--min-delta', default=history.REGRESSION_MIN_DELTA, type=float,
+            metavar=metavar('MS'),
+            help="the minimum increase in milliseconds above the mean of "
+                 "the baseline for the latest duration to be reported as a "
+                 "regression; default: %(default)s",
+        )
+
+        argparser.add_argument(
+            '--flaky-window', default=history.FLAKY_WINDOW, type=int,
+            metavar=metavar('RESULTS'),
+            help="the number of the latest results of each test considered "
+                 "for its classification as flaky; default: %(default)s",
+        )
+
+        argparser.add_argument(
+            '--update-quarantine', default=None, metavar=metavar('FILE'),
+            help="write the tests classified as flaky, i.e. those that both "
+                 "failed and passed with identical inputs, as the list of "
+                 "quarantined tests to FILE",
+        )
+
+        argparser.add_argument(
+            '--fail-threshold', default=None, type=float,
+            metavar=metavar('RATIO'),
+            help="fail if any of the regressions reported have a latest "
+                 "duration of at least RATIO times the mean of their "
+                 "baseline",
+        )
+
+    def run(self, argparser=None, **kwargs):
+        path = kwargs.get(KARMA_HISTORY)
+        if not path:
+            logger.error("the history database must be specified")
+            return False
+
+        regressions = history.find_regressions(
+            path, window=kwargs.get('window'),
+            min_samples=kwargs.get('min_samples'),
+            z_score=kwargs.get('z_score'),
+            min_delta=kwargs.get('min_delta'),
+        )
+        for line in history.format_regressions(regressions):
+            sys.stdout.write(line + '\n')
+        logger.info(
+            "found %d duration regression(s) in the history at '%s'",
+            len(regressions), path)
+
+        flaky = history.find_flaky(path, window=kwargs.get('flaky_window'))
+        for line in history.format_flaky(flaky):
+            sys.stdout.write(line + '\n')
+        logger.info(
+            "found %d flaky test(s) in the history at '%s'", len(flaky), path)
+        if kwargs.get('update_quarantine'):
+            history.write_quarantine(kwargs['update_quarantine'], flaky)
+
+        threshold = kwargs.get('fail_threshold')
+        if threshold is None:
+            return True
+        failed = [
+            regression for regression in regressions
+            if regression['ratio'] is None or regression['ratio'] >= threshold
+        ]
+        if failed:
+            logger.error(
+                "%d duration regression(s) at or above the threshold of "
+                "x%s", len(failed), threshold)
+        return not failed
 
 
 class KarmaRuntime(Runtime, DriverRuntime):
@@ -350,7 +835,7 @@ class KarmaRuntime(Runtime, DriverRuntime):
 
         inst = super(KarmaRuntime, self).entry_point_load_validated(
             entry_point)
-        if not isinstance(inst, ToolchainRuntime):
+        if not isinstance(inst, (ToolchainRuntime, KarmaCommandRuntime)):
             logger.debug(
                 "filtering out entry point '%s' as it does not lead to a "
                 "calmjs.runtime.ToolchainRuntime in KarmaRuntime.",
@@ -391,17 +876,54 @@ class KarmaRuntime(Runtime, DriverRuntime):
                  'result',
         )
 
+        argparser.add_argument(
+            '--profile-python', default=None,
+            dest=KARMA_PROFILE_PYTHON, metavar=metavar('PATH'),
+            help="profile the Python side of the run, i.e. the resolution "
+                 "of the registries, the advices of the toolchain and the "
+                 "generation of the configuration, excluding the time "
+                 "waiting on karma; the statistics are written to PATH in "
+                 "the pstats format, with a summary written to stdout",
+        )
+
+        argparser.add_argument(
+            '--profile-python-limit', default=profiler.PROFILE_LIMIT,
+            type=int, dest=KARMA_PROFILE_PYTHON_LIMIT, metavar=metavar('N'),
+            help="the number of the entries in the summary of the profile, "
+                 "sorted by their cumulative time; default: %(default)s",
+        )
+
+    def _plan_runtime(self, runtime, plan_path, **kwargs):
+        spec = prepare_spec_from_runtime(runtime, **kwargs)
+        write_plan(summarize_plan([self.cli_driver.create_plan(
+            spec, toolchain=runtime.toolchain)]), plan_path)
+        return spec
+
     def _run_runtime(self, runtime, **kwargs):
+        plan_path = kwargs.pop(KARMA_PLAN, None)
+        if plan_path:
+            return self._plan_runtime(runtime, plan_path, **kwargs)
         spec = prepare_spec_from_runtime(runtime, **kwargs)
         toolchain = runtime.toolchain
         self.cli_driver.run(toolchain, spec)
         return spec
 
     def run(self, argparser, **kwargs):
+        profile_path = kwargs.pop(KARMA_PROFILE_PYTHON, None)
+        limit = kwargs.pop(
+            KARMA_PROFILE_PYTHON_LIMIT, profiler.PROFILE_LIMIT)
+        if profile_path:
+            with profiler.profiling(profile_path, limit=limit):
+                return self._run(argparser, **kwargs)
+        return self._run(argparser, **kwargs)
+
+    def _run(self, argparser, **kwargs):
         # have to rely on the local one, because the passed in one will
         # be the root one.
         details = self.get_argparser_details(self.argparser)
         runtime = details.runtimes.get(kwargs.pop(self.action_key))
+        if isinstance(runtime, KarmaCommandRuntime):
+            return runtime.run(argparser=argparser, **kwargs)
         if runtime:
             return self._run_runtime(runtime, **kwargs)
 
@@ -411,5 +933,7 @@ class KarmaRuntime(Runtime, DriverRuntime):
 
 # this will be registered to the karma specific thing.
 run = TestToolchainRuntime(KarmaToolchain())
+bench_run = BenchToolchainRuntime(KarmaBenchToolchain())
+history_report = KarmaHistoryRuntime()
 karma = KarmaRuntime(KarmaDriver.create())
 artifact_karma = KarmaArtifactRuntime()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Module for the accounting and limiting of the resources used by the
+child processes.
+
+The usage is that of the individual child process (and its terminated
+descendants that were waited for), as reported by wait4 on its pid,
+such that the usage of any other child processes that terminated in
+the meantime is not included.
+The limits are applied to each of the processes in the process tree,
+as the limits set on a process are inherited by its descendants.
+
+These are not available on platforms without the resource module.
+"""
+
+import errno
+import os
+import subprocess
+import sys
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # Windows
+    resource = None
+
+# the fields of the usage that are accumulated
+USAGE_TOTAL_FIELDS = (
+    'user_time',
+    'system_time',
+    'voluntary_context_switches',
+    'involuntary_context_switches',
+)
+# the field of the usage for the peak resident set size, in bytes
+USAGE_MAX_RSS = 'max_rss'
+
+# the resource limited for the memory of the processes; the data limit
+# is preferred over the address space limit as the former excludes the
+# address space reserved by the JavaScript engines, and only counts the
+# memory that may actually be written to.
+_MEMORY_RLIMIT = getattr(resource, 'RLIMIT_DATA', None) or getattr(
+    resource, 'RLIMIT_AS', None)
+
+# ru_maxrss is reported in bytes on macOS, kilobytes elsewhere
+_MAXRSS_SCALE = 1 if sys.platform == 'darwin' else 1024
+
+
+def process_usage(ru):
+    """
+    Produce the usage from the resource usage of a terminated process,
+    as a dict.
+    """
+
+    return {
+        'user_time': ru.ru_utime,
+        'system_time': ru.ru_stime,
+        USAGE_MAX_RSS: ru.ru_maxrss * _MAXRSS_SCALE,
+        'voluntary_context_switches': ru.ru_nvcsw,
+        'involuntary_context_switches': ru.ru_nivcsw,
+    }
+
+
+def _wait4(pid):
+    while True:
+        try:
+            return os.wait4(pid, 0)
+        except OSError as e:  # pragma: no cover
+            # only Python 2.7 will not retry on interrupts by itself.
+            if e.errno != errno.EINTR:
+                raise
+
+
+def call(args, usages=None, **kw):
+    """
+    Run the command described by args and return its return code, as
+    subprocess.call does, with the usage of the process appended to the
+    usages list if provided and available on the platform.
+    """
+
+    if usages is None or resource is None or not hasattr(os, 'wait4'):
+        return subprocess.call(args, **kw)
+    process = subprocess.Popen(args, **kw)
+    try:
+        pid, status, ru = _wait4(process.pid)
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    # mark the process as reaped for the Popen instance.
+    process.returncode = (
+        -os.WTERMSIG(status) if os.WIFSIGNALED(status) else
+        os.WEXITSTATUS(status))
+    usages.append(process_usage(ru))
+    return process.returncode
+
+
+def combine_usage(usages):
+    """
+    Combine the usages of the processes for an execution into one, or
+    None if none are available.
+    """
+
+    if not any(usages):
+        return None
+    usage = summarize_usage(usages)
+    usage.pop('runs')
+    return usage
+
+
+def summarize_usage(usages):
+    """
+    Summarize the usages into the total for the accumulated fields and
+    the maximum for the peak resident set size; the usages that are not
+    available are ignored.
+    """
+
+    usages = [usage for usage in usages if usage]
+    summary = {field: sum(usage[field] for usage in usages) for field in (
+        USAGE_TOTAL_FIELDS)}
+    summary[USAGE_MAX_RSS] = max(
+        [usage[USAGE_MAX_RSS] for usage in usages] or [0])
+    summary['runs'] = len(usages)
+    return summary
+
+
+def memory_limiter(limit):
+    """
+    Return the function that will limit the memory of the process that
+    invokes it to limit bytes, for the preexec_fn argument of the
+    subprocess functions; None is returned if the limit cannot be
+    applied.
+    """
+
+    if not limit or _MEMORY_RLIMIT is None:
+        return None
+
+    def apply_limit():
+        soft, hard = resource.getrlimit(_MEMORY_RLIMIT)
+        resource.setrlimit(_MEMORY_RLIMIT, (
+            limit if hard == resource.RLIM_INFINITY else min(limit, hard),
+            hard,
+        ))
+
+    return apply_limit
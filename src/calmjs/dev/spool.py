@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Module for the spool directory based work queue.
+
+The jobs are files in the spool directory, which may be shared across
+hosts through a network filesystem.  Each of the jobs go through the
+following subdirectories:
+
+pending
+    jobs that were enqueued and have not been claimed.
+running
+    jobs that were claimed by a worker, through the atomic rename from
+    the pending directory, such that only one worker will claim a job.
+    The lease alongside each of them records the worker, such that the
+    jobs left behind by the workers that are no longer alive, or with
+    the leases that have expired, may be reclaimed as pending jobs.
+results
+    the result for each of the completed jobs.
+
+Enqueuing a job under the job_id of a completed job will discard its
+result, such that it will be executed again; a job that is running
+will not be enqueued again.
+"""
+
+import codecs
+import errno
+import json
+import logging
+import os
+import socket
+from functools import partial
+from os import listdir
+from os import makedirs
+from os.path import exists
+from os.path import join
+from os.path import splitext
+from time import time
+
+from calmjs.dev.utils import replace
+from calmjs.dev.utils import write_if_changed
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+RESULTS = 'results'
+JOB_SUFFIX = '.json'
+LEASE_SUFFIX = '.lease'
+
+
+def worker_id():
+    """
+    The identity of the current worker process.
+    """
+
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def worker_alive(worker):
+    """
+    Whether the worker may still be alive; only the processes of the
+    workers on the current host can be determined to be no longer
+    alive.
+    """
+
+    host, _, pid = worker.rpartition(':')
+    if host != socket.gethostname() or os.name != 'posix':
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ValueError:
+        return True
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+def _read_json(path):
+    with codecs.open(path, encoding='utf8') as fd:
+        return json.load(fd)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        return False
+    return True
+
+
+class Spool(object):
+    """
+    The work queue inside the spool directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        for name in (PENDING, RUNNING, RESULTS):
+            target = join(path, name)
+            if not exists(target):
+                try:
+                    makedirs(target)
+                except OSError as e:
+                    # another worker may have created it.
+                    if e.errno != errno.EEXIST:
+                        raise
+
+    def _path(self, state, job_id):
+        return join(self.path, state, job_id + JOB_SUFFIX)
+
+    def _lease_path(self, job_id):
+        return join(self.path, RUNNING, job_id + LEASE_SUFFIX)
+
+    def _job_ids(self, state):
+        return sorted(
+            splitext(name)[0] for name in listdir(join(self.path, state))
+            if name.endswith(JOB_SUFFIX) and not name.startswith('.')
+        )
+
+    def _write(self, path, data):
+        # written to a temporary file first, such that the file will
+        # only be visible to other workers once it is complete.
+        write_if_changed(path, partial(json.dump, data, sort_keys=True))
+
+    def enqueue(self, job_id, job):
+        """
+        Enqueue the job under the job_id, discarding the result of the
+        prior completion of the job.  Returns False if the job is not
+        enqueued as it is running.
+        """
+
+        if exists(self._path(RUNNING, job_id)):
+            logger.warning(
+                "job '%s' is running in '%s'; not enqueued", job_id,
+                self.path)
+            return False
+        if _remove(self._path(RESULTS, job_id)):
+            logger.info(
+                "discarded the result of job '%s' to enqueue it again",
+                job_id)
+        self._write(self._path(PENDING, job_id), job)
+        logger.debug("enqueued job '%s' into '%s'", job_id, self.path)
+        return True
+
+    def claim(self, worker=None):
+        """
+        Claim the next pending job, returning the (job_id, job) tuple,
+        or None if there are no more pending jobs.
+        """
+
+        for job_id in self._job_ids(PENDING):
+            target = self._path(RUNNING, job_id)
+            try:
+                replace(self._path(PENDING, job_id), target)
+            except OSError:
+                # claimed by another worker.
+                continue
+            worker = worker or worker_id()
+            # the lease starts from the claim, rather than the enqueue.
+            os.utime(target, None)
+            self._write(self._lease_path(job_id), {'worker': worker})
+            job = _read_json(target)
+            logger.info("worker '%s' claimed job '%s'", worker, job_id)
+            return job_id, job
+        return None
+
+    def renew(self, job_id):
+        """
+        Renew the lease of the claimed job.
+        """
+
+        os.utime(self._lease_path(job_id), None)
+
+    def reclaim(self, timeout=None):
+        """
+        Return the running jobs claimed by the workers that are no
+        longer alive back to pending, along with the jobs with leases
+        not renewed for longer than timeout seconds, if specified.
+        Returns the list of the job_ids reclaimed.
+        """
+
+        reclaimed = []
+        now = time()
+        for job_id in self._job_ids(RUNNING):
+            target = self._path(RUNNING, job_id)
+            lease_path = self._lease_path(job_id)
+            try:
+                worker = _read_json(lease_path)['worker']
+                mtime = os.stat(lease_path).st_mtime
+            except (IOError, OSError, ValueError, KeyError):
+                # the lease is not yet written by the worker that claimed
+                # the job, or the job was completed in the meantime.
+                worker = None
+                try:
+                    mtime = os.stat(target).st_mtime
+                except OSError:
+                    continue
+            if (worker is None or worker_alive(worker)) and (
+                    timeout is None or now - mtime <= timeout):
+                continue
+            try:
+                replace(target, self._path(PENDING, job_id))
+            except OSError:
+                # completed or reclaimed by another worker.
+                continue
+            _remove(lease_path)
+            logger.warning(
+                "reclaimed job '%s' claimed by worker '%s'", job_id, worker)
+            reclaimed.append(job_id)
+        return reclaimed
+
+    def complete(self, job_id, result):
+        """
+        Record the result for the claimed job.
+        """
+
+        self._write(self._path(RESULTS, job_id), result)
+        if not _remove(self._path(RUNNING, job_id)):
+            logger.warning("job '%s' was not claimed as running", job_id)
+        _remove(self._lease_path(job_id))
+
+    def results(self):
+        """
+        Return the results of the completed jobs, ordered by job_id.
+        """
+
+        return [
+            _read_json(self._path(RESULTS, job_id))
+            for job_id in self._job_ids(RESULTS)
+        ]
+
+    def counts(self):
+        """
+        Return the number of jobs in each of the states.
+        """
+
+        return {
+            state: len(self._job_ids(state))
+            for state in (PENDING, RUNNING, RESULTS)
+        }
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+import sys
+from os.path import exists
+from os.path import join
+
+from calmjs.toolchain import NullToolchain
+from calmjs.toolchain import Spec
+from calmjs.utils import pretty_logging
+
+from calmjs.testing import mocks
+from calmjs.testing.utils import mkdtemp
+from calmjs.testing.utils import stub_base_which
+from calmjs.testing.utils import stub_item_attr_value
+
+from calmjs.dev.tests.test_cli import FakeArtifactRegistry
+from calmjs.dev.tests import test_cli
+
+try:
+    import asyncio
+    from calmjs.dev import aio
+except (ImportError, SyntaxError):  # pragma: no cover
+    # Python versions without asyncio or the async syntax
+    aio = None
+
+FAKE_KARMA = """#!%s
+import os
+import subprocess
+import sys
+import time
+
+build_dir = os.path.dirname(sys.argv[2])
+sys.stdout.write('karma %%s\\n' %% sys.argv[1])
+sys.stdout.flush()
+if os.path.exists(os.path.join(build_dir, 'hang')):
+    child = subprocess.Popen([
+        sys.executable, '-c', 'import time; time.sleep(60)'])
+    with open(os.path.join(build_dir, 'pids'), 'w') as fd:
+        fd.write('%%d %%d' %% (os.getpid(), child.pid))
+    time.sleep(60)
+sys.exit(int(os.path.exists(os.path.join(build_dir, 'fail'))))
+""" % sys.executable
+
+
+def alive(pid):
+    try:
+        with open('/proc/%d/stat' % pid) as fd:
+            # zombie processes are considered terminated.
+            return fd.read().split(')')[-1].split()[0] != 'Z'
+    except (IOError, OSError):
+        pass
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+@unittest.skipIf(aio is None, 'asyncio syntax not supported')
+class AsyncTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(asyncio.set_event_loop, None)
+        self.addCleanup(self.loop.close)
+
+    def run_until_complete(self, coro):
+        return self.loop.run_until_complete(coro)
+
+
+class AsyncKarmaDriverTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super(AsyncKarmaDriverTestCase, self).setUp()
+        self.tmpdir = mkdtemp(self)
+        self.binary = join(self.tmpdir, 'karma')
+        with open(self.binary, 'w') as fd:
+            fd.write(FAKE_KARMA)
+        os.chmod(self.binary, 0o755)
+        self.output = []
+        self.driver = aio.AsyncKarmaDriver(
+            binary=self.binary, output=self.output.append)
+
+    def make_spec(self, *flags):
+        build_dir = mkdtemp(self)
+        for flag in flags:
+            with open(join(build_dir, flag), 'w'):
+                pass
+        return Spec(build_dir=build_dir)
+
+    def test_run(self):
+        spec = self.make_spec()
+        handled = []
+        spec.advise('after_link', handled.append, 'after_link')
+        spec.advise('after_test', handled.append, 'after_test')
+        self.run_until_complete(self.driver.run(NullToolchain(), spec))
+        self.assertTrue(exists(join(spec['build_dir'], 'karma.conf.js')))
+        self.assertEqual(0, spec['karma_return_code'])
+        self.assertIn('karma_duration', spec)
+        self.assertNotIn(aio.KARMA_DEFERRED_TEST, spec)
+        self.assertEqual('karma start\n', ''.join(self.output))
+        # the test was completed before the link step.
+        self.assertEqual(['after_test', 'after_link'], handled)
+
+    def test_run_failure_abort(self):
+        spec = self.make_spec('fail')
+        spec['karma_abort_on_test_failure'] = True
+        with pretty_logging(stream=mocks.StringIO()):
+            with self.assertRaises(aio.ToolchainAbort):
+                self.run_until_complete(
+                    self.driver.run(NullToolchain(), spec))
+        self.assertEqual(1, spec['karma_return_code'])
+
+    def test_run_karma_not_found(self):
+        driver = aio.AsyncKarmaDriver(binary=join(self.tmpdir, 'missing'))
+        spec = self.make_spec()
+        with pretty_logging(stream=mocks.StringIO()) as log:
+            self.run_until_complete(driver.run(NullToolchain(), spec))
+        self.assertIn('karma not found', log.getvalue())
+        self.assertNotIn('karma_return_code', spec)
+        # the toolchain continued.
+        self.assertEqual('linked', spec['link'])
+
+    def test_concurrent(self):
+        specs = [self.make_spec() for i in range(3)]
+        specs.append(self.make_spec('fail'))
+
+        self.run_until_complete(asyncio.gather(*[
+            self.driver.run(NullToolchain(), spec) for spec in specs]))
+        self.assertEqual([0, 0, 0, 1], [
+            spec['karma_return_code'] for spec in specs])
+        self.assertEqual(4, ''.join(self.output).count('karma start'))
+
+    def test_cancel_terminates_process_group(self):
+        spec = self.make_spec('hang')
+        pids_path = join(spec['build_dir'], 'pids')
+
+        with pretty_logging(stream=mocks.StringIO()) as log:
+            task = asyncio.ensure_future(
+                self.driver.run(NullToolchain(), spec))
+            for i in range(100):
+                if exists(pids_path):
+                    break
+                self.run_until_complete(asyncio.sleep(0.05))
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                self.run_until_complete(task)
+        self.assertIn('terminating process group', log.getvalue())
+        with open(pids_path) as fd:
+            pids = [int(pid) for pid in fd.read().split()]
+        self.assertEqual(2, len(pids))
+        for i in range(50):
+            if not any(alive(pid) for pid in pids):
+                break
+            self.run_until_complete(asyncio.sleep(0.05))
+        self.assertFalse(any(alive(pid) for pid in pids))
+
+
+class AsyncSplitOnCrashTestCase(AsyncTestCase):
+    """
+    The split and quarantined runs, with karma simulated as per the
+    SplitOnCrashTestCase.
+    """
+
+    def setUp(self):
+        super(AsyncSplitOnCrashTestCase, self).setUp()
+        stub_base_which(self)
+        self.build_dir = mkdtemp(self)
+        self.runs = []
+        self.driver = aio.AsyncKarmaDriver.create()
+        self.driver.execute = self.execute
+
+    def execute(self, args, **kw):
+        future = self.loop.create_future()
+        future.set_result(test_cli.SplitOnCrashTestCase.call(self, args, **kw))
+        return future
+
+    make_spec = test_cli.SplitOnCrashTestCase.make_spec
+    write_quarantine = test_cli.SplitOnCrashTestCase.write_quarantine
+
+    def run_spec(self, spec):
+        self.driver.setup_toolchain_spec(NullToolchain(), spec)
+        with pretty_logging(
+                logger='calmjs.dev', stream=mocks.StringIO()) as log:
+            self.driver.test_spec(spec)
+            self.run_until_complete(spec.pop(aio.KARMA_DEFERRED_TEST)())
+        return log.getvalue()
+
+    def test_split_on_crash(self):
+        spec = self.make_spec('abcd', karma_split_on_crash=True)
+        log = self.run_spec(spec)
+        self.assertIn('splitting the test modules', log)
+        self.assertEqual([
+            ['test_a.js', 'test_b.js', 'test_c.js', 'test_d.js'],
+            ['test_a.js', 'test_b.js'],
+            ['test_c.js', 'test_d.js'],
+            ['test_c.js'],
+            ['test_d.js'],
+        ], self.runs)
+        self.assertEqual([False, True, False, False], [
+            run['crashed'] for run in spec['karma_split_runs']])
+        self.assertEqual(1, spec['karma_return_code'])
+
+    def test_no_crash(self):
+        spec = self.make_spec('ab', karma_split_on_crash=True)
+        self.run_spec(spec)
+        self.assertEqual(1, len(self.runs))
+        self.assertEqual([], spec['karma_split_runs'])
+        self.assertEqual(0, spec['karma_return_code'])
+
+    def test_quarantine_separate(self):
+        spec = self.make_spec(
+            'ad', karma_quarantine=self.write_quarantine('test_d.js'),
+            karma_quarantine_mode='separate')
+        log = self.run_spec(spec)
+        self.assertEqual(2, len(self.runs))
+        self.assertIn('the result of the run is not affected', log)
+        self.assertEqual(1, spec['karma_quarantine_run']['return_code'])
+        self.assertEqual(
+            1, spec['karma_quarantine_run']['outcome']['failed'])
+
+
+class AsyncVerifyPackageArtifactsTestCase(AsyncTestCase):
+
+    def setUp(self):
+        super(AsyncVerifyPackageArtifactsTestCase, self).setUp()
+        self.tmpdir = mkdtemp(self)
+        for name in ('fail.js', 'pass.js', 'other.js'):
+            with open(join(self.tmpdir, name), 'w') as fd:
+                fd.write(name)
+        registries = {
+            'calmjs.artifacts.tests': FakeArtifactRegistry({
+                'pkg1': [
+                    ('ep1', join(self.tmpdir, 'fail.js')),
+                    ('ep2', join(self.tmpdir, 'pass.js')),
+                    ('ep3', join(self.tmpdir, 'missing.js')),
+                    ('ep4', join(self.tmpdir, 'broken')),
+                ],
+                'pkg2': [
+                    ('ep5', join(self.tmpdir, 'pass.js')),
+                    ('ep6', join(self.tmpdir, 'other.js')),
+                ],
+            }),
+            'calmjs.artifacts': FakeArtifactRegistry({}),
+        }
+        self.executed = []
+        self.running = 0
+        self.max_running = 0
+        stub_item_attr_value(self, aio, 'get', registries.get)
+        stub_item_attr_value(
+            self, aio, 'execute_builder', self.execute_builder)
+
+    def execute_builder(self, registry, entry_point, toolchain, spec):
+        self.executed.append(entry_point)
+        self.running += 1
+        self.max_running = max(self.running, self.max_running)
+        future = self.loop.create_future()
+
+        def complete():
+            self.running -= 1
+            spec['karma_return_code'] = int(
+                spec['export_target'].endswith('fail.js'))
+            future.set_result({})
+
+        self.loop.call_later(0.05, complete)
+        return future
+
+    def test_report_keep_going(self):
+        with pretty_logging(stream=mocks.StringIO()):
+            report = self.run_until_complete(
+                aio.karma_verify_package_artifacts_report(
+                    ['pkg1', 'pkg2'], keep_going=True))
+        self.assertFalse(report['success'])
+        # the identical execution for pass.js was only done once.
+        self.assertEqual(['ep1', 'ep2', 'ep6'], sorted(self.executed))
+        self.assertEqual(3, self.max_running)
+        records = report['packages']['pkg1']['export_targets']
+        self.assertEqual(['failed', 'passed', 'error', 'error'], [
+            record['status'] for record in records])
+        self.assertEqual('artifact not found', records[2]['skip_reason'])
+        records = report['packages']['pkg2']['export_targets']
+        self.assertEqual(['passed', 'passed'], [
+            record['status'] for record in records])
+        self.assertTrue(records[0]['cache_hit'])
+        self.assertEqual(0, records[0]['return_code'])
+
+    def test_report_short_circuit(self):
+        with pretty_logging(stream=mocks.StringIO()):
+            report = self.run_until_complete(
+                aio.karma_verify_package_artifacts_report(
+                    ['pkg1', 'pkg2'], concurrency=1))
+        self.assertFalse(report['success'])
+        self.assertEqual(['ep1'], self.executed)
+        self.assertEqual(1, self.max_running)
+        records = report['packages']['pkg1']['export_targets']
+        self.assertEqual(['failed', 'skipped', 'skipped', 'error'], [
+            record['status'] for record in records])
+
+    def test_report_error_cancels_remaining(self):
+        pending = []
+
+        def execute_builder(registry, entry_point, toolchain, spec):
+            future = self.loop.create_future()
+            if entry_point == 'ep6':
+                future.set_exception(ValueError('broken builder'))
+            else:
+                pending.append(future)
+            return future
+
+        stub_item_attr_value(self, aio, 'execute_builder', execute_builder)
+        with pretty_logging(stream=mocks.StringIO()):
+            with self.assertRaises(ValueError):
+                self.run_until_complete(
+                    aio.karma_verify_package_artifacts_report(
+                        ['pkg1', 'pkg2'], keep_going=True))
+        self.assertTrue(pending)
+        # the remaining executions were cancelled, not left running.
+        self.assertTrue(all(future.cancelled() for future in pending))
+
+    def test_karma_verify_package_artifacts(self):
+        self.assertTrue(self.run_until_complete(
+            aio.karma_verify_package_artifacts(['pkg2'])))
+        with pretty_logging(stream=mocks.StringIO()):
+            self.assertFalse(self.run_until_complete(
+                aio.karma_verify_package_artifacts(['pkg1'])))
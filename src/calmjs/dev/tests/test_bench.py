@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import unittest
+from os.path import join
+
+from calmjs.dev import bench
+from calmjs.testing.utils import mkdtemp
+from calmjs.utils import pretty_logging
+from calmjs.testing.mocks import StringIO
+
+
+def result(name, hz, rme=1.0, browser='Chrome'):
+    return {
+        'browser': browser, 'suite': 'suite', 'name': name, 'hz': hz,
+        'rme': rme, 'mean': 1.0 / hz, 'deviation': 0.0, 'samples': 50,
+    }
+
+
+class BenchTestCase(unittest.TestCase):
+
+    def test_load_baseline_missing(self):
+        self.assertEqual([], bench.load_baseline(
+            join(mkdtemp(self), 'baseline.json')))
+
+    def test_load_baseline_invalid(self):
+        path = join(mkdtemp(self), 'baseline.json')
+        with open(path, 'w') as fd:
+            fd.write('{')
+        with pretty_logging(logger='calmjs.dev', stream=StringIO()) as log:
+            self.assertEqual([], bench.load_baseline(path))
+        self.assertIn('ignoring invalid benchmark baseline', log.getvalue())
+
+    def test_write_results_load_baseline(self):
+        path = join(mkdtemp(self), 'baseline.json')
+        results = [result('b', 100.0), result('a', 200.0)]
+        bench.write_results(path, results)
+        self.assertEqual(
+            [result('a', 200.0), result('b', 100.0)],
+            bench.load_baseline(path))
+
+    def test_compare_results(self):
+        baseline = [
+            result('slower', 1000.0), result('noisy', 1000.0, rme=20.0),
+            result('steady', 1000.0), result('faster', 1000.0),
+            result('steady', 1000.0, browser='Firefox'),
+        ]
+        comparisons = bench.compare_results(baseline, [
+            result('slower', 500.0), result('noisy', 800.0, rme=10.0),
+            result('steady', 950.0), result('faster', 2000.0),
+            result('new', 1000.0),
+        ])
+        self.assertEqual(
+            ['faster', 'noisy', 'slower', 'steady'],
+            [comparison['name'] for comparison in comparisons])
+        self.assertEqual(
+            ['slower'], [comparison['name'] for comparison in comparisons
+                         if comparison['regression']])
+        self.assertEqual(0.5, comparisons[2]['ratio'])
+
+        # a wider threshold.
+        self.assertFalse(any(
+            comparison['regression'] for comparison in bench.compare_results(
+                baseline, [result('slower', 500.0)], threshold=0.6)))
+
+    def test_format_comparisons(self):
+        self.assertEqual([
+            'REGRESSION Chrome: suite > slower: '
+            '1000.00 ops/sec -> 500.00 ops/sec (x0.50)',
+            'Chrome: suite > steady: '
+            '1000.00 ops/sec -> 950.00 ops/sec (x0.95)',
+        ], bench.format_comparisons(bench.compare_results(
+            [result('slower', 1000.0), result('steady', 1000.0)],
+            [result('slower', 500.0), result('steady', 950.0)],
+        )))
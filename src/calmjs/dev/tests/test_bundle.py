@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import unittest
+import json
+from os import mkdir
+from os.path import join
+
+from calmjs.parse.vlq import decode_mappings
+
+from calmjs.dev import bundle
+
+from calmjs.testing.utils import mkdtemp
+
+
+class WriteTestBundleTestCase(unittest.TestCase):
+
+    def test_write_test_bundle(self):
+        tmpdir = mkdtemp(self)
+        test_a = join(tmpdir, 'test_a.js')
+        test_b = join(tmpdir, 'test_b.js')
+        target = join(tmpdir, 'build', 'bundle.js')
+        with open(test_a, 'w') as fd:
+            fd.write("'use strict';\nvar a = 1;\n//# sourceMappingURL=a.map\n")
+        with open(test_b, 'w') as fd:
+            fd.write("var b = 2;")
+
+        mkdir(join(tmpdir, 'build'))
+        map_path = bundle.write_test_bundle([test_a, test_b], target)
+        self.assertEqual(target + '.map', map_path)
+
+        with open(target) as fd:
+            lines = fd.read().splitlines()
+        self.assertEqual([
+            '(function () {',
+            "'use strict';",
+            'var a = 1;',
+            '',
+            '})();',
+            '(function () {',
+            'var b = 2;',
+            '})();',
+            '//# sourceMappingURL=bundle.js.map',
+        ], lines)
+
+        with open(map_path) as fd:
+            source_map = json.load(fd)
+        self.assertEqual(['../test_a.js', '../test_b.js'], source_map[
+            'sources'])
+        self.assertEqual('bundle.js', source_map['file'])
+        self.assertEqual([
+            [],
+            [(0, 0, 0, 0)],
+            [(0, 0, 1, 0)],
+            [(0, 0, 1, 0)],
+            [],
+            [],
+            [(0, 1, -2, 0)],
+            [],
+        ], [
+            [tuple(segment) for segment in line]
+            for line in decode_mappings(source_map['mappings'])
+        ])
@@ -1,12 +1,19 @@
 # -*- coding: utf-8 -*-
 import unittest
 import json
+import os
+import sys
+from os import listdir
 from os.path import basename
 from os.path import curdir
 from os.path import exists
 from os.path import join
 from os.path import realpath
+from xml.etree import ElementTree
 
+from pkg_resources import WorkingSet
+
+from calmjs import dist as calmjs_dist
 from calmjs.cli import node
 from calmjs.cli import get_node_version
 from calmjs.types.exceptions import ToolchainAbort
@@ -18,12 +25,17 @@ from calmjs.toolchain import AFTER_TEST
 from calmjs.utils import pretty_logging
 
 from calmjs.dev import cli
+from calmjs.dev import plan
+from calmjs.dev.toolchain import KarmaToolchain
 
 from calmjs.testing import mocks
+from calmjs.testing.utils import make_dummy_dist
 from calmjs.testing.utils import mkdtemp
+from calmjs.testing.utils import remember_cwd
 from calmjs.testing.utils import stub_mod_call
 from calmjs.testing.utils import stub_base_which
 from calmjs.testing.utils import stub_item_attr_value
+from calmjs.testing.utils import stub_stdouts
 
 node_version = get_node_version()
 
@@ -52,6 +64,29 @@ class KarmaDriverTestSpecTestCase(unittest.TestCase):
         self.assertEqual('start', args[1])
         self.assertEqual(conf, args[2])
 
+    def test_base_record_timing(self):
+        stub_mod_call(self, cli)
+        stub_base_which(self)
+        build_dir = mkdtemp(self)
+        cache_dir = mkdtemp(self)
+        driver = cli.KarmaDriver.create()
+        toolchain = NullToolchain()
+        spec = Spec(build_dir=build_dir, build_cache_dir=cache_dir)
+        driver.setup_toolchain_spec(toolchain, spec)
+        driver.test_spec(spec)
+
+        self.assertIn('karma_duration', spec)
+        self.assertIn('karma_rusage', spec)
+        timings = plan.load_timings(cache_dir)
+        self.assertEqual(1, timings[spec['karma_cost_key']]['runs'])
+        # the plan for the same spec will have the estimate.
+        result = driver.create_plan(Spec(build_cache_dir=cache_dir))
+        self.assertEqual(spec['karma_cost_key'], result['cost_key'])
+        self.assertEqual(
+            timings[spec['karma_cost_key']]['mean'],
+            result['estimated_duration'],
+        )
+
     def test_base_with_toolchain(self):
         stub_mod_call(self, cli)
         stub_base_which(self)
@@ -637,6 +672,147 @@ class KarmaDriverTestSpecTestCase(unittest.TestCase):
             'file': realpath('lcov.txt'),
         })
 
+    def test_coverage_reporter_apply_cover_diff(self):
+        spec = Spec(
+            coverage_enable=True,
+            cover_report_types=['html'],
+            cover_diff='changes.diff',
+        )
+        driver = cli.KarmaDriver()
+        config = {}
+        driver._apply_coverage_reporters(spec, config)
+        # json report is required for the diff report.
+        self.assertEqual(['html', 'json'], [
+            r['type'] for r in config['coverageReporter']['reporters']])
+
+    def test_report_cover_diff(self):
+        stub_stdouts(self)
+        build_dir = mkdtemp(self)
+        src_dir = mkdtemp(self)
+        source = join(src_dir, 'mod.js')
+        target = join(build_dir, 'mod.js')
+        diff_file = join(src_dir, 'changes.diff')
+        coverage_json = join(build_dir, 'coverage.json')
+        with open(diff_file, 'w') as fd:
+            fd.write(
+                '--- a/mod.js\n'
+                '+++ b/mod.js\n'
+                '@@ -1,2 +1,2 @@\n'
+                '-var a = 0;\n'
+                '+var a = 1;\n'
+                ' var b = 2;\n'
+            )
+        with open(coverage_json, 'w') as fd:
+            json.dump({target: {
+                'path': target,
+                'statementMap': {'1': {
+                    'start': {'line': 1, 'column': 0},
+                    'end': {'line': 1, 'column': 10},
+                }},
+                's': {'1': 1},
+            }}, fd)
+
+        remember_cwd(self)
+        os.chdir(src_dir)
+        spec = Spec(
+            build_dir=build_dir,
+            cover_diff=diff_file,
+            transpile_sourcepath={'mod': source},
+            transpiled_targetpaths={'mod': 'mod.js'},
+            karma_spec_keys=['transpiled_targetpaths'],
+            test_covered_build_dir_paths={'mod.js'},
+            karma_config={'coverageReporter': {
+                'type': 'json', 'file': coverage_json}},
+        )
+        driver = cli.KarmaDriver()
+        driver.report_cover_diff(spec)
+        self.assertEqual({
+            realpath(source): {'covered': [1], 'missed': []},
+        }, spec['cover_diff_report'])
+        self.assertIn('100%', sys.stdout.getvalue())
+
+    def test_report_cover_diff_missing_coverage(self):
+        spec = Spec(cover_diff='changes.diff', karma_config={})
+        driver = cli.KarmaDriver()
+        with pretty_logging(
+                logger='calmjs.dev', stream=mocks.StringIO()) as log:
+            driver.report_cover_diff(spec)
+        self.assertIn('cannot produce the changed lines', log.getvalue())
+        self.assertNotIn('cover_diff_report', spec)
+
+    def test_create_config_bundle_tests(self):
+        build_dir = mkdtemp(self)
+        test_dir = mkdtemp(self)
+        test_module_paths_map = {}
+        for name in ('test_a', 'test_b', 'test_c', 'template'):
+            path = join(test_dir, name + '.js')
+            with open(path, 'w') as fd:
+                fd.write('var %s = 1;\n' % name)
+            test_module_paths_map[name] = path
+
+        spec = Spec(
+            build_dir=build_dir,
+            bundle_tests=True,
+            bundle_tests_module_limit=2,
+            test_module_paths_map=test_module_paths_map,
+        )
+        driver = cli.KarmaDriver()
+        driver.create_config(spec)
+        bundle_dir = join(build_dir, '__test_bundles__')
+        bundles = [
+            join(bundle_dir, 'bundle0.js'), join(bundle_dir, 'bundle1.js')]
+        self.assertEqual(bundles, spec['test_bundle_paths'])
+        # template.js is not a test so it is not wrapped or bundled.
+        self.assertEqual(
+            [join(test_dir, 'template.js')] + bundles,
+            spec['karma_config']['files'],
+        )
+        self.assertEqual({
+            bundles[0]: ['sourcemap'],
+            bundles[1]: ['sourcemap'],
+        }, spec['karma_config']['preprocessors'])
+        with open(bundles[1]) as fd:
+            self.assertIn('var test_c = 1;', fd.read())
+        self.assertTrue(exists(bundles[1] + '.map'))
+
+        # a subsequent run with fewer bundles in the same build_dir will
+        # remove the stale bundles from the prior run.
+        spec = Spec(
+            build_dir=build_dir,
+            bundle_tests=True,
+            bundle_tests_module_limit=3,
+            test_module_paths_map=test_module_paths_map,
+        )
+        driver.create_config(spec)
+        self.assertEqual(bundles[:1], spec['test_bundle_paths'])
+        self.assertTrue(exists(bundles[0] + '.map'))
+        self.assertFalse(exists(bundles[1]))
+        self.assertFalse(exists(bundles[1] + '.map'))
+
+    def test_create_config_bundle_tests_unsupported(self):
+        spec = Spec(
+            bundle_tests=True,
+            test_module_paths_map={'test_a': 'test_a.js'},
+        )
+        driver = cli.KarmaDriver()
+        with pretty_logging(
+                logger='calmjs.dev', stream=mocks.StringIO()) as log:
+            driver.create_config(spec)
+        self.assertIn(
+            'will not be bundled without a build_dir', log.getvalue())
+        self.assertEqual(['test_a.js'], spec['karma_config']['files'])
+
+        spec = Spec(
+            bundle_tests=True,
+            no_wrap_tests=True,
+            test_module_paths_map={'test_a': 'test_a.js'},
+        )
+        with pretty_logging(
+                logger='calmjs.dev', stream=mocks.StringIO()) as log:
+            driver.create_config(spec)
+        self.assertIn('tests will not be bundled', log.getvalue())
+        self.assertEqual(['test_a.js'], spec['karma_config']['files'])
+
     def test_create_config_artifact_paths(self):
         driver = cli.KarmaDriver()
         spec = Spec(
@@ -708,6 +884,85 @@ class KarmaDriverTestSpecTestCase(unittest.TestCase):
         self.assertIn('test/file', conf)
         self.assertIn('test/artifact', conf)
 
+    def test_write_config_unchanged(self):
+        build_dir = mkdtemp(self)
+        driver = cli.KarmaDriver()
+        spec = Spec(build_dir=build_dir, karma_config={'files': ['a.js']})
+        driver.write_config(spec)
+        karma_conf_js = join(build_dir, 'karma.conf.js')
+        os.utime(karma_conf_js, (0, 0))
+        with pretty_logging(
+                logger='calmjs.dev', stream=mocks.StringIO()) as log:
+            driver.write_config(spec)
+        self.assertIn('unchanged', log.getvalue())
+        self.assertEqual(0, os.stat(karma_conf_js).st_mtime)
+
+        spec['karma_config']['files'].append('b.js')
+        driver.write_config(spec)
+        self.assertNotEqual(0, os.stat(karma_conf_js).st_mtime)
+        self.assertEqual(['karma.conf.js'], os.listdir(build_dir))
+
+    def test_write_config_sidecar(self):
+        build_dir = mkdtemp(self)
+        driver = cli.KarmaDriver()
+        spec = Spec(
+            build_dir=build_dir, karma_config_sidecar=True,
+            karma_config={'files': ['a.js']},
+        )
+        driver.write_config(spec)
+        karma_conf_js = join(build_dir, 'karma.conf.js')
+        karma_conf_json = join(build_dir, 'karma.conf.json')
+        with open(karma_conf_js) as fd:
+            stub = fd.read()
+        with open(karma_conf_json) as fd:
+            self.assertEqual({'files': ['a.js']}, json.load(fd))
+
+        os.utime(karma_conf_js, (0, 0))
+        spec['karma_config']['files'].append('b.js')
+        driver.write_config(spec)
+        with open(karma_conf_json) as fd:
+            self.assertEqual({'files': ['a.js', 'b.js']}, json.load(fd))
+        # the stub remains unchanged.
+        with open(karma_conf_js) as fd:
+            self.assertEqual(stub, fd.read())
+        self.assertEqual(0, os.stat(karma_conf_js).st_mtime)
+
+        # other configuration files have their own sidecar.
+        driver._write_config_file(
+            spec, {'files': ['c.js']},
+            join(build_dir, 'karma.split.0.conf.js'))
+        with open(join(build_dir, 'karma.split.0.conf.json')) as fd:
+            self.assertEqual({'files': ['c.js']}, json.load(fd))
+        with open(karma_conf_json) as fd:
+            self.assertEqual({'files': ['a.js', 'b.js']}, json.load(fd))
+
+    def test_write_config_compact(self):
+        build_dir = mkdtemp(self)
+        for name in ('a.js', 'b.js'):
+            with open(join(build_dir, name), 'w'):
+                pass
+        driver = cli.KarmaDriver()
+        spec = Spec(
+            build_dir=build_dir, karma_compact_config=True,
+            karma_config={
+                'files': ['a.js', 'b.js'],
+                'preprocessors': {'a.js': ['coverage'], 'b.js': ['coverage']},
+                'singleRun': True,
+            },
+            artifact_paths=['test/artifact'],
+        )
+        driver.write_config(spec)
+        with open(join(build_dir, 'karma.conf.js')) as fd:
+            conf = fd.read()
+        self.assertIn('"*.js"', conf)
+        self.assertIn('"watched": false', conf)
+        self.assertNotIn('"a.js"', conf)
+        # the complete listing remains in the spec.
+        self.assertEqual(
+            ['test/artifact', 'a.js', 'b.js'], spec['karma_config']['files'])
+        self.assertEqual(
+            ['a.js', 'b.js'], sorted(spec['karma_config']['preprocessors']))
+
     def test_write_config_override(self):
         nodejs_version = (6, 0, 0)
 
@@ -749,5 +1004,999 @@ class KarmaDriverTestSpecTestCase(unittest.TestCase):
             log.getvalue()
         )
 
+
+class SplitOnCrashTestCase(unittest.TestCase):
+    """
+    The karma runs are simulated by the fake call, where the browser
+    crashes whenever test_c.js is run alongside other test modules, and
+    test_d.js fails.
+    """
+
+    def setUp(self):
+        stub_base_which(self)
+        stub_item_attr_value(self, cli, 'call', self.call)
+        self.build_dir = mkdtemp(self)
+        self.runs = []
+
+    def call(self, args, **kw):
+        with open(args[2]) as fd:
+            text = fd.read()
+        config = json.loads(text[text.index('set(') + 4:text.rindex(')')])
+        tests = []
+        for path in config['files']:
+            if path.endswith('bundle0.js'):
+                with open(path + '.map') as fd:
+                    tests.extend(
+                        basename(source) for source in json.load(fd)[
+                            'sources'])
+            elif basename(path).startswith('test_'):
+                tests.append(basename(path))
+        self.runs.append(tests)
+        crashed = 'test_c.js' in tests and len(tests) > 1
+        with open(config['calmjsOutcome']['file'], 'w') as fd:
+            json.dump({
+                'disconnected': crashed, 'process_failures': [],
+                'passed': 0 if crashed else len(tests) - (
+                    'test_d.js' in tests),
+                'failed': 0 if crashed else int('test_d.js' in tests),
+                'skipped': 0,
+                'results': [{
+                    'browser': 'Chrome', 'suite': test, 'name': 'test',
+                    'time': 1, 'status': (
+                        'failed' if test == 'test_d.js' else 'passed'),
+                } for test in tests if not crashed],
+                'stream': config['calmjsOutcome'].get('stream'),
+            }, fd)
+        if config['calmjsOutcome'].get('stream'):
+            with open(config['calmjsOutcome']['stream'], 'w') as fd:
+                for test in tests if not crashed else []:
+                    fd.write(json.dumps({
+                        'browser': 'Chrome', 'suite': [test], 'name': 'test',
+                        'time': 1, 'status': (
+                            'failed' if test == 'test_d.js' else 'passed'),
+                    }) + '\n')
+        return int(crashed or 'test_d.js' in tests)
+
+    def make_spec(self, names, **kw):
+        return Spec(build_dir=self.build_dir, test_module_paths_map={
+            name: join(self.build_dir, 'test_%s.js' % name)
+            for name in names
+        }, **kw)
+
+    def run_spec(self, spec):
+        driver = cli.KarmaDriver.create()
+        driver.setup_toolchain_spec(NullToolchain(), spec)
+        with pretty_logging(
+                logger='calmjs.dev', stream=mocks.StringIO()) as log:
+            driver.test_spec(spec)
+        return log.getvalue()
+
+    def test_split_on_crash(self):
+        spec = self.make_spec('abcd', karma_split_on_crash=True)
+        log = self.run_spec(spec)
+        self.assertIn('splitting the test modules', log)
+        self.assertTrue(exists(join(
+            self.build_dir, 'karma.outcome.reporter.js')))
+        self.assertEqual([
+            ['test_a.js', 'test_b.js', 'test_c.js', 'test_d.js'],
+            ['test_a.js', 'test_b.js'],
+            ['test_c.js', 'test_d.js'],
+            ['test_c.js'],
+            ['test_d.js'],
+        ], self.runs)
+        self.assertTrue(spec['karma_outcome']['disconnected'])
+        self.assertEqual([False, True, False, False], [
+            run['crashed'] for run in spec['karma_split_runs']])
+        # the failure of test_d.js is in the merged result.
+        self.assertEqual(1, spec['karma_return_code'])
+
+    def test_split_on_crash_bundled(self):
+        spec = self.make_spec('abcd', karma_split_on_crash=True)
+        for path in spec['test_module_paths_map'].values():
+            with open(path, 'w') as fd:
+                fd.write('var test = 1;\n')
+        spec['bundle_tests'] = True
+        self.run_spec(spec)
+        bundle_dir = join(self.build_dir, '__test_bundles__')
+        self.assertEqual(
+            [join(bundle_dir, 'bundle0.js')], spec['test_bundle_paths'])
+        # the test modules within the bundle are bisected, with every
+        # subset bundled again for its separate run.
+        self.assertEqual([
+            ['test_a.js', 'test_b.js', 'test_c.js', 'test_d.js'],
+            ['test_a.js', 'test_b.js'],
+            ['test_c.js', 'test_d.js'],
+            ['test_c.js'],
+            ['test_d.js'],
+        ], self.runs)
+        with open(join(self.build_dir, 'karma.split.2.conf.js')) as fd:
+            text = fd.read()
+        self.assertIn('split2.bundle0.js', text)
+        self.assertNotIn('"%s"' % join(bundle_dir, 'bundle0.js'), text)
+        self.assertEqual(
+            [join(self.build_dir, 'test_c.js')],
+            spec['karma_split_runs'][2]['test_module_paths'])
+        self.assertEqual(1, spec['karma_return_code'])
+
+        # the bundles of the split runs are removed by the next build.
+        cli.KarmaDriver().create_config(self.make_spec(
+            'abcd', bundle_tests=True))
+        self.assertEqual(
+            ['bundle0.js', 'bundle0.js.map'], sorted(listdir(bundle_dir)))
+
+    def test_split_on_crash_passed(self):
+        spec = self.make_spec('abc', karma_split_on_crash=True)
+        self.run_spec(spec)
+        self.assertEqual([
+            ['test_a.js', 'test_b.js', 'test_c.js'],
+            ['test_a.js'],
+            ['test_b.js', 'test_c.js'],
+            ['test_b.js'],
+            ['test_c.js'],
+        ], self.runs)
+        self.assertEqual(0, spec['karma_return_code'])
+
+    def test_no_crash(self):
+        spec = self.make_spec('ab', karma_split_on_crash=True)
+        self.run_spec(spec)
+        self.assertEqual(1, len(self.runs))
+        self.assertEqual([], spec['karma_split_runs'])
+        self.assertEqual(0, spec['karma_return_code'])
+
+    def test_export_metrics(self):
+        prometheus = join(self.build_dir, 'karma.prom')
+        jsonl = join(self.build_dir, 'karma.jsonl')
+        spec = self.make_spec(
+            'abcd', karma_split_on_crash=True, export_target='pkg.js',
+            karma_metrics_prometheus=prometheus, karma_metrics_jsonl=jsonl)
+        self.run_spec(spec)
+        self.assertEqual(
+            {'passed': 3, 'failed': 1, 'skipped': 0},
+            spec['karma_metrics']['tests'])
+        self.assertEqual(1, spec['karma_metrics']['return_code'])
+        with open(prometheus) as fd:
+            text = fd.read()
+        self.assertIn(
+            'calmjs_dev_karma_tests{browsers="",export_target="pkg.js",'
+            'packages="",result="failed"} 1.0\n', text)
+        with open(jsonl) as fd:
+            self.assertEqual(spec['karma_metrics'], json.loads(fd.read()))
+
+    def test_export_metrics_no_split(self):
+        prometheus = join(self.build_dir, 'karma.prom')
+        spec = self.make_spec('ab', karma_metrics_prometheus=prometheus)
+        self.run_spec(spec)
+        self.assertEqual(1, len(self.runs))
+        self.assertNotIn('karma_split_runs', spec)
+        self.assertEqual(
+            {'passed': 2, 'failed': 0, 'skipped': 0},
+            spec['karma_metrics']['tests'])
+        self.assertTrue(exists(prometheus))
+
+    def test_collect_metrics(self):
+        spec = self.make_spec('ab', karma_metrics_collect=True)
+        self.run_spec(spec)
+        self.assertEqual(
+            {'passed': 2, 'failed': 0, 'skipped': 0},
+            spec['karma_metrics']['tests'])
+
+    def test_record_history(self):
+        path = join(self.build_dir, 'history.db')
+        spec = self.make_spec(
+            'abcd', karma_split_on_crash=True, karma_history=path)
+        self.run_spec(spec)
+        with open(join(self.build_dir, 'karma.conf.js')) as fd:
+            self.assertIn('"results": true', fd.read())
+        with cli.history.connect(path) as conn:
+            self.assertEqual([
+                ('test_a.js', 'passed'),
+                ('test_b.js', 'passed'),
+                ('test_c.js', 'passed'),
+                ('test_d.js', 'failed'),
+            ], list(conn.execute(
+                'SELECT suite, status FROM results ORDER BY suite')))
+
+    def test_minimal_reporter(self):
+        spec = self.make_spec(
+            'abcd', karma_split_on_crash=True, karma_reporter='minimal')
+        self.run_spec(spec)
+        self.assertTrue(exists(join(
+            self.build_dir, 'karma.minimal.reporter.js')))
+        config = spec['karma_config']
+        self.assertEqual(
+            ['calmjs-minimal', 'calmjs-outcome'], config['reporters'])
+        self.assertEqual({'file': join(
+            self.build_dir, 'karma.minimal.log')}, config['calmjsMinimal'])
+        self.assertFalse(config['colors'])
+        # the separate runs write their details to their own files.
+        with open(join(self.build_dir, 'karma.split.1.conf.js')) as fd:
+            self.assertIn('karma.minimal.1.log', fd.read())
+
+    def write_quarantine(self, *names):
+        path = join(self.build_dir, 'quarantine.json')
+        with open(path, 'w') as fd:
+            json.dump({'tests': [{
+                'packages': '', 'export_target': '',
+                'suite': name, 'name': 'test',
+            } for name in names]}, fd)
+        return path
+
+    def test_quarantine_exclude(self):
+        spec = self.make_spec(
+            'ab', karma_quarantine=self.write_quarantine('test_b.js'))
+        self.run_spec(spec)
+        self.assertEqual(1, len(self.runs))
+        quarantine_js = join(self.build_dir, 'karma.quarantine.js')
+        self.assertEqual(quarantine_js, spec['karma_config']['files'][0])
+        with open(quarantine_js) as fd:
+            self.assertIn('[["test_b.js", "test"]]', fd.read())
+        self.assertNotIn('karma_quarantine_run', spec)
+
+    def test_quarantine_without_mocha(self):
+        build_base_config = cli.karma.build_base_config
+        stub_item_attr_value(
+            self, cli.karma, 'build_base_config',
+            lambda: build_base_config(frameworks=('jasmine',)))
+        spec = self.make_spec(
+            'ab', karma_quarantine=self.write_quarantine('test_b.js'),
+            karma_split_on_crash=True)
+        log = self.run_spec(spec)
+        self.assertIn('the quarantine cannot be applied', log)
+        self.assertEqual([['test_a.js', 'test_b.js']], self.runs)
+        self.assertEqual([], spec['karma_quarantine_tests'])
+        self.assertFalse(exists(join(self.build_dir, 'karma.quarantine.js')))
+        self.assertNotIn(
+            join(self.build_dir, 'karma.quarantine.js'),
+            spec['karma_config']['files'])
+
+    def test_quarantine_separate(self):
+        spec = self.make_spec(
+            'ad', karma_quarantine=self.write_quarantine('test_d.js'),
+            karma_quarantine_mode='separate')
+        log = self.run_spec(spec)
+        self.assertEqual(2, len(self.runs))
+        self.assertIn('the result of the run is not affected', log)
+        with open(join(self.build_dir, 'karma.quarantine.conf.js')) as fd:
+            self.assertIn('karma.quarantine.only.js', fd.read())
+        # the quarantined test_d.js failed in the separate run.
+        self.assertEqual(1, spec['karma_quarantine_run']['return_code'])
+        self.assertEqual(
+            1, spec['karma_quarantine_run']['outcome']['failed'])
+        self.assertEqual(1, cli.history.summarize_quarantine(spec)[
+            'failed'])
+
+    def test_junit_xml(self):
+        target = join(self.build_dir, 'junit.xml')
+        spec = self.make_spec(
+            'abcd', karma_split_on_crash=True, karma_junit_xml=target)
+        log = self.run_spec(spec)
+        self.assertIn('JUnit XML', log)
+        root = ElementTree.parse(target).getroot()
+        self.assertEqual(1, len(root))
+        self.assertEqual('4', root[0].get('tests'))
+        self.assertEqual('1', root[0].get('failures'))
+        # only the results of the runs that were not split.
+        self.assertEqual(
+            ['test_a.js', 'test_b.js', 'test_c.js', 'test_d.js'],
+            [testcase.get('classname').split('.', 1)[1]
+             for testcase in root[0]])
+
+    def test_junit_writer(self):
+        target = join(self.build_dir, 'junit.xml')
+        with cli.junit.JUnitXMLWriter(target) as writer:
+            for names in ('ab', 'd'):
+                self.build_dir = mkdtemp(self)
+                self.run_spec(self.make_spec(
+                    names, karma_junit_writer=writer))
+        root = ElementTree.parse(target).getroot()
+        self.assertEqual(['2', '1'], [
+            suite.get('tests') for suite in root])
+
+    def test_memory_limit(self):
+        calls = []
+        stub_item_attr_value(
+            self, cli, 'call', lambda args, **kw: calls.append(kw) or 0)
+        spec = self.make_spec('a', karma_memory_limit=1 << 30)
+        self.run_spec(spec)
+        self.assertNotIn('karma_split_runs', spec)
+        if cli.rusage.memory_limiter(1) is None:
+            self.assertNotIn('preexec_fn', calls[0])
+        else:
+            self.assertTrue(callable(calls[0]['preexec_fn']))
+
+
 # rest of cli related tests have been streamlined into runtime for
 # setup and teardown optimisation.
+
+
+class FakeArtifactRegistry(object):
+
+    def __init__(self, records):
+        self.records = records
+        self.scanned = []
+
+    def iter_export_targets_for(self, package):
+        self.scanned.append(package)
+        for name, export_target in self.records.get(package, []):
+            yield name, export_target
+
+    def generate_builder(self, entry_point, export_target):
+        if export_target.endswith('.js'):
+            yield entry_point, NullToolchain(), Spec(
+                export_target=export_target)
+
+
+class BenchTestCase(unittest.TestCase):
+    """
+    The benchmark runs are simulated by the fake call, which writes the
+    operations per second provided by the test as the results.
+    """
+
+    def setUp(self):
+        stub_base_which(self)
+        stub_item_attr_value(self, cli, 'call', self.call)
+        stub_stdouts(self)
+        self.build_dir = mkdtemp(self)
+        self.hz = 1000.0
+
+    def call(self, args, **kw):
+        with open(args[2]) as fd:
+            text = fd.read()
+        config = json.loads(text[text.index('set(') + 4:text.rindex(')')])
+        self.config = config
+        with open(config['calmjsBench']['file'], 'w') as fd:
+            json.dump({'results': [{
+                'browser': 'Chrome', 'suite': 'suite', 'name': 'bench',
+                'hz': self.hz, 'rme': 1.0, 'mean': 1.0 / self.hz,
+                'deviation': 0.0, 'samples': 50,
+            }]}, fd)
+        return 0
+
+    def run_spec(self, **kw):
+        spec = Spec(build_dir=self.build_dir, karma_bench=True, **kw)
+        driver = cli.KarmaDriver.create()
+        with pretty_logging(
+                logger='calmjs.dev', stream=mocks.StringIO()) as log:
+            driver.setup_toolchain_spec(NullToolchain(), spec)
+            driver.test_spec(spec)
+        return spec, log.getvalue()
+
+    def test_bench(self):
+        output = join(self.build_dir, 'bench.json')
+        spec, log = self.run_spec(
+            coverage_enable=True, karma_bench_output=output)
+        self.assertIn('coverage is not available for benchmarks', log)
+        self.assertTrue(exists(join(
+            self.build_dir, 'karma.bench.reporter.js')))
+        self.assertEqual(['benchmark'], self.config['frameworks'])
+        self.assertEqual(['calmjs-bench'], self.config['reporters'])
+        self.assertEqual(1000.0, spec['karma_bench_results'][0]['hz'])
+        self.assertEqual(0, spec['karma_return_code'])
+        with open(output) as fd:
+            self.assertEqual(spec['karma_bench_results'], json.load(
+                fd)['results'])
+
+    def test_bench_baseline(self):
+        baseline = join(self.build_dir, 'baseline.json')
+        self.run_spec(karma_bench_output=baseline)
+
+        spec, log = self.run_spec(karma_bench_baseline=baseline)
+        self.assertEqual([], spec['karma_bench_regressions'])
+        self.assertEqual(0, spec['karma_return_code'])
+        self.assertIn('(x1.00)', sys.stdout.getvalue())
+
+        self.hz = 500.0
+        with self.assertRaises(ToolchainAbort):
+            self.run_spec(
+                karma_bench_baseline=baseline,
+                karma_abort_on_test_failure=True)
+        self.assertIn('REGRESSION Chrome: suite > bench', (
+            sys.stdout.getvalue()))
+
+        # a threshold that accepts the result.
+        spec, log = self.run_spec(
+            karma_bench_baseline=baseline, karma_bench_threshold=0.6)
+        self.assertEqual(0, spec['karma_return_code'])
+
+    def test_bench_no_results(self):
+        self.call = lambda args, **kw: 0
+        stub_item_attr_value(self, cli, 'call', self.call)
+        spec, log = self.run_spec()
+        self.assertIn('no benchmark results were captured', log)
+        self.assertEqual([], spec['karma_bench_results'])
+
+
+class ArtifactLoadTestCase(unittest.TestCase):
+    """
+    The karma runs are simulated by the fake call, which writes the
+    timings of the loading of the artifacts as reported by the loader.
+    """
+
+    def setUp(self):
+        stub_base_which(self)
+        stub_item_attr_value(self, cli, 'call', self.call)
+        self.build_dir = mkdtemp(self)
+        self.artifact = join(mkdtemp(self), 'example.js')
+        self.timings = True
+        with open(self.artifact, 'w') as fd:
+            fd.write('var example = 1;\n')
+
+    def call(self, args, **kw):
+        with open(args[2]) as fd:
+            text = fd.read()
+        config = json.loads(text[text.index('set(') + 4:text.rindex(')')])
+        self.config = config
+        if 'calmjsArtifacts' not in config or self.timings is None:
+            return 0
+        with open(config['calmjsArtifacts']['file'], 'w') as fd:
+            json.dump({'browsers': {'Chrome': [{
+                'path': self.artifact, 'fetch': 1.0, 'evaluate': 5.0,
+            }]}}, fd)
+        return 0
+
+    def run_spec(self, **kw):
+        spec = Spec(
+            build_dir=self.build_dir, artifact_paths=[self.artifact],
+            export_target=self.artifact, **kw)
+        driver = cli.KarmaDriver.create()
+        with pretty_logging(
+                logger='calmjs.dev', stream=mocks.StringIO()) as log:
+            driver.setup_toolchain_spec(NullToolchain(), spec)
+            driver.test_spec(spec)
+        return spec, log.getvalue()
+
+    def test_measure_artifacts(self):
+        spec, log = self.run_spec(karma_measure_artifacts=True)
+        self.assertEqual([
+            join(self.build_dir, 'karma.artifacts.loader.js'), {
+                'pattern': self.artifact, 'included': False, 'served': True,
+                'watched': False,
+            }], self.config['files'][:2])
+        self.assertIn('calmjs-artifacts', self.config['reporters'])
+        with open(join(self.build_dir, 'karma.artifacts.loader.js')) as fd:
+            self.assertIn(json.dumps(self.artifact), fd.read())
+        self.assertTrue(exists(join(
+            self.build_dir, 'karma.artifacts.reporter.js')))
+        self.assertEqual({
+            'artifacts': [{
+                'path': self.artifact, 'size': 17, 'browsers': {'Chrome': {
+                    'fetch': 1.0, 'evaluate': 5.0, 'total': 6.0}},
+            }],
+            'budget': None,
+            'exceeded': [],
+            'measured': True,
+        }, spec['karma_artifact_load'])
+        self.assertIn('Chrome: fetch 1.0 ms, parse and evaluate 5.0 ms', log)
+        self.assertEqual(0, spec['karma_return_code'])
+
+    def test_not_measured(self):
+        spec, log = self.run_spec()
+        self.assertEqual([self.artifact], self.config['files'][:1])
+        self.assertNotIn('karma_artifact_load', spec)
+
+    def test_artifact_budgets(self):
+        budgets = join(self.build_dir, 'budgets.json')
+        with open(budgets, 'w') as fd:
+            json.dump({
+                '*': {'size': '1K'},
+                'example.js': {'size': 16, 'load': 5},
+            }, fd)
+        spec, log = self.run_spec(karma_artifact_budgets=budgets)
+        self.assertEqual(
+            ['size', 'load'], [item['limit'] for item in spec[
+                'karma_artifact_load']['exceeded']])
+        self.assertIn('load of 6.0 ms exceeds the budget of 5.0 ms', log)
+        self.assertEqual(1, spec['karma_return_code'])
+
+        with open(budgets, 'w') as fd:
+            json.dump({'*': {'size': '1K', 'load': 10}}, fd)
+        spec, log = self.run_spec(karma_artifact_budgets=budgets)
+        self.assertEqual([], spec['karma_artifact_load']['exceeded'])
+        self.assertEqual(0, spec['karma_return_code'])
+
+    def test_artifact_budgets_not_measured(self):
+        self.timings = None
+        budgets = join(self.build_dir, 'budgets.json')
+        with open(budgets, 'w') as fd:
+            json.dump({'*': {'size': '1K'}}, fd)
+        spec, log = self.run_spec(karma_artifact_budgets=budgets)
+        self.assertFalse(spec['karma_artifact_load']['measured'])
+        self.assertIn('WARNING', log)
+        self.assertEqual(0, spec['karma_return_code'])
+
+        # the budget for the load cannot be verified.
+        with open(budgets, 'w') as fd:
+            json.dump({'*': {'size': '1K', 'load': 10}}, fd)
+        spec, log = self.run_spec(karma_artifact_budgets=budgets)
+        self.assertIn('was not measured for the budget of its load', log)
+        self.assertEqual(1, spec['karma_return_code'])
+
+
+class NodeProfileTestCase(unittest.TestCase):
+    """
+    The karma runs are simulated by the fake call, which writes a
+    profile to the directory specified by the Node.js arguments.
+    """
+
+    def setUp(self):
+        self.build_dir = mkdtemp(self)
+        self.karma_bin = join(mkdtemp(self), 'karma')
+        stub_base_which(self, self.karma_bin)
+        stub_item_attr_value(self, cli, 'call', self.call)
+        self.calls = []
+
+    def call(self, args, **kw):
+        self.calls.append(args)
+        for arg in args:
+            for flag, suffix in (
+                    ('--cpu-prof-dir=', '.cpuprofile'),
+                    ('--heap-prof-dir=', '.heapprofile')):
+                if arg.startswith(flag):
+                    with open(join(arg[len(flag):], 'karma%d%s' % (
+                            len(self.calls), suffix)), 'w') as fd:
+                        fd.write('{}')
+        return 0
+
+    def run_spec(self, **kw):
+        spec = Spec(build_dir=self.build_dir, **kw)
+        driver = cli.KarmaDriver.create()
+        with pretty_logging(
+                logger='calmjs.dev', stream=mocks.StringIO()) as log:
+            driver.setup_toolchain_spec(NullToolchain(), spec)
+            driver.test_spec(spec)
+        return spec, log.getvalue()
+
+    def test_karma_command(self):
+        spec, log = self.run_spec()
+        self.assertEqual([
+            self.karma_bin, 'start', join(self.build_dir, 'karma.conf.js'),
+            '--color',
+        ], self.calls[0])
+        self.assertNotIn('karma_node_profiles', spec)
+
+    def test_node_options(self):
+        spec, log = self.run_spec(
+            karma_node_options='--max-old-space-size=4096 --trace-warnings')
+        self.assertEqual([
+            'node', '--max-old-space-size=4096', '--trace-warnings',
+            realpath(self.karma_bin), 'start',
+            join(self.build_dir, 'karma.conf.js'), '--color',
+        ], self.calls[0])
+
+    def test_node_profiles(self):
+        cwd = realpath(mkdtemp(self))
+        remember_cwd(self)
+        os.chdir(cwd)
+        prof_dir = join(cwd, 'node-profiles')
+        spec, log = self.run_spec(
+            karma_node_cpu_prof=True, karma_node_heap_prof=True)
+        self.assertEqual([
+            'node', '--cpu-prof', '--cpu-prof-dir=' + prof_dir,
+            '--heap-prof', '--heap-prof-dir=' + prof_dir,
+        ], self.calls[0][:5])
+        self.assertEqual([
+            join(prof_dir, 'karma1.cpuprofile'),
+            join(prof_dir, 'karma1.heapprofile'),
+        ], spec['karma_node_profiles'])
+        self.assertIn('collected 2 Node.js profile(s)', log)
+
+        # only the profiles of the latest run are collected.
+        spec, log = self.run_spec(karma_node_cpu_prof=True)
+        self.assertEqual([
+            join(prof_dir, 'karma2.cpuprofile'),
+        ], spec['karma_node_profiles'])
+
+    def test_node_prof_dir(self):
+        prof_dir = join(mkdtemp(self), 'profiles')
+        spec, log = self.run_spec(
+            karma_node_cpu_prof=True, karma_node_prof_dir=prof_dir)
+        self.assertEqual([
+            join(realpath(prof_dir), 'karma1.cpuprofile'),
+        ], spec['karma_node_profiles'])
+
+    def test_find_karma_script_cmd(self):
+        driver = cli.KarmaDriver.create()
+        binary = join(self.build_dir, 'node_modules', '.bin', 'karma.cmd')
+        self.assertEqual(
+            join(self.build_dir, 'node_modules', '.bin', os.pardir, 'karma',
+                 'bin', 'karma'),
+            driver.find_karma_script(binary))
+
+
+class VerifyPackageArtifactsIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = FakeArtifactRegistry({
+            'pkg1': [('ep1', 'pkg1.js'), ('ep2', 'pkg1.broken')],
+            'pkg2': [('ep3', 'pkg2.js')],
+        })
+
+    def test_index_export_targets(self):
+        index = cli.index_export_targets(
+            self.registry, ['pkg1', 'pkg2', 'pkg3'])
+        self.assertEqual({
+            'pkg1': [('ep1', 'pkg1.js'), ('ep2', 'pkg1.broken')],
+            'pkg2': [('ep3', 'pkg2.js')],
+            'pkg3': [],
+        }, index)
+        self.assertEqual(['pkg1', 'pkg2', 'pkg3'], self.registry.scanned)
+
+    def test_load_builders(self):
+        records = [('ep1', 'pkg1.js'), ('ep2', 'pkg1.broken')] * 5
+        builders = cli.load_builders(self.registry, records)
+        self.assertEqual(10, len(builders))
+        self.assertEqual(['ep1', None] * 5, [
+            builder and builder[0] for builder in builders])
+        self.assertEqual('pkg1.js', builders[0][2]['export_target'])
+
+    def test_load_builders_serial(self):
+        builders = cli.load_builders(
+            self.registry, [('ep3', 'pkg2.js')], pool_size=1)
+        self.assertEqual('ep3', builders[0][0])
+        self.assertEqual([], cli.load_builders(self.registry, []))
+
+
+class ExecutionDedupTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp(self)
+        self.executed = []
+        for name, content in (('a.js', 'a'), ('b.js', 'a'), ('c.js', 'c')):
+            with open(join(self.tmpdir, name), 'w') as fd:
+                fd.write(content)
+
+    def execute_builder(self, entry_point, toolchain, spec):
+        self.executed.append(entry_point)
+        spec['karma_return_code'] = 0 if entry_point != 'fail' else 1
+
+    def make_builder(self, entry_point, name, **kw):
+        return entry_point, NullToolchain(), Spec(
+            export_target=join(self.tmpdir, name), **kw)
+
+    def test_execution_key(self):
+        def key(name, **kw):
+            spec = self.make_builder('ep', name, **kw)[2]
+            spec['artifact_paths'] = [spec['export_target']]
+            cli.prepare_spec_artifacts(spec)
+            return cli.execution_key(spec)
+
+        # identical contents at different locations
+        self.assertEqual(key('a.js'), key('b.js'))
+        self.assertNotEqual(key('a.js'), key('c.js'))
+        self.assertNotEqual(key('a.js'), key('a.js', karma_browsers=['X']))
+        self.assertNotEqual(key('a.js'), key('a.js', coverage_enable=True))
+
+    def test_execution_key_builder_specs(self):
+        # the specs as produced by the builders of the two packages,
+        # where pkg2 re-exports the identical bundle from pkg1 with the
+        # tests of pkg1.
+        driver = cli.KarmaDriver()
+        test_module_paths = {'pkg1/tests/test_a': join(
+            self.tmpdir, 'pkg1', 'tests', 'test_a.js')}
+        driver.resolve_test_module_paths_map = lambda spec: dict(
+            test_module_paths)
+
+        def builder_spec(package, name):
+            spec = Spec(
+                export_target=join(self.tmpdir, name),
+                source_package_names=[package],
+                test_package_names=[package],
+                calmjs_module_registry_names=['calmjs.module'],
+                calmjs_test_registry_names=['calmjs.module.tests'],
+                karma_browsers=['Firefox'],
+                transpile_no_indent=True,
+            )
+            spec['artifact_paths'] = [spec['export_target']]
+            cli.prepare_spec_artifacts(spec)
+            return spec
+
+        key = cli.execution_key(builder_spec('pkg1', 'a.js'), driver)
+        self.assertEqual(key, cli.execution_key(
+            builder_spec('pkg2', 'b.js'), driver))
+        # with different test modules, they are different executions.
+        test_module_paths['pkg2/tests/test_b'] = join(
+            self.tmpdir, 'pkg2', 'tests', 'test_b.js')
+        self.assertNotEqual(key, cli.execution_key(
+            builder_spec('pkg2', 'b.js'), driver))
+
+    def stub_package_tests(self):
+        # the packages declare their module registries through their
+        # metadata, with the test modules of every package resolved
+        # only through the test registry of the declared registry.
+        working_dir = mkdtemp(self)
+        for name in ('pkg1', 'pkg2'):
+            make_dummy_dist(self, (
+                ('calmjs_module_registry.txt', 'calmjs.module'),
+            ), name, '1.0', working_dir=working_dir)
+        stub_item_attr_value(
+            self, calmjs_dist, 'default_working_set',
+            WorkingSet([working_dir]))
+
+        def get_module_registries_dependencies(pkg_names, registry_names):
+            if registry_names != ['calmjs.module.tests']:
+                return {}
+            return {
+                '%s/tests/test_a' % name: join(
+                    self.tmpdir, name, 'tests', 'test_a.js')
+                for name in pkg_names
+            }
+
+        stub_item_attr_value(
+            self, cli.dist, 'get_module_registries_dependencies',
+            get_module_registries_dependencies)
+
+    def test_execution_key_prepared_registry_names(self):
+        # the specs as produced by the builders, without the registry
+        # names which are only assigned by the prepare step of the
+        # toolchain.
+        self.stub_package_tests()
+
+        def builder_spec(package, name):
+            spec = Spec(
+                export_target=join(self.tmpdir, name),
+                test_package_names=[package],
+            )
+            spec['artifact_paths'] = [spec['export_target']]
+            cli.prepare_spec_artifacts(spec)
+            return spec
+
+        toolchain = KarmaToolchain()
+        spec = builder_spec('pkg1', 'a.js')
+        key = cli.execution_key(spec, toolchain=toolchain)
+        # the identical artifacts are tested by the tests of different
+        # packages, so they are different executions.
+        self.assertNotEqual(key, cli.execution_key(
+            builder_spec('pkg2', 'b.js'), toolchain=toolchain))
+        self.assertEqual(key, cli.execution_key(
+            builder_spec('pkg1', 'b.js'), toolchain=toolchain))
+        # the spec itself is left to be prepared by the toolchain.
+        self.assertNotIn('calmjs_module_registry_names', spec)
+
+    def test_create_plan_cost_key(self):
+        # the plan resolves the test modules as the executed toolchain
+        # would, such that the timings recorded by the execution apply.
+        self.stub_package_tests()
+        driver = cli.KarmaDriver()
+        toolchain = KarmaToolchain()
+        spec = Spec(test_package_names=['pkg1'], build_dir=mkdtemp(self))
+        result = driver.create_plan(spec, toolchain=toolchain)
+        self.assertEqual([join(self.tmpdir, 'pkg1', 'tests', 'test_a.js')], (
+            result['test_module_paths']))
+        toolchain.prepare(spec)
+        driver.create_config(spec)
+        self.assertEqual(spec['karma_cost_key'], result['cost_key'])
+
+    def test_execute_builder_dedup(self):
+        registry = self
+        executions = {}
+        self.assertTrue(cli._execute_builder(
+            registry, self.make_builder('ep1', 'a.js'), {}, executions))
+        with pretty_logging(
+                logger='calmjs.dev', stream=mocks.StringIO()) as log:
+            self.assertTrue(cli._execute_builder(
+                registry, self.make_builder('ep2', 'b.js'), {}, executions))
+        self.assertIn('identical to a previous execution', log.getvalue())
+        self.assertFalse(cli._execute_builder(
+            registry, self.make_builder('fail', 'c.js'), {}, executions))
+        # the failure is also fanned out.
+        self.assertFalse(cli._execute_builder(
+            registry, self.make_builder('ep3', 'c.js'), {}, executions))
+        self.assertEqual(['ep1', 'fail'], self.executed)
+        self.assertEqual(2, len(executions))
+
+    def test_execute_builder_no_dedup(self):
+        registry = self
+        cli._execute_builder(registry, self.make_builder('ep1', 'a.js'), {})
+        cli._execute_builder(registry, self.make_builder('ep2', 'a.js'), {})
+        self.assertEqual(['ep1', 'ep2'], self.executed)
+
+
+class VerificationReportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp(self)
+        for name in ('fail.js', 'pass.js'):
+            with open(join(self.tmpdir, name), 'w') as fd:
+                fd.write(name)
+        registry = FakeArtifactRegistry({
+            'pkg1': [
+                ('ep1', join(self.tmpdir, 'fail.js')),
+                ('ep2', join(self.tmpdir, 'pass.js')),
+                ('ep3', join(self.tmpdir, 'missing.js')),
+                ('ep4', join(self.tmpdir, 'broken')),
+            ],
+            'pkg2': [('ep5', join(self.tmpdir, 'pass.js'))],
+        })
+        registry.execute_builder = self.execute_builder
+        self.registry = registry
+        registries = {
+            'calmjs.artifacts.tests': registry,
+            'calmjs.artifacts': FakeArtifactRegistry({}),
+        }
+        self.executed = []
+        self.specs = []
+        stub_item_attr_value(self, cli, 'get', registries.get)
+
+    def execute_builder(self, entry_point, toolchain, spec):
+        self.executed.append(entry_point)
+        self.specs.append(spec)
+        spec['karma_return_code'] = int(
+            spec['export_target'].endswith('fail.js'))
+        spec['karma_rusage'] = {
+            'user_time': 1.0,
+            'system_time': 0.5,
+            'max_rss': 1024,
+            'voluntary_context_switches': 2,
+            'involuntary_context_switches': 1,
+        }
+
+    def test_report_short_circuit(self):
+        report = cli.karma_verify_package_artifacts_report(['pkg1', 'pkg2'])
+        self.assertFalse(report['success'])
+        self.assertEqual(['ep1'], self.executed)
+        records = report['packages']['pkg1']['export_targets']
+        self.assertEqual(['failed', 'skipped', 'skipped', 'error'], [
+            record['status'] for record in records])
+        self.assertEqual(1, records[0]['return_code'])
+        self.assertEqual('previous failure', records[1]['skip_reason'])
+        self.assertEqual('builder not available', records[3]['skip_reason'])
+        # serializable
+        json.dumps(report)
+
+    def test_report_keep_going(self):
+        report = cli.karma_verify_package_artifacts_report(
+            ['pkg1', 'pkg2'], keep_going=True)
+        self.assertFalse(report['success'])
+        self.assertEqual(['ep1', 'ep2'], self.executed)
+        records = report['packages']['pkg1']['export_targets']
+        self.assertEqual(['failed', 'passed', 'error', 'error'], [
+            record['status'] for record in records])
+        self.assertEqual('artifact not found', records[2]['skip_reason'])
+        # the identical execution for the other package.
+        record = report['packages']['pkg2']['export_targets'][0]
+        self.assertEqual('passed', record['status'])
+        self.assertTrue(record['cache_hit'])
+        self.assertEqual(0, record['return_code'])
+        self.assertFalse(report['packages']['pkg2']['tests_missing'])
+        # the resource usage summarized for the packages, where the
+        # reused result incurred none.
+        usage = report['packages']['pkg1']['rusage']
+        self.assertEqual(2, usage['runs'])
+        self.assertEqual(2.0, usage['user_time'])
+        self.assertEqual(1024, usage['max_rss'])
+        self.assertEqual(0, report['packages']['pkg2']['rusage']['runs'])
+
+    def test_report_junit_reused(self):
+        target = join(self.tmpdir, 'junit.xml')
+
+        def execute_builder(entry_point, toolchain, spec):
+            self.execute_builder(entry_point, toolchain, spec)
+            cli.junit.write_junit_xml(spec, spec['karma_junit_writer'])
+
+        self.registry.execute_builder = execute_builder
+        with cli.junit.JUnitXMLWriter(target) as writer:
+            cli.karma_verify_package_artifacts_report(
+                ['pkg1', 'pkg2'], keep_going=True, karma_junit_writer=writer)
+        # the testsuite is written for the reused execution of pkg2.
+        self.assertEqual(['ep1', 'ep2'], self.executed)
+        self.assertEqual([
+            join(self.tmpdir, 'fail.js'),
+            join(self.tmpdir, 'pass.js'),
+            join(self.tmpdir, 'pass.js'),
+        ], [
+            suite.get('name')
+            for suite in ElementTree.parse(target).getroot()
+        ])
+
+    def test_report_metrics_collected(self):
+        cli.karma_verify_package_artifacts_report(
+            ['pkg2'], karma_metrics_prometheus='karma.prom',
+            karma_metrics_jsonl='karma.jsonl')
+        # the metrics are only exported once for the verification.
+        spec = self.specs[0]
+        self.assertTrue(spec['karma_metrics_collect'])
+        self.assertNotIn('karma_metrics_prometheus', spec)
+        self.assertNotIn('karma_metrics_jsonl', spec)
+
+    def test_karma_verify_package_artifacts(self):
+        self.assertTrue(cli.karma_verify_package_artifacts(['pkg2']))
+        self.assertFalse(cli.karma_verify_package_artifacts(['pkg1']))
+
+    def test_write_verification_report(self):
+        report = cli.karma_verify_package_artifacts_report(['pkg2'])
+        target = join(self.tmpdir, 'report.json')
+        cli.write_verification_report(report, target)
+        with open(target) as fd:
+            self.assertEqual(report, json.load(fd))
+
+        stub_stdouts(self)
+        cli.write_verification_report(report, '-')
+        self.assertEqual(report, json.loads(sys.stdout.getvalue()))
+
+    def test_karma_plan_package_artifacts(self):
+        result = cli.karma_plan_package_artifacts(
+            ['pkg1', 'pkg2'], karma_browsers=['Firefox'])
+        # nothing executed.
+        self.assertEqual([], self.executed)
+        executions = result['executions']
+        self.assertEqual(5, len(executions))
+        self.assertEqual(['Firefox'], executions[0]['browsers'])
+        self.assertEqual(
+            [join(self.tmpdir, 'fail.js')], executions[0]['artifact_paths'])
+        self.assertNotIn('skip_reason', executions[1])
+        self.assertEqual('artifact not found', executions[2]['skip_reason'])
+        self.assertEqual(
+            'builder not available', executions[3]['skip_reason'])
+        self.assertEqual(
+            'identical to a previous execution', executions[4]['skip_reason'])
+        self.assertEqual(
+            executions[1]['execution_key'], executions[4]['execution_key'])
+        self.assertEqual(2, result['unestimated'])
+        json.dumps(result)
+
+    def test_karma_plan_package_artifacts_no_writes(self):
+        cache_dir = mkdtemp(self)
+        other = join(self.tmpdir, 'other.js')
+        with open(other, 'w') as fd:
+            fd.write('other.js')
+        self.registry.records['pkg3'] = [('ep6', other)]
+        result = cli.karma_plan_package_artifacts(
+            ['pkg1', 'pkg2', 'pkg3'], build_cache_dir=cache_dir)
+        executions = result['executions']
+        # the keyed build directories and the fingerprints were not
+        # written to the build cache directory.
+        self.assertTrue(executions[0]['build_dir'].startswith(
+            realpath(cache_dir)))
+        self.assertEqual([], os.listdir(cache_dir))
+        self.assertEqual(
+            'identical to a previous execution', executions[4]['skip_reason'])
+        # the artifact of a unique size is not fingerprinted.
+        self.assertNotIn('execution_key', executions[5])
+        self.assertNotIn('skip_reason', executions[5])
+
+    def test_spool(self):
+        spool_dir = join(self.tmpdir, 'spool')
+        job_ids = cli.karma_spool_enqueue(
+            spool_dir, ['pkg1', 'pkg2'], karma_browsers=['Firefox'])
+        self.assertEqual(5, len(job_ids))
+        self.assertEqual([], self.executed)
+
+        report = cli.karma_spool_collect(spool_dir)
+        self.assertFalse(report['success'])
+        self.assertEqual(5, report['pending'])
+
+        self.assertFalse(cli.karma_spool_work(spool_dir))
+        # the identical execution for pkg2 was reused by this worker.
+        self.assertEqual(['ep1', 'ep2'], self.executed)
+        report = cli.karma_spool_collect(spool_dir)
+        self.assertFalse(report['success'])
+        self.assertEqual(0, report['pending'])
+        records = report['packages']['pkg1']['export_targets']
+        self.assertEqual(['failed', 'passed', 'error', 'error'], [
+            record['status'] for record in records])
+        self.assertEqual(
+            'passed',
+            report['packages']['pkg2']['export_targets'][0]['status'],
+        )
+        self.assertEqual(2, report['packages']['pkg1']['rusage']['runs'])
+        json.dumps(report)
+
+    def test_spool_success(self):
+        spool_dir = join(self.tmpdir, 'spool')
+        cli.karma_spool_enqueue(spool_dir, ['pkg2'])
+        self.assertTrue(cli.karma_spool_work(spool_dir))
+        self.assertTrue(cli.karma_spool_collect(spool_dir)['success'])
+
+    def test_spool_reclaim(self):
+        spool_dir = join(self.tmpdir, 'spool')
+        cli.karma_spool_enqueue(spool_dir, ['pkg2'])
+        # the job left running by a worker elsewhere.
+        cli.spool.Spool(spool_dir).claim('elsewhere:1')
+        self.assertTrue(cli.karma_spool_work(spool_dir))
+        self.assertEqual([], self.executed)
+        self.assertEqual(1, cli.karma_spool_collect(spool_dir)['running'])
+        for name in os.listdir(join(spool_dir, 'running')):
+            os.utime(join(spool_dir, 'running', name), (0, 0))
+        self.assertTrue(cli.karma_spool_work(spool_dir, lease=60))
+        self.assertEqual(['ep5'], self.executed)
+        self.assertTrue(cli.karma_spool_collect(spool_dir)['success'])
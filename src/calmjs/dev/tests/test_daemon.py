@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+import socket
+import sys
+from os.path import join
+from threading import Thread
+
+from calmjs.dev import daemon
+
+from calmjs.testing.utils import mkdtemp
+from calmjs.testing.utils import stub_item_attr_value
+from calmjs.testing.utils import stub_os_environ
+
+
+def touch(path):
+    with open(path, 'w'):
+        pass
+    return path
+
+
+class WorkingSetSignatureTestCase(unittest.TestCase):
+
+    def test_working_set_signature(self):
+        tmpdir = mkdtemp(self)
+        paths = [tmpdir, join(tmpdir, 'missing')]
+        signature = daemon.working_set_signature(paths)
+        self.assertEqual(signature, daemon.working_set_signature(paths))
+        touch(join(tmpdir, 'unrelated.txt'))
+        os.utime(tmpdir, (0, 0))
+        signature = daemon.working_set_signature(paths)
+        target = touch(join(tmpdir, 'demo-1.0.dist-info'))
+        os.utime(tmpdir, (0, 0))
+        self.assertNotEqual(signature, daemon.working_set_signature(paths))
+        signature = daemon.working_set_signature(paths)
+        os.utime(target, (1, 1))
+        self.assertNotEqual(signature, daemon.working_set_signature(paths))
+
+
+class SocketPathTestCase(unittest.TestCase):
+
+    def test_default_socket_path(self):
+        stub_os_environ(self)
+        os.environ.pop(daemon.CALMJS_DEV_DAEMON_SOCKET, None)
+        os.environ['XDG_RUNTIME_DIR'] = join('run', 'user')
+        self.assertEqual(
+            join('run', 'user', 'calmjs-dev-daemon.sock'),
+            daemon.default_socket_path())
+        os.environ.pop('XDG_RUNTIME_DIR')
+        path = daemon.default_socket_path()
+        self.assertEqual('calmjs-dev-daemon.sock', os.path.basename(path))
+        self.assertTrue(os.path.basename(os.path.dirname(path)).startswith(
+            'calmjs-dev-daemon-'))
+        os.environ[daemon.CALMJS_DEV_DAEMON_SOCKET] = 'daemon.sock'
+        self.assertEqual('daemon.sock', daemon.default_socket_path())
+
+    @unittest.skipIf(not hasattr(os, 'getuid'), 'no file ownership')
+    def test_ensure_private_dir(self):
+        tmpdir = mkdtemp(self)
+        socket_dir = join(tmpdir, 'private')
+        daemon.ensure_private_dir(join(socket_dir, 'daemon.sock'))
+        self.assertEqual(0o700, os.stat(socket_dir).st_mode & 0o777)
+        # existing private directory is accepted.
+        daemon.ensure_private_dir(join(socket_dir, 'daemon.sock'))
+
+        os.chmod(socket_dir, 0o755)
+        with self.assertRaises(OSError):
+            daemon.ensure_private_dir(join(socket_dir, 'daemon.sock'))
+        with self.assertRaises(OSError):
+            daemon.ensure_private_dir(join(
+                touch(join(tmpdir, 'file')), 'daemon.sock'))
+
+
+class FakeRuntime(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, args):
+        self.calls.append(args)
+        sys.stdout.write('cwd=%s;args=%s;env=%s\n' % (
+            os.getcwd(), ' '.join(args), os.environ.get('DAEMON_TEST')))
+        return args != ['fail']
+
+
+@unittest.skipIf(not daemon.supported, 'daemon not supported')
+class DaemonTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp(self)
+        self.path = join(self.tmpdir, 'daemon.sock')
+        self.server = daemon.DaemonServer(self.path, FakeRuntime())
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.thread.join)
+        self.addCleanup(self.server.shutdown)
+
+    def request_run(self, args):
+        output = join(self.tmpdir, 'output')
+        with open(output, 'w') as fd:
+            response = daemon.request(self.path, {
+                'command': 'run',
+                'args': args,
+                'cwd': self.tmpdir,
+                'environ': {'DAEMON_TEST': 'value'},
+            }, (0, fd.fileno(), fd.fileno()))
+        with open(output) as fd:
+            return response, fd.read()
+
+    def test_run(self):
+        response, output = self.request_run(['karma', 'run'])
+        self.assertEqual({'status': 'ok', 'returncode': 0}, response)
+        self.assertEqual('cwd=%s;args=karma run;env=value\n' % (
+            os.path.realpath(self.tmpdir)), output)
+        # executed in the forked process.
+        self.assertEqual([], self.server.runtime.calls)
+        self.assertNotEqual('value', os.environ.get('DAEMON_TEST'))
+
+        response, output = self.request_run(['fail'])
+        self.assertEqual({'status': 'ok', 'returncode': 1}, response)
+
+    def test_stale(self):
+        self.server.signature = 'outdated'
+        response, output = self.request_run(['karma'])
+        self.assertEqual({'status': 'stale'}, response)
+        self.thread.join(5)
+        self.assertFalse(self.thread.is_alive())
+
+    def test_stop(self):
+        self.assertEqual({'status': 'stopped'}, daemon.request(
+            self.path, {'command': 'stop'}))
+        self.thread.join(5)
+        self.assertFalse(self.thread.is_alive())
+
+    def test_stop_check_timeout(self):
+        # the connection without a message does not block the daemon.
+        stub_item_attr_value(self, daemon, 'STOP_CHECK_TIMEOUT', 0.1)
+        idle = daemon.connect(self.path)
+        response, output = self.request_run(['karma', 'run'])
+        self.assertEqual({'status': 'ok', 'returncode': 0}, response)
+        # the forked process still waits for the message of the idle
+        # connection, so complete it such that it may exit.
+        self.assertEqual({
+            'status': 'error', 'error': 'unsupported command',
+        }, daemon.exchange(idle, {'command': 'unknown'}))
+
+    def test_invalid_message(self):
+        self.assertEqual({
+            'status': 'error', 'error': 'unsupported command',
+        }, daemon.request(self.path, {'command': 'unknown'}))
+        self.assertEqual({
+            'status': 'error', 'error': "missing or invalid 'cwd'",
+        }, daemon.request(self.path, {
+            'command': 'run', 'args': ['karma'], 'environ': {}}))
+        response = daemon.request(self.path, {
+            'command': 'run', 'args': ['karma'], 'environ': {},
+            'cwd': join(self.tmpdir, 'missing')})
+        self.assertEqual('error', response['status'])
+        self.assertTrue(response['error'].startswith('invalid cwd'))
+
+        sock = daemon.connect(self.path)
+        sock.sendall(b'not json\n')
+        self.assertEqual({
+            'status': 'error', 'error': 'malformed message',
+        }, daemon.recv_message(sock)[0])
+        sock.close()
+        self.assertEqual([], self.server.runtime.calls)
+
+    def test_run_rejected(self):
+        stub_item_attr_value(
+            self, daemon, 'validate_message', lambda message: 'rejected')
+        calls = self.stub_main()
+        self.assertEqual(1, daemon.run(['karma'], self.path))
+        self.assertEqual([], calls)
+
+    @unittest.skipIf(
+        not hasattr(daemon.socket, 'SO_PEERCRED'), 'no peer credentials')
+    def test_peer_uid(self):
+        left, right = daemon.socket.socketpair(daemon.socket.AF_UNIX)
+        self.addCleanup(left.close)
+        self.addCleanup(right.close)
+        self.assertEqual(os.getuid(), daemon.peer_uid(left))
+
+    def test_reject_other_user(self):
+        stub_item_attr_value(
+            self, daemon, 'peer_uid', lambda sock: daemon._getuid() + 1)
+        response, output = self.request_run(['karma'])
+        self.assertIsNone(response)
+        self.assertEqual('', output)
+
+    def test_exchange_closed(self):
+        # the response sent before the daemon closed the connection
+        # with the message unread is still received.
+        sock, peer = socket.socketpair(socket.AF_UNIX)
+        daemon.send_message(peer, {'status': 'stale'})
+        peer.close()
+        self.assertEqual(
+            {'status': 'stale'}, daemon.exchange(sock, {'command': 'run'}))
+
+        sock, peer = socket.socketpair(socket.AF_UNIX)
+        peer.close()
+        self.assertIsNone(daemon.exchange(sock, {'command': 'run'}))
+
+    def stub_main(self):
+        calls = []
+        from calmjs import runtime
+        stub_item_attr_value(self, runtime, 'main', calls.append)
+        return calls
+
+    def test_run_no_reexecution(self):
+        # the forked process died without a response
+        stub_item_attr_value(
+            self, self.server, 'execute', lambda args: os._exit(0))
+        calls = self.stub_main()
+        self.assertEqual(1, daemon.run(['karma'], self.path))
+        self.assertEqual([], calls)
+
+    def test_run_stale_fallback(self):
+        self.server.signature = 'outdated'
+        calls = self.stub_main()
+        self.assertEqual(0, daemon.run(['karma'], self.path))
+        self.assertEqual([['karma']], calls)
+
+
+class ClientFallbackTestCase(unittest.TestCase):
+
+    def test_run_fallback(self):
+        calls = []
+
+        def main(args):
+            calls.append(args)
+            sys.exit(1)
+
+        from calmjs import runtime
+        stub_item_attr_value(self, runtime, 'main', main)
+        path = join(mkdtemp(self), 'missing.sock')
+        self.assertEqual(1, daemon.run(['karma'], path))
+        self.assertEqual([['karma']], calls)
+
+    def test_main_run_args(self):
+        calls = []
+        stub_item_attr_value(
+            self, daemon, 'run', lambda args, path: calls.append(
+                (args, path)) or 0)
+        self.assertEqual(0, daemon.main([
+            '--socket', 'sock', 'run', '--', 'karma', 'run']))
+        self.assertEqual([(['karma', 'run'], 'sock')], calls)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+import unittest
+import json
+import sys
+from os import mkdir
+from os.path import join
+from os.path import realpath
+from textwrap import dedent
+
+from calmjs.parse.vlq import encode_mappings
+
+from calmjs.dev import diffcover
+
+from calmjs.testing.mocks import StringIO
+from calmjs.testing.utils import mkdtemp
+from calmjs.testing.utils import stub_item_attr_value
+
+diff = dedent("""
+diff --git a/src/mod.js b/src/mod.js
+index 83db48f..bf269f4 100644
+--- a/src/mod.js
++++ b/src/mod.js
+@@ -1,5 +1,5 @@
+ var a = 1;
+-var b = 2;
++var b = 3;
++var c = 4;
+
+--- removed line that looks like a header
+ function f() {
+@@ -10,2 +11,3 @@ function f() {
+ return a;
++// comment
+ }
+\\ No newline at end of file
+diff --git a/src/gone.js b/src/gone.js
+deleted file mode 100644
+--- a/src/gone.js
++++ /dev/null
+@@ -1 +0,0 @@
+-var gone = 1;
+diff --git a/src/new.js b/src/new.js
+new file mode 100644
+--- /dev/null
++++ b/src/new.js
+@@ -0,0 +1 @@
++var added = 1;
+""").lstrip().splitlines(True)
+
+
+class ParseUnifiedDiffTestCase(unittest.TestCase):
+
+    def test_parse_unified_diff(self):
+        basedir = mkdtemp(self)
+        result = diffcover.parse_unified_diff(diff, basedir=basedir)
+        self.assertEqual({
+            realpath(join(basedir, 'src', 'mod.js')): {2, 3, 12},
+            realpath(join(basedir, 'src', 'new.js')): {1},
+        }, result)
+
+    def test_parse_unified_diff_strip(self):
+        basedir = mkdtemp(self)
+        result = diffcover.parse_unified_diff(diff, strip=2, basedir=basedir)
+        self.assertEqual(sorted([
+            realpath(join(basedir, 'mod.js')),
+            realpath(join(basedir, 'new.js')),
+        ]), sorted(result))
+
+    def test_parse_unified_diff_empty(self):
+        self.assertEqual({}, diffcover.parse_unified_diff([]))
+
+    def test_read_unified_diff_stdin(self):
+        basedir = mkdtemp(self)
+        stub_item_attr_value(self, sys, 'stdin', StringIO(''.join(diff)))
+        result = diffcover.read_unified_diff('-', basedir=basedir)
+        self.assertEqual(2, len(result))
+
+    def test_read_unified_diff_file(self):
+        basedir = mkdtemp(self)
+        target = join(basedir, 'changes.diff')
+        with open(target, 'w') as fd:
+            fd.write(''.join(diff))
+        result = diffcover.read_unified_diff(target, basedir=basedir)
+        self.assertEqual(2, len(result))
+
+
+class DiffCoverageReportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = mkdtemp(self)
+        self.source = join(self.basedir, 'mod.js')
+        self.target = join(self.basedir, 'build', 'mod.js')
+        # a generated file where source line N is generated at line N+1
+        # due to an inserted header line.
+        source_map = {
+            'version': 3,
+            'sources': ['../mod.js'],
+            'names': [],
+            'mappings': encode_mappings(
+                [[]] + [[(0, 0, 1 if line else 0, 0)] for line in range(5)]),
+            'file': 'mod.js',
+        }
+        mkdir(join(self.basedir, 'build'))
+        with open(self.target + '.map', 'w') as fd:
+            json.dump(source_map, fd)
+
+    def make_coverage(self, hits):
+        # statement N starts on line N
+        return {
+            self.target: {
+                'path': self.target,
+                'statementMap': {
+                    str(line): {
+                        'start': {'line': line, 'column': 0},
+                        'end': {'line': line, 'column': 10},
+                    } for line in hits
+                },
+                's': {str(line): count for line, count in hits.items()},
+            },
+        }
+
+    def test_index_statement_lines(self):
+        coverage = self.make_coverage({1: 0, 2: 3})
+        self.assertEqual(
+            {1: False, 2: True},
+            diffcover.index_statement_lines(coverage[self.target]),
+        )
+
+    def test_map_source_lines(self):
+        source_map = diffcover.load_source_map(self.target)
+        self.assertEqual([realpath(self.source)], source_map['sources'])
+        self.assertEqual({
+            1: {2},
+            3: {4},
+        }, diffcover.map_source_lines(
+            source_map, realpath(self.source), {1, 3}))
+        self.assertEqual({}, diffcover.map_source_lines(
+            source_map, realpath(self.target), {1, 3}))
+
+    def test_load_source_map_missing(self):
+        self.assertIsNone(diffcover.load_source_map(self.source))
+
+    def test_build_report_source_map(self):
+        source = realpath(self.source)
+        report = diffcover.build_diff_coverage_report(
+            {source: {1, 2, 3, 5}},
+            self.make_coverage({2: 1, 3: 0, 4: 0}),
+            {source: [self.target]},
+        )
+        # line 5 is generated at line 6, which has no statements.
+        self.assertEqual({
+            source: {'covered': [1], 'missed': [2, 3]},
+        }, report)
+
+    def test_build_report_direct(self):
+        # sources covered directly, without source maps.
+        report = diffcover.build_diff_coverage_report(
+            {self.source: {1, 2, 3}},
+            {self.source: self.make_coverage({1: 1, 2: 0})[self.target]},
+            {self.source: [self.source]},
+        )
+        self.assertEqual({
+            self.source: {'covered': [1], 'missed': [2]},
+        }, report)
+
+    def test_build_report_not_covered(self):
+        report = diffcover.build_diff_coverage_report(
+            {self.source: {1, 2, 3}}, {}, {self.source: [self.target]})
+        self.assertEqual({}, report)
+
+    def test_format_report(self):
+        result = diffcover.format_diff_coverage_report({
+            'src/a.js': {'covered': [1, 2], 'missed': [3, 4, 5, 9]},
+            'src/b.js': {'covered': [7], 'missed': []},
+        })
+        lines = result.splitlines()
+        self.assertEqual(
+            'src/a.js           6     4    33%  3-5, 9', lines[2])
+        self.assertEqual('src/b.js           1     0   100%', lines[3])
+        self.assertEqual('TOTAL              7     4    42%', lines[-1])
+
+    def test_format_report_empty(self):
+        result = diffcover.format_diff_coverage_report({})
+        self.assertIn('TOTAL', result)
+        self.assertIn('-', result.splitlines()[-1])
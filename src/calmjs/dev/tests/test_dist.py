@@ -56,3 +56,8 @@ class DistTestCase(unittest.TestCase):
         self.assertEqual([
             'root.module.tests.child.child',
         ], list(dist.map_registry_name_to_test(['root.module.child.child'])))
+
+        # the benchmark registries
+        self.assertEqual([
+            'root.module.bench.child.child',
+        ], list(dist.map_registry_name_to_bench(['root.module.child.child'])))
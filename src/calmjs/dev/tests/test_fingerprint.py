@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import unittest
+import hashlib
+import json
+import os
+from os.path import join
+from os.path import realpath
+
+from calmjs.dev import fingerprint
+
+from calmjs.testing.utils import mkdtemp
+from calmjs.testing.utils import stub_item_attr_value
+
+
+def touch(path, content=b''):
+    with open(path, 'wb') as fd:
+        fd.write(content)
+    return path
+
+
+class HashFileTestCase(unittest.TestCase):
+
+    def test_hash_file(self):
+        content = b'var a = 1;\n' * 1000
+        target = touch(join(mkdtemp(self), 'a.js'), content)
+        stub_item_attr_value(self, fingerprint, 'MMAP_CHUNK_SIZE', 64)
+        self.assertEqual(
+            hashlib.sha256(content).hexdigest(),
+            fingerprint.hash_file(target),
+        )
+
+    def test_hash_file_empty(self):
+        target = touch(join(mkdtemp(self), 'empty.js'))
+        self.assertEqual(
+            hashlib.sha256(b'').hexdigest(), fingerprint.hash_file(target))
+
+
+class FingerprintCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp(self)
+        self.target = touch(join(self.tmpdir, 'a.js'), b'var a = 1;')
+        self.digest = hashlib.sha256(b'var a = 1;').hexdigest()
+
+    def test_fingerprint_memoized(self):
+        hashed = []
+
+        def hash_file(path, algorithm):
+            hashed.append(path)
+            return 'digest'
+
+        stub_item_attr_value(self, fingerprint, 'hash_file', hash_file)
+        cache = fingerprint.FingerprintCache()
+        self.assertEqual('digest', cache.fingerprint(self.target))
+        self.assertEqual('digest', cache.fingerprint(self.target))
+        self.assertEqual(1, len(hashed))
+        # modification results in the file being hashed again.
+        os.utime(self.target, (0, 0))
+        cache.fingerprint(self.target)
+        self.assertEqual(2, len(hashed))
+
+    def test_fingerprint_missing(self):
+        cache = fingerprint.FingerprintCache()
+        self.assertIsNone(cache.fingerprint(join(self.tmpdir, 'missing.js')))
+        self.assertIsNone(cache.fingerprint(self.tmpdir))
+        self.assertEqual({realpath(self.target): self.digest}, {
+            realpath(k): v for k, v in cache.fingerprints([
+                self.target, join(self.tmpdir, 'missing.js')]).items()
+        })
+
+    def test_store(self):
+        store = join(self.tmpdir, 'store.json')
+        cache = fingerprint.FingerprintCache(store)
+        cache.save()
+        # nothing to save.
+        self.assertFalse(os.path.exists(store))
+        self.assertEqual(self.digest, cache.fingerprint(self.target))
+        cache.save()
+        with open(store) as fd:
+            records = json.load(fd)['records']
+        self.assertEqual(self.digest, records[realpath(self.target)][4])
+
+        def hash_file(path, algorithm):
+            raise AssertionError('should not be called')
+
+        stub_item_attr_value(self, fingerprint, 'hash_file', hash_file)
+        reloaded = fingerprint.FingerprintCache(store)
+        self.assertEqual(self.digest, reloaded.fingerprint(self.target))
+
+    def test_store_invalid(self):
+        store = touch(join(self.tmpdir, 'store.json'), b'{')
+        cache = fingerprint.FingerprintCache(store)
+        self.assertEqual({}, cache.records)
+
+    def test_get_fingerprint_cache(self):
+        cache = fingerprint.get_fingerprint_cache(self.tmpdir)
+        self.assertIs(cache, fingerprint.get_fingerprint_cache(self.tmpdir))
+        self.assertEqual(
+            join(realpath(self.tmpdir), 'fingerprints.json'), cache.path)
+        self.assertIsNone(fingerprint.get_fingerprint_cache().path)
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+import unittest
+from os.path import join
+from time import time
+
+from calmjs.toolchain import Spec
+from calmjs.utils import pretty_logging
+
+from calmjs.testing import mocks
+from calmjs.testing.utils import mkdtemp
+from calmjs.testing.utils import stub_item_attr_value
+
+from calmjs.dev import history
+
+
+def make_spec(results, **kw):
+    return Spec(
+        test_package_names=['pkg'],
+        export_target='pkg.js',
+        karma_return_code=0,
+        karma_duration=1.0,
+        karma_outcome={'results': results},
+        **kw
+    )
+
+
+def make_result(name, time, status='passed', suite='suite'):
+    return {
+        'browser': 'Chrome',
+        'suite': suite,
+        'name': name,
+        'time': time,
+        'status': status,
+    }
+
+
+class RecordRunTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = join(mkdtemp(self), 'history.db')
+
+    def test_record_run(self):
+        run_id = history.record_run(self.path, make_spec([
+            make_result('a', 10),
+            make_result('b', 20, status='failed'),
+        ]))
+        with history.connect(self.path) as conn:
+            self.assertEqual([(run_id, 'pkg', 'pkg.js', 0, 1.0)], list(
+                conn.execute(
+                    'SELECT id, packages, export_target, return_code, '
+                    'duration FROM runs')))
+            self.assertEqual([
+                ('Chrome', 'suite', 'a', 'passed', 10.0),
+                ('Chrome', 'suite', 'b', 'failed', 20.0),
+            ], list(conn.execute(
+                'SELECT browser, suite, name, status, duration FROM results '
+                'ORDER BY name')))
+
+    def test_record_run_split(self):
+        spec = make_spec([], karma_split_runs=[
+            {'test_module_paths': ['a', 'b'], 'crashed': True,
+             'outcome': {'results': [make_result('crashed', 1)]}},
+            {'test_module_paths': ['a'], 'crashed': False,
+             'outcome': {'results': [make_result('a', 1)]}},
+            {'test_module_paths': ['b'], 'crashed': False,
+             'outcome': {'results': [make_result('b', 1)]}},
+        ])
+        history.record_run(self.path, spec)
+        with history.connect(self.path) as conn:
+            self.assertEqual([('a',), ('b',)], list(conn.execute(
+                'SELECT name FROM results ORDER BY name')))
+
+    def test_record_run_no_outcome(self):
+        with pretty_logging(
+                logger='calmjs.dev', stream=mocks.StringIO()) as log:
+            self.assertIsNone(history.record_run(self.path, Spec()))
+        self.assertIn('no outcome captured', log.getvalue())
+
+    def test_record_run_many(self):
+        results = [make_result('test %d' % i, i % 7) for i in range(50000)]
+        started = time()
+        history.record_run(self.path, make_spec(results))
+        # generous bound, as the inserts are done in a single batch.
+        self.assertLess(time() - started, 10)
+        with history.connect(self.path) as conn:
+            self.assertEqual(50000, conn.execute(
+                'SELECT COUNT(*) FROM results').fetchone()[0])
+
+
+class RegressionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = join(mkdtemp(self), 'history.db')
+        for duration in (10, 11, 9, 10, 12, 10, 9, 11):
+            history.record_run(self.path, make_spec([
+                make_result('stable', duration),
+                make_result('slower', duration),
+                make_result('flaky', duration),
+            ]))
+
+    def test_no_regressions(self):
+        history.record_run(self.path, make_spec([
+            make_result('stable', 11),
+            make_result('slower', 12),
+        ]))
+        self.assertEqual([], history.find_regressions(self.path))
+
+    def test_regressions(self):
+        history.record_run(self.path, make_spec([
+            make_result('stable', 11),
+            make_result('slower', 40),
+            # failures are not part of the durations.
+            make_result('flaky', 1000, status='failed'),
+        ]))
+        regressions = history.find_regressions(self.path)
+        self.assertEqual(1, len(regressions))
+        regression = regressions[0]
+        self.assertEqual('slower', regression['name'])
+        self.assertEqual('pkg', regression['packages'])
+        self.assertEqual(40, regression['duration'])
+        self.assertEqual(8, regression['samples'])
+        self.assertAlmostEqual(10.25, regression['mean'])
+        self.assertAlmostEqual(40 / 10.25, regression['ratio'])
+        self.assertEqual([
+            'pkg [pkg.js] Chrome: suite > slower',
+            '    10.2 ms -> 40.0 ms (x3.90, z=28.7, 8 prior runs)',
+        ], history.format_regressions(regressions))
+
+    def test_regressions_options(self):
+        history.record_run(self.path, make_spec([
+            make_result('slower', 40),
+        ]))
+        self.assertEqual([], history.find_regressions(
+            self.path, min_samples=9))
+        self.assertEqual([], history.find_regressions(
+            self.path, min_delta=50))
+        self.assertEqual([], history.find_regressions(
+            self.path, z_score=100))
+        self.assertEqual(3, history.find_regressions(
+            self.path, window=3, min_samples=3)[0]['samples'])
+
+
+class InputsTestCase(unittest.TestCase):
+
+    def test_run_inputs(self):
+        digests = []
+        for content in ('a', 'a', 'b'):
+            build_dir = mkdtemp(self)
+            target = join(build_dir, 'test.js')
+            with open(target, 'w') as fd:
+                fd.write(content)
+            digests.append(history.run_inputs(Spec(karma_config={
+                'files': [target, {'pattern': 'http://example.com/a.js'}],
+            })))
+        # the locations of the files are not part of the inputs.
+        self.assertEqual(digests[0], digests[1])
+        self.assertNotEqual(digests[0], digests[2])
+
+
+class FlakyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = join(mkdtemp(self), 'history.db')
+
+    def record(self, inputs, *results):
+        stub_item_attr_value(
+            self, history, 'run_inputs', lambda spec: inputs)
+        history.record_run(self.path, make_spec(list(results)))
+
+    def test_find_flaky(self):
+        self.record('1', make_result('a', 1), make_result('b', 1))
+        self.record('1', make_result('a', 1, status='failed'),
+                    make_result('b', 1))
+        # failures with different inputs are not flakiness.
+        self.record('2', make_result('a', 1), make_result('b', 1))
+        self.record('3', make_result('a', 1), make_result(
+            'b', 1, status='failed'))
+        flaky = history.find_flaky(self.path)
+        self.assertEqual([{
+            'packages': 'pkg',
+            'export_target': 'pkg.js',
+            'suite': 'suite',
+            'name': 'a',
+            'browsers': ['Chrome'],
+        }], flaky)
+        self.assertEqual(
+            ['pkg [pkg.js] suite > a (flaky on Chrome)'],
+            history.format_flaky(flaky))
+        # only the latest results are considered.
+        self.assertEqual([], history.find_flaky(self.path, window=2))
+
+    def test_quarantine(self):
+        target = join(mkdtemp(self), 'quarantine.json')
+        self.assertEqual([], history.load_quarantine(target))
+        with pretty_logging(
+                logger='calmjs.dev', stream=mocks.StringIO()) as log:
+            history.write_quarantine(target, [{
+                'packages': 'pkg', 'export_target': 'pkg.js',
+                'suite': 'suite', 'name': 'b', 'browsers': ['Chrome'],
+            }, {
+                'packages': 'pkg', 'export_target': 'pkg.js',
+                'suite': 'suite', 'name': 'a', 'browsers': ['Chrome'],
+            }, {
+                'packages': 'other', 'export_target': 'other.js',
+                'suite': 'suite', 'name': 'a', 'browsers': ['Chrome'],
+            }])
+        self.assertIn('wrote 3 flaky test(s)', log.getvalue())
+        self.assertEqual(['other', 'pkg', 'pkg'], [
+            test['packages'] for test in history.load_quarantine(target)])
+
+        spec = make_spec([], karma_quarantine=target)
+        self.assertEqual(
+            [['suite', 'a'], ['suite', 'b']], history.quarantine_tests(spec))
+        self.assertEqual([], history.quarantine_tests(make_spec([])))
+
+    def test_load_quarantine_invalid(self):
+        target = join(mkdtemp(self), 'quarantine.json')
+        with open(target, 'w') as fd:
+            fd.write('{')
+        with pretty_logging(
+                logger='calmjs.dev', stream=mocks.StringIO()) as log:
+            self.assertEqual([], history.load_quarantine(target))
+        self.assertIn('ignoring invalid quarantine list', log.getvalue())
+
+    def test_summarize_quarantine(self):
+        self.assertIsNone(history.summarize_quarantine(make_spec([])))
+        self.assertEqual({
+            'tests': 1, 'mode': 'exclude', 'return_code': None,
+        }, history.summarize_quarantine(make_spec(
+            [], karma_quarantine_tests=[['suite', 'a']])))
+        self.assertEqual({
+            'tests': 1, 'mode': 'separate', 'return_code': 1,
+            'passed': 0, 'failed': 1, 'skipped': 0,
+        }, history.summarize_quarantine(make_spec(
+            [], karma_quarantine_tests=[['suite', 'a']],
+            karma_quarantine_mode='separate',
+            karma_quarantine_run={'return_code': 1, 'outcome': {
+                'passed': 0, 'failed': 1, 'skipped': 0}},
+        )))
+
+    def test_record_quarantine_run(self):
+        history.record_run(self.path, make_spec(
+            [make_result('a', 1)], karma_quarantine_run={
+                'return_code': 1,
+                'outcome': {'results': [make_result('b', 1, 'failed')]},
+            }))
+        with history.connect(self.path) as conn:
+            self.assertEqual([('a', 'passed'), ('b', 'failed')], list(
+                conn.execute('SELECT name, status FROM results ORDER BY '
+                             'name')))
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+import unittest
+import json
+from os.path import join
+from xml.etree import ElementTree
+
+from calmjs.toolchain import Spec
+from calmjs.testing import mocks
+from calmjs.testing.utils import mkdtemp
+
+from calmjs.dev import junit
+
+
+def write_stream(path, results):
+    with open(path, 'w') as fd:
+        for result in results:
+            fd.write(json.dumps(result) + '\n')
+        # the truncated line from a crashed run.
+        fd.write('{"browser": ')
+
+
+def make_result(name, status='passed', log=()):
+    return {
+        'browser': 'Chrome 1.0',
+        'suite': ['outer', 'inner'],
+        'name': name,
+        'time': 1500,
+        'status': status,
+        'log': list(log),
+    }
+
+
+class TestcaseTestCase(unittest.TestCase):
+
+    def test_write_testcase_passed(self):
+        stream = mocks.StringIO()
+        junit.write_testcase(stream, make_result('a "test"'))
+        self.assertEqual(
+            '    <testcase classname="Chrome 1_0.outer.inner" '
+            'name=\'a "test"\' time="1.5"/>\n', stream.getvalue())
+
+    def test_write_testcase_skipped(self):
+        stream = mocks.StringIO()
+        junit.write_testcase(stream, make_result('a', 'skipped'))
+        self.assertIn('<skipped/>', stream.getvalue())
+
+    def test_write_testcase_failed(self):
+        stream = mocks.StringIO()
+        junit.write_testcase(stream, make_result('a', 'failed', [
+            '\x1b[31mexpected <1> to equal 2\x1b[39m\n    at test.js\x07',
+        ]))
+        self.assertIn(
+            '<failure message="expected &lt;1&gt; to equal 2">'
+            'expected &lt;1&gt; to equal 2\n    at test.js</failure>',
+            stream.getvalue())
+
+
+class WriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp(self)
+        self.path = join(self.tmpdir, 'junit.xml')
+
+    def parse(self):
+        return ElementTree.parse(self.path).getroot()
+
+    def test_write_testsuites(self):
+        stream1 = join(self.tmpdir, 'results1.jsonl')
+        stream2 = join(self.tmpdir, 'results2.jsonl')
+        write_stream(stream1, [
+            make_result('a'), make_result('b', 'failed', ['failure'])])
+        write_stream(stream2, [make_result('c', 'skipped')])
+        with junit.JUnitXMLWriter(self.path) as writer:
+            writer.write_testsuite('pkg:pkg.js', [
+                {'stream': stream1}, {'stream': stream2}], 2.5)
+            writer.write_testsuite('other', [])
+
+        root = self.parse()
+        self.assertEqual('testsuites', root.tag)
+        suite, other = list(root)
+        self.assertEqual('pkg:pkg.js', suite.get('name'))
+        self.assertEqual('3', suite.get('tests'))
+        self.assertEqual('1', suite.get('failures'))
+        self.assertEqual('1', suite.get('skipped'))
+        self.assertEqual('0', suite.get('errors'))
+        self.assertEqual('2.5', suite.get('time'))
+        self.assertEqual(['a', 'b', 'c'], [
+            testcase.get('name') for testcase in suite])
+        self.assertEqual('failure', suite[1][0].get('message'))
+
+        # the run without any outcome.
+        self.assertEqual('1', other.get('errors'))
+        self.assertEqual(
+            'karma run did not complete', other[0][0].get('message'))
+
+    def test_write_testsuite_crashed(self):
+        with junit.JUnitXMLWriter(self.path) as writer:
+            writer.write_testsuite('pkg', [{
+                'stream': join(self.tmpdir, 'missing.jsonl'),
+                'disconnected': False,
+                'process_failures': ['crashed'],
+            }])
+        suite = self.parse()[0]
+        self.assertEqual('1', suite.get('tests'))
+        self.assertEqual('1', suite.get('errors'))
+        self.assertEqual(
+            'karma run crashed or the browser disconnected: crashed',
+            suite[0][0].get('message'))
+
+    def test_write_junit_xml(self):
+        stream1 = join(self.tmpdir, 'results1.jsonl')
+        stream2 = join(self.tmpdir, 'results2.jsonl')
+        write_stream(stream1, [make_result('a')])
+        write_stream(stream2, [make_result('b', 'failed')])
+        spec = Spec(
+            source_package_names=['pkg'],
+            export_target='pkg.js',
+            karma_duration=1.0,
+            karma_outcome={'stream': stream1},
+            karma_quarantine_run={
+                'return_code': 1, 'outcome': {'stream': stream2}},
+        )
+        with junit.JUnitXMLWriter(self.path) as writer:
+            junit.write_junit_xml(spec, writer)
+        self.assertEqual(['pkg:pkg.js', 'pkg:pkg.js (quarantined)'], [
+            suite.get('name') for suite in self.parse()])
+
+    def test_write_reused_junit_xml(self):
+        stream = join(self.tmpdir, 'results.jsonl')
+        write_stream(stream, [
+            make_result(u'\u6e2c\u8a66' * 20000), make_result('b', 'failed')])
+        spec = Spec(
+            source_package_names=['pkg1'],
+            export_target='pkg1.js',
+            execution_key='key',
+            karma_outcome={'stream': stream},
+            karma_quarantine_run={'return_code': 0, 'outcome': None},
+        )
+        with junit.JUnitXMLWriter(self.path) as writer:
+            junit.write_junit_xml(spec, writer)
+            junit.write_reused_junit_xml(Spec(
+                source_package_names=['pkg2'],
+                export_target='pkg2.js',
+                execution_key='key',
+            ), writer)
+            # no record of the execution.
+            junit.write_reused_junit_xml(Spec(
+                source_package_names=['pkg3'],
+                export_target='pkg3.js',
+                execution_key='other',
+            ), writer)
+
+        suites = list(self.parse())
+        self.assertEqual([
+            'pkg1:pkg1.js', 'pkg1:pkg1.js (quarantined)',
+            'pkg2:pkg2.js', 'pkg2:pkg2.js (quarantined)', 'pkg3:pkg3.js',
+        ], [suite.get('name') for suite in suites])
+        for attr in ('tests', 'failures', 'timestamp'):
+            self.assertEqual(suites[0].get(attr), suites[2].get(attr))
+        self.assertEqual(
+            [testcase.get('name') for testcase in suites[0]],
+            [testcase.get('name') for testcase in suites[2]])
+        self.assertEqual(u'\u6e2c\u8a66' * 20000, suites[2][0].get('name'))
+        self.assertEqual('1', suites[4].get('errors'))
+
+    def test_testsuite_name(self):
+        self.assertEqual('karma', junit.testsuite_name(Spec()))
+        self.assertEqual('pkg', junit.testsuite_name(Spec(
+            test_package_names=['pkg'])))
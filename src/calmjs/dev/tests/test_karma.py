@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
 import unittest
+import json
+from os import mkdir
 from os.path import join
 
+from calmjs.cli import get_node_version
+from calmjs.cli import node
 from calmjs.dev import karma
+from calmjs.dev.cli import KarmaDriver
 from calmjs.testing.utils import mkdtemp
+from calmjs.testing.utils import stub_item_attr_value
 from calmjs.testing.mocks import StringIO
 from calmjs.utils import pretty_logging
 
@@ -84,3 +90,526 @@ class BaseConfigTestCase(unittest.TestCase):
         self.assertIn(
             "coverage reporter 'invalid_builder' not supported", s.getvalue())
         self.assertEqual({'dir': 'somedir', 'reporters': []}, reporters)
+
+
+class CompactConfigTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.basedir = mkdtemp(self)
+        for name in ('a.js', 'b.js', 'c.js', 'a.js.map', '.hidden.js'):
+            with open(join(self.basedir, name), 'w'):
+                pass
+        mkdir(join(self.basedir, 'sub'))
+        for name in ('d.js', 'e.js'):
+            with open(join(self.basedir, 'sub', name), 'w'):
+                pass
+
+    def test_compact_files_collapse(self):
+        self.assertEqual([
+            'artifact.js',
+            '*.js',
+            join('sub', '*.js'),
+        ], karma.compact_files([
+            'artifact.js',
+            'a.js', 'b.js', 'c.js',
+            join('sub', 'd.js'), join('sub', 'e.js'),
+        ], self.basedir))
+
+    def test_compact_files_partial(self):
+        # not all files of the directory selected.
+        files = ['a.js', 'c.js', join('sub', 'd.js')]
+        self.assertEqual(files, karma.compact_files(files, self.basedir))
+
+    def test_compact_files_order(self):
+        # reordering not permitted
+        files = ['b.js', 'a.js', 'c.js']
+        self.assertEqual(files, karma.compact_files(files, self.basedir))
+        files = ['a.js', 'b.js', join('sub', 'd.js'), 'c.js']
+        self.assertEqual(files, karma.compact_files(files, self.basedir))
+
+    def test_compact_files_patterns(self):
+        pattern = {'pattern': 'x.js', 'included': False}
+        files = ['a.js', 'b.js', pattern, 'c.js']
+        self.assertEqual(files, karma.compact_files(files, self.basedir))
+        self.assertEqual(['*', '*'], karma.compact_files(['*', '*'], '.'))
+
+    def test_compact_files_single_run(self):
+        self.assertEqual([{
+            'pattern': '*.js',
+            'watched': False,
+        }, {
+            'pattern': join('sub', '*.js'),
+            'watched': False,
+            'nocache': True,
+        }, {
+            'pattern': 'artifact.js',
+            'watched': False,
+            'nocache': True,
+        }], karma.compact_files([
+            'a.js', 'b.js', 'c.js',
+            join('sub', 'd.js'), join('sub', 'e.js'),
+            'artifact.js',
+        ], self.basedir, single_run=True, preprocessors={
+            'b.js': ['coverage'],
+        }))
+
+    def test_compact_files_single_run_glob_preprocessors(self):
+        self.assertEqual([{
+            'pattern': 'artifact.js',
+            'watched': False,
+        }], karma.compact_files(
+            ['artifact.js'], self.basedir, single_run=True, preprocessors={
+                'some/**/*.js': ['coverage'],
+            }))
+
+    def test_compact_preprocessors(self):
+        self.assertEqual({
+            '*.js': ['coverage'],
+            join('sub', 'd.js'): ['coverage', 'wrap'],
+            join('sub', 'e.js'): ['coverage'],
+            'some/**/*.js': ['other'],
+        }, karma.compact_preprocessors({
+            'a.js': ['coverage'],
+            'b.js': 'coverage',
+            'c.js': ['coverage'],
+            join('sub', 'd.js'): ['coverage', 'wrap'],
+            join('sub', 'e.js'): ['coverage'],
+            'some/**/*.js': ['other'],
+        }, self.basedir))
+
+
+class ConfigWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.driver = KarmaDriver()
+        self.config = {
+            'basePath': '/tmp',
+            'files': ['test_%d.js' % i for i in range(100)],
+            'preprocessors': {
+                'test_%d.js' % i: ['coverage'] for i in range(100)},
+            'singleRun': True,
+        }
+
+    def test_streaming_config_writer_identical(self):
+        expected = StringIO()
+        karma.config_writer(self.driver, self.config, expected)
+        result = StringIO()
+        karma.streaming_config_writer(self.driver, self.config, result)
+        self.assertEqual(expected.getvalue(), result.getvalue())
+        self.assertTrue(result.getvalue().startswith('module.exports'))
+
+    def test_streaming_config_writer_chunked(self):
+        writes = []
+
+        class Writer(object):
+            def write(self, value):
+                writes.append(value)
+
+        stub_item_attr_value(self, karma, 'STREAM_WRITE_CHUNKS', 64)
+        karma.streaming_config_writer(self.driver, self.config, Writer())
+        self.assertGreater(len(writes), 10)
+        expected = StringIO()
+        karma.config_writer(self.driver, self.config, expected)
+        self.assertEqual(expected.getvalue(), ''.join(writes))
+
+    def test_sidecar_writer(self):
+        result = StringIO()
+        karma.sidecar_writer(self.config, result)
+        self.assertEqual(self.config, json.loads(result.getvalue()))
+        self.assertNotIn('\n', result.getvalue())
+        self.assertNotIn(', ', result.getvalue())
+
+    def test_config_stub_writer(self):
+        result = StringIO()
+        karma.config_stub_writer(self.config, result)
+        self.assertEqual(karma.KARMA_CONF_STUB, result.getvalue())
+        self.assertIn("'.json'", result.getvalue())
+        self.assertNotIn('test_1.js', result.getvalue())
+
+    def test_sidecar_path(self):
+        self.assertEqual(
+            join('build', 'karma.conf.json'),
+            karma.sidecar_path(join('build', 'karma.conf.js')))
+        self.assertEqual(
+            join('build', 'karma.split.1.conf.json'),
+            karma.sidecar_path(join('build', 'karma.split.1.conf.js')))
+
+
+class OutcomeTestCase(unittest.TestCase):
+
+    def test_apply_outcome_reporter_config(self):
+        config = karma.build_base_config()
+        karma.apply_outcome_reporter_config(
+            config, '/build', '/build/karma.outcome.json')
+        self.assertEqual(
+            ['karma-*', join('/build', 'karma.outcome.reporter.js')],
+            config['plugins'])
+        self.assertEqual(
+            ['spec', 'progress', 'calmjs-outcome'], config['reporters'])
+        self.assertEqual({
+            'file': '/build/karma.outcome.json',
+            'results': False,
+        }, config['calmjsOutcome'])
+
+    def test_completed_outcomes(self):
+        self.assertEqual([], karma.completed_outcomes({}))
+        self.assertEqual([{'passed': 1}], karma.completed_outcomes({
+            'karma_outcome': {'passed': 1}}))
+        self.assertEqual([{'passed': 2}, {'passed': 3}], (
+            karma.completed_outcomes({
+                'karma_outcome': {'disconnected': True},
+                'karma_split_runs': [
+                    {'test_module_paths': ['a', 'b'], 'crashed': True,
+                     'outcome': {'disconnected': True}},
+                    {'test_module_paths': ['a'], 'crashed': False,
+                     'outcome': {'passed': 2}},
+                    {'test_module_paths': ['b'], 'crashed': False,
+                     'outcome': {'passed': 3}},
+                    {'test_module_paths': ['c'], 'crashed': True,
+                     'outcome': None},
+                ],
+            })))
+
+    def test_read_clear_outcome(self):
+        target = join(mkdtemp(self), 'outcome.json')
+        self.assertIsNone(karma.read_outcome(target))
+        with open(target, 'w') as fd:
+            fd.write('{"disconnected": true}')
+        self.assertEqual({'disconnected': True}, karma.read_outcome(target))
+        karma.clear_outcome(target)
+        self.assertIsNone(karma.read_outcome(target))
+        # no error for missing files.
+        karma.clear_outcome(target)
+
+    def test_is_crashed(self):
+        self.assertFalse(karma.is_crashed(0, None))
+        self.assertFalse(karma.is_crashed(1, None))
+        self.assertFalse(karma.is_crashed(1, {
+            'disconnected': False, 'process_failures': []}))
+        self.assertTrue(karma.is_crashed(-9, None))
+        self.assertTrue(karma.is_crashed(1, {'disconnected': True}))
+        self.assertTrue(karma.is_crashed(1, {
+            'disconnected': False, 'process_failures': ['crashed']}))
+
+    @unittest.skipIf(get_node_version() is None, 'node.js not found')
+    def test_outcome_reporter(self):
+        build_dir = mkdtemp(self)
+        reporter_js = join(build_dir, karma.KARMA_OUTCOME_REPORTER_JS)
+        target = join(build_dir, karma.KARMA_OUTCOME_JSON)
+        with open(reporter_js, 'w') as fd:
+            fd.write(karma.KARMA_OUTCOME_REPORTER_SOURCE)
+        node(
+            'var plugin = require(%s);\n'
+            'var Reporter = plugin["reporter:calmjs-outcome"][1];\n'
+            'var reporter = new Reporter({calmjsOutcome: {file: %s}});\n'
+            'var browser = {name: "Chrome"};\n'
+            'reporter.onBrowserRegister(browser);\n'
+            'reporter.onSpecComplete(browser, {success: true});\n'
+            'reporter.onSpecComplete(browser, {success: true});\n'
+            'reporter.onSpecComplete(browser, {success: false});\n'
+            'reporter.onSpecComplete(browser, {skipped: true});\n'
+            'reporter.onBrowserProcessFailure({error: "crashed"});\n'
+            'reporter.onRunComplete([], {\n'
+            '    disconnected: true, error: false, success: 2, failed: 1});\n'
+            % (json.dumps(reporter_js), json.dumps(target))
+        )
+        outcome = karma.read_outcome(target)
+        self.assertIsInstance(outcome.pop('browser_registered'), int)
+        self.assertEqual({
+            'disconnected': True,
+            'error': False,
+            'passed': 2,
+            'failed': 1,
+            'skipped': 1,
+            'process_failures': ['crashed'],
+        }, outcome)
+
+    @unittest.skipIf(get_node_version() is None, 'node.js not found')
+    def test_quarantine_source(self):
+        script = (
+            'var window = {__karma__: {start: function() {\n'
+            '    console.log(JSON.stringify(window.mocha.suite.suites.map(\n'
+            '        function(s) { return s.tests.map(\n'
+            '            function(t) { return t.title; }); })));\n'
+            '}}, mocha: {suite: {root: true, tests: [], suites: []}}};\n'
+            'var root = window.mocha.suite;\n'
+            'var suite = {title: "a", parent: root, suites: []};\n'
+            'suite.tests = [\n'
+            '    {title: "flaky", parent: suite},\n'
+            '    {title: "stable", parent: suite}];\n'
+            'root.suites.push(suite);\n'
+            '%s\n'
+            'window.__karma__.start();\n'
+        )
+        self.assertEqual('[["stable"]]', node(script % (
+            karma.quarantine_source([['a', 'flaky']])))[0].strip())
+        self.assertEqual('[["flaky"]]', node(script % (
+            karma.quarantine_source([['a', 'flaky']], only=True)))[0].strip())
+
+    @unittest.skipIf(get_node_version() is None, 'node.js not found')
+    def test_quarantine_source_without_mocha(self):
+        stdout, stderr = node(
+            'var window = {__karma__: {start: function() {\n'
+            '    console.log("started");\n'
+            '}}, console: console};\n'
+            '%s\n'
+            'window.__karma__.start();\n' % karma.quarantine_source(
+                [['a', 'flaky']]))
+        self.assertEqual('started', stdout.strip())
+        self.assertIn('the quarantine is not applied', stderr)
+
+    @unittest.skipIf(get_node_version() is None, 'node.js not found')
+    def test_outcome_reporter_results(self):
+        build_dir = mkdtemp(self)
+        reporter_js = join(build_dir, karma.KARMA_OUTCOME_REPORTER_JS)
+        target = join(build_dir, karma.KARMA_OUTCOME_JSON)
+        with open(reporter_js, 'w') as fd:
+            fd.write(karma.KARMA_OUTCOME_REPORTER_SOURCE)
+        node(
+            'var plugin = require(%s);\n'
+            'var Reporter = plugin["reporter:calmjs-outcome"][1];\n'
+            'var reporter = new Reporter({calmjsOutcome: {\n'
+            '    file: %s, results: true}});\n'
+            'reporter.onSpecComplete({name: "Chrome"}, {\n'
+            '    suite: ["a", "b"], description: "c", time: 5,\n'
+            '    success: false});\n'
+            'reporter.onRunComplete([], {});\n'
+            % (json.dumps(reporter_js), json.dumps(target))
+        )
+        self.assertEqual([{
+            'browser': 'Chrome',
+            'suite': 'a > b',
+            'name': 'c',
+            'time': 5,
+            'status': 'failed',
+        }], karma.read_outcome(target)['results'])
+
+    @unittest.skipIf(get_node_version() is None, 'node.js not found')
+    def test_outcome_reporter_stream(self):
+        build_dir = mkdtemp(self)
+        reporter_js = join(build_dir, karma.KARMA_OUTCOME_REPORTER_JS)
+        target = join(build_dir, karma.KARMA_OUTCOME_JSON)
+        stream = join(build_dir, karma.KARMA_RESULTS_JSONL)
+        with open(reporter_js, 'w') as fd:
+            fd.write(karma.KARMA_OUTCOME_REPORTER_SOURCE)
+        node(
+            'var plugin = require(%s);\n'
+            'var Reporter = plugin["reporter:calmjs-outcome"][1];\n'
+            'var reporter = new Reporter({calmjsOutcome: {\n'
+            '    file: %s, stream: %s}});\n'
+            'reporter.onSpecComplete({name: "Chrome"}, {\n'
+            '    suite: ["a"], description: "b", time: 5, success: true});\n'
+            'reporter.onSpecComplete({name: "Chrome"}, {\n'
+            '    suite: ["a"], description: "c", time: 1, success: false,\n'
+            '    log: ["failure"]});\n'
+            'reporter.onRunComplete([], {});\n'
+            'reporter.onExit(function() {});\n'
+            % (json.dumps(reporter_js), json.dumps(target),
+               json.dumps(stream))
+        )
+        self.assertEqual(stream, karma.read_outcome(target)['stream'])
+        with open(stream) as fd:
+            results = [json.loads(line) for line in fd]
+        self.assertEqual([{
+            'browser': 'Chrome', 'suite': ['a'], 'name': 'b', 'time': 5,
+            'status': 'passed', 'log': [],
+        }, {
+            'browser': 'Chrome', 'suite': ['a'], 'name': 'c', 'time': 1,
+            'status': 'failed', 'log': ['failure'],
+        }], results)
+
+
+class MinimalReporterTestCase(unittest.TestCase):
+
+    def test_apply_minimal_reporter_config(self):
+        config = karma.build_base_config()
+        config['reporters'].append('coverage')
+        karma.apply_minimal_reporter_config(
+            config, '/build', '/build/karma.minimal.log')
+        self.assertEqual(
+            ['karma-*', join('/build', 'karma.minimal.reporter.js')],
+            config['plugins'])
+        self.assertEqual(['coverage', 'calmjs-minimal'], config['reporters'])
+        self.assertEqual(
+            {'file': '/build/karma.minimal.log'}, config['calmjsMinimal'])
+        self.assertFalse(config['colors'])
+        self.assertEqual('WARN', config['logLevel'])
+
+        # the outcome reporter is to be applied alongside.
+        karma.apply_outcome_reporter_config(
+            config, '/build', '/build/karma.outcome.json')
+        self.assertEqual(
+            ['coverage', 'calmjs-minimal', 'calmjs-outcome'],
+            config['reporters'])
+
+    @unittest.skipIf(get_node_version() is None, 'node.js not found')
+    def test_minimal_reporter(self):
+        build_dir = mkdtemp(self)
+        reporter_js = join(build_dir, karma.KARMA_MINIMAL_REPORTER_JS)
+        target = join(build_dir, karma.KARMA_MINIMAL_LOG)
+        with open(reporter_js, 'w') as fd:
+            fd.write(karma.KARMA_MINIMAL_REPORTER_SOURCE)
+        stdout, stderr = node(
+            'var plugin = require(%s);\n'
+            'var Reporter = plugin["reporter:calmjs-minimal"][1];\n'
+            'var reporter = new Reporter({calmjsMinimal: {file: %s}});\n'
+            'var browser = {name: "Chrome"};\n'
+            'reporter.onBrowserLog(browser, "logged", "log");\n'
+            'reporter.onSpecComplete(browser, {\n'
+            '    suite: ["a"], description: "b", time: 5, success: true});\n'
+            'reporter.onSpecComplete(browser, {\n'
+            '    suite: ["a"], description: "c", time: 1, success: false,\n'
+            '    log: ["Error: failure\\n    at c.js:1"]});\n'
+            'reporter.onSpecComplete(browser, {\n'
+            '    suite: ["a"], description: "d", skipped: true});\n'
+            'reporter.onRunComplete([], {});\n'
+            'reporter.onExit(function() {});\n'
+            % (json.dumps(reporter_js), json.dumps(target))
+        )
+        lines = stdout.splitlines()
+        self.assertEqual([
+            'FAILED Chrome: a > c',
+            '    Error: failure',
+            '        at c.js:1',
+        ], lines[:3])
+        self.assertTrue(lines[3].startswith(
+            'Executed 3 tests: 1 passed, 1 failed, 1 skipped ('))
+        self.assertEqual(4, len(lines))
+
+        with open(target) as fd:
+            detail = fd.read()
+        self.assertIn('Chrome LOG: logged\n', detail)
+        self.assertIn('PASSED Chrome: a > b (5 ms)\n', detail)
+        self.assertIn('SKIPPED Chrome: a > d', detail)
+        self.assertIn('FAILED Chrome: a > c\n', detail)
+        self.assertIn(lines[3], detail)
+
+
+class BenchReporterTestCase(unittest.TestCase):
+
+    def test_apply_bench_config(self):
+        config = karma.build_base_config()
+        config['frameworks'].append('extra')
+        karma.apply_bench_config(config, '/build', '/build/karma.bench.json')
+        self.assertEqual(['benchmark', 'extra'], config['frameworks'])
+        self.assertEqual(
+            ['karma-*', join('/build', 'karma.bench.reporter.js')],
+            config['plugins'])
+        self.assertEqual(['calmjs-bench'], config['reporters'])
+        self.assertEqual(
+            {'file': '/build/karma.bench.json'}, config['calmjsBench'])
+
+    def test_read_bench_results(self):
+        target = join(mkdtemp(self), 'karma.bench.json')
+        self.assertIsNone(karma.read_bench_results(target))
+        with open(target, 'w') as fd:
+            fd.write('{}')
+        self.assertIsNone(karma.read_bench_results(target))
+        with open(target, 'w') as fd:
+            fd.write('{"results": []}')
+        self.assertEqual([], karma.read_bench_results(target))
+
+    @unittest.skipIf(get_node_version() is None, 'node.js not found')
+    def test_bench_reporter(self):
+        build_dir = mkdtemp(self)
+        reporter_js = join(build_dir, karma.KARMA_BENCH_REPORTER_JS)
+        target = join(build_dir, karma.KARMA_BENCH_JSON)
+        with open(reporter_js, 'w') as fd:
+            fd.write(karma.KARMA_BENCH_REPORTER_SOURCE)
+        stdout, stderr = node(
+            'var plugin = require(%s);\n'
+            'var Reporter = plugin["reporter:calmjs-bench"][1];\n'
+            'var reporter = new Reporter({calmjsBench: {file: %s}});\n'
+            'var browser = {name: "Chrome"};\n'
+            'reporter.onSpecComplete(browser, {description: "test"});\n'
+            'reporter.onSpecComplete(browser, {benchmark: {\n'
+            '    suite: "a", name: "b", hz: 1000.5, stats: {\n'
+            '        rme: 1.25, mean: 0.001, deviation: 0.0001,\n'
+            '        sample: [0.001, 0.001]}}});\n'
+            'reporter.onRunComplete([], {});\n'
+            % (json.dumps(reporter_js), json.dumps(target))
+        )
+        self.assertEqual(
+            u'Chrome: a > b x 1000.50 ops/sec ±1.25% (2 samples)\n',
+            stdout)
+        self.assertEqual([{
+            'browser': 'Chrome', 'suite': 'a', 'name': 'b', 'hz': 1000.5,
+            'rme': 1.25, 'mean': 0.001, 'deviation': 0.0001, 'samples': 2,
+        }], karma.read_bench_results(target))
+
+
+class ArtifactsLoaderTestCase(unittest.TestCase):
+
+    def test_served_url(self):
+        build_dir = mkdtemp(self)
+        self.assertEqual('/base/a/b.js', karma.served_url(
+            join(build_dir, 'a', 'b.js'), build_dir))
+        other = join(mkdtemp(self), 'c.js')
+        self.assertEqual(
+            '/absolute' + ('' if other.startswith('/') else '/') +
+            other.replace('\\', '/'), karma.served_url(other, build_dir))
+
+    def test_artifacts_loader_files(self):
+        self.assertEqual([join('/build', 'karma.artifacts.loader.js'), {
+            'pattern': '/srv/example.js', 'included': False, 'served': True,
+            'watched': False,
+        }], karma.artifacts_loader_files(['/srv/example.js'], '/build'))
+
+    def test_apply_artifacts_reporter_config(self):
+        config = karma.build_base_config()
+        karma.apply_artifacts_reporter_config(
+            config, '/build', '/build/karma.artifacts.json')
+        self.assertEqual(
+            ['karma-*', join('/build', 'karma.artifacts.reporter.js')],
+            config['plugins'])
+        self.assertEqual(
+            ['spec', 'progress', 'calmjs-artifacts'], config['reporters'])
+        self.assertEqual(
+            {'file': '/build/karma.artifacts.json'},
+            config['calmjsArtifacts'])
+
+    @unittest.skipIf(get_node_version() is None, 'node.js not found')
+    def test_artifacts_loader_reporter(self):
+        build_dir = mkdtemp(self)
+        reporter_js = join(build_dir, karma.KARMA_ARTIFACTS_REPORTER_JS)
+        target = join(build_dir, karma.KARMA_ARTIFACTS_JSON)
+        with open(reporter_js, 'w') as fd:
+            fd.write(karma.KARMA_ARTIFACTS_REPORTER_SOURCE)
+        artifact = join(build_dir, 'example.js')
+        stdout, stderr = node(
+            'var plugin = require(%s);\n'
+            'var Reporter = plugin["reporter:calmjs-artifacts"][1];\n'
+            'var reporter = new Reporter({calmjsArtifacts: {file: %s}});\n'
+            'var browser = {name: "Chrome"};\n'
+            'global.__karma__ = {info: function(info) {\n'
+            '    reporter.onBrowserLog(browser, "ignored", "log");\n'
+            '    reporter.onBrowserLog(browser, info.log, info.type);\n'
+            '}};\n'
+            'var written = [];\n'
+            'global.document = {\n'
+            '    write: function(html) { written.push(html); },\n'
+            '    createElement: function() { return {}; }\n'
+            '};\n'
+            '%s\n'
+            '// the written scripts as they would be loaded in order.\n'
+            'written.join("").replace(\n'
+            '    /<script(?: src="([^"]*)")?>([^<]*)<\\/script>/g,\n'
+            '    function(match, src, body) {\n'
+            '        if (src) {\n'
+            '            global.loaded = src;\n'
+            '        } else {\n'
+            '            (0, eval)(body);\n'
+            '        }\n'
+            '    });\n'
+            'reporter.onRunComplete();\n'
+            'console.log(loaded);\n'
+            % (json.dumps(reporter_js), json.dumps(target),
+               karma.artifacts_loader_source([artifact], build_dir))
+        )
+        self.assertEqual('/base/example.js', stdout.strip())
+        timings = karma.read_outcome(target)['browsers']['Chrome']
+        self.assertEqual(1, len(timings))
+        self.assertEqual(artifact, timings[0]['path'])
+        # no resource timing for the fetch outside of the browsers.
+        self.assertIsNone(timings[0]['fetch'])
+        self.assertGreaterEqual(timings[0]['evaluate'], 0)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import unittest
+import json
+from os.path import join
+
+from calmjs.dev import loadtime
+from calmjs.testing.utils import mkdtemp
+from calmjs.utils import pretty_logging
+from calmjs.testing.mocks import StringIO
+
+
+class LoadTimeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = mkdtemp(self)
+        self.artifact = join(self.tmpdir, 'example.js')
+        with open(self.artifact, 'w') as fd:
+            fd.write('var example = 1;\n')
+
+    def test_summarize_load(self):
+        missing = join(self.tmpdir, 'missing.js')
+        artifacts = loadtime.summarize_load([self.artifact, missing], {
+            'Chrome': [{
+                'path': self.artifact, 'fetch': 1.5, 'evaluate': 2.0,
+            }],
+            'Firefox': [{
+                'path': self.artifact, 'fetch': None, 'evaluate': 1.0,
+            }],
+        })
+        self.assertEqual([{
+            'path': self.artifact,
+            'size': 17,
+            'browsers': {
+                'Chrome': {
+                    'fetch': 1.5, 'evaluate': 2.0, 'total': 3.5},
+                'Firefox': {
+                    'fetch': None, 'evaluate': 1.0, 'total': 1.0},
+            },
+        }, {
+            'path': missing,
+            'size': None,
+            'browsers': {},
+        }], artifacts)
+        self.assertEqual([
+            '%s: 17 bytes' % self.artifact,
+            '    Chrome: fetch 1.5 ms, parse and evaluate 2.0 ms',
+            '    Firefox: fetch n/a, parse and evaluate 1.0 ms',
+            '%s: n/a bytes' % missing,
+        ], loadtime.format_load(artifacts))
+
+    def test_load_budgets(self):
+        path = join(self.tmpdir, 'budgets.json')
+        with pretty_logging(logger='calmjs.dev', stream=StringIO()) as log:
+            self.assertEqual({}, loadtime.load_budgets(path))
+        self.assertIn('no artifact budgets found', log.getvalue())
+        with open(path, 'w') as fd:
+            fd.write('{')
+        with pretty_logging(logger='calmjs.dev', stream=StringIO()) as log:
+            self.assertEqual({}, loadtime.load_budgets(path))
+        self.assertIn('ignoring invalid artifact budgets', log.getvalue())
+        with open(path, 'w') as fd:
+            json.dump({'*': {'size': '1K'}}, fd)
+        self.assertEqual({'*': {'size': '1K'}}, loadtime.load_budgets(path))
+
+    def test_budget_for(self):
+        budgets = {
+            '*': {'size': '1M'},
+            'example.js': {'size': '200K', 'load': 50},
+            '/srv/other.js': {'load': 10},
+        }
+        self.assertEqual({'size': 204800, 'load': 50}, loadtime.budget_for(
+            budgets, '/srv/example.js'))
+        self.assertEqual({'load': 10}, loadtime.budget_for(
+            budgets, '/srv/other.js'))
+        self.assertEqual({'size': 1048576}, loadtime.budget_for(
+            budgets, '/srv/unknown.js'))
+        self.assertEqual({'size': 1048576}, loadtime.budget_for(
+            budgets, None))
+        self.assertIsNone(loadtime.budget_for({}, '/srv/example.js'))
+
+    def test_check_budget(self):
+        artifacts = [{
+            'path': 'example.js', 'size': 2048, 'browsers': {
+                'Chrome': {'total': 60.0}, 'Firefox': {'total': 20.0}},
+        }]
+        self.assertEqual([], loadtime.check_budget(artifacts, None))
+        self.assertEqual([], loadtime.check_budget(
+            artifacts, {'size': 4096, 'load': 100}))
+        exceeded = loadtime.check_budget(
+            artifacts, {'size': 1024, 'load': 50})
+        self.assertEqual([{
+            'path': 'example.js', 'browser': None, 'limit': 'size',
+            'value': 2048, 'budget': 1024,
+        }, {
+            'path': 'example.js', 'browser': 'Chrome', 'limit': 'load',
+            'value': 60.0, 'budget': 50,
+        }], exceeded)
+        self.assertEqual([
+            'example.js: size of 2048 bytes exceeds the budget of 1024 bytes',
+            'example.js (Chrome): load of 60.0 ms exceeds the budget of '
+            '50.0 ms',
+        ], loadtime.format_exceeded(exceeded))
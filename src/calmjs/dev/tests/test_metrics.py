@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import unittest
+import json
+from os.path import join
+
+from calmjs.toolchain import Spec
+from calmjs.testing.utils import mkdtemp
+
+from calmjs.dev import metrics
+
+
+class CoverageTestCase(unittest.TestCase):
+
+    def test_summarize_coverage(self):
+        summary = metrics.summarize_coverage({
+            'a.js': {
+                's': {'1': 1, '2': 0, '3': 2, '4': 0},
+                'f': {'1': 1},
+                'b': {'1': [1, 0]},
+                'statementMap': {
+                    '1': {'start': {'line': 1}},
+                    '2': {'start': {'line': 2}},
+                    '3': {'start': {'line': 3}},
+                    '4': {'start': {'line': 3}},
+                },
+            },
+        })
+        self.assertEqual({
+            'statements': 0.5,
+            'branches': 0.5,
+            'functions': 1.0,
+            'lines': 2.0 / 3,
+        }, summary)
+
+    def test_summarize_coverage_empty(self):
+        self.assertEqual({
+            'statements': None,
+            'branches': None,
+            'functions': None,
+            'lines': None,
+        }, metrics.summarize_coverage({}))
+
+    def test_load_coverage_summary(self):
+        self.assertIsNone(metrics.load_coverage_summary(None))
+        target = join(mkdtemp(self), 'coverage.json')
+        self.assertIsNone(metrics.load_coverage_summary(target))
+        with open(target, 'w') as fd:
+            json.dump({'a.js': {'s': {'1': 1}}}, fd)
+        self.assertEqual(
+            1.0, metrics.load_coverage_summary(target)['statements'])
+
+
+class RunMetricsTestCase(unittest.TestCase):
+
+    def test_run_metrics(self):
+        spec = Spec(
+            test_package_names=['pkg1', 'pkg2'],
+            export_target='pkg.js',
+            karma_browsers=['Chrome'],
+            karma_started=100.0,
+            karma_duration=12.5,
+            karma_return_code=0,
+            karma_outcome={
+                'passed': 3, 'failed': 0, 'skipped': 1,
+                'browser_registered': 102500,
+            },
+        )
+        result = metrics.run_metrics(spec)
+        self.assertEqual('karma_run', result['type'])
+        self.assertEqual({
+            'packages': 'pkg1,pkg2',
+            'export_target': 'pkg.js',
+            'browsers': 'Chrome',
+        }, result['labels'])
+        self.assertEqual(12.5, result['duration_seconds'])
+        self.assertEqual(2.5, result['startup_seconds'])
+        self.assertEqual(
+            {'passed': 3, 'failed': 0, 'skipped': 1}, result['tests'])
+        self.assertIsNone(result['coverage'])
+
+    def test_run_metrics_no_outcome(self):
+        result = metrics.run_metrics(Spec(karma_return_code=1))
+        self.assertIsNone(result['tests'])
+        self.assertIsNone(result['startup_seconds'])
+        self.assertEqual('', result['labels']['packages'])
+
+    def test_run_metrics_split_runs(self):
+        result = metrics.run_metrics(Spec(karma_split_runs=[
+            {'test_module_paths': ['a', 'b'], 'crashed': True,
+             'outcome': {'passed': 1}},
+            {'test_module_paths': ['a'], 'crashed': False,
+             'outcome': {'passed': 2, 'failed': 1, 'skipped': 0}},
+            {'test_module_paths': ['b'], 'crashed': True, 'outcome': None},
+        ]))
+        # the outcome of the crashed run that was split is excluded.
+        self.assertEqual(
+            {'passed': 2, 'failed': 1, 'skipped': 0}, result['tests'])
+
+
+class VerificationMetricsTestCase(unittest.TestCase):
+
+    def test_verification_metrics(self):
+        run = {'type': 'karma_run'}
+        result = metrics.verification_metrics({
+            'success': False,
+            'duration': 3.0,
+            'packages': {
+                'pkg2': {'export_targets': [
+                    {'status': 'passed', 'return_code': 0, 'cache_hit': True},
+                ]},
+                'pkg1': {'export_targets': [
+                    {'status': 'passed', 'return_code': 0, 'metrics': run},
+                    {'status': 'failed', 'return_code': 1},
+                    {'status': 'skipped', 'return_code': None},
+                ]},
+            },
+        })
+        self.assertEqual({'packages': 'pkg1,pkg2'}, result['labels'])
+        self.assertFalse(result['success'])
+        self.assertEqual(
+            {'passed': 2, 'failed': 1, 'skipped': 1},
+            result['export_targets'])
+        self.assertEqual(1, result['cache_hits'])
+        self.assertEqual(2, result['cache_misses'])
+        self.assertEqual([run], result['runs'])
+
+
+class ExportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = {
+            'type': 'karma_run',
+            'timestamp': 0,
+            'labels': {'packages': 'pkg', 'export_target': 'a"b'},
+            'duration_seconds': 1.5,
+            'return_code': 0,
+            'startup_seconds': None,
+            'tests': {'passed': 2, 'failed': 0},
+            'coverage': None,
+        }
+
+    def test_format_prometheus(self):
+        self.assertEqual(
+            '# TYPE calmjs_dev_karma_duration_seconds gauge\n'
+            'calmjs_dev_karma_duration_seconds'
+            '{export_target="a\\"b",packages="pkg"} 1.5\n'
+            '# TYPE calmjs_dev_karma_return_code gauge\n'
+            'calmjs_dev_karma_return_code'
+            '{export_target="a\\"b",packages="pkg"} 0.0\n'
+            '# TYPE calmjs_dev_karma_tests gauge\n'
+            'calmjs_dev_karma_tests'
+            '{export_target="a\\"b",packages="pkg",result="failed"} 0.0\n'
+            'calmjs_dev_karma_tests'
+            '{export_target="a\\"b",packages="pkg",result="passed"} 2.0\n',
+            metrics.format_prometheus(self.metrics),
+        )
+
+    def test_format_prometheus_verification(self):
+        text = metrics.format_prometheus({
+            'type': 'verification',
+            'labels': {'packages': 'pkg'},
+            'duration_seconds': 3.0,
+            'success': True,
+            'export_targets': {'passed': 1},
+            'cache_hits': 0,
+            'cache_misses': 1,
+            'runs': [self.metrics],
+        })
+        self.assertIn('calmjs_dev_verify_success{packages="pkg"} 1.0\n', text)
+        self.assertIn(
+            'calmjs_dev_verify_executions{cache="miss",packages="pkg"} 1.0\n',
+            text)
+        self.assertIn('calmjs_dev_karma_duration_seconds{', text)
+        # the type is only declared once per metric.
+        self.assertEqual(
+            1, text.count('# TYPE calmjs_dev_verify_executions gauge'))
+
+    def test_export_metrics(self):
+        tmpdir = mkdtemp(self)
+        prometheus = join(tmpdir, 'karma.prom')
+        jsonl = join(tmpdir, 'karma.jsonl')
+        metrics.export_metrics(self.metrics, prometheus=prometheus)
+        metrics.export_metrics(self.metrics, jsonl=jsonl)
+        metrics.export_metrics(self.metrics, jsonl=jsonl)
+        with open(prometheus) as fd:
+            self.assertEqual(
+                metrics.format_prometheus(self.metrics), fd.read())
+        with open(jsonl) as fd:
+            lines = fd.read().splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertEqual(self.metrics, json.loads(lines[1]))
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import unittest
+import json
+import sys
+from os.path import join
+
+from calmjs.dev import plan
+
+from calmjs.testing.utils import mkdtemp
+from calmjs.testing.utils import stub_stdouts
+
+
+class CostKeyTestCase(unittest.TestCase):
+
+    def test_cost_key(self):
+        key = plan.cost_key({}, ['b.js', 'a.js'])
+        self.assertEqual(key, plan.cost_key({}, ['a.js', 'b.js']))
+        self.assertEqual(key, plan.cost_key({'build_dir': 'x'}, [
+            'a.js', 'b.js']))
+        self.assertNotEqual(key, plan.cost_key({}, ['a.js']))
+        self.assertNotEqual(key, plan.cost_key(
+            {'coverage_enable': True}, ['a.js', 'b.js']))
+
+
+class TimingsTestCase(unittest.TestCase):
+
+    def test_record_timing(self):
+        cache_dir = mkdtemp(self)
+        self.assertEqual({}, plan.load_timings(cache_dir))
+        plan.record_timing(cache_dir, 'key', 2.0)
+        plan.record_timing(cache_dir, 'key', 4.0)
+        timings = plan.load_timings(cache_dir)
+        self.assertEqual(
+            {'runs': 2, 'last': 4.0, 'mean': 3.0}, timings['key'])
+        self.assertEqual(3.0, plan.estimate_duration(timings, 'key'))
+        self.assertIsNone(plan.estimate_duration(timings, 'other'))
+
+    def test_load_timings_unavailable(self):
+        self.assertEqual({}, plan.load_timings(None))
+        cache_dir = mkdtemp(self)
+        with open(join(cache_dir, plan.TIMINGS_STORE), 'w') as fd:
+            fd.write('{')
+        self.assertEqual({}, plan.load_timings(cache_dir))
+
+
+class PlanTestCase(unittest.TestCase):
+
+    def test_summarize_plan(self):
+        result = plan.summarize_plan([
+            {'estimated_duration': 1.5},
+            {'estimated_duration': None},
+            {'skip_reason': 'artifact not found'},
+            {'estimated_duration': 2.0},
+        ])
+        self.assertEqual(3.5, result['estimated_duration'])
+        self.assertEqual(1, result['unestimated'])
+
+    def test_write_plan(self):
+        result = plan.summarize_plan([{'estimated_duration': 1.0}])
+        target = join(mkdtemp(self), 'plan.json')
+        plan.write_plan(result, target)
+        with open(target) as fd:
+            self.assertEqual(result, json.load(fd))
+
+        stub_stdouts(self)
+        plan.write_plan(result, '-')
+        self.assertEqual(result, json.loads(sys.stdout.getvalue()))
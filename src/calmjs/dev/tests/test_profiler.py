@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import unittest
+import pstats
+from os.path import join
+from time import sleep
+
+from calmjs.dev import profiler
+from calmjs.testing.mocks import StringIO
+from calmjs.testing.utils import mkdtemp
+
+
+class PausableClockTestCase(unittest.TestCase):
+
+    def test_clock(self):
+        now = [10.0]
+        clock = profiler.PausableClock(timer=lambda: now[0])
+        self.assertEqual(10.0, clock())
+        clock.pause()
+        now[0] = 15.0
+        self.assertEqual(10.0, clock())
+        # nested pauses, such as for the concurrent executions.
+        clock.pause()
+        now[0] = 20.0
+        clock.resume()
+        self.assertEqual(10.0, clock())
+        clock.resume()
+        self.assertEqual(10.0, clock())
+        now[0] = 21.0
+        self.assertEqual(11.0, clock())
+
+    def test_paused_without_profiling(self):
+        with profiler.paused():
+            pass
+
+
+def wait_on_child():
+    with profiler.paused():
+        sleep(0.2)
+
+
+class ProfilingTestCase(unittest.TestCase):
+
+    def test_profiling(self):
+        target = join(mkdtemp(self), 'karma.pstats')
+        stream = StringIO()
+        with profiler.profiling(target, limit=5, stream=stream):
+            wait_on_child()
+        self.assertEqual([], profiler._clocks)
+        self.assertIn('wait_on_child', stream.getvalue())
+
+        stats = pstats.Stats(target).stats
+        cumulative = [
+            value[3] for key, value in stats.items()
+            if key[2] == 'wait_on_child'
+        ]
+        self.assertEqual(1, len(cumulative))
+        # the time paused is excluded.
+        self.assertLess(cumulative[0], 0.1)
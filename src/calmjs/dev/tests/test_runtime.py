@@ -35,15 +35,21 @@ from calmjs.toolchain import CALMJS_TOOLCHAIN_ADVICE
 from calmjs.utils import pretty_logging
 
 from calmjs.dev import cli
+from calmjs.dev import history
 from calmjs.dev.cli import KarmaDriver
 from calmjs.dev.toolchain import TestToolchain
+from calmjs.dev.toolchain import KarmaBenchToolchain
 from calmjs.dev.toolchain import KarmaToolchain
+from calmjs.dev.toolchain import prepare_spec_artifact_fingerprints
 from calmjs.dev.toolchain import prepare_spec_artifacts
+from calmjs.dev.toolchain import prepare_spec_from_runtime
 from calmjs.dev.toolchain import update_spec_for_karma
 from calmjs.dev.artifact import ArtifactTestRegistry
 from calmjs.dev.karma import DEFAULT_COVER_REPORT_TYPE_OPTIONS
 from calmjs.dev.karma import KARMA_CONF_TEMPLATE
 from calmjs.dev.runtime import init_argparser_common
+from calmjs.dev.runtime import BenchToolchainRuntime
+from calmjs.dev.runtime import KarmaHistoryRuntime
 from calmjs.dev.runtime import KarmaRuntime
 from calmjs.dev.runtime import TestToolchainRuntime
 from calmjs.dev.runtime import KarmaArtifactRuntime
@@ -85,6 +91,72 @@ class TestCommonArgparser(unittest.TestCase):
         # check for deprecated option
         self.assertIsNone(self.parse([]).coverage_type)
 
+    def test_parse_memory_limit_split_on_crash(self):
+        self.assertIsNone(self.parse([]).karma_memory_limit)
+        self.assertFalse(self.parse([]).karma_split_on_crash)
+        parsed = self.parse(['--memory-limit', '512M', '--split-on-crash'])
+        self.assertEqual(512 << 20, parsed.karma_memory_limit)
+        self.assertTrue(parsed.karma_split_on_crash)
+
+    def test_parse_metrics(self):
+        self.assertIsNone(self.parse([]).karma_metrics_prometheus)
+        self.assertIsNone(self.parse([]).karma_metrics_jsonl)
+        parsed = self.parse([
+            '--metrics-prometheus', 'karma.prom',
+            '--metrics-jsonl', 'karma.jsonl',
+        ])
+        self.assertEqual('karma.prom', parsed.karma_metrics_prometheus)
+        self.assertEqual('karma.jsonl', parsed.karma_metrics_jsonl)
+
+    def test_parse_history(self):
+        self.assertIsNone(self.parse([]).karma_history)
+        parsed = self.parse(['--history', 'history.db'])
+        self.assertEqual('history.db', parsed.karma_history)
+
+    def test_parse_quarantine(self):
+        self.assertIsNone(self.parse([]).karma_quarantine)
+        self.assertIsNone(self.parse([]).karma_quarantine_mode)
+        parsed = self.parse([
+            '--quarantine', 'quarantine.json',
+            '--quarantine-mode', 'separate',
+        ])
+        self.assertEqual('quarantine.json', parsed.karma_quarantine)
+        self.assertEqual('separate', parsed.karma_quarantine_mode)
+
+    def test_parse_junit_xml(self):
+        self.assertIsNone(self.parse([]).karma_junit_xml)
+        parsed = self.parse(['--junit-xml', 'junit.xml'])
+        self.assertEqual('junit.xml', parsed.karma_junit_xml)
+
+    def test_parse_measure_artifacts(self):
+        self.assertFalse(self.parse([]).karma_measure_artifacts)
+        self.assertIsNone(self.parse([]).karma_artifact_budgets)
+        parsed = self.parse([
+            '--measure-artifacts', '--artifact-budgets', 'budgets.json'])
+        self.assertTrue(parsed.karma_measure_artifacts)
+        self.assertEqual('budgets.json', parsed.karma_artifact_budgets)
+
+    def test_parse_node(self):
+        parsed = self.parse([])
+        self.assertIsNone(parsed.karma_node_options)
+        self.assertFalse(parsed.karma_node_cpu_prof)
+        self.assertFalse(parsed.karma_node_heap_prof)
+        self.assertIsNone(parsed.karma_node_prof_dir)
+        parsed = self.parse([
+            '--node-options=--max-old-space-size=4096', '--node-cpu-prof',
+            '--node-heap-prof', '--node-prof-dir', 'profiles',
+        ])
+        self.assertEqual(
+            '--max-old-space-size=4096', parsed.karma_node_options)
+        self.assertTrue(parsed.karma_node_cpu_prof)
+        self.assertTrue(parsed.karma_node_heap_prof)
+        self.assertEqual('profiles', parsed.karma_node_prof_dir)
+
+    def test_parse_reporter(self):
+        self.assertIsNone(self.parse([]).karma_reporter)
+        parsed = self.parse(['--reporter', 'minimal'])
+        self.assertEqual('minimal', parsed.karma_reporter)
+
     def test_parse_default_cover_report_type_legacy(self):
         import warnings
         with warnings.catch_warnings(record=True) as w:
@@ -159,6 +231,18 @@ class TestToolchainRuntimeTestCase(unittest.TestCase):
         spec = rt.kwargs_to_spec()
         self.assertTrue(isinstance(spec, Spec))
 
+    def test_kwargs_to_spec_build_cache_dir(self):
+        cache_dir = mkdtemp(self)
+        rt = TestToolchainRuntime(TestToolchain())
+        spec = rt.kwargs_to_spec(
+            build_cache_dir=cache_dir, test_package_names=['demo'])
+        self.assertTrue(spec['build_dir'].startswith(realpath(cache_dir)))
+        # only created when the toolchain is to be executed.
+        self.assertFalse(exists(spec['build_dir']))
+        self.assertEqual(spec['build_dir'], rt.kwargs_to_spec(
+            build_cache_dir=cache_dir, test_package_names=['demo'],
+        )['build_dir'])
+
     def test_prepare_spec_artifacts(self):
         stub_stdouts(self)
         remember_cwd(self)
@@ -179,6 +263,13 @@ class TestToolchainRuntimeTestCase(unittest.TestCase):
 
         # note that the full path is now specified.
         self.assertEqual(spec['artifact_paths'], [real])
+        # the fingerprints of the artifacts are only made available
+        # when requested.
+        self.assertNotIn('artifact_fingerprints', spec)
+        self.assertEqual(
+            [real], list(prepare_spec_artifact_fingerprints(spec)))
+        self.assertIn('artifact_fingerprints', spec)
+        self.assertIn('fingerprint_cache', spec)
         self.assertIn('does not exists', log.getvalue())
         self.assertIn(fake, log.getvalue())
 
@@ -213,6 +304,256 @@ class TestToolchainRuntimeTestCase(unittest.TestCase):
         ])
 
 
+class BenchToolchainRuntimeTestCase(unittest.TestCase):
+
+    def test_kwargs_to_spec(self):
+        rt = BenchToolchainRuntime(KarmaBenchToolchain())
+        spec = rt.kwargs_to_spec()
+        self.assertTrue(spec['karma_bench'])
+
+    def test_parse(self):
+        rt = BenchToolchainRuntime(KarmaBenchToolchain())
+        argparser = ArgumentParser()
+        rt.init_argparser(argparser)
+        parsed = argparser.parse_known_args([])[0]
+        self.assertIsNone(parsed.karma_bench_baseline)
+        self.assertIsNone(parsed.karma_bench_threshold)
+        parsed = argparser.parse_known_args([
+            '--baseline', 'baseline.json', '--bench-output', 'bench.json',
+            '--bench-threshold', '0.2',
+        ])[0]
+        self.assertEqual('baseline.json', parsed.karma_bench_baseline)
+        self.assertEqual('bench.json', parsed.karma_bench_output)
+        self.assertEqual(0.2, parsed.karma_bench_threshold)
+
+    def test_prepare_spec_from_runtime(self):
+        rt = BenchToolchainRuntime(KarmaBenchToolchain())
+        spec = prepare_spec_from_runtime(
+            rt, karma_bench_baseline='baseline.json')
+        self.assertTrue(spec['karma_bench'])
+        self.assertEqual('baseline.json', spec['karma_bench_baseline'])
+
+
+class KarmaArtifactRuntimeTestCase(unittest.TestCase):
+
+    def test_run_verify_report(self):
+        from calmjs.dev import runtime
+        calls = []
+
+        def report(package_names, **kwargs):
+            calls.append((package_names, kwargs))
+            return {'success': False, 'packages': {}}
+
+        stub_item_attr_value(
+            self, runtime, 'karma_verify_package_artifacts_report', report)
+        target = join(mkdtemp(self), 'report.json')
+        rt = KarmaArtifactRuntime()
+        self.assertFalse(rt.run(
+            package_names=['pkg'], keep_going=True, verify_report=target))
+        self.assertEqual([(['pkg'], {'keep_going': True})], calls)
+        with open(target) as fd:
+            self.assertEqual(
+                {'success': False, 'packages': {}}, json.load(fd))
+
+    def test_run_junit_xml(self):
+        from calmjs.dev import runtime
+        calls = []
+
+        def report(package_names, **kwargs):
+            calls.append(sorted(kwargs))
+            kwargs['karma_junit_writer'].write_testsuite('pkg', [])
+            return {'success': True, 'packages': {}}
+
+        stub_item_attr_value(
+            self, runtime, 'karma_verify_package_artifacts_report', report)
+        target = join(mkdtemp(self), 'junit.xml')
+        rt = KarmaArtifactRuntime()
+        self.assertTrue(rt.run(package_names=['pkg'], karma_junit_xml=target))
+        self.assertEqual([['karma_junit_writer']], calls)
+        with open(target) as fd:
+            self.assertIn('<testsuite ', fd.read())
+
+    def test_run_spool(self):
+        from calmjs.dev import runtime
+        calls = []
+        stub_item_attr_value(
+            self, runtime, 'karma_spool_enqueue',
+            lambda *a, **kw: calls.append(('enqueue', a, kw)))
+        stub_item_attr_value(
+            self, runtime, 'karma_spool_work',
+            lambda *a, **kw: calls.append(('work', a, kw)) or True)
+        rt = KarmaArtifactRuntime()
+        with pretty_logging(
+                logger='calmjs.dev', stream=mocks.StringIO()) as log:
+            self.assertFalse(rt.run(
+                package_names=['pkg'], verify_spool='work'))
+        self.assertIn('spool directory must be specified', log.getvalue())
+        self.assertTrue(rt.run(
+            package_names=['pkg'], verify_spool='enqueue',
+            verify_spool_dir='spool', karma_browsers=['Firefox'],
+        ))
+        self.assertTrue(rt.run(
+            package_names=['pkg'], verify_spool='work',
+            verify_spool_dir='spool', verify_spool_lease=60.0,
+        ))
+        self.assertEqual([
+            ('enqueue', ('spool', ['pkg']), {'karma_browsers': ['Firefox']}),
+            ('work', ('spool',), {'lease': 60.0}),
+        ], calls)
+
+
+class KarmaRuntimePlanTestCase(unittest.TestCase):
+
+    def test_run_runtime_plan(self):
+        stub_stdouts(self)
+        stub_mod_call(self, cli)
+        target = join(mkdtemp(self), 'plan.json')
+        rt = KarmaRuntime(KarmaDriver())
+        spec = rt._run_runtime(
+            TestToolchainRuntime(KarmaToolchain()),
+            test_package_names=['calmjs.dev'], karma_plan=target,
+        )
+        # karma not invoked.
+        self.assertIsNone(self.call_args)
+        self.assertNotIn('karma_return_code', spec)
+        with open(target) as fd:
+            result = json.load(fd)
+        self.assertEqual(1, len(result['executions']))
+        self.assertEqual(
+            ['calmjs.dev'], result['executions'][0]['test_package_names'])
+
+    def test_run_runtime_plan_build_cache_dir(self):
+        stub_stdouts(self)
+        stub_mod_call(self, cli)
+        cache_dir = mkdtemp(self)
+        target = join(mkdtemp(self), 'plan.json')
+        rt = KarmaRuntime(KarmaDriver())
+        spec = rt._run_runtime(
+            TestToolchainRuntime(KarmaToolchain()),
+            test_package_names=['calmjs.dev'], karma_plan=target,
+            build_cache_dir=cache_dir,
+        )
+        self.assertTrue(spec['build_dir'].startswith(realpath(cache_dir)))
+        # the keyed build directory is not created for the plan.
+        self.assertEqual([], os.listdir(cache_dir))
+
+
+class KarmaRuntimeNodeProfileTestCase(unittest.TestCase):
+
+    def test_run_runtime_node_profiles(self):
+        stub_stdouts(self)
+        stub_base_which(self, join(mkdtemp(self), 'karma'))
+        cwd = realpath(mkdtemp(self))
+        remember_cwd(self)
+        os.chdir(cwd)
+
+        def call(args, **kw):
+            prof_dir = [
+                arg for arg in args if arg.startswith('--cpu-prof-dir=')
+            ][0].split('=', 1)[1]
+            with open(join(prof_dir, 'karma.cpuprofile'), 'w') as fd:
+                fd.write('{}')
+            return 0
+
+        stub_item_attr_value(self, cli, 'call', call)
+        rt = KarmaRuntime(KarmaDriver())
+        spec = rt._run_runtime(
+            TestToolchainRuntime(KarmaToolchain()),
+            test_package_names=['calmjs.dev'], karma_node_cpu_prof=True,
+        )
+        # the temporary build directory was removed, but not profiles.
+        self.assertFalse(exists(spec['build_dir']))
+        self.assertEqual([
+            join(cwd, 'node-profiles', 'karma.cpuprofile'),
+        ], spec['karma_node_profiles'])
+        self.assertTrue(exists(spec['karma_node_profiles'][0]))
+
+
+class KarmaRuntimeProfileTestCase(unittest.TestCase):
+
+    def test_run_profile_python(self):
+        stub_stdouts(self)
+        target = join(mkdtemp(self), 'karma.pstats')
+        rt = KarmaRuntime(KarmaDriver())
+        calls = []
+
+        def run(argparser, **kwargs):
+            calls.append(kwargs)
+            return True
+
+        rt._run = run
+        with pretty_logging(
+                logger='calmjs.dev', stream=mocks.StringIO()) as log:
+            self.assertTrue(rt.run(
+                None, karma_profile_python=target,
+                karma_profile_python_limit=5, karma_runtime='run'))
+        # the profile options are not passed on.
+        self.assertEqual([{'karma_runtime': 'run'}], calls)
+        self.assertTrue(exists(target))
+        self.assertIn('excluding the time waiting on karma', log.getvalue())
+        self.assertIn('cumulative', sys.stdout.getvalue())
+
+    def test_run_no_profile_python(self):
+        stub_stdouts(self)
+        rt = KarmaRuntime(KarmaDriver())
+        rt._run = lambda argparser, **kwargs: kwargs
+        self.assertEqual({'karma_runtime': 'run'}, rt.run(
+            None, karma_profile_python=None, karma_runtime='run'))
+        self.assertEqual('', sys.stdout.getvalue())
+
+
+class KarmaHistoryRuntimeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = join(mkdtemp(self), 'history.db')
+        for duration in (10, 11, 9, 10, 12, 10, 40):
+            history.record_run(self.path, Spec(
+                test_package_names=['pkg'],
+                karma_outcome={'results': [{
+                    'browser': 'Chrome', 'suite': 'suite', 'name': 'test',
+                    'time': duration, 'status': 'passed',
+                }]},
+            ))
+
+    def test_report(self):
+        stub_stdouts(self)
+        rt = KarmaRuntime(KarmaDriver())
+        with pretty_logging(
+                logger='calmjs.dev', stream=mocks.StringIO()) as log:
+            self.assertTrue(rt(['history', '--history', self.path]))
+        self.assertIn('pkg [] Chrome: suite > test', sys.stdout.getvalue())
+        self.assertIn('found 1 duration regression(s)', log.getvalue())
+
+    def test_report_fail_threshold(self):
+        stub_stdouts(self)
+        rt = KarmaHistoryRuntime()
+        with pretty_logging(
+                logger='calmjs.dev', stream=mocks.StringIO()) as log:
+            self.assertTrue(rt([
+                '--history', self.path, '--fail-threshold', '5']))
+            self.assertFalse(rt([
+                '--history', self.path, '--fail-threshold', '3']))
+        self.assertIn('1 duration regression(s) at or above', log.getvalue())
+
+    def test_update_quarantine(self):
+        stub_stdouts(self)
+        target = join(mkdtemp(self), 'quarantine.json')
+        with pretty_logging(
+                logger='calmjs.dev', stream=mocks.StringIO()) as log:
+            self.assertTrue(KarmaHistoryRuntime()([
+                '--history', self.path, '--update-quarantine', target]))
+        self.assertIn('found 0 flaky test(s)', log.getvalue())
+        with open(target) as fd:
+            self.assertEqual({'tests': []}, json.load(fd))
+
+    def test_report_no_history(self):
+        stub_stdouts(self)
+        with pretty_logging(
+                logger='calmjs.dev', stream=mocks.StringIO()) as log:
+            self.assertFalse(KarmaHistoryRuntime()([]))
+        self.assertIn('history database must be specified', log.getvalue())
+
+
 class BaseRuntimeTestCase(unittest.TestCase):
 
     def test_update_spec_for_karma(self):
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import unittest
+import os
+import subprocess
+import sys
+
+from calmjs.dev import rusage
+
+
+@unittest.skipIf(
+    rusage.resource is None or not hasattr(os, 'wait4'),
+    'resource usage of processes not available')
+class CallTestCase(unittest.TestCase):
+
+    def test_call(self):
+        usages = []
+        self.assertEqual(0, rusage.call([
+            sys.executable, '-c', 'sum(range(3000000))'], usages=usages))
+        self.assertEqual(3, rusage.call([
+            sys.executable, '-c', 'import sys; sys.exit(3)'], usages=usages))
+        self.assertEqual(2, len(usages))
+        usage = usages[0]
+        self.assertGreater(usage['user_time'] + usage['system_time'], 0)
+        self.assertGreater(usage['max_rss'], 0)
+        self.assertGreaterEqual(usage['voluntary_context_switches'], 0)
+        self.assertGreaterEqual(usage['involuntary_context_switches'], 0)
+
+    def test_call_max_rss_per_process(self):
+        usages = []
+        rusage.call([
+            sys.executable, '-c', 'bytearray(256 << 20)'], usages=usages)
+        rusage.call([sys.executable, '-c', 'pass'], usages=usages)
+        # the peak of the earlier, larger process is not reported.
+        self.assertLess(usages[1]['max_rss'], usages[0]['max_rss'])
+
+    def test_call_signaled(self):
+        usages = []
+        self.assertEqual(-9, rusage.call([
+            sys.executable, '-c',
+            'import os; os.kill(os.getpid(), 9)'], usages=usages))
+        self.assertEqual(1, len(usages))
+
+    def test_call_without_usages(self):
+        self.assertEqual(0, rusage.call([sys.executable, '-c', 'pass']))
+
+
+class CombineUsageTestCase(unittest.TestCase):
+
+    def test_combine_usage(self):
+        usage = {
+            'user_time': 1.0,
+            'system_time': 0.5,
+            'max_rss': 100,
+            'voluntary_context_switches': 2,
+            'involuntary_context_switches': 1,
+        }
+        self.assertEqual(dict(usage, user_time=2.0, system_time=1.0, **{
+            'max_rss': 200,
+            'voluntary_context_switches': 4,
+            'involuntary_context_switches': 2,
+        }), rusage.combine_usage([usage, dict(usage, max_rss=200)]))
+        self.assertIsNone(rusage.combine_usage([]))
+
+
+class SummarizeUsageTestCase(unittest.TestCase):
+
+    def make_usage(self, cpu, rss):
+        return {
+            'user_time': cpu,
+            'system_time': cpu / 2,
+            'max_rss': rss,
+            'voluntary_context_switches': 10,
+            'involuntary_context_switches': 1,
+        }
+
+    def test_summarize_usage(self):
+        summary = rusage.summarize_usage([
+            self.make_usage(2.0, 100), None, self.make_usage(1.0, 300)])
+        self.assertEqual({
+            'user_time': 3.0,
+            'system_time': 1.5,
+            'max_rss': 300,
+            'voluntary_context_switches': 20,
+            'involuntary_context_switches': 2,
+            'runs': 2,
+        }, summary)
+
+    def test_summarize_usage_empty(self):
+        summary = rusage.summarize_usage([None])
+        self.assertEqual(0, summary['runs'])
+        self.assertEqual(0, summary['max_rss'])
+        self.assertEqual(0, summary['user_time'])
+
+
+@unittest.skipIf(
+    rusage.memory_limiter(1) is None, 'memory limits not available')
+class MemoryLimiterTestCase(unittest.TestCase):
+
+    def test_memory_limiter(self):
+        args = [sys.executable, '-c', 'bytearray(256 << 20)']
+        self.assertEqual(0, subprocess.call(args))
+        with open(os.devnull, 'w') as devnull:
+            self.assertNotEqual(0, subprocess.call(
+                args, stderr=devnull,
+                preexec_fn=rusage.memory_limiter(96 << 20),
+            ))
+
+    def test_memory_limiter_unset(self):
+        self.assertIsNone(rusage.memory_limiter(None))
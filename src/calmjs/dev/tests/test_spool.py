@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import unittest
+import json
+import os
+import socket
+from multiprocessing import Pool
+from multiprocessing import Process
+from os.path import exists
+from os.path import join
+
+from calmjs.dev import spool
+
+from calmjs.testing.utils import mkdtemp
+
+
+def claim_all(path):
+    queue = spool.Spool(path)
+    claimed = []
+    for job_id, job in iter(queue.claim, None):
+        queue.complete(job_id, {'job': job['n'], 'worker': os.getpid()})
+        claimed.append(job_id)
+    return claimed
+
+
+class SpoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = join(mkdtemp(self), 'spool')
+        self.queue = spool.Spool(self.path)
+
+    def test_enqueue_claim_complete(self):
+        self.queue.enqueue('job1', {'n': 1})
+        self.queue.enqueue('job2', {'n': 2})
+        self.assertEqual(
+            {'pending': 2, 'running': 0, 'results': 0}, self.queue.counts())
+
+        self.assertEqual(('job1', {'n': 1}), self.queue.claim())
+        self.assertEqual(
+            {'pending': 1, 'running': 1, 'results': 0}, self.queue.counts())
+        self.queue.complete('job1', {'status': 'passed'})
+        self.assertEqual(
+            {'pending': 1, 'running': 0, 'results': 1}, self.queue.counts())
+        self.assertEqual([{'status': 'passed'}], self.queue.results())
+
+        self.assertEqual('job2', self.queue.claim()[0])
+        self.assertIsNone(self.queue.claim())
+
+    def test_claim_taken(self):
+        self.queue.enqueue('job1', {'n': 1})
+        other = spool.Spool(self.path)
+        self.assertEqual('job1', other.claim()[0])
+        self.assertIsNone(self.queue.claim())
+
+    def test_enqueue_again(self):
+        self.queue.enqueue('job1', {'n': 1})
+        self.queue.claim()
+        # the running job is not enqueued again.
+        self.assertFalse(self.queue.enqueue('job1', {'n': 1}))
+        self.assertEqual(
+            {'pending': 0, 'running': 1, 'results': 0}, self.queue.counts())
+        self.queue.complete('job1', {'status': 'failed'})
+        # while the result of the completed job is discarded.
+        self.assertTrue(self.queue.enqueue('job1', {'n': 1}))
+        self.assertEqual(
+            {'pending': 1, 'running': 0, 'results': 0}, self.queue.counts())
+        self.assertEqual([], self.queue.results())
+
+    def test_reclaim_worker_gone(self):
+        self.queue.enqueue('job1', {'n': 1})
+        self.queue.enqueue('job2', {'n': 2})
+        self.queue.claim('%s:%d' % (socket.gethostname(), os.getpid()))
+        self.queue.claim('elsewhere:1')
+        self.assertEqual([], self.queue.reclaim())
+
+        # a process that is no longer alive.
+        process = Process(target=int)
+        process.start()
+        process.join()
+        with open(join(self.path, 'running', 'job1.lease'), 'w') as fd:
+            json.dump({'worker': '%s:%d' % (
+                socket.gethostname(), process.pid)}, fd)
+        self.assertEqual(['job1'], self.queue.reclaim())
+        self.assertEqual(
+            {'pending': 1, 'running': 1, 'results': 0}, self.queue.counts())
+        self.assertFalse(exists(join(self.path, 'running', 'job1.lease')))
+        self.assertEqual(('job1', {'n': 1}), self.queue.claim())
+
+    def test_reclaim_lease_expired(self):
+        self.queue.enqueue('job1', {'n': 1})
+        self.queue.enqueue('job2', {'n': 2})
+        self.queue.claim('elsewhere:1')
+        self.queue.claim('elsewhere:2')
+        lease = join(self.path, 'running', 'job1.lease')
+        os.utime(lease, (0, 0))
+        self.assertEqual([], self.queue.reclaim())
+        self.assertEqual(['job1'], self.queue.reclaim(60))
+        self.queue.claim('elsewhere:1')
+        os.utime(lease, (0, 0))
+        self.queue.renew('job1')
+        self.assertEqual([], self.queue.reclaim(60))
+
+        # the completion of the job removes its lease.
+        self.queue.complete('job1', {'status': 'passed'})
+        self.assertFalse(exists(lease))
+
+    def test_worker_alive(self):
+        self.assertTrue(spool.worker_alive(spool.worker_id()))
+        self.assertTrue(spool.worker_alive('elsewhere:1'))
+        self.assertTrue(spool.worker_alive(socket.gethostname() + ':pid'))
+
+    def test_worker_processes(self):
+        for n in range(40):
+            self.queue.enqueue('job%02d' % n, {'n': n})
+        pool = Pool(4)
+        try:
+            claimed = pool.map(claim_all, [self.path] * 4)
+        finally:
+            pool.close()
+            pool.join()
+        job_ids = sorted(job_id for ids in claimed for job_id in ids)
+        # every job was claimed exactly once.
+        self.assertEqual(['job%02d' % n for n in range(40)], job_ids)
+        self.assertEqual(
+            list(range(40)), [r['job'] for r in self.queue.results()])
@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
 import unittest
+from os.path import exists
+from os.path import join
+from os.path import realpath
 
+from calmjs.toolchain import Spec
 from calmjs.dev import toolchain
 
+from calmjs.testing.utils import mkdtemp
+from calmjs.testing.utils import stub_item_attr_value
+
 
 class UpdateSpecForKarmaTestCase(unittest.TestCase):
     """
@@ -45,3 +52,80 @@ class UpdateSpecForKarmaTestCase(unittest.TestCase):
         spec['test_package_names'].append('demo3')
         # remain unchanged.
         self.assertEqual(names, ['demo1', 'demo2'])
+
+
+class BuildCacheDirTestCase(unittest.TestCase):
+
+    def test_build_cache_key(self):
+        key = toolchain.build_cache_key(Spec(
+            test_package_names=['demo'], coverage_enable=True))
+        self.assertEqual(key, toolchain.build_cache_key(Spec(
+            coverage_enable=True, test_package_names=['demo'],
+            # the build directories and callables are not applicable
+            build_dir='somewhere', build_cache_dir='cache',
+            karma_config_writer=lambda *a: None,
+            # nor are the destinations of the outputs of the run
+            karma_junit_xml='junit.xml', karma_history='history.db',
+            karma_metrics_jsonl='metrics.jsonl', cover_report_dir='cov',
+            karma_bench_output='bench.json', karma_node_prof_dir='prof',
+        )))
+        self.assertNotEqual(key, toolchain.build_cache_key(Spec(
+            test_package_names=['demo', 'other'], coverage_enable=True)))
+        self.assertNotEqual(key, toolchain.build_cache_key(Spec(
+            test_package_names=['demo'])))
+        self.assertNotEqual(key, toolchain.build_cache_key(Spec(
+            test_package_names=['demo'], coverage_enable=True,
+            karma_browsers=['Firefox'])))
+
+    def test_prepare_spec_build_cache_dir(self):
+        cache_dir = mkdtemp(self)
+        spec = Spec(build_cache_dir=cache_dir, test_package_names=['demo'])
+        toolchain.prepare_spec_build_cache_dir(spec)
+        build_dir = spec['build_dir']
+        self.assertFalse(exists(build_dir))
+        self.assertEqual(
+            join(realpath(cache_dir), toolchain.build_cache_key(spec)),
+            build_dir,
+        )
+        toolchain.create_spec_build_cache_dir(spec)
+        self.assertTrue(exists(build_dir))
+        # reusing the existing directory.
+        toolchain.create_spec_build_cache_dir(spec)
+        self.assertTrue(exists(build_dir))
+
+        # the same directory is selected for the same packages.
+        spec = Spec(build_cache_dir=cache_dir, test_package_names=['demo'])
+        toolchain.prepare_spec_build_cache_dir(spec)
+        self.assertEqual(build_dir, spec['build_dir'])
+
+    def test_prepare_spec_build_cache_dir_not_applicable(self):
+        spec = Spec(test_package_names=['demo'])
+        toolchain.prepare_spec_build_cache_dir(spec)
+        self.assertNotIn('build_dir', spec)
+
+        spec = Spec(build_cache_dir=mkdtemp(self), build_dir='somewhere')
+        toolchain.prepare_spec_build_cache_dir(spec)
+        self.assertEqual('somewhere', spec['build_dir'])
+        # a specified build directory is never created.
+        toolchain.create_spec_build_cache_dir(spec)
+        self.assertFalse(exists('somewhere'))
+
+
+class KarmaBenchToolchainTestCase(unittest.TestCase):
+
+    def test_prepare(self):
+        stub_item_attr_value(
+            self, toolchain, 'flatten_module_registry_names',
+            lambda names: ['calmjs.dev.module'])
+        spec = Spec(test_package_names=['calmjs.dev'])
+        toolchain.KarmaBenchToolchain().prepare(spec)
+        self.assertEqual(
+            ['calmjs.dev.module.bench'], spec['calmjs_test_registry_names'])
+
+    def test_prepare_test_registry_names(self):
+        spec = Spec(
+            test_package_names=['calmjs.dev'],
+            calmjs_test_registry_names=['calmjs.dev.module.tests'])
+        toolchain.KarmaBenchToolchain().prepare(spec)
+        self.assertEqual(
+            ['calmjs.dev.module.tests'], spec['calmjs_test_registry_names'])
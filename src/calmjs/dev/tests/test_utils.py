@@ -1,11 +1,15 @@
 # -*- coding: utf-8 -*-
 import unittest
+import hashlib
 import os
+from os.path import join
 
 from calmjs.toolchain import Toolchain
 
 from calmjs.dev import utils
 
+from calmjs.testing.utils import mkdtemp
+from calmjs.testing.utils import stub_item_attr_value
 from calmjs.testing.utils import stub_os_environ
 
 
@@ -93,3 +97,88 @@ class TargetsFromSpecTestCase(unittest.TestCase):
             '/move/to/m1.js', '/move/to/m2.js',
             '/path/to/t1.js', '/path/to/t2.js',
         ])
+
+
+class WriteIfChangedTestCase(unittest.TestCase):
+
+    def test_file_digest(self):
+        target = join(mkdtemp(self), 'file')
+        with open(target, 'wb') as fd:
+            fd.write(b'content')
+        self.assertEqual(
+            hashlib.sha256(b'content').hexdigest(), utils.file_digest(target))
+
+    def test_write_if_changed(self):
+        tmpdir = mkdtemp(self)
+        target = join(tmpdir, 'file')
+        self.assertTrue(utils.write_if_changed(
+            target, lambda fd: fd.write('content')))
+        os.utime(target, (0, 0))
+        self.assertFalse(utils.write_if_changed(
+            target, lambda fd: fd.write('content')))
+        # untouched.
+        self.assertEqual(0, os.stat(target).st_mtime)
+        self.assertTrue(utils.write_if_changed(
+            target, lambda fd: fd.write('changed')))
+        with open(target) as fd:
+            self.assertEqual('changed', fd.read())
+        # no temporary files left behind.
+        self.assertEqual(['file'], os.listdir(tmpdir))
+
+    def test_default_file_mode(self):
+        umask = os.umask(0o027)
+        try:
+            self.assertEqual(0o640, utils._default_file_mode())
+            # the umask is restored.
+            self.assertEqual(0o027, os.umask(0o027))
+        finally:
+            os.umask(umask)
+
+    def test_rename_replace(self):
+        tmpdir = mkdtemp(self)
+        source = join(tmpdir, 'source')
+        target = join(tmpdir, 'target')
+        for path in (source, target):
+            with open(path, 'w') as fd:
+                fd.write(path)
+        utils._rename_replace(source, target)
+        self.assertEqual(['target'], os.listdir(tmpdir))
+        with open(target) as fd:
+            self.assertEqual(source, fd.read())
+        with self.assertRaises(OSError):
+            utils._rename_replace(source, target)
+
+    def test_write_if_changed_mode(self):
+        target = join(mkdtemp(self), 'file')
+        stub_item_attr_value(self, utils, 'DEFAULT_FILE_MODE', 0o644)
+        utils.write_if_changed(target, lambda fd: fd.write('content'))
+        self.assertEqual(0o644, os.stat(target).st_mode & 0o777)
+        # the mode of the existing file is retained.
+        os.chmod(target, 0o640)
+        utils.write_if_changed(target, lambda fd: fd.write('changed'))
+        self.assertEqual(0o640, os.stat(target).st_mode & 0o777)
+
+    def test_write_if_changed_failure(self):
+        tmpdir = mkdtemp(self)
+        target = join(tmpdir, 'file')
+
+        def writer(fd):
+            fd.write('partial')
+            raise ValueError('failure')
+
+        with self.assertRaises(ValueError):
+            utils.write_if_changed(target, writer)
+        self.assertEqual([], os.listdir(tmpdir))
+
+
+class ParseSizeTestCase(unittest.TestCase):
+
+    def test_parse_size(self):
+        self.assertEqual(1024, utils.parse_size('1024'))
+        self.assertEqual(2048, utils.parse_size('2k'))
+        self.assertEqual(512 << 20, utils.parse_size('512M'))
+        self.assertEqual(3 << 29, utils.parse_size('1.5GB'))
+
+    def test_parse_size_invalid(self):
+        with self.assertRaises(ValueError):
+            utils.parse_size('lots')
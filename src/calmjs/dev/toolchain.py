@@ -1,20 +1,54 @@
 # -*- coding: utf-8 -*-
+import hashlib
+import json
 import logging
+from os import makedirs
+from os.path import dirname
 from os.path import exists
+from os.path import join
 from os.path import realpath
 
+from calmjs.toolchain import Spec
 from calmjs.toolchain import Toolchain
 from calmjs.toolchain import ARTIFACT_PATHS
 from calmjs.toolchain import CALMJS_MODULE_REGISTRY_NAMES
 from calmjs.toolchain import CALMJS_TEST_REGISTRY_NAMES
+from calmjs.toolchain import EXPORT_TARGET
+from calmjs.toolchain import SOURCE_PACKAGE_NAMES
+from calmjs.toolchain import TEST_MODULE_PATHS_MAP
 from calmjs.toolchain import TEST_PACKAGE_NAMES
 from calmjs.toolchain import BUILD_DIR
 from calmjs.dist import flatten_module_registry_names
 
+from calmjs.dev.dist import map_registry_name_to_bench
+from calmjs.dev.fingerprint import get_fingerprint_cache
+
+from calmjs.dev.karma import KARMA_ARTIFACT_BUDGETS
+from calmjs.dev.karma import KARMA_BENCH
+from calmjs.dev.karma import KARMA_BENCH_BASELINE
+from calmjs.dev.karma import KARMA_BENCH_OUTPUT
+from calmjs.dev.karma import KARMA_BENCH_THRESHOLD
 from calmjs.dev.karma import KARMA_BROWSERS
+from calmjs.dev.karma import KARMA_COMPACT_CONFIG
+from calmjs.dev.karma import KARMA_CONFIG_SIDECAR
 from calmjs.dev.karma import KARMA_EXTRA_FRAMEWORKS
 from calmjs.dev.karma import KARMA_ABORT_ON_TEST_FAILURE
 from calmjs.dev.karma import KARMA_HALT_AFTER_TEST
+from calmjs.dev.karma import KARMA_HISTORY
+from calmjs.dev.karma import KARMA_JUNIT_WRITER
+from calmjs.dev.karma import KARMA_JUNIT_XML
+from calmjs.dev.karma import KARMA_MEASURE_ARTIFACTS
+from calmjs.dev.karma import KARMA_MEMORY_LIMIT
+from calmjs.dev.karma import KARMA_NODE_CPU_PROF
+from calmjs.dev.karma import KARMA_NODE_HEAP_PROF
+from calmjs.dev.karma import KARMA_NODE_OPTIONS
+from calmjs.dev.karma import KARMA_NODE_PROF_DIR
+from calmjs.dev.karma import KARMA_METRICS_JSONL
+from calmjs.dev.karma import KARMA_METRICS_PROMETHEUS
+from calmjs.dev.karma import KARMA_QUARANTINE
+from calmjs.dev.karma import KARMA_QUARANTINE_MODE
+from calmjs.dev.karma import KARMA_REPORTER
+from calmjs.dev.karma import KARMA_SPLIT_ON_CRASH
 
 logger = logging.getLogger(__name__)
 
@@ -37,8 +71,24 @@ COVER_REPORT_DIR = 'cover_report_dir'
 COVER_REPORT_FILE = 'cover_report_file'
 # flag for including coverage report for tests.
 COVER_TEST = 'cover_test'
+# the unified diff to restrict a coverage report to the changed lines
+COVER_DIFF = 'cover_diff'
+# the resulting changed lines coverage report
+COVER_DIFF_REPORT = 'cover_diff_report'
 # no wrap tests with a function closure
 NO_WRAP_TESTS = 'no_wrap_tests'
+# flag for concatenating the wrapped tests into bundles
+BUNDLE_TESTS = 'bundle_tests'
+# the maximum number of test modules for each of the bundles
+BUNDLE_TESTS_MODULE_LIMIT = 'bundle_tests_module_limit'
+# the persistent directory that keyed build directories are created in
+BUILD_CACHE_DIR = 'build_cache_dir'
+# the fingerprints of the artifacts, keyed by their real paths
+ARTIFACT_FINGERPRINTS = 'artifact_fingerprints'
+# the fingerprint cache that produced the artifact fingerprints
+FINGERPRINT_CACHE = 'fingerprint_cache'
+# the key that identifies an artifact test execution
+EXECUTION_KEY = 'execution_key'
 # test filename prefix
 TEST_FILENAME_PREFIX = 'test_filename_prefix'
 
@@ -49,9 +99,34 @@ TEST_COVERED_ARTIFACT_PATHS = 'test_covered_artifact_paths'
 TEST_COVERED_BUILD_DIR_PATHS = 'test_covered_build_dir_paths'
 # the test paths that were covered
 TEST_COVERED_TEST_PATHS = 'test_covered_test_paths'
+# the bundles that the tests were concatenated into
+TEST_BUNDLE_PATHS = 'test_bundle_paths'
+# the test modules that were concatenated into each of the bundles
+TEST_BUNDLE_MODULES = 'test_bundle_modules'
 
 COVER_REPORT_DIR_DEFAULT = 'coverage'
 TEST_FILENAME_PREFIX_DEFAULT = 'test'
+BUNDLE_TESTS_MODULE_LIMIT_DEFAULT = 1000
+TEST_BUNDLE_DIRNAME = '__test_bundles__'
+
+# the options that determine the preprocessors applied to the files of
+# an execution, for the execution key
+EXECUTION_KEY_PREPROCESSOR_OPTIONS = (
+    BUNDLE_TESTS, BUNDLE_TESTS_MODULE_LIMIT, COVERAGE_ENABLE, COVER_ARTIFACT,
+    COVER_BUNDLE, COVER_TEST, NO_WRAP_TESTS,
+)
+
+# the options that determine the files generated into the build
+# directory, for the key of the keyed build directory; the destinations
+# of the outputs of the run are excluded.
+BUILD_CACHE_KEY_OPTIONS = (
+    SOURCE_PACKAGE_NAMES, TEST_PACKAGE_NAMES, CALMJS_MODULE_REGISTRY_NAMES,
+    CALMJS_TEST_REGISTRY_NAMES, TEST_MODULE_PATHS_MAP, TEST_FILENAME_PREFIX,
+    ARTIFACT_PATHS, EXPORT_TARGET, KARMA_BROWSERS, KARMA_EXTRA_FRAMEWORKS,
+    KARMA_ARTIFACT_BUDGETS, KARMA_BENCH, KARMA_COMPACT_CONFIG,
+    KARMA_CONFIG_SIDECAR, KARMA_MEASURE_ARTIFACTS, KARMA_QUARANTINE,
+    KARMA_QUARANTINE_MODE, KARMA_REPORTER, KARMA_SPLIT_ON_CRASH,
+) + EXECUTION_KEY_PREPROCESSOR_OPTIONS
 
 # BBB backward compat
 COVERAGE_TYPE_DEFAULT = 'default'
@@ -73,6 +148,97 @@ def prepare_spec_artifacts(spec):
     if spec.get(ARTIFACT_PATHS):
         # do this to conform to usage for artifact_paths in spec.
         spec[ARTIFACT_PATHS] = list(checkpaths(spec.get(ARTIFACT_PATHS)))
+        # any fingerprints are for the previous artifact paths.
+        spec.pop(ARTIFACT_FINGERPRINTS, None)
+
+
+def prepare_spec_artifact_fingerprints(spec, save=True):
+    """
+    Return the fingerprints of the artifacts in the spec, keyed by their
+    real paths, which are only produced when first requested as every
+    artifact must be read in full, with the results assigned to the spec
+    for the subsequent requests.  The fingerprint cache is only written
+    if save is True.
+    """
+
+    fingerprints = spec.get(ARTIFACT_FINGERPRINTS)
+    if fingerprints is not None:
+        return fingerprints
+
+    cache = spec.get(FINGERPRINT_CACHE)
+    if cache is None:
+        cache = spec[FINGERPRINT_CACHE] = get_fingerprint_cache(
+            spec.get(BUILD_CACHE_DIR))
+    fingerprints = spec[ARTIFACT_FINGERPRINTS] = cache.fingerprints(
+        realpath(path) for path in spec.get(ARTIFACT_PATHS) or [])
+    if save:
+        cache.save()
+    return fingerprints
+
+
+def spec_option_values(spec):
+    """
+    Return the values in the spec that may be serialized as JSON, as
+    these are the options that were provided to the spec.
+    """
+
+    values = {}
+    for key, value in spec.items():
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            # values such as callables or advices are not options.
+            continue
+        values[key] = value
+    return values
+
+
+def build_cache_key(spec):
+    """
+    Produce the key for the build directory in the build cache directory
+    for the spec, derived only from the BUILD_CACHE_KEY_OPTIONS, such
+    that runs that share the identical set of packages and options that
+    affect the build will make use of the same build directory,
+    regardless of where their outputs are written.
+    """
+
+    values = {key: spec.get(key) for key in BUILD_CACHE_KEY_OPTIONS}
+    return hashlib.sha256(json.dumps(
+        values, sort_keys=True).encode('utf8')).hexdigest()[:16]
+
+
+def prepare_spec_build_cache_dir(spec):
+    """
+    Assign the keyed build directory inside the build cache directory
+    to the spec, if the build cache directory is specified and that the
+    build directory is not already specified.  The directory is not
+    created here, but by create_spec_build_cache_dir when the toolchain
+    is to be executed.
+    """
+
+    if not spec.get(BUILD_CACHE_DIR) or spec.get(BUILD_DIR):
+        return
+
+    spec[BUILD_DIR] = join(
+        realpath(spec[BUILD_CACHE_DIR]), build_cache_key(spec))
+
+
+def create_spec_build_cache_dir(spec):
+    """
+    Create the keyed build directory assigned to the spec by
+    prepare_spec_build_cache_dir, if it does not already exist.
+    """
+
+    build_dir = spec.get(BUILD_DIR)
+    if not (spec.get(BUILD_CACHE_DIR) and build_dir) or dirname(
+            build_dir) != realpath(spec[BUILD_CACHE_DIR]):
+        return
+
+    if not exists(build_dir):
+        makedirs(build_dir)
+        logger.debug("created keyed build directory '%s'", build_dir)
+    else:
+        logger.debug("reusing keyed build directory '%s'", build_dir)
 
 
 def update_spec_for_karma(spec, **kwargs):
@@ -83,15 +249,39 @@ def update_spec_for_karma(spec, **kwargs):
         # default value, and keys to be assigned that
         (None, [
             KARMA_ABORT_ON_TEST_FAILURE,
+            KARMA_ARTIFACT_BUDGETS,
+            KARMA_BENCH_BASELINE,
+            KARMA_BENCH_OUTPUT,
+            KARMA_BENCH_THRESHOLD,
             KARMA_HALT_AFTER_TEST,
+            KARMA_COMPACT_CONFIG,
+            KARMA_CONFIG_SIDECAR,
+            KARMA_HISTORY,
+            KARMA_JUNIT_WRITER,
+            KARMA_JUNIT_XML,
+            KARMA_MEASURE_ARTIFACTS,
+            KARMA_MEMORY_LIMIT,
+            KARMA_METRICS_JSONL,
+            KARMA_NODE_CPU_PROF,
+            KARMA_NODE_HEAP_PROF,
+            KARMA_NODE_OPTIONS,
+            KARMA_NODE_PROF_DIR,
+            KARMA_METRICS_PROMETHEUS,
+            KARMA_QUARANTINE,
+            KARMA_QUARANTINE_MODE,
+            KARMA_REPORTER,
+            KARMA_SPLIT_ON_CRASH,
             COVERAGE_ENABLE,
             COVER_REPORT_DIR,
             COVER_REPORT_FILE,
             COVER_ARTIFACT,
             COVER_BUNDLE,
             COVER_TEST,
+            COVER_DIFF,
             NO_WRAP_TESTS,
+            BUNDLE_TESTS,
             BUILD_DIR,
+            BUILD_CACHE_DIR,
             # deprecated flag
             COVERAGE_TYPE,
         ]),
@@ -126,6 +316,7 @@ def prepare_spec_from_runtime(runtime, **kwargs):
     # runtime require/supply, plug them back in like so:
     update_spec_for_karma(spec, **kwargs)
     prepare_spec_artifacts(spec)
+    prepare_spec_build_cache_dir(spec)
 
     return spec
 
@@ -169,3 +360,29 @@ class KarmaToolchain(TestToolchain):
         # names
         spec[CALMJS_MODULE_REGISTRY_NAMES] = flatten_module_registry_names(
             spec.get(TEST_PACKAGE_NAMES, []))
+
+
+class KarmaBenchToolchain(KarmaToolchain):
+    """
+    For the benchmarks, gathered from the benchmark registries of the
+    module registries.
+    """
+
+    def prepare(self, spec):
+        super(KarmaBenchToolchain, self).prepare(spec)
+        if CALMJS_TEST_REGISTRY_NAMES not in spec:
+            spec[CALMJS_TEST_REGISTRY_NAMES] = list(
+                map_registry_name_to_bench(spec[CALMJS_MODULE_REGISTRY_NAMES]))
+
+
+def prepared_spec(toolchain, spec):
+    """
+    Return a copy of the spec with the registry names assigned as the
+    prepare step of the test toolchain would, such that the test modules
+    may be resolved identically ahead of the execution of the toolchain.
+    """
+
+    spec = Spec(spec)
+    if isinstance(toolchain, TestToolchain):
+        toolchain.prepare(spec)
+    return spec
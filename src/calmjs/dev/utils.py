@@ -1,7 +1,48 @@
 # -*- coding: utf-8 -*-
+import codecs
+import hashlib
+import json
 import os
+import stat
+import sys
+from os.path import basename
+from os.path import dirname
+from os.path import exists
+from os.path import getsize
 from os.path import pathsep
 from itertools import chain
+from tempfile import mkstemp
+
+
+def _rename_replace(src, dst):
+    # os.rename fails on Windows if dst exists, so it is removed first,
+    # at the cost of the replacement no longer being atomic there.
+    try:
+        os.rename(src, dst)
+    except OSError:
+        if not exists(dst):
+            raise
+        os.remove(dst)
+        os.rename(src, dst)
+
+
+def _default_file_mode():
+    # os.umask can only be read by setting it, which affects the whole
+    # process, so this is only done once on import.
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+# os.replace is not available for Python 2.7
+replace = getattr(os, 'replace', _rename_replace)
+# the mode of the newly created files under the umask of the process
+DEFAULT_FILE_MODE = _default_file_mode()
+
+# the chunk size used for reading through files for hashing.
+CHUNK_SIZE = 1 << 16
+# the suffixes for the sizes accepted by parse_size.
+SIZE_SUFFIXES = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
 
 
 # keys that are needed by various platforms for successful launching of
@@ -68,3 +109,79 @@ def get_targets_from_spec(spec, spec_keys):
     """
 
     return chain.from_iterable(spec.get(key, {}).values() for key in spec_keys)
+
+
+def file_digest(path, algorithm='sha256'):
+    """
+    Return the hex digest of the contents of the file at path.
+    """
+
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _file_mode(path):
+    # the mode of the existing file at path, or the mode a newly created
+    # file would have under the umask, as the temporary files from
+    # mkstemp are only readable by the owner.
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        return DEFAULT_FILE_MODE
+
+
+def write_if_changed(path, writer, mode='w'):
+    """
+    Call the writer with a file object to produce the contents that are
+    destined for the file at path, such that the file is only replaced
+    if the contents differ from what it already has, leaving the file
+    untouched otherwise.  Returns True if the file was written.
+    """
+
+    fd, tmp_path = mkstemp(
+        prefix='.' + basename(path) + '.', dir=dirname(path) or None)
+    try:
+        with os.fdopen(fd, mode) as writable:
+            writer(writable)
+        if exists(path) and getsize(path) == getsize(tmp_path) and (
+                file_digest(path) == file_digest(tmp_path)):
+            return False
+        os.chmod(tmp_path, _file_mode(path))
+        replace(tmp_path, path)
+        return True
+    finally:
+        if exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def write_json(data, path):
+    """
+    Write the data as JSON to the file at path, or to stdout if the path
+    is '-'.
+    """
+
+    if path == '-':
+        json.dump(data, sys.stdout, indent=4, sort_keys=True)
+        sys.stdout.write('\n')
+        return
+    with codecs.open(path, 'w', encoding='utf8') as fd:
+        json.dump(data, fd, indent=4, sort_keys=True)
+
+
+def parse_size(value):
+    """
+    Parse the size in bytes, with an optional K, M or G suffix for the
+    binary multiples.
+    """
+
+    text = value.strip().upper().rstrip('B')
+    multiplier = SIZE_SUFFIXES.get(text[-1:], 1)
+    if text[-1:] in SIZE_SUFFIXES:
+        text = text[:-1]
+    try:
+        return int(float(text) * multiplier)
+    except ValueError:
+        raise ValueError("invalid size: %r" % value)